@@ -25,27 +25,147 @@ class Config:
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)
+    # Server-side sessions (sqlite) keep only a session ID in the cookie; 'cookie' keeps Flask's signed cookie
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+    SESSION_STORE_PATH = os.environ.get('SESSION_STORE_PATH', 'data/sessions.db')
+    SESSION_MAX_ENTRIES = int(os.environ.get('SESSION_MAX_ENTRIES', '50000'))
+    SESSION_PURGE_INTERVAL_SECONDS = int(os.environ.get('SESSION_PURGE_INTERVAL_SECONDS', '300'))
+    SESSION_TOUCH_INTERVAL_SECONDS = int(os.environ.get('SESSION_TOUCH_INTERVAL_SECONDS', '60'))
     
     # Email configuration
-    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.office365.com')  # Outlook SMTP
     MAIL_PORT = int(os.environ.get('MAIL_PORT', '587'))
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@skycarelink.com')
+    # Mail delivery: durable outbox, pooled SMTP connections and background workers
+    MAIL_ASYNC = os.environ.get('MAIL_ASYNC', 'true').lower() == 'true'
+    MAIL_OUTBOX_PATH = os.environ.get('MAIL_OUTBOX_PATH', 'data/mail_outbox.db')
+    MAIL_POOL_SIZE = int(os.environ.get('MAIL_POOL_SIZE', '2'))
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', '2'))
+    MAIL_CONNECTION_IDLE_SECONDS = int(os.environ.get('MAIL_CONNECTION_IDLE_SECONDS', '30'))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', '6'))
+    MAIL_RETRY_BASE_SECONDS = int(os.environ.get('MAIL_RETRY_BASE_SECONDS', '30'))
+    MAIL_RETRY_MAX_SECONDS = int(os.environ.get('MAIL_RETRY_MAX_SECONDS', '3600'))
+    MAIL_RATE_PER_SECOND = float(os.environ.get('MAIL_RATE_PER_SECOND', '10'))  # per worker process; 0 = unlimited
+    EMAIL_LOG_BATCH_SIZE = int(os.environ.get('EMAIL_LOG_BATCH_SIZE', '50'))
+    EMAIL_LOG_FLUSH_INTERVAL_SECONDS = float(os.environ.get('EMAIL_LOG_FLUSH_INTERVAL_SECONDS', '2.0'))
+    EMAIL_LOG_MAX_BUFFERED = int(os.environ.get('EMAIL_LOG_MAX_BUFFERED', '5000'))  # kept for retry while the DB is down
+    
+    # Notification fan-out (new quote requests to affiliates); sent through the mail outbox
+    NOTIFY_NEW_QUOTE_MAX_RECIPIENTS = int(os.environ.get('NOTIFY_NEW_QUOTE_MAX_RECIPIENTS', '3'))  # 0 = all verified affiliates
+    
+    # SMS delivery queue
+    SMS_ASYNC = os.environ.get('SMS_ASYNC', 'true').lower() == 'true'
+    SMS_WORKERS = int(os.environ.get('SMS_WORKERS', '2'))
+    SMS_COALESCE_SECONDS = int(os.environ.get('SMS_COALESCE_SECONDS', '60'))
+    SMS_MAX_ATTEMPTS = int(os.environ.get('SMS_MAX_ATTEMPTS', '5'))
+    SMS_RETRY_BASE_SECONDS = float(os.environ.get('SMS_RETRY_BASE_SECONDS', '2'))
     
     # Analytics
     GA_MEASUREMENT_ID = os.environ.get('GA_MEASUREMENT_ID')
     
     # Password reset
     RESET_TOKEN_EXPIRY_HOURS = 2
+    EMAIL_VERIFICATION_TOKEN_EXPIRY_HOURS = 48
     
     # Audit logging
     AUDIT_SENSITIVE_ACTIONS = True
     AUDIT_RETENTION_DAYS = 365
+    AUDIT_STORE_PATH = os.environ.get('AUDIT_STORE_PATH', 'data/audit.db')
+    # Background audit writer: events are queued and bulk-inserted in batches
+    AUDIT_ASYNC = os.environ.get('AUDIT_ASYNC', 'True').lower() == 'true'
+    AUDIT_QUEUE_MAX_SIZE = int(os.environ.get('AUDIT_QUEUE_MAX_SIZE', '10000'))
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', '200'))
+    AUDIT_FLUSH_INTERVAL_SECONDS = float(os.environ.get('AUDIT_FLUSH_INTERVAL_SECONDS', '1.0'))
+    AUDIT_ENQUEUE_TIMEOUT_SECONDS = float(os.environ.get('AUDIT_ENQUEUE_TIMEOUT_SECONDS', '0.05'))
+    
+    # Data store for data/*.json documents (sqlite, json)
+    DATA_STORE_BACKEND = os.environ.get('DATA_STORE_BACKEND', 'sqlite')
+    DATA_STORE_PATH = os.environ.get('DATA_STORE_PATH', 'data/datastore.db')
+    
+    # Append-only security/error event logs
+    SECURITY_LOG_DIR = os.environ.get('SECURITY_LOG_DIR', 'data/logs/security')
+    ERROR_LOG_DIR = os.environ.get('ERROR_LOG_DIR', 'data/logs/errors')
+    LOG_SEGMENT_MAX_BYTES = int(os.environ.get('LOG_SEGMENT_MAX_BYTES', str(256 * 1024)))
+    LOG_SEGMENT_MAX_AGE_HOURS = int(os.environ.get('LOG_SEGMENT_MAX_AGE_HOURS', '24'))
+    LOG_MAX_SEGMENTS = int(os.environ.get('LOG_MAX_SEGMENTS', '20'))
+    LOG_FSYNC_INTERVAL_SECONDS = float(os.environ.get('LOG_FSYNC_INTERVAL_SECONDS', '1.0'))
+    LOG_FSYNC_BATCH = int(os.environ.get('LOG_FSYNC_BATCH', '64'))
     
     # Rate limiting
-    RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'memory://')
+    # memory:// (per worker) or sqlite:///path/to/file.db (shared by all workers)
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL', 'sqlite:///data/ratelimits.db')
+    RATELIMIT_MAX_ENTRIES = int(os.environ.get('RATELIMIT_MAX_ENTRIES', '100000'))
+    RATELIMIT_PURGE_INTERVAL_SECONDS = int(os.environ.get('RATELIMIT_PURGE_INTERVAL_SECONDS', '60'))
+    
+    # Write-behind popularity counters (provider selections, search hit ratio)
+    COUNTERS_DB_PATH = os.environ.get('COUNTERS_DB_PATH', 'data/counters.db')
+    COUNTER_FLUSH_INTERVAL_SECONDS = float(os.environ.get('COUNTER_FLUSH_INTERVAL_SECONDS', '5'))  # max loss window
+    COUNTER_RETENTION_DAYS = 90
+    
+    # Intake drafts: autosaves within the coalescing window are written once
+    DRAFTS_DB_PATH = os.environ.get('DRAFTS_DB_PATH', 'data/drafts.db')
+    DRAFT_COALESCE_SECONDS = float(os.environ.get('DRAFT_COALESCE_SECONDS', '10'))
+    DRAFT_SWEEP_INTERVAL_SECONDS = int(os.environ.get('DRAFT_SWEEP_INTERVAL_SECONDS', '3600'))
+    
+    # Facility autocomplete dataset (.csv with a header row or .jsonl: name, city, state, weight)
+    FACILITY_DATA_PATH = os.environ.get('FACILITY_DATA_PATH', 'data/facilities.csv')
+    
+    # Offline gazetteer for geocoding cities and facilities (.csv or .jsonl: name, state, lat, lng, kind)
+    GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH', 'data/us_cities.csv')
+    # Affiliate bases (geocoded coverage regions) are re-read from the affiliates table this often
+    AFFILIATE_GEO_REFRESH_SECONDS = int(os.environ.get('AFFILIATE_GEO_REFRESH_SECONDS', '300'))
+    
+    # Password hashing: stored hashes with other parameters are upgraded on the next successful login
+    PASSWORD_HASH_SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'pbkdf2_sha256')  # or 'scrypt'
+    PASSWORD_PBKDF2_ITERATIONS = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', '600000'))
+    PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', '32768'))
+    PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+    PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '16'))  # running + queued
+    PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS', '2'))
+    PASSWORD_VERIFY_CACHE_SIZE = int(os.environ.get('PASSWORD_VERIFY_CACHE_SIZE', '1024'))  # 0 disables
+    PASSWORD_VERIFY_CACHE_TTL_SECONDS = int(os.environ.get('PASSWORD_VERIFY_CACHE_TTL_SECONDS', '300'))
+    
+    # Password reset and email verification tokens (hashed, shared by all workers)
+    TOKEN_STORE_PATH = os.environ.get('TOKEN_STORE_PATH', 'data/tokens.db')
+    TOKEN_PURGE_INTERVAL_SECONDS = int(os.environ.get('TOKEN_PURGE_INTERVAL_SECONDS', '600'))
+    TOKEN_PURGE_BATCH_SIZE = int(os.environ.get('TOKEN_PURGE_BATCH_SIZE', '500'))
+    
+    # Login anomaly profiles (known IPs/devices per user), written behind in batches
+    LOGIN_PROFILES_DB_PATH = os.environ.get('LOGIN_PROFILES_DB_PATH', 'data/login_profiles.db')
+    LOGIN_PROFILE_FLUSH_INTERVAL_SECONDS = float(os.environ.get('LOGIN_PROFILE_FLUSH_INTERVAL_SECONDS', '5'))
+    LOGIN_PROFILE_CACHE_SIZE = int(os.environ.get('LOGIN_PROFILE_CACHE_SIZE', '10000'))
+    LOGIN_PROFILE_CACHE_TTL_SECONDS = int(os.environ.get('LOGIN_PROFILE_CACHE_TTL_SECONDS', '60'))
+    
+    # Fixed seed for simulated quotes (tests, demos); unset for fresh randomness
+    QUOTE_PRICING_SEED = int(os.environ['QUOTE_PRICING_SEED']) if os.environ.get('QUOTE_PRICING_SEED') else None
+    
+    # Quote events pushed to waiting families over Server-Sent Events
+    QUOTE_EVENTS_DB_PATH = os.environ.get('QUOTE_EVENTS_DB_PATH', 'data/quote_events.db')
+    QUOTE_EVENTS_REPLAY_SIZE = int(os.environ.get('QUOTE_EVENTS_REPLAY_SIZE', '50'))  # per request, for Last-Event-ID
+    QUOTE_EVENTS_RETENTION_SECONDS = int(os.environ.get('QUOTE_EVENTS_RETENTION_SECONDS', '86400'))
+    QUOTE_EVENTS_POLL_INTERVAL_SECONDS = float(os.environ.get('QUOTE_EVENTS_POLL_INTERVAL_SECONDS', '1'))  # other workers' events
+    QUOTE_STREAM_HEARTBEAT_SECONDS = int(os.environ.get('QUOTE_STREAM_HEARTBEAT_SECONDS', '20'))
+    QUOTE_STREAM_MAX_SECONDS = int(os.environ.get('QUOTE_STREAM_MAX_SECONDS', '600'))  # then the browser reconnects
+    QUOTE_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('QUOTE_STREAM_MAX_SUBSCRIBERS', '100'))  # per worker, below --threads
+    QUOTE_STREAM_RETRY_MS = int(os.environ.get('QUOTE_STREAM_RETRY_MS', '5000'))
+    
+    # Affiliate work queue (open quote requests by severity and age, updated by quote lifecycle events)
+    WORK_QUEUE_RESYNC_SECONDS = int(os.environ.get('WORK_QUEUE_RESYNC_SECONDS', '60'))  # picks up other workers' changes
+    WORK_QUEUE_CHANGE_LOG_SIZE = int(os.environ.get('WORK_QUEUE_CHANGE_LOG_SIZE', '1000'))
+    WORK_QUEUE_PAGE_SIZE = int(os.environ.get('WORK_QUEUE_PAGE_SIZE', '20'))
+    WORK_QUEUE_MAX_ITEMS = int(os.environ.get('WORK_QUEUE_MAX_ITEMS', '5000'))
+    WORK_QUEUE_CONFIRMED_HOURS = int(os.environ.get('WORK_QUEUE_CONFIRMED_HOURS', '24'))  # confirmed bookings stay listed
+    
+    # Uploaded documents: content-addressed files keyed by SHA-256 (identical uploads stored once)
+    DOCUMENT_STORE_PATH = os.environ.get('DOCUMENT_STORE_PATH', 'data/documents')
+    DOCUMENT_UPLOAD_CHUNK_SIZE = int(os.environ.get('DOCUMENT_UPLOAD_CHUNK_SIZE', str(64 * 1024)))
+    # Internal nginx location mapped to DOCUMENT_STORE_PATH (e.g. /protected-documents/) to serve via X-Accel-Redirect
+    DOCUMENT_ACCEL_REDIRECT_PREFIX = os.environ.get('DOCUMENT_ACCEL_REDIRECT_PREFIX', '')
     
     @staticmethod
     def init_app(app):
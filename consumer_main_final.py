@@ -3,10 +3,10 @@ import logging
 import json
 import uuid
 import csv
-import hashlib
 import hmac
 import secrets
 import shutil
+import threading
 from pathlib import Path
 # import requests  # Will install if Google Places API is needed
 from datetime import datetime, timedelta, timezone
@@ -19,6 +19,23 @@ except ImportError:
 import random
 from flask import Flask, render_template, request, session, redirect, url_for, flash, jsonify, send_file, Response, send_from_directory
 import io
+from contextlib import contextmanager
+from services.storage import data_store
+from services.announcements import AnnouncementCache
+from services.sessions import SQLiteSessionInterface
+from services.drafts import DraftStore, DraftConflict
+from services.event_log import security_events, error_events
+from services.rate_limiter import rate_limiter
+from services.provider_search import ProviderSearchIndex
+from services.counters import popularity_counters
+from services.facility_search import FacilityAutocomplete
+from services.geo import GeoIndex, gazetteer, resolve_point, distance_between
+from services.passwords import password_hasher, PasswordHasherBusy
+from services.login_profiles import login_profiles
+from services.pricing import pricing_engine, PRICING_RULES, EQUIPMENT_COSTS
+from services.fairness import FairnessRanking, days_since
+from services.quote_events import quote_events, QuoteStreamFull
+from services.work_queue import work_queue
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -36,7 +53,7 @@ try:
     except ImportError:
         print("⚠ IVR models not available - IVR features will be limited")
     # Import new notification services
-    from services.mailer import mail_service
+    from services.mailer import mail_service, start_mail_delivery
     try:
         from services.sms import sms_service
     except ImportError:
@@ -55,6 +72,19 @@ except ImportError as e:
 # Create Flask app with performance optimizations and CSRF protection
 consumer_app = Flask(__name__, template_folder='consumer_templates', static_folder='consumer_static', static_url_path='/consumer_static')
 consumer_app.secret_key = os.environ.get("SESSION_SECRET", "consumer-demo-key-change-in-production")
+# Let a front server that understands X-Sendfile stream document downloads
+consumer_app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+
+# The models use the db from app.py; register it on this app too, against the same database
+if DB_AVAILABLE:
+    from app import app as models_app
+    for key in ('SQLALCHEMY_DATABASE_URI', 'SQLALCHEMY_ENGINE_OPTIONS', 'SQLALCHEMY_TRACK_MODIFICATIONS'):
+        consumer_app.config[key] = models_app.config[key]
+    db.init_app(consumer_app)
+
+# Session data lives server-side; the cookie only carries the session ID
+if os.environ.get('SESSION_BACKEND', 'sqlite').lower() == 'sqlite':
+    consumer_app.session_interface = SQLiteSessionInterface()
 
 # Import and configure security
 try:
@@ -105,6 +135,9 @@ if DB_AVAILABLE:
         print("✓ Email verification and quote workflow registered")
     except Exception as e:
         print(f"⚠ Error registering email routes: {e}")
+    
+    # Outbox messages queued before a restart go out now, not on the next send
+    start_mail_delivery(consumer_app)
 else:
     # Register email routes even without full DB
     try:
@@ -159,6 +192,9 @@ def after_request(response):
         response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
     elif request.path.endswith(('.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.ico', '.woff', '.woff2')):
         response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    elif response.cache_control.public:
+        # The view chose to make this response cacheable (e.g. /api/hospital-search)
+        pass
     else:
         # Dynamic content - short cache
         response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
@@ -167,30 +203,34 @@ def after_request(response):
     
     return response
 
+# Placeholder hash of the demo accounts (not a real bcrypt hash); verify_password accepts the demo password for it
+DEMO_PASSWORD_HASH = '$2b$12$9xZ7LGEPmXM5UvQfM2.mreK9hHhOqVd9lJcLzX8YeKNpA3KzL5Ae6'
+DEMO_PASSWORD = 'demo123'
+
 # Demo user accounts with hashed passwords (bcrypt-compatible format)
 DEMO_USERS = {
     'family': {
-        'password_hash': '$2b$12$9xZ7LGEPmXM5UvQfM2.mreK9hHhOqVd9lJcLzX8YeKNpA3KzL5Ae6',  # demo123
+        'password_hash': DEMO_PASSWORD_HASH,
         'role': 'family', 'name': 'Sarah Johnson'
     },
     'hospital': {
-        'password_hash': '$2b$12$9xZ7LGEPmXM5UvQfM2.mreK9hHhOqVd9lJcLzX8YeKNpA3KzL5Ae6',  # demo123
+        'password_hash': DEMO_PASSWORD_HASH,
         'role': 'hospital', 'name': 'Dr. Michael Chen'
     },
     'affiliate': {
-        'password_hash': '$2b$12$9xZ7LGEPmXM5UvQfM2.mreK9hHhOqVd9lJcLzX8YeKNpA3KzL5Ae6',  # demo123
+        'password_hash': DEMO_PASSWORD_HASH,
         'role': 'affiliate', 'name': 'Captain Lisa Martinez'
     },
     'provider': {
-        'password_hash': '$2b$12$9xZ7LGEPmXM5UvQfM2.mreK9hHhOqVd9lJcLzX8YeKNpA3KzL5Ae6',  # demo123
+        'password_hash': DEMO_PASSWORD_HASH,
         'role': 'affiliate', 'name': 'Captain Lisa Martinez'
     },
     'mvp': {
-        'password_hash': '$2b$12$9xZ7LGEPmXM5UvQfM2.mreK9hHhOqVd9lJcLzX8YeKNpA3KzL5Ae6',  # demo123
+        'password_hash': DEMO_PASSWORD_HASH,
         'role': 'mvp', 'name': 'Alex Thompson'
     },
     'admin': {
-        'password_hash': '$2b$12$9xZ7LGEPmXM5UvQfM2.mreK9hHhOqVd9lJcLzX8YeKNpA3KzL5Ae6',  # demo123
+        'password_hash': DEMO_PASSWORD_HASH,
         'role': 'admin', 'name': 'Admin User'
     }
 }
@@ -239,15 +279,8 @@ OPERATIONAL_CONFIG = {
     ]
 }
 
-# Equipment pricing (dynamic)
-EQUIPMENT_PRICING = {
-    'ventilator': 5000,
-    'ecmo': 10000,
-    'incubator': 3000,
-    'escort': 2000,
-    'oxygen': 1000,
-    'other': 0
-}
+# Equipment pricing (dynamic) - the pricing engine's single rule table
+EQUIPMENT_PRICING = EQUIPMENT_COSTS
 
 # Subscription pricing
 SUBSCRIPTION_PRICING = {
@@ -363,6 +396,12 @@ DRAFTS_CONFIG = {
     'max_drafts_per_user': 10
 }
 
+# Drafts persist server-side per user; autosaves are coalesced before they are written
+draft_store = DraftStore(
+    expiry_days=DRAFTS_CONFIG['draft_expiry_days'],
+    max_per_owner=DRAFTS_CONFIG['max_drafts_per_user']
+)
+
 # Quote Distribution Configuration - Phase 5.A
 QUOTE_CONFIG = {
     'response_window_min': 15,  # minimum minutes for quotes
@@ -375,27 +414,47 @@ QUOTE_CONFIG = {
     'saturated_market_delay': 120  # 2 hours max delay message
 }
 
+def load_affiliate_rows():
+    """Affiliates from the Affiliate table for the fairness ranking; empty when no database is configured"""
+    if not DB_AVAILABLE:
+        return []
+    with consumer_app.app_context():
+        rows = db.session.query(
+            Affiliate.id, Affiliate.company_name, Affiliate.response_rate_30day, Affiliate.total_bookings,
+            Affiliate.is_spotlight, Affiliate.offers_concierge, Affiliate.created_at
+        ).all()
+    return [{
+        'id': f"affiliate_{affiliate_id}",
+        'name': name,
+        'base_price': PRICING_RULES['default_affiliate_base_price'],
+        'capabilities': [],
+        'priority': bool(offers_concierge),
+        'response_rate_30d': round((response_rate or 0.0) * 100),  # stored as 0.0-1.0
+        'total_bookings': total_bookings or 0,
+        'days_since_join': days_since(created_at),
+        'spotlight': bool(is_spotlight),
+        'ground_included': False
+    } for affiliate_id, name, response_rate, total_bookings, is_spotlight, offers_concierge, created_at in rows]
+
+# Fairness-ordered affiliates: the Affiliate table, else the mock list; delistings are honoured
+fairness_ranking = FairnessRanking(
+    rows_fn=load_affiliate_rows,
+    defaults=[dict(affiliate, id=f"affiliate_{i+1}") for i, affiliate in enumerate(MOCK_AFFILIATES)],
+    store=data_store,
+    fairness_threshold=QUOTE_CONFIG['fairness_threshold'],
+    spotlight_bookings=QUOTE_CONFIG['spotlight_booking_threshold'],
+    spotlight_days=QUOTE_CONFIG['spotlight_days_threshold']
+)
+
 def get_affiliate_priority_order():
-    """Sort affiliates by fairness rules: high responders first, then deprioritized low responders"""
-    affiliates = MOCK_AFFILIATES.copy()
-    
-    # Separate by response rate
-    high_responders = [a for a in affiliates if a['response_rate_30d'] >= QUOTE_CONFIG['fairness_threshold']]
-    low_responders = [a for a in affiliates if a['response_rate_30d'] < QUOTE_CONFIG['fairness_threshold']]
-    
-    # Sort each group by response rate (descending)
-    high_responders.sort(key=lambda x: x['response_rate_30d'], reverse=True)
-    low_responders.sort(key=lambda x: x['response_rate_30d'], reverse=True)
-    
-    # High responders first, then low responders (deprioritized but not blocked)
-    return high_responders + low_responders
+    """Affiliates by fairness rules: high responders first, then deprioritized low responders"""
+    return fairness_ranking.ordered()
 
 def has_spotlight_badge(affiliate):
     """Determine if affiliate gets spotlight badge (new or low booking count)"""
-    return (affiliate['total_bookings'] < QUOTE_CONFIG['spotlight_booking_threshold'] or 
-            affiliate['days_since_join'] < QUOTE_CONFIG['spotlight_days_threshold'])
+    return affiliate['spotlight']
 
-def generate_mock_quotes(request_data, affiliate_count=None):
+def generate_mock_quotes(request_data, affiliate_count=None, family_seats=None, seed=None):
     """Generate mock quotes with fairness ordering and realistic timing"""
     ordered_affiliates = get_affiliate_priority_order()
     
@@ -403,72 +462,55 @@ def generate_mock_quotes(request_data, affiliate_count=None):
         # Limit to specific count for testing
         ordered_affiliates = ordered_affiliates[:affiliate_count]
     
-    quotes = []
-    base_equipment_cost = sum(EQUIPMENT_PRICING.get(eq, 0) for eq in request_data.get('equipment', []))
+    if family_seats is None:
+        family_seats = session.get('patient_data', {}).get('family_seats', 0)
     
-    for i, affiliate in enumerate(ordered_affiliates):
-        # Simulate some affiliates not responding (based on response rate)
-        if random.randint(1, 100) > affiliate['response_rate_30d']:
-            continue  # This affiliate didn't respond
-        
-        equipment_cost = base_equipment_cost
-        total_cost = affiliate['base_price'] + equipment_cost
-        
-        # Add same-day upcharge if applicable
-        if request_data.get('same_day'):
-            total_cost += int(total_cost * 0.2)
-        
-        # Add subscription discount if applicable
-        if request_data.get('subscription_discount'):
-            total_cost = int(total_cost * 0.9)
+    # Price every candidate affiliate in one batch; non-responders are dropped by response rate
+    priced_quotes = pricing_engine.affiliate_quotes(
+        [a['base_price'] for a in ordered_affiliates],
+        [a['response_rate_30d'] for a in ordered_affiliates],
+        equipment=request_data.get('equipment', []),
+        same_day=request_data.get('same_day'),
+        subscription_discount=request_data.get('subscription_discount'),
+        family_seats=family_seats,
+        response_window=(QUOTE_CONFIG['response_window_min'], QUOTE_CONFIG['response_window_max']),
+        seed=seed
+    )
+    
+    quotes = []
+    for priced in priced_quotes:
+        i = priced['index']
+        affiliate = ordered_affiliates[i]
         
-        # Add family seating costs with aircraft-specific availability
-        family_seats = session.get('patient_data', {}).get('family_seats', 0)
+        # Family seating availability depends on the aircraft
         family_availability_message = ""
-        family_cost = 0
-        
-        aircraft_type = random.choice(['Learjet 60', 'Citation X', 'King Air 350', 'Hawker 400XP', 'Beechcraft 1900', 'Cessna Citation', 'MD 902 Helicopter', 'Bell 429 Helicopter'])
-        
+        available_seats = priced['family_seats']
         if family_seats > 0:
-            aircraft_capacity = {
-                'Learjet 60': 3, 'Citation X': 2, 'King Air 350': 3,
-                'Hawker 400XP': 2, 'Beechcraft 1900': 1, 'Cessna Citation': 1,
-                'MD 902 Helicopter': 0, 'Bell 429 Helicopter': 0
-            }
-            
-            max_seats = aircraft_capacity.get(aircraft_type, 1)
-            available_seats = min(family_seats, max_seats)
-            
-            if max_seats == 0:
+            if priced['seat_capacity'] == 0:
                 family_availability_message = "No family seating on helicopter aircraft"
             elif available_seats < family_seats:
-                family_cost = available_seats * 1200
                 family_availability_message = f"Limited to {available_seats} seat{'s' if available_seats != 1 else ''} (requested {family_seats})"
             else:
-                family_cost = available_seats * 1200
-                family_availability_message = f"{available_seats} family seat{'s' if available_seats != 1 else ''} (+${family_cost:,})"
-        
-        total_cost += family_cost
+                family_availability_message = f"{available_seats} family seat{'s' if available_seats != 1 else ''} (+${priced['family_cost']:,})"
         
-        quote = {
-            'affiliate_id': f"affiliate_{i+1}",
+        quotes.append({
+            'affiliate_id': affiliate['id'],
             'affiliate_name': affiliate['name'],
-            'aircraft_type': aircraft_type,
-            'total_cost': total_cost,
+            'aircraft_type': priced['aircraft_type'],
+            'total_cost': priced['total'],
             'base_cost': affiliate['base_price'],
-            'equipment_cost': equipment_cost,
-            'family_cost': family_cost,
+            'equipment_cost': priced['equipment_cost'],
+            'family_cost': priced['family_cost'],
             'family_seats_requested': family_seats,
             'family_availability_message': family_availability_message,
-            'eta_minutes': random.randint(45, 120),
+            'eta_minutes': priced['eta_minutes'],
             'capabilities': affiliate['capabilities'],
             'ground_included': affiliate['ground_included'],
             'response_rate': affiliate['response_rate_30d'],
             'spotlight_badge': has_spotlight_badge(affiliate),
             'priority_partner': affiliate['priority'],
-            'response_time_minutes': random.randint(QUOTE_CONFIG['response_window_min'], QUOTE_CONFIG['response_window_max'])
-        }
-        quotes.append(quote)
+            'response_time_minutes': priced['response_time_minutes']
+        })
     
     # Sort by total cost for display
     quotes.sort(key=lambda x: x['total_cost'])
@@ -492,56 +534,90 @@ def save_index(index_data):
     with open(PROVIDERS_INDEX_PATH, 'w') as f:
         json.dump(index_data, f, indent=2)
 
-def load_metrics():
-    """Load search metrics from JSON file"""
+# Popularity counters: selections per provider and search hits by source, rolling 90 days
+PROVIDER_SELECTIONS_COUNTER = 'provider_selections'
+SEARCH_METRICS_COUNTER = 'search_metrics'
+POPULARITY_WINDOW_DAYS = 90
+
+def seed_popularity_counters():
+    """Import the legacy file counts once, dated on the import day so they age out of the window 90 days later
+    
+    The files carry totals, not per-day history; dating them by their last update would drop every
+    count older than the window at import.
+    """
+    today = datetime.utcnow().date().isoformat()
     try:
-        with open(SEARCH_METRICS_PATH, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {
-            "period_start": datetime.utcnow().isoformat() + "Z",
-            "internal_hits": 0,
-            "external_hits": 0,
-            "manual_entries": 0
-        }
+        popularity_counters.seed(PROVIDER_SELECTIONS_COUNTER, [
+            (p['id'], p.get('search_count_90d', 0), today)
+            for p in load_index()['providers']
+        ])
+        if os.path.exists(SEARCH_METRICS_PATH):
+            with open(SEARCH_METRICS_PATH, 'r') as f:
+                legacy = json.load(f)
+            popularity_counters.seed(SEARCH_METRICS_COUNTER, [
+                (key, legacy.get(key, 0), today)
+                for key in ('internal_hits', 'external_hits', 'manual_entries')
+            ])
+    except Exception as e:
+        logging.error(f"Failed to seed popularity counters: {e}")
 
-def save_metrics(metrics_data):
-    """Save search metrics to JSON file"""
-    os.makedirs('data', exist_ok=True)
-    with open(SEARCH_METRICS_PATH, 'w') as f:
-        json.dump(metrics_data, f, indent=2)
+def load_metrics():
+    """Search metrics over the rolling 90-day window"""
+    totals = popularity_counters.rolling_all(SEARCH_METRICS_COUNTER, POPULARITY_WINDOW_DAYS)
+    period_start = datetime.utcnow() - timedelta(days=POPULARITY_WINDOW_DAYS - 1)
+    return {
+        "period_start": period_start.strftime('%Y-%m-%d') + "T00:00:00Z",
+        "internal_hits": totals.get('internal_hits', 0),
+        "external_hits": totals.get('external_hits', 0),
+        "manual_entries": totals.get('manual_entries', 0)
+    }
+
+seed_popularity_counters()
+
+# Built at startup and rebuilt off the request thread when providers_index.json changes; flushed
+# selection counts are applied in place
+provider_search = ProviderSearchIndex(
+    PROVIDERS_INDEX_PATH,
+    popularity_fn=lambda: popularity_counters.rolling_all(PROVIDER_SELECTIONS_COUNTER, POPULARITY_WINDOW_DAYS),
+    popularity_version_fn=lambda: popularity_counters.version(PROVIDER_SELECTIONS_COUNTER)
+)
+provider_search.refresh()
+
+# Grid over approved facilities with coordinates, rebuilt whenever the search index is
+facility_geo = GeoIndex(cell_degrees=0.5)
+_facility_geo_source = None
+
+def refresh_facility_geo():
+    """Re-grid facilities (and teach the gazetteer their names) after a provider index rebuild"""
+    global _facility_geo_source
+    provider_search.refresh()
+    providers = provider_search.providers
+    if providers is _facility_geo_source:
+        return
+    facility_geo.build((p.get('id'), p.get('lat'), p.get('lng'), p) for p in providers)
+    for provider in providers:
+        if provider.get('lat') is not None and provider.get('lng') is not None:
+            gazetteer.add(provider.get('name'), provider['lat'], provider['lng'], kind='facility')
+    _facility_geo_source = providers
+
+def locate_intake_endpoint(data, prefix):
+    """(lat, lng) for the from_/to_ side of an intake form: facility name, then city/state, then address"""
+    refresh_facility_geo()
+    return resolve_point({
+        'name': data.get(f'{prefix}_hospital'),
+        'city': data.get(f'{prefix}_city'),
+        'state': data.get(f'{prefix}_state'),
+        'address': data.get(f'{prefix}_address')
+    })
 
 def search_internal(query):
-    """Search internal providers index - case insensitive substring match"""
-    index = load_index()
-    query_lower = query.lower()
-    
-    results = []
-    for provider in index['providers']:
-        if not provider.get('approved', False):
-            continue
-            
-        name_match = query_lower in provider['name'].lower()
-        address_match = query_lower in provider['address'].lower()
-        
-        if name_match or address_match:
-            results.append(provider)
-    
-    # Sort by search_count_90d (popularity) and return top 5
-    results.sort(key=lambda x: x.get('search_count_90d', 0), reverse=True)
-    return results[:5]
+    """Search internal providers index - prefix and typo-tolerant token match, ranked with popularity"""
+    return provider_search.search(query, limit=5)
 
 def promote_or_increment(provider_id):
-    """Increment search count for selected internal provider"""
-    index = load_index()
-    
-    for provider in index['providers']:
-        if provider['id'] == provider_id:
-            provider['search_count_90d'] = provider.get('search_count_90d', 0) + 1
-            provider['updated_at'] = datetime.utcnow().isoformat() + "Z"
-            break
-    
-    save_index(index)
+    """Increment search count for selected internal provider (write-behind, no file rewrite)"""
+    popularity_counters.incr(PROVIDER_SELECTIONS_COUNTER, provider_id)
+    provider_search.bump(provider_id)
 
 def submit_manual_entry(name, address, provider_type):
     """Add manual provider entry for admin approval"""
@@ -565,32 +641,14 @@ def submit_manual_entry(name, address, provider_type):
     save_index(index)
     
     # Update metrics
-    metrics = load_metrics()
-    metrics['manual_entries'] += 1
-    save_metrics(metrics)
+    popularity_counters.incr(SEARCH_METRICS_COUNTER, 'manual_entries')
     
     return new_provider
 
 def record_hit_ratio(source):
-    """Record search hit by source type"""
-    metrics = load_metrics()
-    
-    # Check if period is > 90 days old, reset if needed
-    period_start = datetime.fromisoformat(metrics['period_start'].replace('Z', '+00:00'))
-    if datetime.utcnow() - period_start.replace(tzinfo=None) > timedelta(days=90):
-        metrics = {
-            "period_start": datetime.utcnow().isoformat() + "Z",
-            "internal_hits": 0,
-            "external_hits": 0,
-            "manual_entries": 0
-        }
-    
-    if source == 'internal':
-        metrics['internal_hits'] += 1
-    elif source == 'external':
-        metrics['external_hits'] += 1
-    
-    save_metrics(metrics)
+    """Record search hit by source type (rolling 90-day window, no manual reset)"""
+    if source in ('internal', 'external'):
+        popularity_counters.incr(SEARCH_METRICS_COUNTER, f'{source}_hits')
 
 def search_google_places(query, api_key):
     """Search Google Places API for providers - stub implementation"""
@@ -613,26 +671,20 @@ SECURITY_CONFIG = {
     'mfa_expiry_minutes': 10
 }
 
-def load_security_data(filename, default_data):
-    """Load security data from JSON file"""
-    try:
-        with open(filename, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        os.makedirs('data', exist_ok=True)
-        with open(filename, 'w') as f:
-            json.dump(default_data, f, indent=2)
-        return default_data
+# Security log readers scan at most this many recent events (the old file kept 1000)
+SECURITY_LOG_SCAN_LIMIT = 1000
 
-def save_security_data(filename, data):
-    """Save security data to JSON file"""
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=2)
+# Security log event types surfaced on the anti-abuse dashboard, mapped to display names
+SECURITY_ALERT_EVENT_NAMES = {
+    'login_failed': 'failed_login',
+    'mfa_failed': 'mfa_failure',
+    'anomaly_alert_sent': 'anomaly_alert',
+    'login_rate_limited': 'abuse_trigger',
+    'reset_rate_limited': 'abuse_trigger'
+}
 
 def log_security_event(username, event_type, ip_address, user_agent, details=None):
-    """Log security events to security_log.json"""
-    security_log = load_security_data('data/security_log.json', {'events': []})
-    
+    """Append a security event to the segmented security log"""
     event = {
         'timestamp': datetime.now().isoformat(),
         'user': username or 'unknown',
@@ -642,136 +694,56 @@ def log_security_event(username, event_type, ip_address, user_agent, details=Non
         'details': details or {}
     }
     
-    security_log['events'].append(event)
-    
-    # Keep only last 1000 events to manage file size
-    if len(security_log['events']) > 1000:
-        security_log['events'] = security_log['events'][-1000:]
-    
-    save_security_data('data/security_log.json', security_log)
+    security_events.append(event)
     logging.info(f"Security event logged: {event_type} for {username} from {ip_address}")
 
 def check_rate_limits(ip_address, username=None):
     """Check rate limits for IP and username"""
-    rate_limits = load_security_data('data/rate_limits.json', 
-                                   {'ip_attempts': {}, 'user_attempts': {}, 'locked_accounts': {}})
-    
-    now = datetime.now()
-    cutoff_time = now - timedelta(hours=SECURITY_CONFIG['rate_limit_window_hours'])
-    
-    # Clean old attempts
-    for ip in list(rate_limits['ip_attempts'].keys()):
-        rate_limits['ip_attempts'][ip] = [
-            attempt for attempt in rate_limits['ip_attempts'][ip]
-            if datetime.fromisoformat(attempt) > cutoff_time
-        ]
-        if not rate_limits['ip_attempts'][ip]:
-            del rate_limits['ip_attempts'][ip]
-    
-    for user in list(rate_limits['user_attempts'].keys()):
-        rate_limits['user_attempts'][user] = [
-            attempt for attempt in rate_limits['user_attempts'][user]
-            if datetime.fromisoformat(attempt) > cutoff_time
-        ]
-        if not rate_limits['user_attempts'][user]:
-            del rate_limits['user_attempts'][user]
+    window_seconds = SECURITY_CONFIG['rate_limit_window_hours'] * 3600
     
     # Check IP rate limit
-    ip_attempts = len(rate_limits['ip_attempts'].get(ip_address, []))
+    ip_attempts = int(rate_limiter.count(f"login_ip:{ip_address}", window_seconds))
     if ip_attempts >= SECURITY_CONFIG['max_attempts_per_ip']:
         return {'allowed': False, 'reason': 'ip_rate_limit', 'attempts': ip_attempts}
     
     # Check user rate limit if username provided
     if username:
-        user_attempts = len(rate_limits['user_attempts'].get(username, []))
+        user_attempts = int(rate_limiter.count(f"login_user:{username}", window_seconds))
         if user_attempts >= SECURITY_CONFIG['max_attempts_per_user']:
             return {'allowed': False, 'reason': 'user_rate_limit', 'attempts': user_attempts}
         
         # Check if account is locked
-        if username in rate_limits['locked_accounts']:
-            lock_until = datetime.fromisoformat(rate_limits['locked_accounts'][username])
-            if now < lock_until:
-                return {'allowed': False, 'reason': 'account_locked', 'lock_until': lock_until.isoformat()}
-            else:
-                del rate_limits['locked_accounts'][username]
+        lock_until = rate_limiter.lock_until(f"account:{username}")
+        if lock_until:
+            return {'allowed': False, 'reason': 'account_locked', 'lock_until': lock_until.isoformat()}
     
-    save_security_data('data/rate_limits.json', rate_limits)
     return {'allowed': True}
 
 def record_failed_attempt(ip_address, username=None):
     """Record a failed login attempt"""
-    rate_limits = load_security_data('data/rate_limits.json', 
-                                   {'ip_attempts': {}, 'user_attempts': {}, 'locked_accounts': {}})
-    
-    now = datetime.now().isoformat()
+    window_seconds = SECURITY_CONFIG['rate_limit_window_hours'] * 3600
     
     # Record IP attempt
-    if ip_address not in rate_limits['ip_attempts']:
-        rate_limits['ip_attempts'][ip_address] = []
-    rate_limits['ip_attempts'][ip_address].append(now)
+    rate_limiter.hit(f"login_ip:{ip_address}", window_seconds)
     
     # Record user attempt
     if username:
-        if username not in rate_limits['user_attempts']:
-            rate_limits['user_attempts'][username] = []
-        rate_limits['user_attempts'][username].append(now)
+        user_attempts = rate_limiter.hit(f"login_user:{username}", window_seconds)
         
         # Check if user should be soft-locked
-        if len(rate_limits['user_attempts'][username]) >= SECURITY_CONFIG['max_attempts_per_user']:
+        if user_attempts >= SECURITY_CONFIG['max_attempts_per_user']:
             lock_until = datetime.now() + timedelta(hours=SECURITY_CONFIG['lockout_duration_hours'])
-            rate_limits['locked_accounts'][username] = lock_until.isoformat()
+            rate_limiter.lock(f"account:{username}", lock_until)
             
             # Send alert email (stub)
             send_security_alert(username, 'account_locked', {
                 'reason': 'too_many_failures',
                 'lock_until': lock_until.isoformat()
             })
-    
-    save_security_data('data/rate_limits.json', rate_limits)
 
 def detect_anomaly(username, ip_address, user_agent):
     """Detect login anomalies for step-up authentication"""
-    user_settings = load_security_data('data/user_settings.json', {'users': {}})
-    
-    if username not in user_settings['users']:
-        user_settings['users'][username] = {
-            'known_ips': [],
-            'known_user_agents': [],
-            'last_login': None,
-            'mfa_enabled': False
-        }
-    
-    user_data = user_settings['users'][username]
-    risk_factors = []
-    
-    # Check for new IP
-    if ip_address not in user_data['known_ips']:
-        risk_factors.append('new_ip')
-        user_data['known_ips'].append(ip_address)
-        # Keep only last 10 IPs
-        user_data['known_ips'] = user_data['known_ips'][-10:]
-    
-    # Check for new user agent
-    ua_signature = hashlib.md5(user_agent.encode()).hexdigest()[:8] if user_agent else 'unknown'
-    if ua_signature not in user_data['known_user_agents']:
-        risk_factors.append('new_device')
-        user_data['known_user_agents'].append(ua_signature)
-        # Keep only last 5 user agents
-        user_data['known_user_agents'] = user_data['known_user_agents'][-5:]
-    
-    # Check time anomaly (login outside 6 AM - 11 PM local time)
-    current_hour = datetime.now().hour
-    if current_hour < 6 or current_hour > 23:
-        risk_factors.append('odd_time')
-    
-    user_data['last_login'] = datetime.now().isoformat()
-    save_security_data('data/user_settings.json', user_settings)
-    
-    return {
-        'is_risky': len(risk_factors) > 0,
-        'risk_factors': risk_factors,
-        'require_step_up': len(risk_factors) >= 2 or 'new_ip' in risk_factors
-    }
+    return login_profiles.record_login(username, ip_address, user_agent)
 
 def generate_mfa_code():
     """Generate 6-digit MFA code"""
@@ -798,26 +770,26 @@ def send_security_alert(username, alert_type, details):
     return True
 
 def hash_password(password):
-    """Hash password using bcrypt-compatible method (simplified for demo)"""
-    # In production, use actual bcrypt
-    salt = secrets.token_hex(16)
-    hashed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-    return f"pbkdf2_sha256${salt}${hashed.hex()}"
+    """Hash a password with the configured scheme and work factor"""
+    return password_hasher.hash(password)
 
 def verify_password(password, password_hash):
-    """Verify password against hash"""
-    if password_hash.startswith('$2b$'):
-        # Demo bcrypt hashes - verify against demo123
-        return password == 'demo123'
-    elif password_hash.startswith('pbkdf2_sha256$'):
-        # Verify PBKDF2 hash
-        try:
-            _, salt, stored_hash = password_hash.split('$')
-            hashed = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-            return hashed.hex() == stored_hash
-        except:
-            return False
-    return False
+    """Verify password against hash (any stored format, see services.passwords)
+    
+    The DEMO_USERS placeholder hash accepts the demo password; nothing outside this app's demo accounts uses it.
+    """
+    if password_hash == DEMO_PASSWORD_HASH:
+        return hmac.compare_digest(password or '', DEMO_PASSWORD)
+    return password_hasher.verify(password, password_hash)
+
+def upgrade_demo_password(username, password, password_hash):
+    """Replace an outdated demo user hash in the background after a successful login"""
+    def persist(new_hash):
+        user_data = DEMO_USERS.get(username)
+        # Skip if the password was changed while the rehash was running
+        if user_data and user_data.get('password_hash') == password_hash:
+            user_data['password_hash'] = new_hash
+    password_hasher.rehash_later(password, password_hash, persist)
 
 def authenticate_user(username, password, ip_address=None, user_agent=None):
     """Enhanced authentication with rate limiting and anomaly detection"""
@@ -833,7 +805,9 @@ def authenticate_user(username, password, ip_address=None, user_agent=None):
     # Check user exists and password is correct
     if username in DEMO_USERS:
         user_data = DEMO_USERS[username]
+        # PasswordHasherBusy propagates: an overloaded hasher is not a failed attempt
         if verify_password(password, user_data['password_hash']):
+            upgrade_demo_password(username, password, user_data['password_hash'])
             # Detect anomalies
             anomaly = detect_anomaly(username, ip_address, user_agent)
             
@@ -867,6 +841,11 @@ def generate_quote_session():
     session['slots_remaining'] = 2
     return quote_id
 
+# Priced quote lists per quote session, reused until the fairness ordering changes
+QUOTE_CACHE_SIZE = 1024
+_quote_cache = {}
+_quote_cache_lock = threading.Lock()
+
 def get_affiliate_quotes(origin, destination, equipment_list, transport_type, is_training_mode=False):
     """Generate mock affiliate quotes using Phase 5.A fairness system"""
     request_data = {
@@ -877,9 +856,20 @@ def get_affiliate_quotes(origin, destination, equipment_list, transport_type, is
         'same_day': transport_type == 'critical',
         'subscription_discount': False  # Can be updated based on session
     }
-    
-    # Use the new fairness-based quote generation
-    quotes = generate_mock_quotes(request_data)
+    family_seats = session.get('patient_data', {}).get('family_seats', 0)
+    
+    # Same quote session + same ranking version -> same quotes (page reloads, "show more", confirmation)
+    cache_key = (session.get('quote_id'), fairness_ranking.version, origin, destination,
+                 tuple(equipment_list or ()), transport_type, family_seats)
+    quotes = _quote_cache.get(cache_key) if cache_key[0] else None
+    if quotes is None:
+        # Use the new fairness-based quote generation
+        quotes = generate_mock_quotes(request_data, family_seats=family_seats)
+        if cache_key[0]:
+            with _quote_cache_lock:
+                _quote_cache[cache_key] = quotes
+                while len(_quote_cache) > QUOTE_CACHE_SIZE:
+                    _quote_cache.pop(next(iter(_quote_cache)))
     
     # Convert to legacy format for compatibility
     formatted_quotes = []
@@ -902,45 +892,33 @@ def get_affiliate_quotes(origin, destination, equipment_list, transport_type, is
     
     return formatted_quotes
 
+def draft_owner():
+    """Drafts belong to the logged-in user (shared across devices) or to this browser's session"""
+    user_id = session.get('user_id')
+    if user_id:
+        owner = f"user:{user_id}"
+        anonymous = session.pop('draft_owner', None)
+        if anonymous:
+            # Keep drafts started before login
+            draft_store.reassign(f"anon:{anonymous}", owner)
+        return owner
+    if 'draft_owner' not in session:
+        session['draft_owner'] = str(uuid.uuid4())
+    return f"anon:{session['draft_owner']}"
+
 def save_draft(session_data, draft_id=None):
     """Auto-save draft functionality"""
-    if not draft_id:
-        draft_id = str(uuid.uuid4())
-    
-    draft_data = {
-        'id': draft_id,
-        'data': session_data,
-        'status': 'draft',
-        'created_at': datetime.now().isoformat(),
-        'last_modified': datetime.now().isoformat(),
-        'expires_at': (datetime.now() + timedelta(days=DRAFTS_CONFIG['draft_expiry_days'])).isoformat()
-    }
-    
-    # In production, save to database
-    # For demo, store in session
-    if 'drafts' not in session:
-        session['drafts'] = {}
-    session['drafts'][draft_id] = draft_data
-    session.modified = True
-    
-    logging.info(f"Draft saved: {draft_id}")
-    return draft_id
+    draft = draft_store.save(draft_owner(), draft_id, data=session_data)
+    logging.info(f"Draft saved: {draft['id']}")
+    return draft['id']
 
 def load_draft(draft_id):
     """Load saved draft data"""
-    if 'drafts' in session and draft_id in session['drafts']:
-        return session['drafts'][draft_id]
-    return None
+    return draft_store.get(draft_id, draft_owner())
 
 def delete_draft(draft_id):
     """Delete a draft (only for draft status)"""
-    if 'drafts' in session and draft_id in session['drafts']:
-        draft = session['drafts'][draft_id]
-        if draft['status'] == 'draft':
-            del session['drafts'][draft_id]
-            session.modified = True
-            return True
-    return False
+    return draft_store.delete(draft_id, draft_owner())
 
 def cancel_active_request(request_id):
     """Cancel an active quoted request (cannot delete, only cancel)"""
@@ -977,7 +955,12 @@ def login_post():
     ip_address = request.environ.get('REMOTE_ADDR', 'unknown')
     user_agent = request.headers.get('User-Agent', 'unknown')
     
-    user = authenticate_user(username, password, ip_address, user_agent)
+    try:
+        user = authenticate_user(username, password, ip_address, user_agent)
+    except PasswordHasherBusy:
+        log_security_event(username, 'login_deferred', ip_address, user_agent, {'reason': 'hasher_busy'})
+        flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+        return redirect(url_for('login'))
     if user:
         # Check if MFA is required
         if user.get('requires_mfa'):
@@ -1164,45 +1147,43 @@ def admin_security():
         flash('Admin access required.', 'error')
         return redirect(url_for('home'))
     
-    # Load security data
-    security_log = load_security_data('data/security_log.json', {'events': []})
-    rate_limits = load_security_data('data/rate_limits.json', {'ip_attempts': {}, 'user_attempts': {}, 'locked_accounts': {}})
-    user_settings = load_security_data('data/user_settings.json', {'users': {}})
-    
     # Process filters
     filter_user = request.args.get('user', '')
     filter_type = request.args.get('type', '')
     filter_date = request.args.get('date', '')
     
-    events = security_log['events']
-    
-    # Apply filters
-    if filter_user:
-        events = [e for e in events if filter_user.lower() in e['user'].lower()]
-    if filter_type:
-        events = [e for e in events if e['type'] == filter_type]
-    if filter_date:
-        events = [e for e in events if e['timestamp'].startswith(filter_date)]
+    def matches_filters(e):
+        if filter_user and filter_user.lower() not in e.get('user', '').lower():
+            return False
+        if filter_type and e.get('type') != filter_type:
+            return False
+        if filter_date and not e.get('timestamp', '').startswith(filter_date):
+            return False
+        return True
     
-    # Sort by most recent first
-    events = sorted(events, key=lambda x: x['timestamp'], reverse=True)
+    # Single newest-first pass over the log tail: filtered page, 24h stats and type list
+    cutoff_24h = (datetime.now() - timedelta(hours=24)).isoformat()
+    events = []
+    recent_events = []
+    event_types = set()
+    for e in security_events.iter_recent(limit=SECURITY_LOG_SCAN_LIMIT):
+        event_types.add(e.get('type', 'unknown'))
+        if e.get('timestamp', '') >= cutoff_24h:
+            recent_events.append(e)
+        if len(events) < 100 and matches_filters(e):
+            events.append(e)
     
     # Get locked accounts with time remaining
     locked_accounts = []
-    for username, lock_until_str in rate_limits['locked_accounts'].items():
-        lock_until = datetime.fromisoformat(lock_until_str)
-        if datetime.now() < lock_until:
-            time_remaining = lock_until - datetime.now()
-            locked_accounts.append({
-                'username': username,
-                'lock_until': lock_until_str,
-                'time_remaining_minutes': int(time_remaining.total_seconds() / 60)
-            })
+    for lock_key, lock_until in rate_limiter.active_locks('account:'):
+        time_remaining = lock_until - datetime.now()
+        locked_accounts.append({
+            'username': lock_key[len('account:'):],
+            'lock_until': lock_until.isoformat(),
+            'time_remaining_minutes': int(time_remaining.total_seconds() / 60)
+        })
     
     # Get security stats
-    recent_events = [e for e in security_log['events'] if 
-                    datetime.now() - datetime.fromisoformat(e['timestamp']) < timedelta(hours=24)]
-    
     stats = {
         'total_events_24h': len(recent_events),
         'failed_logins_24h': len([e for e in recent_events if e.get('type') == 'login_failed']),
@@ -1213,11 +1194,10 @@ def admin_security():
     }
     
     # Get unique event types for filter dropdown
-    event_types = list(set(e.get('type', 'unknown') for e in security_log['events']))
-    event_types.sort()
+    event_types = sorted(event_types)
     
     return render_template('admin_security.html', 
-                         events=events[:100],  # Show last 100 events
+                         events=events,  # Newest 100 matching events
                          locked_accounts=locked_accounts,
                          stats=stats,
                          event_types=event_types,
@@ -1238,11 +1218,9 @@ def admin_unlock_account():
     admin_user = session.get('username', 'admin')
     
     if username:
-        rate_limits = load_security_data('data/rate_limits.json', {'ip_attempts': {}, 'user_attempts': {}, 'locked_accounts': {}})
-        
-        if username in rate_limits['locked_accounts']:
-            del rate_limits['locked_accounts'][username]
-            save_security_data('data/rate_limits.json', rate_limits)
+        if rate_limiter.unlock(f"account:{username}"):
+            # Clear the failure counter too, otherwise the next check re-blocks the user
+            rate_limiter.reset(f"login_user:{username}")
             
             # Log admin action
             log_security_event(username, 'admin_account_unlocked', ip_address, user_agent, {
@@ -1269,11 +1247,8 @@ def admin_lock_account():
     admin_user = session.get('username', 'admin')
     
     if username:
-        rate_limits = load_security_data('data/rate_limits.json', {'ip_attempts': {}, 'user_attempts': {}, 'locked_accounts': {}})
-        
         lock_until = datetime.now() + timedelta(hours=duration_hours)
-        rate_limits['locked_accounts'][username] = lock_until.isoformat()
-        save_security_data('data/rate_limits.json', rate_limits)
+        rate_limiter.lock(f"account:{username}", lock_until)
         
         # Log admin action
         log_security_event(username, 'admin_account_locked', ip_address, user_agent, {
@@ -1443,7 +1418,8 @@ def consumer_requests():
     
     return render_template('consumer_requests_phase12.html', 
                          requests=requests_list, 
-                         summary=summary)
+                         summary=summary,
+                         last_event_id=quote_events.latest_id())
 
 @consumer_app.route('/portal-views')
 def portal_views():
@@ -1534,6 +1510,7 @@ def admin_relist_affiliate():
         
         # Save updated data
         save_json_data('data/delisted_affiliates.json', delisted_data)
+        fairness_ranking.invalidate()
         
         flash(f'Affiliate {affiliate_id} has been successfully relisted', 'success')
         return redirect(url_for('admin_delisted'))
@@ -1614,9 +1591,11 @@ def admin_announcements_create():
                 logging.error(f"Database save failed, falling back to JSON: {e}")
                 # Fallback to JSON
                 save_json_data('data/announcements.json', announcements_data)
+                announcement_cache.invalidate()
         else:
             # Save to JSON
             save_json_data('data/announcements.json', announcements_data)
+            announcement_cache.invalidate()
         
         flash('Announcement created successfully.', 'success')
         return redirect(url_for('admin_announcements'))
@@ -1649,6 +1628,7 @@ def admin_announcements_update(announcement_id):
                 announcement['updated_at'] = datetime.now().isoformat()
                 
                 save_json_data('data/announcements.json', announcements_data)
+                announcement_cache.invalidate()
                 status = 'activated' if announcement['is_active'] else 'deactivated'
                 flash(f'Announcement updated and {status} successfully.', 'success')
                 return redirect(url_for('admin_announcements'))
@@ -1679,6 +1659,7 @@ def admin_announcements_delete(announcement_id):
         
         if len(announcements_data['announcements']) < original_count:
             save_json_data('data/announcements.json', announcements_data)
+            announcement_cache.invalidate()
             flash('Announcement deleted successfully.', 'success')
         else:
             flash('Announcement not found.', 'error')
@@ -1728,6 +1709,7 @@ def admin_delist_affiliate():
         
         delisted_data['delisted'].append(delist_entry)
         save_json_data('data/delisted_affiliates.json', delisted_data)
+        fairness_ranking.invalidate()
         
         flash(f'Affiliate delisted successfully. Strike count: {new_strikes}/2', 'warning')
         return redirect(url_for('admin_delisted'))
@@ -1768,35 +1750,41 @@ def admin_dashboard():
 # Phase 7.C: Enhanced Draft Management Routes
 @consumer_app.route('/api/save-draft', methods=['POST'])
 def api_save_draft():
-    """Phase 7.C: Save intake draft with noise control"""
+    """Phase 7.C: Save intake draft with noise control
+
+    Body is either the full form or a delta: {"draft_id", "base_version", "patch": {...}, "remove": [...]}
+    """
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         
         # Generate or use existing draft ID
-        if 'draft_id' not in session:
-            session['draft_id'] = str(uuid.uuid4())
-        
-        draft_id = session['draft_id']
+        draft_id = data.get('draft_id') or session.get('draft_id') or str(uuid.uuid4())
+        session['draft_id'] = draft_id
         
         # Check if this is the first save for this session
         first_save_key = f'first_draft_save_{draft_id}'
         is_first_save = not session.get(first_save_key, False)
         
-        draft_data = {
-            'id': draft_id,
-            'form_data': data,
-            'saved_at': datetime.now().isoformat(),
-            'expires_at': (datetime.now() + timedelta(hours=24)).isoformat()
-        }
-        
-        # Save draft
-        session['current_draft'] = draft_data
+        try:
+            if 'patch' in data or 'remove' in data:
+                draft = draft_store.save(draft_owner(), draft_id, patch=data.get('patch') or {},
+                                         remove=data.get('remove') or (), base_version=data.get('base_version'))
+            else:
+                draft = draft_store.save(draft_owner(), draft_id, data=data)
+        except DraftConflict as conflict:
+            # Client patched an older version (e.g. another device saved since) or a draft that expired:
+            # it resyncs from the server copy, or sends the full form when there is none
+            return jsonify({'success': False, 'conflict': True, 'draft': conflict.draft}), 409
+        except PermissionError:
+            session.pop('draft_id', None)
+            return jsonify({'success': False, 'error': 'Draft not found'}), 404
         
         if is_first_save:
             session[first_save_key] = True
             return jsonify({
                 'success': True,
                 'draft_id': draft_id,
+                'version': draft['version'],
                 'message': 'Draft saved',
                 'show_toast': True
             })
@@ -1806,6 +1794,7 @@ def api_save_draft():
             return jsonify({
                 'success': True,
                 'draft_id': draft_id,
+                'version': draft['version'],
                 'message': f'Saved • {current_time}',
                 'show_toast': False,
                 'show_inline': True
@@ -1827,6 +1816,15 @@ def api_load_draft(draft_id):
         logging.error(f"Draft load error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@consumer_app.route('/api/drafts')
+def api_list_drafts():
+    """Drafts of the current user (all devices) or browser session, newest first"""
+    try:
+        return jsonify({'success': True, 'drafts': draft_store.list(draft_owner())})
+    except Exception as e:
+        logging.error(f"Draft list error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @consumer_app.route('/api/delete-draft/<draft_id>', methods=['DELETE'])
 def api_delete_draft(draft_id):
     """Delete draft endpoint (only for draft status)"""
@@ -1894,32 +1892,34 @@ def api_opt_in_assistance():
 
 # Phase 6.A: Commission Ledger Functions
 def load_json_data(file_path, default_data=None):
-    """Safely load JSON data with fallback"""
+    """Safely load JSON data with fallback (backed by the configured data store)"""
     try:
-        if os.path.exists(file_path):
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        else:
-            if default_data:
-                save_json_data(file_path, default_data)
-                return default_data
-            return {}
+        data = data_store.load(file_path)
+        if data is not None:
+            return data
+        if default_data:
+            save_json_data(file_path, default_data)
+            return default_data
+        return {}
     except Exception as e:
         logging.error(f"Error loading {file_path}: {e}")
         return default_data or {}
 
 def save_json_data(file_path, data):
-    """Safely save JSON data"""
+    """Safely save JSON data (only changed top-level keys are rewritten on sqlite)"""
     try:
-        # Ensure directory exists
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=2)
+        data_store.save(file_path, data)
         return True
     except Exception as e:
         logging.error(f"Error saving {file_path}: {e}")
         return False
 
+@contextmanager
+def update_json_data(file_path, default_data=None):
+    """Atomic read-modify-write of a data document, safe across gunicorn workers"""
+    with data_store.transaction(file_path, default_data) as data:
+        yield data
+
 def get_invoice_week(date_obj):
     """Get invoice week in format YYYY-Www (Sunday-Saturday)"""
     # Find the Sunday of the week containing the date
@@ -1930,17 +1930,20 @@ def get_invoice_week(date_obj):
 
 def get_affiliate_recoup_amount(affiliate_id):
     """Get current recoup amount for affiliate"""
-    recoup_data = load_json_data('data/affiliates_recoup.json', {})
-    return recoup_data.get(affiliate_id, {}).get('recouped_amount_usd', 0)
+    recoup_info = data_store.get_item('data/affiliates_recoup.json', affiliate_id, {})
+    return recoup_info.get('recouped_amount_usd', 0)
 
 def update_affiliate_recoup_amount(affiliate_id, new_amount):
     """Update affiliate's recoup amount"""
-    recoup_data = load_json_data('data/affiliates_recoup.json', {})
-    recoup_data[affiliate_id] = {
-        'recouped_amount_usd': new_amount,
-        'updated_at': datetime.now().isoformat()
-    }
-    return save_json_data('data/affiliates_recoup.json', recoup_data)
+    try:
+        data_store.set_item('data/affiliates_recoup.json', affiliate_id, {
+            'recouped_amount_usd': new_amount,
+            'updated_at': datetime.now().isoformat()
+        })
+        return True
+    except Exception as e:
+        logging.error(f"Error saving recoup amount for {affiliate_id}: {e}")
+        return False
 
 def record_commission_entry(booking_id, affiliate_id, base_amount_usd, is_dummy=False):
     """Record commission entry when booking completes"""
@@ -1984,18 +1987,13 @@ def record_commission_entry(booking_id, affiliate_id, base_amount_usd, is_dummy=
             'invoice_week': get_invoice_week(datetime.now())
         }
         
-        # Add to ledger
-        ledger_data = load_json_data('data/ledger.json', {'entries': [], 'meta': {'version': 1}})
-        ledger_data['entries'].append(entry)
-        ledger_data['meta']['last_updated'] = datetime.now().isoformat()
+        # Add to ledger (one row insert; the document's version and updated_at record the append)
+        data_store.append_item('data/ledger.json', 'entries', entry, {'entries': [], 'meta': {'version': 1}})
         
-        if save_json_data('data/ledger.json', ledger_data):
-            rate_display = f"{int(effective_percent * 100)}%"
-            recoup_display = f"${new_recoup:,}/{COMMISSION_CONFIG['recoup_threshold_usd']:,}"
-            logging.info(f"Commission recorded ({rate_display}, recoup {recoup_display})")
-            return True
-        
-        return False
+        rate_display = f"{int(effective_percent * 100)}%"
+        recoup_display = f"${new_recoup:,}/{COMMISSION_CONFIG['recoup_threshold_usd']:,}"
+        logging.info(f"Commission recorded ({rate_display}, recoup {recoup_display})")
+        return True
         
     except Exception as e:
         logging.error(f"Error recording commission: {e}")
@@ -2005,17 +2003,12 @@ def record_commission_entry(booking_id, affiliate_id, base_amount_usd, is_dummy=
 def record_audit_event(event_type, **kwargs):
     """Record audit trail event"""
     try:
-        audit_data = load_json_data('data/audit_trail.json', {'events': [], 'meta': {}})
-        
-        event = {
-            'id': f"audit_{len(audit_data['events']) + 1:03d}",
+        data_store.append_item('data/audit_trail.json', 'events', lambda index: {
+            'id': f"audit_{index + 1:03d}",
             'event_type': event_type,
             'timestamp': datetime.now().isoformat(),
             **kwargs
-        }
-        
-        audit_data['events'].append(event)
-        save_json_data('data/audit_trail.json', audit_data)
+        }, {'events': [], 'meta': {}})
         logging.info(f"Audit event recorded: {event_type}")
         return True
     except Exception as e:
@@ -2072,75 +2065,12 @@ def get_training_limit_status(affiliate_id):
         logging.error(f"Error getting training limits: {e}")
         return {'used': 0, 'limit': 50, 'remaining': 50, 'at_limit': False}
 
+# Parsed once per document version; renders only bisect the precomputed active windows
+announcement_cache = AnnouncementCache(data_store, EST)
+
 def get_active_announcements():
     """Get active announcements with normalized schema and EST timezone support"""
-    try:
-        # Single source of truth: /data/announcements.json
-        announcements_data = load_json_data('data/announcements.json', {'announcements': []})
-        now = datetime.now(EST)
-        
-        active_announcements = []
-        for announcement in announcements_data.get('announcements', []):
-            # Schema normalization: handle both is_active and active fields
-            is_active = announcement.get('is_active', announcement.get('active', False))
-            
-            # Ensure boolean (not string)
-            if isinstance(is_active, str):
-                is_active = is_active.lower() in ('true', '1', 'yes')
-            
-            if not is_active:
-                continue
-                
-            try:
-                # Parse dates with EST timezone
-                start_str = announcement.get('start_at', '2025-01-01T00:00:00')
-                end_str = announcement.get('end_at', '2025-12-31T23:59:59')
-                
-                # Clean ISO strings and parse as naive datetime
-                start_naive = datetime.fromisoformat(start_str.replace('Z', '').split('.')[0])
-                end_naive = datetime.fromisoformat(end_str.replace('Z', '').split('.')[0])
-                
-                # Make timezone-aware with EST
-                start_at = start_naive.replace(tzinfo=EST)
-                end_at = end_naive.replace(tzinfo=EST)
-                
-                # Active filter: now_est ∈ [start_at_est, end_at_est] && is_active == True
-                if start_at <= now <= end_at:
-                    # Calculate countdown if target is set
-                    countdown_target = announcement.get('countdown_target') or ''
-                    if countdown_target and str(countdown_target).strip():
-                        try:
-                            target_naive = datetime.fromisoformat(str(countdown_target).replace('Z', '').split('.')[0])
-                            target_dt = target_naive.replace(tzinfo=EST)
-                            
-                            time_diff = target_dt - now
-                            
-                            if time_diff.total_seconds() > 0:
-                                days = time_diff.days
-                                hours, remainder = divmod(time_diff.seconds, 3600)
-                                minutes, _ = divmod(remainder, 60)
-                                announcement['countdown_display'] = f"{days:02d}:{hours:02d}:{minutes:02d}"
-                                announcement['countdown_expired'] = False
-                            else:
-                                announcement['countdown_display'] = "We're live!"
-                                announcement['countdown_expired'] = True
-                        except:
-                            # Invalid countdown target, skip countdown
-                            pass
-                    
-                    # Normalize style field
-                    announcement['style'] = announcement.get('style', 'info')
-                    active_announcements.append(announcement)
-                    
-            except Exception as date_error:
-                logging.error(f"Error parsing announcement dates for {announcement.get('id', 'unknown')}: {date_error}")
-                continue
-        
-        return active_announcements
-        
-    except Exception as e:
-        logging.error(f"Error loading announcements from /data/announcements.json: {e}")
-        return []
+    return announcement_cache.active()
 
 # Context processor to inject active announcements into all templates
 @consumer_app.context_processor
@@ -2250,13 +2180,10 @@ def consumer_intake_post():
         'passport_confirmed': 'passport_confirmed' in request.form
     }
     
-    equipment_cost = 0
-    for item in session['patient_data']['equipment']:
-        if item in EQUIPMENT_PRICING:
-            equipment_cost += EQUIPMENT_PRICING[item]
+    equipment_cost = pricing_engine.equipment_cost(session['patient_data']['equipment'])
     
     if session['patient_data']['same_day']:
-        equipment_cost *= 1.2
+        equipment_cost = pricing_engine.surcharged(equipment_cost, same_day=True)
     
     session['equipment_cost'] = equipment_cost
     return redirect(url_for('consumer_quotes'))
@@ -2397,6 +2324,7 @@ def quotes_new():
                 
                 db.session.add(quote_db)
                 db.session.commit()
+                work_queue.quote_changed(quote_db)
                 
                 logging.info(f"Quote {ref_id} saved to database with equipment flags - Monitor: {equipment_monitor}, Stretcher: {equipment_stretcher}, Oxygen: {equipment_oxygen}")
                 
@@ -2481,54 +2409,31 @@ def quotes_results(ref):
                          quotes=sample_quotes,
                          ref=ref)
 
-def generate_sample_quotes(quote_request):
+def generate_sample_quotes(quote_request, seed=None):
     """Generate sample quotes based on request data"""
-    import random
-    
     base_prices = [25000, 30000, 35000, 40000, 45000, 50000, 55000, 60000]
-    quotes = []
     
-    # Generate 3-5 quotes
-    for i in range(random.randint(3, 5)):
-        base_fare = random.choice(base_prices)
-        
-        # Add equipment costs
-        equipment_cost = 0
-        equipment_pricing = {
-            'basic_monitor': 2000,
-            'medical_stretcher': 3000,
-            'oxygen_supply': 2500,
-            'ventilator': 15000,
-            'ecmo': 25000
-        }
-        
-        for eq in quote_request.get('equipment', []):
-            equipment_cost += equipment_pricing.get(eq, 0)
-        
-        # Same-day surcharge for critical transport
-        same_day_surcharge = 0
-        if quote_request.get('service_type') == 'critical':
-            same_day_surcharge = int((base_fare + equipment_cost) * 0.2)
-        
-        total_price = base_fare + equipment_cost + same_day_surcharge
-        
+    # Same-day surcharge for critical transport
+    priced_quotes = pricing_engine.sample_quotes(
+        base_prices,
+        ['King Air 350', 'Citation CJ3', 'Learjet 45', 'Beechcraft 1900'],
+        equipment_cost=pricing_engine.equipment_cost(quote_request.get('equipment', [])),
+        same_day=quote_request.get('service_type') == 'critical',
+        seed=seed
+    )
+    
+    quotes = []
+    for i, priced in enumerate(priced_quotes):
         quotes.append({
             'id': f'quote_{i+1}',
             'provider_name': f'Provider {chr(65+i)}**',  # A**, B**, etc.
-            'aircraft_type': random.choice(['King Air 350', 'Citation CJ3', 'Learjet 45', 'Beechcraft 1900']),
-            'eta': f'{random.randint(2, 8)} hours',
-            'base_fare': base_fare,
-            'equipment_cost': equipment_cost,
-            'same_day_surcharge': same_day_surcharge,
-            'total_price': total_price,
-            'capabilities': random.sample([
-                'Critical Care Certified',
-                'Pediatric Specialist', 
-                'ECMO Capable',
-                '24/7 Availability',
-                'Weather Certified',
-                'International Flights'
-            ], 3)
+            'aircraft_type': priced['aircraft_type'],
+            'eta': priced['eta'],
+            'base_fare': priced['base_fare'],
+            'equipment_cost': priced['equipment_cost'],
+            'same_day_surcharge': priced['same_day_surcharge'],
+            'total_price': priced['total'],
+            'capabilities': priced['capabilities']
         })
     
     return sorted(quotes, key=lambda x: x['total_price'])
@@ -2590,7 +2495,7 @@ def load_config():
         return {"env": "staging", "flags": {"training_mode": False, "email_enabled": False, "sms_enabled": False}}
 
 def log_error(error_type, message, details=None):
-    """Log errors to error_log.json"""
+    """Append an error to the segmented error log"""
     try:
         error_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -2599,21 +2504,7 @@ def log_error(error_type, message, details=None):
             "details": details or {}
         }
         
-        try:
-            with open('data/error_log.json', 'r') as f:
-                error_log = json.load(f)
-        except:
-            error_log = {"errors": []}
-        
-        error_log["errors"].append(error_entry)
-        
-        # Keep only last 1000 errors
-        if len(error_log["errors"]) > 1000:
-            error_log["errors"] = error_log["errors"][-1000:]
-        
-        with open('data/error_log.json', 'w') as f:
-            json.dump(error_log, f, indent=2)
-            
+        error_events.append(error_entry)
         logging.error(f"Error logged: {error_type} - {message}")
     except Exception as e:
         logging.error(f"Failed to log error: {e}")
@@ -2626,7 +2517,7 @@ def run_backup():
         os.makedirs(backup_dir, exist_ok=True)
         
         # Backup JSON files
-        for json_file in ['security_log.json', 'rate_limits.json', 'user_settings.json', 'config.json', 'error_log.json', 'manifest.json']:
+        for json_file in ['user_settings.json', 'config.json', 'manifest.json']:
             try:
                 if os.path.exists(f'data/{json_file}'):
                     shutil.copy2(f'data/{json_file}', f'{backup_dir}/{json_file}')
@@ -2637,6 +2528,25 @@ def run_backup():
         if os.path.exists('data/invoices'):
             shutil.copytree('data/invoices', f'{backup_dir}/invoices', dirs_exist_ok=True)
         
+        # Backup security and error log segments
+        for event_log in (security_events, error_events):
+            try:
+                event_log.backup(backup_dir)
+            except Exception as e:
+                logging.error(f"Failed to backup {event_log.prefix} log: {e}")
+        
+        # Snapshot known login devices/IPs
+        try:
+            login_profiles.backup(backup_dir)
+        except Exception as e:
+            logging.error(f"Failed to backup login profiles: {e}")
+        
+        # Snapshot the data store (ledger, audit trail, announcements, ...)
+        try:
+            data_store.backup(backup_dir)
+        except Exception as e:
+            logging.error(f"Failed to backup data store: {e}")
+        
         backup_info = {
             "timestamp": datetime.now().isoformat(),
             "backup_dir": backup_dir,
@@ -2675,16 +2585,7 @@ def reset_demo_data():
             "actions": reset_actions
         }
         
-        try:
-            with open('data/security_log.json', 'r') as f:
-                security_log = json.load(f)
-        except:
-            security_log = {"events": []}
-        
-        security_log["events"].append(audit_entry)
-        
-        with open('data/security_log.json', 'w') as f:
-            json.dump(security_log, f, indent=2)
+        security_events.append(audit_entry)
         
         return {"success": True, "actions": reset_actions}
     except Exception as e:
@@ -3629,13 +3530,21 @@ def add_referral():
     
     return jsonify({'success': False, 'error': 'Invalid referral code'})
 
-def get_recent_security_events():
-    """Get recent security events including failed logins"""
+def get_recent_security_events(limit=10):
+    """Get recent security events including failed logins (newest first from the log tail)"""
+    recent = security_events.tail(
+        limit=limit,
+        predicate=lambda e: e.get('type') in SECURITY_ALERT_EVENT_NAMES,
+        scan_limit=SECURITY_LOG_SCAN_LIMIT
+    )
     return [
-        {'timestamp': '2025-08-11 01:15:30', 'event': 'failed_login', 'user': 'user@example.com', 'ip': '192.168.1.100'},
-        {'timestamp': '2025-08-11 01:10:15', 'event': 'mfa_failure', 'user': 'admin@demo.com', 'ip': '172.31.96.226'},
-        {'timestamp': '2025-08-11 00:45:22', 'event': 'anomaly_alert', 'user': 'affiliate_user', 'ip': '10.0.0.1'},
-        {'timestamp': '2025-08-11 00:30:10', 'event': 'abuse_trigger', 'user': 'test@demo.com', 'ip': '192.168.1.50'}
+        {
+            'timestamp': e.get('timestamp', '').replace('T', ' ').split('.')[0],
+            'event': SECURITY_ALERT_EVENT_NAMES[e['type']],
+            'user': e.get('user', 'unknown'),
+            'ip': e.get('ip', 'unknown')
+        }
+        for e in recent
     ]
 
 # Enhanced AI Bot with Industry-Standard FAQ
@@ -3827,6 +3736,39 @@ def api_providers_search():
         'message': 'No matches found. Please add manually if needed.'
     })
 
+@consumer_app.route('/api/providers/nearby')
+def api_providers_nearby():
+    """Nearest approved facilities to lat/lng, or to a city/state or facility name (q)"""
+    refresh_facility_geo()
+    try:
+        if request.args.get('lat') and request.args.get('lng'):
+            point = (float(request.args['lat']), float(request.args['lng']))
+        else:
+            point = resolve_point({
+                'name': request.args.get('q'),
+                'city': request.args.get('city'),
+                'state': request.args.get('state')
+            })
+        limit = min(max(int(request.args.get('limit', 5)), 1), 20)
+        max_miles = float(request.args['max_miles']) if request.args.get('max_miles') else None
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'Invalid coordinates or limits'}), 400
+    
+    if point is None:
+        return jsonify({'ok': False, 'error': 'Location not found'}), 404
+    
+    results = [{
+        'id': provider['id'],
+        'name': provider['name'],
+        'address': provider['address'],
+        'type': provider['type'],
+        'lat': provider.get('lat'),
+        'lng': provider.get('lng'),
+        'distance_miles': round(distance, 1)
+    } for distance, _, provider in facility_geo.nearest(point[0], point[1], k=limit, max_miles=max_miles)]
+    
+    return jsonify({'ok': True, 'origin': {'lat': point[0], 'lng': point[1]}, 'results': results})
+
 @consumer_app.route('/api/providers/manual', methods=['POST'])
 def api_providers_manual():
     """Submit manual provider entry for admin approval"""
@@ -3891,6 +3833,11 @@ def admin_facilities():
     index = load_index()
     metrics = load_metrics()
     
+    # Selection counts come from the rolling counters rather than the file
+    selection_counts = popularity_counters.rolling_all(PROVIDER_SELECTIONS_COUNTER, POPULARITY_WINDOW_DAYS)
+    for provider in index['providers']:
+        provider['search_count_90d'] = selection_counts.get(provider['id'], 0)
+    
     # Separate approved and pending providers
     approved_providers = [p for p in index['providers'] if p.get('approved', False)]
     pending_providers = [p for p in index['providers'] if not p.get('approved', False)]
@@ -4360,25 +4307,22 @@ def test_commission():
 def enforce_training_limit(affiliate_id):
     """Check and enforce training dummy case limits"""
     try:
-        training_data = load_json_data('data/training_limits.json', {'affiliate_limits': {}})
-        
-        if affiliate_id not in training_data['affiliate_limits']:
-            training_data['affiliate_limits'][affiliate_id] = {
-                'dummy_cases_used': 0,
-                'dummy_cases_limit': OPERATIONAL_CONFIG['training_limits']['dummy_cases_per_affiliate'],
-                'last_dummy_case': None
-            }
-        
-        limit_info = training_data['affiliate_limits'][affiliate_id]
-        
-        if limit_info['dummy_cases_used'] >= limit_info['dummy_cases_limit']:
-            return False, f"Training limit reached ({limit_info['dummy_cases_used']}/{limit_info['dummy_cases_limit']})"
-        
-        # Increment usage
-        limit_info['dummy_cases_used'] += 1
-        limit_info['last_dummy_case'] = datetime.now().isoformat()
-        
-        save_json_data('data/training_limits.json', training_data)
+        with update_json_data('data/training_limits.json', {'affiliate_limits': {}}) as training_data:
+            if affiliate_id not in training_data['affiliate_limits']:
+                training_data['affiliate_limits'][affiliate_id] = {
+                    'dummy_cases_used': 0,
+                    'dummy_cases_limit': OPERATIONAL_CONFIG['training_limits']['dummy_cases_per_affiliate'],
+                    'last_dummy_case': None
+                }
+            
+            limit_info = training_data['affiliate_limits'][affiliate_id]
+            
+            if limit_info['dummy_cases_used'] >= limit_info['dummy_cases_limit']:
+                return False, f"Training limit reached ({limit_info['dummy_cases_used']}/{limit_info['dummy_cases_limit']})"
+            
+            # Increment usage
+            limit_info['dummy_cases_used'] += 1
+            limit_info['last_dummy_case'] = datetime.now().isoformat()
         
         remaining = limit_info['dummy_cases_limit'] - limit_info['dummy_cases_used']
         return True, f"Training case recorded. Remaining: {remaining}"
@@ -4761,7 +4705,7 @@ def join_individual():
                     contact_name=f"{first_name} {last_name}",
                     phone_number=mobile_phone,
                     role='individual',
-                    password_hash=generate_password_hash(password),
+                    password_hash=hash_password(password),
                     marketing_opt_in=marketing_opt_in,
                     membership_status='free_trial',
                     membership_expires=datetime.now(timezone.utc) + timedelta(days=30),
@@ -5533,6 +5477,9 @@ def intake_submit():
         patient_last_name = data.get('patient_last_name', '')
         patient_full_name = f"{patient_first_name} {patient_last_name}".strip()
         
+        origin_point = locate_intake_endpoint(data, 'from')
+        destination_point = locate_intake_endpoint(data, 'to')
+        
         # Store comprehensive patient data in session
         session['patient_data'] = {
             'patient_name': patient_full_name,
@@ -5556,7 +5503,9 @@ def intake_submit():
             'additional_info': data.get('additional_info', ''),
             'preferred_time': data.get('preferred_time', ''),
             'family_seats': family_seats,
-            'distance_miles': random.randint(50, 500),  # Simulated
+            'origin_coordinates': origin_point,
+            'destination_coordinates': destination_point,
+            'distance_miles': distance_between(origin_point, destination_point),  # None if either end is unknown
             'niche_markets': data.get('niche_markets', [])
         }
         
@@ -5598,57 +5547,26 @@ def home():
 # Phase 12.A: Anti-abuse and fair-use helper functions
 def check_rate_limit(ip_address):
     """Phase 12.B Fix: Enhanced rate limiting - 5 per minute for quote submissions"""
-    import time
-    from collections import defaultdict
-    
-    # Simple in-memory rate limiting (production would use Redis)
-    if not hasattr(check_rate_limit, 'requests'):
-        check_rate_limit.requests = defaultdict(list)
-    
-    now = time.time()
-    minute_ago = now - 60  # Changed to 1 minute window
-    
-    # Clean old requests
-    check_rate_limit.requests[ip_address] = [
-        req_time for req_time in check_rate_limit.requests[ip_address] 
-        if req_time > minute_ago
-    ]
-    
-    # Check limit: 5 per minute
-    if len(check_rate_limit.requests[ip_address]) >= 5:
-        return False
-    
-    # Add current request
-    check_rate_limit.requests[ip_address].append(now)
-    return True
+    return rate_limiter.allow(f"quote_submit:{ip_address}", limit=5, window_seconds=60)
+
+# Fair-use policy: 4th quote without a booking in 14 days triggers the deposit
+FAIR_USE_WINDOW_SECONDS = 14 * 24 * 3600
+FAIR_USE_QUOTE_LIMIT = 4
 
 def check_fair_use_policy(user_id):
     """Phase 12.B Fix: Track 4th quote triggers $49 deposit requirement"""
-    import time
-    from collections import defaultdict
-    
-    if not hasattr(check_fair_use_policy, 'user_tracking'):
-        check_fair_use_policy.user_tracking = defaultdict(lambda: {'quotes': 0, 'bookings': 0, 'last_quote': 0})
-    
-    user_key = f"user_{user_id}"
-    user_data = check_fair_use_policy.user_tracking[user_key]
-    
-    # Check if 14-day window has reset
-    two_weeks_ago = time.time() - (14 * 24 * 3600)
-    if user_data['last_quote'] < two_weeks_ago:
-        user_data['quotes'] = 0
-        user_data['bookings'] = 0
+    user_key = f"fair_use:user_{user_id}"
     
     # Increment quote count
-    user_data['quotes'] += 1
-    user_data['last_quote'] = time.time()
+    quotes = rate_limiter.hit(f"{user_key}:quotes", FAIR_USE_WINDOW_SECONDS)
+    bookings = rate_limiter.count(f"{user_key}:bookings", FAIR_USE_WINDOW_SECONDS)
     
     # If this is the 4th quote without bookings, require deposit
-    # Check for admin override first
-    if session.get('admin_override_deposit'):
+    # Check for admin override first (shared by all workers, expires with the window)
+    if rate_limiter.lock_until(f"{user_key}:override") or session.get('admin_override_deposit'):
         return True
         
-    if user_data['quotes'] >= 4 and user_data['bookings'] == 0:
+    if quotes >= FAIR_USE_QUOTE_LIMIT and bookings == 0:
         return False
     
     return True
@@ -5663,48 +5581,59 @@ def admin_override_deposit():
         data = request.get_json()
         user_id = data.get('user_id')
         
-        # Reset the user's tracking
-        if hasattr(check_fair_use_policy, 'user_tracking'):
-            user_key = f"user_{user_id}"
-            if user_key in check_fair_use_policy.user_tracking:
-                check_fair_use_policy.user_tracking[user_key]['quotes'] = 0
-                check_fair_use_policy.user_tracking[user_key]['bookings'] = 0
+        # Reset the user's tracking in the shared store so every worker sees it
+        user_key = f"fair_use:user_{user_id}"
+        rate_limiter.reset(f"{user_key}:quotes")
+        rate_limiter.reset(f"{user_key}:bookings")
         
-        # Set admin override flag
-        session['admin_override_deposit'] = True
+        # Set admin override flag for the user (not the admin's own session)
+        override_until = datetime.now() + timedelta(seconds=FAIR_USE_WINDOW_SECONDS)
+        rate_limiter.lock(f"{user_key}:override", override_until)
         
         return jsonify({
             'success': True,
-            'message': 'Deposit requirement cleared by admin override'
+            'message': 'Deposit requirement cleared by admin override',
+            'override_until': override_until.isoformat()
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@consumer_app.route('/admin/rate_limits')
+def admin_rate_limits():
+    """Admin view of live rate-limit and fair-use counters"""
+    if session.get('user_role') != 'admin':
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
+    prefix = request.args.get('prefix', '')
+    limit = min(request.args.get('limit', 200, type=int), 1000)
+    
+    locks = [
+        {'key': key, 'until': until.isoformat()}
+        for key, until in rate_limiter.active_locks(prefix)
+    ]
+    
+    return jsonify({
+        'success': True,
+        'storage': rate_limiter.backend.__class__.__name__,
+        'counters': rate_limiter.snapshot(prefix, limit=limit),
+        'locks': locks
+    })
+
 def create_transport_request(data):
-    """Create a new transport request from intake data"""
+    """Create a new transport request from intake data
+    
+    The request id doubles as the Quote ref_id affiliates answer, so it is also the channel that
+    quote events for this request are published on.
+    """
     import uuid
-    request_id = str(uuid.uuid4())[:8]
+    request_id = f"QR{datetime.now().strftime('%y%m%d')}{uuid.uuid4().hex[:6].upper()}"
     
     # Calculate pricing with same-day surcharge
-    base_price = 45000  # Base price for demo
-    equipment_cost = 0
-    
-    if data.get('equipment'):
-        equipment_pricing = {
-            'ventilator': 15000,
-            'ecmo': 25000,
-            'balloon_pump': 12000,
-            'iv_pumps': 3000,
-            'cardiac_monitor': 5000,
-            'transport_incubator': 8000
-        }
-        equipment_cost = sum(equipment_pricing.get(eq, 0) for eq in data.get('equipment', []))
-    
-    total_price = base_price + equipment_cost
+    base_price = PRICING_RULES['default_base_price']  # Base price for demo
+    equipment_cost = pricing_engine.equipment_cost(data.get('equipment', []))
     
     # Phase 12.A: Same-day +20% surcharge
-    if data.get('same_day_urgent'):
-        total_price = int(total_price * 1.2)
+    total_price = pricing_engine.surcharged(base_price + equipment_cost, same_day=data.get('same_day_urgent'))
     
     # Store request data
     request_data = {
@@ -5730,13 +5659,64 @@ def create_transport_request(data):
         'status': 'pending_quotes'
     }
     
-    # Store in session for demo (production would save to database)
+    # Store in session for demo; the Quote row is what affiliates see and answer
     if 'transport_requests' not in session:
         session['transport_requests'] = {}
     session['transport_requests'][request_id] = request_data
+    save_transport_quote(request_id, data)
     
     return request_id
 
+def save_transport_quote(request_id, data):
+    """Save an intake request as a Quote (ref_id = request_id) and put it in the affiliate work queue"""
+    if not DB_AVAILABLE:
+        return None
+    try:
+        from models import Quote
+        
+        # Intake uses severity 1-5; quotes use 1-3
+        try:
+            severity_level = min(max(int(data.get('severity_level')), 1), 3)
+        except (TypeError, ValueError):
+            severity_level = 2
+        try:
+            flight_date = datetime.strptime(data.get('preferred_date') or '', '%Y-%m-%d')
+        except ValueError:
+            flight_date = datetime.now()
+        
+        quote_db = Quote(
+            ref_id=request_id,
+            contact_name=session.get('contact_name') or data.get('patient_name') or 'Consumer request',
+            contact_email=session.get('user_email'),
+            service_type=data.get('transport_type') or 'non-critical',
+            severity_level=severity_level,
+            flight_date=flight_date,
+            from_city=data.get('origin_city', ''),
+            from_state=data.get('origin_state', ''),
+            to_city=data.get('destination_city', ''),
+            to_state=data.get('destination_state', ''),
+            from_hospital=data.get('origin'),
+            from_address=data.get('origin_address'),
+            to_hospital=data.get('destination'),
+            to_address=data.get('destination_address'),
+            preferred_time=data.get('preferred_time'),
+            family_seats=data.get('family_seats', 0),
+            patient_gender=data.get('patient_gender'),
+            patient_age_range=data.get('patient_age_range'),
+            patient_weight=data.get('patient_weight'),
+            additional_info=data.get('additional_info'),
+            quote_expiry=datetime.now() + timedelta(days=7),
+            status='submitted'
+        )
+        db.session.add(quote_db)
+        db.session.commit()
+        work_queue.quote_changed(quote_db)
+        return quote_db
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Database save error for transport request {request_id}: {e}")
+        return None
+
 @consumer_app.route('/quotes/<request_id>')
 def consumer_quotes_phase12(request_id):
     """Phase 12.A: Enhanced quotes page with Concierge badge and unmasking"""
@@ -5749,55 +5729,46 @@ def consumer_quotes_phase12(request_id):
     # Generate Phase 12.A compliant quotes with dummy pricing band ($20k-$72k)
     quotes = generate_dummy_quotes(request_data)
     
+    # Quote events after this id are new to the page; the stream and the polling fallback start here
     return render_template('consumer_quotes_phase12.html', 
                          quotes=quotes, 
-                         request=request_data)
+                         request=request_data,
+                         last_event_id=quote_events.latest_id())
 
-def generate_dummy_quotes(request_data):
+def generate_dummy_quotes(request_data, seed=None):
     """Phase 12.A: Generate quotes with constrained pricing ($20k-$72k) and Concierge options"""
-    import random
-    
     # Phase 12.B Fix: Strict $20k-$72k dummy pricing constraint 
     base_prices = [20000, 25000, 30000, 35000, 40000, 45000, 50000, 55000, 60000, 65000, 70000, 72000]
+    equipment_cost = request_data.get('equipment_cost', 0)
+    same_day = request_data.get('same_day_urgent')
     
     # Check if any Concierge-enabled affiliate exists (for demo, assume 1 exists)
     has_concierge_provider = True
     
-    quotes = []
+    # Generate 3-5 regular quotes, kept within the Phase 12.A pricing band
+    priced_quotes = pricing_engine.sample_quotes(
+        base_prices,
+        ['King Air 350', 'Citation CJ3', 'Learjet 45'],
+        equipment_cost=equipment_cost,
+        same_day=same_day,
+        band=PRICING_RULES['price_band'],
+        seed=seed
+    )
     
-    # Generate 3-5 regular quotes
-    for i in range(random.randint(3, 5)):
-        base_fare = random.choice(base_prices)
-        equipment_cost = request_data.get('equipment_cost', 0)
-        same_day_surcharge = 0
-        
-        if request_data.get('same_day_urgent'):
-            same_day_surcharge = int((base_fare + equipment_cost) * 0.2)
-        
-        total_price = base_fare + equipment_cost + same_day_surcharge
-        
-        # Ensure within Phase 12.A pricing band
-        total_price = max(20000, min(72000, total_price))
-        
+    quotes = []
+    for i, priced in enumerate(priced_quotes):
         quotes.append({
             'id': f'quote_{i+1}',
             'provider_name': f'AirMed Provider {i+1}',
             'masked_name': f'Provider {chr(65+i)}**',  # A**, B**, etc.
-            'aircraft_type': random.choice(['King Air 350', 'Citation CJ3', 'Learjet 45']),
-            'eta': f'{random.randint(2, 8)} hours',
-            'base_fare': base_fare,
-            'equipment_cost': equipment_cost,
+            'aircraft_type': priced['aircraft_type'],
+            'eta': priced['eta'],
+            'base_fare': priced['base_fare'],
+            'equipment_cost': priced['equipment_cost'],
             'concierge_addon': 0,
-            'same_day_surcharge': same_day_surcharge,
-            'total_price': total_price,
-            'capabilities': random.sample([
-                'Critical Care Certified',
-                'Pediatric Specialist',
-                'ECMO Capable',
-                '24/7 Availability',
-                'Weather Certified',
-                'International Flights'
-            ], 3),
+            'same_day_surcharge': priced['same_day_surcharge'],
+            'total_price': priced['total'],
+            'capabilities': priced['capabilities'],
             'is_concierge': False,
             'confirmed': False,
             'booking_code': None
@@ -5806,16 +5777,9 @@ def generate_dummy_quotes(request_data):
     # Phase 12.B Fix: Concierge = lowest base + $15k exactly
     if has_concierge_provider:
         # Find best (lowest) base fare and add exactly $15k
-        best_base = min(q['base_fare'] for q in quotes)
-        concierge_base = best_base
-        concierge_addon = 15000
-        equipment_cost = request_data.get('equipment_cost', 0)
-        same_day_surcharge = 0
-        
-        if request_data.get('same_day_urgent'):
-            same_day_surcharge = int((concierge_base + equipment_cost) * 0.2)
-        
-        concierge_total = concierge_base + equipment_cost + concierge_addon + same_day_surcharge
+        concierge_base = min(q['base_fare'] for q in quotes)
+        concierge_addon = PRICING_RULES['concierge_addon']
+        concierge_surcharge = pricing_engine.same_day_surcharge(concierge_base + equipment_cost, same_day)
         
         quotes.append({
             'id': 'quote_concierge',
@@ -5826,8 +5790,8 @@ def generate_dummy_quotes(request_data):
             'base_fare': concierge_base,
             'equipment_cost': equipment_cost,
             'concierge_addon': concierge_addon,
-            'same_day_surcharge': same_day_surcharge,
-            'total_price': concierge_total,
+            'same_day_surcharge': concierge_surcharge,
+            'total_price': concierge_base + equipment_cost + concierge_surcharge + concierge_addon,
             'capabilities': [
                 'White Glove Service',
                 'Priority Dispatch',
@@ -5842,18 +5806,49 @@ def generate_dummy_quotes(request_data):
     
     return quotes
 
+@consumer_app.route('/quotes/stream')
+@consumer_app.route('/quotes/stream/<request_id>')
+def quotes_stream(request_id=None):
+    """Phase 12.A: Push new quotes over Server-Sent Events, for one request or ?request_id=...&request_id=..."""
+    request_ids = [request_id] if request_id else request.args.getlist('request_id')[:50]
+    if not request_ids:
+        return Response('request_id is required', status=400)
+    
+    # EventSource resends the last id it saw as a header when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    
+    try:
+        stream = quote_events.stream(request_ids, last_event_id)
+    except QuoteStreamFull:
+        # The page falls back to /quotes/poll
+        return Response('Too many open quote streams', status=503, headers={'Retry-After': '30'})
+    
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @consumer_app.route('/quotes/poll')
 def quotes_poll():
-    """Phase 12.A: Poll for new quotes (15-second intervals)"""
+    """Phase 12.A: Fallback for browsers without a quote stream; counts quote events after since"""
     request_id = request.args.get('request_id')
+    if not request_id:
+        return jsonify({'new_quotes': False, 'count': 0, 'last_event_id': 0})
     
-    # Simulate new quote availability (random chance)
-    import random
-    has_new_quotes = random.random() < 0.1  # 10% chance of new quote
+    since = request.args.get('since', type=int)
+    if since is None:
+        # First poll only establishes where this page starts
+        return jsonify({'new_quotes': False, 'count': 0, 'last_event_id': quote_events.latest_id(request_id)})
     
+    events = quote_events.history(request_id, since)
     return jsonify({
-        'new_quotes': has_new_quotes,
-        'count': random.randint(1, 2) if has_new_quotes else 0
+        'new_quotes': bool(events),
+        'count': len(events),
+        'last_event_id': events[-1][0] if events else since
     })
 
 @consumer_app.route('/quotes/select', methods=['POST'])
@@ -6001,7 +5996,8 @@ def consumer_requests_phase12_old():
     
     return render_template('consumer_requests_phase12.html', 
                          requests=requests_list, 
-                         summary=summary)
+                         summary=summary,
+                         last_event_id=quote_events.latest_id())
 
 # Phase 12.A: Database models for anti-abuse system
 if DB_AVAILABLE:
@@ -6038,15 +6034,38 @@ HOSPITAL_CLINIC_DATABASE = [
     "University of Colorado Hospital - Aurora, CO", "Oregon Health & Science University - Portland, OR"
 ]
 
+HOSPITAL_SEARCH_LIMIT = 10
+HOSPITAL_SEARCH_MAX_AGE = int(os.environ.get('HOSPITAL_SEARCH_MAX_AGE', '300'))  # seconds browsers may reuse results
+
+def load_facility_rows():
+    """Facilities from the hospitals table, used when no FACILITY_DATA_PATH file exists"""
+    if not DB_AVAILABLE:
+        return []
+    with consumer_app.app_context():
+        rows = db.session.query(Hospital.name, Hospital.address).all()
+    return [{'name': name, 'city': (address or '').strip()} for name, address in rows]
+
+# Loaded from Config.FACILITY_DATA_PATH (.csv/.jsonl), else the hospitals table plus the built-in list
+facility_search = FacilityAutocomplete(
+    rows_fn=load_facility_rows,
+    defaults=HOSPITAL_CLINIC_DATABASE
+)
+
 @consumer_app.route('/api/hospital-search', methods=['GET'])
 def hospital_search():
-    """Hospital/clinic search endpoint for autofill functionality"""
-    query = request.args.get('q', '').lower()
+    """Hospital/clinic search endpoint for autofill functionality (token-prefix match, cacheable)"""
+    query = request.args.get('q', '').strip()
     if len(query) < 2:
         return jsonify([])
     
-    matching_hospitals = [h for h in HOSPITAL_CLINIC_DATABASE if query in h.lower()]
-    return jsonify(matching_hospitals[:10])
+    etag = facility_search.etag(query, HOSPITAL_SEARCH_LIMIT)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(facility_search.search(query, limit=HOSPITAL_SEARCH_LIMIT))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'public, max-age={HOSPITAL_SEARCH_MAX_AGE}'
+    return response
 
 # Dashboard Preview Routes
 @consumer_app.route('/dashboard-preview')
@@ -0,0 +1,34 @@
+"""email stats hourly
+
+Revision ID: 5d2e8c41a7b3
+Revises: 18c5a519f952
+Create Date: 2026-10-17 09:12:40.218573
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8c41a7b3'
+down_revision = '18c5a519f952'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('email_stats_hourly',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('email_type', sa.String(length=50), nullable=False),
+    sa.Column('sent', sa.Integer(), nullable=False),
+    sa.Column('failed', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('hour', 'email_type', name='uq_email_stats_hour_type')
+    )
+    op.create_index(op.f('ix_email_stats_hourly_hour'), 'email_stats_hourly', ['hour'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_email_stats_hourly_hour'), table_name='email_stats_hourly')
+    op.drop_table('email_stats_hourly')
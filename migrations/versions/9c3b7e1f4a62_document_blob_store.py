@@ -0,0 +1,44 @@
+"""document blob store
+
+Revision ID: 9c3b7e1f4a62
+Revises: 5d2e8c41a7b3
+Create Date: 2026-10-17 15:26:08.114392
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+from services.blob_store import blob_store, move_document_blobs, restore_document_blobs
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3b7e1f4a62'
+down_revision = '5d2e8c41a7b3'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('documents'):
+        return
+    # Batch mode so SQLite, which cannot ALTER COLUMN, rebuilds the table instead
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.alter_column('file_data', existing_type=sa.LargeBinary(), nullable=True)
+    moved, mismatched = move_document_blobs(bind, blob_store)
+    logger.info(f"Moved {moved} document blobs to {blob_store.root}")
+    if mismatched:
+        logger.warning(f"Left {len(mismatched)} documents whose content does not match file_hash: {mismatched}")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('documents'):
+        return
+    restore_document_blobs(bind, blob_store)
+    with op.batch_alter_table('documents') as batch_op:
+        batch_op.alter_column('file_data', existing_type=sa.LargeBinary(), nullable=False)
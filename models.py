@@ -3,7 +3,7 @@ SQLAlchemy models for MediFly database
 """
 from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from app import db
 
@@ -398,4 +398,18 @@ class EmailLog(db.Model):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     
     def __repr__(self):
-        return f'<EmailLog {self.recipient}>'
\ No newline at end of file
+        return f'<EmailLog {self.recipient}>'
+
+class EmailStatsHourly(db.Model):
+    """Sent/failed email counters per type per hour, maintained with EmailLog batches"""
+    __tablename__ = 'email_stats_hourly'
+    __table_args__ = (UniqueConstraint('hour', 'email_type', name='uq_email_stats_hour_type'),)
+    
+    id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, nullable=False, index=True)  # UTC, truncated to the hour
+    email_type = Column(String(50), nullable=False)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<EmailStatsHourly {self.hour} {self.email_type}>'
@@ -1,45 +1,139 @@
 import os
+import json
+import base64
+import sqlite3
 import logging
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 from flask import request, session
-import json
+
+from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Columns stored as JSON text
+_JSON_FIELDS = ('old_values', 'new_values')
+
+_FIELDS = (
+    'id', 'timestamp', 'event_type', 'entity_type', 'entity_id', 'action', 'description',
+    'user_id', 'user_role', 'session_id', 'ip_address', 'user_agent',
+    'old_values', 'new_values', 'request_id'
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audit_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    entity_type TEXT,
+    entity_id TEXT,
+    action TEXT,
+    description TEXT,
+    user_id,
+    user_role TEXT,
+    session_id TEXT,
+    ip_address TEXT,
+    user_agent TEXT,
+    old_values TEXT,
+    new_values TEXT,
+    request_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_audit_entity ON audit_events (entity_type, entity_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_audit_event_type ON audit_events (event_type, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_events (timestamp, id);
+"""
+
+# Retention pruning runs at most this often per process
+_PRUNE_INTERVAL_SECONDS = 3600
+
+
+def _encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode()).decode()
+
+
+def _decode_cursor(cursor):
+    timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+    return timestamp, int(row_id)
+
+
 class AuditLog:
-    """Simple file-based audit logging system for sensitive actions"""
+    """Audit trail for sensitive actions, stored in an indexed SQLite file"""
     
-    AUDIT_FILE = 'data/audit_logs.json'
+    AUDIT_FILE = 'data/audit_logs.json'  # Legacy file, imported on first use
     
-    @classmethod
-    def _ensure_data_dir(cls):
-        """Ensure data directory exists"""
-        os.makedirs('data', exist_ok=True)
+    _local = threading.local()
+    _next_prune = 0.0
     
     @classmethod
-    def _load_audit_logs(cls):
-        """Load existing audit logs"""
-        cls._ensure_data_dir()
-        try:
-            if os.path.exists(cls.AUDIT_FILE):
-                with open(cls.AUDIT_FILE, 'r') as f:
-                    return json.load(f)
-            return {'logs': []}
-        except Exception as e:
-            logger.error(f"Error loading audit logs: {e}")
-            return {'logs': []}
+    def _connect(cls):
+        """Per-thread connection, reopened after a fork (gunicorn workers)"""
+        conn = getattr(cls._local, 'conn', None)
+        if conn is not None and cls._local.pid == os.getpid():
+            return conn
+        
+        directory = os.path.dirname(Config.AUDIT_STORE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        conn = sqlite3.connect(Config.AUDIT_STORE_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+        
+        cls._local.conn = conn
+        cls._local.pid = os.getpid()
+        cls._import_legacy(conn)
+        return conn
     
     @classmethod
-    def _save_audit_logs(cls, logs):
-        """Save audit logs to file"""
-        cls._ensure_data_dir()
+    def _import_legacy(cls, conn):
+        """Move entries from the old audit_logs.json into the store, once"""
+        if not os.path.exists(cls.AUDIT_FILE):
+            return
         try:
-            with open(cls.AUDIT_FILE, 'w') as f:
-                json.dump(logs, f, indent=2, default=str)
-            return True
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Another worker may have imported it while we waited for the lock
+                if os.path.exists(cls.AUDIT_FILE):
+                    with open(cls.AUDIT_FILE, 'r') as f:
+                        entries = json.load(f).get('logs', [])
+                    conn.executemany(cls._insert_sql(), [cls._to_row(entry) for entry in entries])
+                    os.replace(cls.AUDIT_FILE, f'{cls.AUDIT_FILE}.migrated')
+                    logger.info(f"Imported {len(entries)} audit log entries from {cls.AUDIT_FILE}")
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
         except Exception as e:
-            logger.error(f"Error saving audit logs: {e}")
-            return False
+            logger.error(f"Error importing legacy audit logs: {e}")
+    
+    @staticmethod
+    def _insert_sql():
+        columns = ', '.join(_FIELDS[1:])
+        placeholders = ', '.join('?' for _ in _FIELDS[1:])
+        return f"INSERT INTO audit_events ({columns}) VALUES ({placeholders})"
+    
+    @staticmethod
+    def _to_row(entry):
+        row = []
+        for field in _FIELDS[1:]:
+            value = entry.get(field)
+            if field in _JSON_FIELDS and value is not None:
+                value = json.dumps(value, default=str)
+            elif field == 'entity_id' and value is not None:
+                value = str(value)
+            row.append(value)
+        return row
+    
+    @staticmethod
+    def _from_row(row):
+        entry = dict(row)
+        for field in _JSON_FIELDS:
+            if entry.get(field) is not None:
+                entry[field] = json.loads(entry[field])
+        return entry
     
     @classmethod
     def log_event(cls, event_type, entity_type, entity_id, action, 
@@ -49,12 +143,7 @@ class AuditLog:
         """Log a sensitive action to the audit trail"""
         
         try:
-            # Load existing logs
-            logs_data = cls._load_audit_logs()
-            
-            # Create audit log entry
             audit_entry = {
-                'id': len(logs_data['logs']) + 1,
                 'timestamp': datetime.now().isoformat(),
                 'event_type': event_type,
                 'entity_type': entity_type,
@@ -71,42 +160,60 @@ class AuditLog:
                 'request_id': request_id
             }
             
-            # Add to logs
-            logs_data['logs'].append(audit_entry)
+            cls._connect().execute(cls._insert_sql(), cls._to_row(audit_entry))
+            logger.info(f"Audit log created: {event_type} - {action} on {entity_type} {entity_id}")
             
-            # Keep only last 10000 entries to prevent file from growing too large
-            if len(logs_data['logs']) > 10000:
-                logs_data['logs'] = logs_data['logs'][-10000:]
+            # Retention replaces the old 10,000 entry cap
+            if time.time() >= cls._next_prune:
+                cls._next_prune = time.time() + _PRUNE_INTERVAL_SECONDS
+                cls.prune()
             
-            # Save logs
-            success = cls._save_audit_logs(logs_data)
-            
-            if success:
-                logger.info(f"Audit log created: {event_type} - {action} on {entity_type} {entity_id}")
-            else:
-                logger.error(f"Failed to save audit log for: {event_type}")
-            
-            return success
+            return True
             
         except Exception as e:
             logger.error(f"Error creating audit log: {e}")
             return False
     
+    @classmethod
+    def query(cls, entity_type=None, entity_id=None, event_type=None, limit=50, cursor=None):
+        """Newest-first page of audit logs; returns (logs, next_cursor)
+        
+        Pass next_cursor back as cursor to fetch the following page; it is None on the last page.
+        """
+        clauses = []
+        params = []
+        if entity_type is not None:
+            clauses.append('entity_type = ?')
+            params.append(entity_type)
+        if entity_id is not None:
+            clauses.append('entity_id = ?')
+            params.append(str(entity_id))
+        if event_type is not None:
+            clauses.append('event_type = ?')
+            params.append(event_type)
+        if cursor:
+            # Keyset pagination: continue strictly after the last row of the previous page
+            clauses.append('(timestamp, id) < (?, ?)')
+            params.extend(_decode_cursor(cursor))
+        
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = cls._connect().execute(
+            f"SELECT * FROM audit_events {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1]['timestamp'], rows[-1]['id'])
+        return [cls._from_row(row) for row in rows], next_cursor
+    
     @classmethod
     def get_recent_logs(cls, limit=100, event_type=None):
         """Get recent audit logs with optional filtering"""
         try:
-            logs_data = cls._load_audit_logs()
-            logs = logs_data['logs']
-            
-            # Filter by event type if specified
-            if event_type:
-                logs = [log for log in logs if log.get('event_type') == event_type]
-            
-            # Sort by timestamp descending and limit
-            logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            
-            return logs[:limit]
+            logs, _ = cls.query(event_type=event_type, limit=limit)
+            return logs
             
         except Exception as e:
             logger.error(f"Error retrieving audit logs: {e}")
@@ -116,24 +223,26 @@ class AuditLog:
     def get_entity_logs(cls, entity_type, entity_id, limit=50):
         """Get audit logs for a specific entity"""
         try:
-            logs_data = cls._load_audit_logs()
-            logs = logs_data['logs']
-            
-            # Filter by entity
-            entity_logs = [
-                log for log in logs 
-                if log.get('entity_type') == entity_type and 
-                   log.get('entity_id') == str(entity_id)
-            ]
-            
-            # Sort by timestamp descending and limit
-            entity_logs.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            
-            return entity_logs[:limit]
+            logs, _ = cls.query(entity_type=entity_type, entity_id=entity_id, limit=limit)
+            return logs
             
         except Exception as e:
             logger.error(f"Error retrieving entity logs: {e}")
             return []
+    
+    @classmethod
+    def prune(cls, retention_days=None):
+        """Delete entries older than the retention period; returns the number removed"""
+        retention_days = retention_days or Config.AUDIT_RETENTION_DAYS
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        try:
+            deleted = cls._connect().execute('DELETE FROM audit_events WHERE timestamp < ?', (cutoff,)).rowcount
+            if deleted:
+                logger.info(f"Pruned {deleted} audit log entries older than {retention_days} days")
+            return deleted
+        except Exception as e:
+            logger.error(f"Error pruning audit logs: {e}")
+            return 0
 
 
 # Helper functions for common audit scenarios
@@ -16,8 +16,8 @@ class Document(db.Model):
     content_type = db.Column(db.String(100), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     
-    # File content as BLOB
-    file_data = db.Column(db.LargeBinary, nullable=False)
+    # File content lives in the blob store under file_hash; rows from before the move may still hold it here
+    file_data = db.Column(db.LargeBinary, nullable=True)
     
     # Upload metadata
     uploaded_by = db.Column(db.String(100))  # User identifier
@@ -3,13 +3,18 @@ Affiliate routes for quote management and notifications
 """
 
 from flask import Blueprint, request, render_template, redirect, url_for, flash, jsonify, session
+import time
 import logging
 from datetime import datetime, timedelta
 import uuid
 
+from config import Config
 from models import db, Quote, User
 from services.mailer import mail_service
 from services.sms import sms_service
+from services.geo import GeoIndex, resolve_point, haversine_miles
+from services.quote_events import quote_events, QUOTE_RECEIVED
+from services.work_queue import work_queue
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +71,8 @@ def provide_quote(quote_ref):
         quote.quote_expires_at = datetime.utcnow() + timedelta(days=7)  # 7 day expiry
         
         db.session.commit()
+        work_queue.quote_changed(quote)
+        publish_quote_received(quote)
         
         # Send notifications to caller
         try:
@@ -104,6 +111,7 @@ def old_confirm_booking_deprecated(quote_ref):
         quote.booking_reference = f"BK{datetime.utcnow().strftime('%Y%m%d')}{str(uuid.uuid4())[:8].upper()}"
         
         db.session.commit()
+        work_queue.quote_changed(quote)
         
         # Send booking confirmation notifications
         send_booking_confirmed_notifications(quote)
@@ -124,9 +132,12 @@ def old_confirm_booking_deprecated(quote_ref):
 def send_affiliate_quote_request(quote):
     """Send new quote request notification to affiliate"""
     try:
-        # For demo purposes, send to a test affiliate email
-        # In production, this would route to the appropriate affiliate based on location/criteria
-        affiliate_email = "affiliate-test@example.com"  # This should come from affiliate database
+        # Route to the closest affiliate that covers the origin and takes this severity level
+        origin = resolve_point({'name': quote.from_hospital, 'city': quote.from_city, 'state': quote.from_state})
+        severity_level = int(quote.severity_level or 1)
+        matches = nearest_affiliates(origin, lambda affiliate: severity_level in affiliate['severity_levels'], limit=1)
+        # Demo fallback until affiliates with coverage regions are on file
+        affiliate_email = matches[0][1]['email'] if matches else "affiliate-test@example.com"
         
         # Build location strings
         from_location = f"{quote.from_city}, {quote.from_state}" if quote.from_city and quote.from_state else "Location TBD"
@@ -185,7 +196,7 @@ def send_quote_ready_notifications(quote):
         # Send SMS notification
         if quote.contact_phone:
             sms_message = f"SkyCareLink: Your quote is ready! ${quote.quoted_price:,.0f} from {quote.provider_name or 'provider'}. View details: {results_url}"
-            sms_success = sms_service.send_sms(quote.contact_phone, sms_message)
+            sms_success = sms_service.send_sms(quote.contact_phone, sms_message, kind='quote_ready')
         else:
             sms_success = False
         
@@ -196,6 +207,16 @@ def send_quote_ready_notifications(quote):
         logger.error(f"Error sending quote ready notifications: {str(e)}")
         return False
 
+def publish_quote_received(quote):
+    """Push the new quote to any family watching this request's quotes page"""
+    try:
+        quote_events.publish(quote.ref_id, QUOTE_RECEIVED, {
+            'request_id': quote.ref_id,
+            'submitted_at': quote.quote_submitted_at.isoformat() if quote.quote_submitted_at else None
+        })
+    except Exception as e:
+        logger.error(f"Failed to publish quote event for {quote.ref_id}: {e}")
+
 def send_booking_confirmed_notifications(quote):
     """Send booking confirmation notifications to caller"""
     try:
@@ -220,7 +241,7 @@ def send_booking_confirmed_notifications(quote):
         # Send SMS notification
         if quote.contact_phone:
             sms_message = f"SkyCareLink: Booking confirmed! Ref: {quote.booking_reference or quote.ref_id}. {quote.provider_name or 'Provider'} will contact you with flight details."
-            sms_success = sms_service.send_sms(quote.contact_phone, sms_message)
+            sms_success = sms_service.send_sms(quote.contact_phone, sms_message, kind='booking_confirmed')
         else:
             sms_success = False
         
@@ -295,13 +316,104 @@ def call_center_settings():
         flash('An error occurred while updating settings.', 'error')
         return render_template('affiliate_call_center_settings.html', settings=request.form)
 
+def split_coverage_regions(coverage_regions):
+    """['Houston, TX', 'Dallas, TX'] from 'Houston, TX; Dallas, TX' (or one region per line)"""
+    return [region.strip() for region in (coverage_regions or '').replace('\n', ';').split(';') if region.strip()]
+
+def distance_to_coverage(origin_location, coverage_regions):
+    """Miles from the origin to the closest geocodable coverage region ('Houston, TX; Dallas, TX'),
+    None when either side cannot be located"""
+    origin = resolve_point(origin_location)
+    if origin is None:
+        return None
+    bases = [resolve_point(region) for region in split_coverage_regions(coverage_regions)]
+    distances = [haversine_miles(origin[0], origin[1], base[0], base[1]) for base in bases if base]
+    return round(min(distances)) if distances else None
+
+# Grid over affiliate bases: one point per geocodable coverage region of each active affiliate
+affiliate_geo = GeoIndex(cell_degrees=1.0)
+_affiliate_geo_state = {'next_refresh': 0.0, 'max_radius': 0}
+
+def affiliate_routing_info(affiliate):
+    """What IVR and quote routing need from an Affiliate row (the payload of its bases)"""
+    return {
+        'affiliate_id': affiliate.id,
+        'name': affiliate.company_name,
+        'email': affiliate.email,
+        'day_phone': affiliate.day_phone,
+        'after_hours_phone': affiliate.after_hours_phone if affiliate.accepts_after_hours else None,
+        'business_hours_start': affiliate.business_hours_start if affiliate.business_hours_start is not None else 8,
+        'business_hours_end': affiliate.business_hours_end if affiliate.business_hours_end is not None else 18,
+        'severity_levels': [level for level in [1, 2, 3] if getattr(affiliate, f'accepts_level_{level}')],
+        'coverage_radius': affiliate.coverage_radius or 150
+    }
+
+def refresh_affiliate_geo(force=False):
+    """Re-grid active affiliates' bases from their coverage regions, at most once per AFFILIATE_GEO_REFRESH_SECONDS"""
+    now = time.monotonic()
+    if not force and now < _affiliate_geo_state['next_refresh']:
+        return
+    _affiliate_geo_state['next_refresh'] = now + Config.AFFILIATE_GEO_REFRESH_SECONDS
+    try:
+        from models.affiliate import Affiliate
+        
+        points, max_radius = [], 0
+        for affiliate in Affiliate.query.filter_by(is_active=True).all():
+            info = affiliate_routing_info(affiliate)
+            for index, region in enumerate(split_coverage_regions(affiliate.coverage_regions)):
+                point = resolve_point(region)
+                if point:
+                    points.append((f'{affiliate.id}:{index}', point[0], point[1], info))
+                    max_radius = max(max_radius, info['coverage_radius'])
+        affiliate_geo.build(points)
+        _affiliate_geo_state['max_radius'] = max_radius
+    except Exception as e:
+        logger.error(f"Failed to index affiliate bases: {e}")
+
+def nearest_affiliates(origin, capable, limit=5):
+    """[(miles, info)] for the closest affiliates with capable(info) whose coverage_radius reaches origin
+
+    An affiliate with several bases counts once, at its closest base.
+    """
+    if origin is None:
+        return []
+    refresh_affiliate_geo()
+    found = {}
+    # A few extra candidates so affiliates with several nearby bases do not crowd out the rest
+    for distance, _, info in affiliate_geo.nearest(origin[0], origin[1], k=limit * 4,
+                                                   max_miles=_affiliate_geo_state['max_radius'], predicate=capable):
+        if distance <= info['coverage_radius'] and info['affiliate_id'] not in found:
+            found[info['affiliate_id']] = (round(distance), info)
+    return list(found.values())[:limit]
+
+def affiliate_phone(info, now):
+    """Day phone within business hours (Monday-Friday), else the after-hours phone if they take those calls"""
+    in_hours = info['business_hours_start'] <= now.hour < info['business_hours_end'] and now.weekday() < 5
+    return info['day_phone'] if in_hours else info['after_hours_phone']
+
 def get_available_affiliates_for_ivr(severity_level, origin_location=None):
     """Get list of affiliates available for IVR routing based on criteria"""
     try:
-        # In production, this would query the actual affiliate database
-        # with proper geographic matching and real-time availability
+        now = datetime.now()
         
-        # For demo, use session-stored settings
+        # Closest affiliates whose bases cover the origin, that take this level and have a phone to ring now
+        origin = resolve_point(origin_location) if origin_location and DB_AVAILABLE else None
+        if origin is not None:
+            def capable(info):
+                return severity_level in info['severity_levels'] and bool(affiliate_phone(info, now))
+            
+            matches = nearest_affiliates(origin, capable)
+            if matches or len(affiliate_geo):
+                return [{
+                    'affiliate_id': info['affiliate_id'],
+                    'name': info['name'],
+                    'phone': affiliate_phone(info, now),
+                    'max_concurrent': 2,  # not stored per affiliate yet
+                    'distance_miles': distance_miles,
+                    'severity_levels': info['severity_levels']
+                } for distance_miles, info in matches]
+        
+        # Demo: no affiliate bases on file, use the session-stored settings
         settings = session.get('affiliate_call_center_settings', {})
         
         if not settings.get('ivr_consent'):
@@ -313,8 +425,6 @@ def get_available_affiliates_for_ivr(severity_level, origin_location=None):
             return []
         
         # Check business hours
-        from datetime import datetime
-        now = datetime.now()
         current_hour = now.hour
         
         is_business_hours = (
@@ -327,11 +437,20 @@ def get_available_affiliates_for_ivr(severity_level, origin_location=None):
         if not phone_number:
             return []
         
+        # Geographic matching: the origin must lie within coverage_radius of a coverage region
+        distance_miles = None
+        if origin_location:
+            options = session.get('affiliate_call_center_options', {})
+            distance_miles = distance_to_coverage(origin_location, options.get('coverage_regions', ''))
+            if distance_miles is not None and distance_miles > options.get('coverage_radius', 150):
+                return []
+        
         return [{
             'affiliate_id': 'demo_affiliate_1',
             'name': 'Demo Medical Transport LLC',
             'phone': phone_number,
             'max_concurrent': settings.get('max_concurrent_calls', 2),
+            'distance_miles': distance_miles,
             'severity_levels': [
                 level for level in [1, 2, 3] 
                 if settings.get(f'accepts_level_{level}', False)
@@ -342,6 +461,10 @@ def get_available_affiliates_for_ivr(severity_level, origin_location=None):
         logger.error(f"Error getting available affiliates for IVR: {str(e)}")
         return []
 
+def passed_quotes():
+    """Quote requests this affiliate passed on, hidden from their queue"""
+    return set(session.get('affiliate_passed_quotes', []))
+
 # Affiliate Dashboard Routes
 @affiliate_bp.route('/dashboard')
 def dashboard():
@@ -349,6 +472,7 @@ def dashboard():
     try:
         # Get pending and recent quotes
         quotes = []
+        queue_version = queue_epoch = None
         stats = {
             'pending_quotes': 0,
             'completed_today': 0,
@@ -357,53 +481,19 @@ def dashboard():
         }
         
         if DB_AVAILABLE:
-            from datetime import datetime, timedelta
-            from models import Quote
-            
-            # Get quotes for this affiliate (simplified - in production would filter by affiliate ID)
-            all_quotes = Quote.query.filter(
-                Quote.status.in_(['pending', 'quoted', 'confirmed'])
-            ).order_by(Quote.created_at.desc()).limit(20).all()
-            
-            for quote in all_quotes:
-                # Calculate age in hours
-                age_delta = datetime.utcnow() - quote.created_at
-                age_hours = int(age_delta.total_seconds() / 3600)
-                
-                quote_data = {
-                    'ref_id': quote.ref_id,
-                    'status': quote.status,
-                    'severity_level': quote.severity_level,
-                    'age_hours': age_hours,
-                    'from_city': quote.from_city,
-                    'from_state': quote.from_state,
-                    'to_city': quote.to_city,
-                    'to_state': quote.to_state,
-                    'flight_date': quote.flight_date,
-                    'contact_name': quote.contact_name,
-                    'contact_phone': quote.contact_phone,
-                    'contact_email': quote.contact_email,
-                    'ground_transport_needed': quote.ground_transport_needed,
-                    'quoted_price': quote.quoted_price
-                }
+            # Served from the in-memory work queue; quote lifecycle events keep it current
+            queue = work_queue.changes_since(None, exclude=passed_quotes())
+            queue_version, queue_epoch = queue['version'], queue['epoch']
+            stats = queue['stats']
+            now = time.time()
+            for item in queue['upserts']:
+                quote_data = dict(item)
+                quote_data['age_hours'] = int((now - item['created_at']) / 3600)
+                quote_data['flight_date'] = datetime.fromisoformat(item['flight_date']) if item['flight_date'] else None
                 quotes.append(quote_data)
-                
-                # Update statistics
-                if quote.status == 'pending':
-                    stats['pending_quotes'] += 1
-                    if quote.severity_level == 3:
-                        stats['urgent_requests'] += 1
-                
-                # Today's completed quotes
-                today = datetime.utcnow().date()
-                if quote.quote_submitted_at and quote.quote_submitted_at.date() == today:
-                    stats['completed_today'] += 1
-                    if quote.quoted_price:
-                        stats['revenue_today'] += float(quote.quoted_price)
         
         # Demo quotes if no database
         if not quotes and not DB_AVAILABLE:
-            from datetime import datetime, timedelta
             quotes = [
                 {
                     'ref_id': 'QT-20250817-001',
@@ -429,13 +519,23 @@ def dashboard():
                 'revenue_today': 15750
             }
         
-        return render_template('affiliate/dashboard.html', quotes=quotes, stats=stats)
+        return render_template('affiliate/dashboard.html', quotes=quotes, stats=stats,
+                               queue_version=queue_version, queue_epoch=queue_epoch)
         
     except Exception as e:
         logger.error(f"Error loading affiliate dashboard: {str(e)}")
         flash('Error loading dashboard. Please try again.', 'error')
         return render_template('affiliate/dashboard.html', quotes=[], stats={})
 
+@affiliate_bp.route('/queue/changes')
+def queue_changes():
+    """Changes to this affiliate's quote queue since ?epoch=<epoch>&since=<version>, relative to the refs the
+    page shows (?shown=<ref,ref,...>); everything when since is missing, too old or from another process"""
+    shown = [ref for ref in request.args.get('shown', '').split(',') if ref]
+    changes = work_queue.changes_since(request.args.get('since', type=int), exclude=passed_quotes(),
+                                       epoch=request.args.get('epoch'), shown=shown)
+    return jsonify(changes)
+
 @affiliate_bp.route('/submit-quote/<quote_ref>')
 def submit_quote_form(quote_ref):
     """Display quote submission form"""
@@ -517,6 +617,8 @@ def submit_quote(quote_ref):
         
         if DB_AVAILABLE:
             db.session.commit()
+        work_queue.quote_changed(quote)
+        publish_quote_received(quote)
         
         # Send notifications
         try:
@@ -545,8 +647,10 @@ def pass_quote(quote_ref):
                 # Log the pass action
                 logger.info(f"Quote {quote_ref} passed by affiliate")
                 # In production, this would rotate to next affiliate
-                # For now, just keep status as pending
-                pass
+                # For now, it stays pending and leaves only this affiliate's queue
+                passed = session.get('affiliate_passed_quotes', [])
+                if quote_ref not in passed:
+                    session['affiliate_passed_quotes'] = (passed + [quote_ref])[-500:]
         
         flash('Quote passed to next affiliate successfully.', 'info')
         
@@ -579,6 +683,7 @@ def confirm_booking(quote_ref):
         
         if DB_AVAILABLE:
             db.session.commit()
+        work_queue.quote_changed(quote)
         
         # Send booking confirmation
         try:
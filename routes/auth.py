@@ -1,60 +1,21 @@
 import os
-import secrets
-import hashlib
 from datetime import datetime, timedelta
 from flask import Blueprint, request, render_template, redirect, url_for, flash, session, jsonify
-from werkzeug.security import check_password_hash, generate_password_hash
 import logging
 
 from models.audit import AuditLog
 from services.mailer import mail_service
+from services.passwords import hash_password
+from services.tokens import token_store, PASSWORD_RESET
+from config import Config
 
 logger = logging.getLogger(__name__)
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
-# Password reset token storage (in production, use Redis or database)
-password_reset_tokens = {}
-
-def generate_reset_token():
-    """Generate a secure password reset token"""
-    return secrets.token_urlsafe(32)
-
-def hash_token(token):
-    """Hash token for secure storage"""
-    return hashlib.sha256(token.encode()).hexdigest()
-
 def is_token_valid(token, email):
     """Check if password reset token is valid"""
-    token_hash = hash_token(token)
-    if token_hash not in password_reset_tokens:
-        return False
-    
-    stored_data = password_reset_tokens[token_hash]
-    if stored_data['email'] != email:
-        return False
-    
-    # Check expiration (2 hours)
-    expiry = datetime.fromisoformat(stored_data['expires'])
-    if datetime.now() > expiry:
-        # Clean up expired token
-        del password_reset_tokens[token_hash]
-        return False
-    
-    return True
-
-def cleanup_expired_tokens():
-    """Remove expired tokens from storage"""
-    current_time = datetime.now()
-    expired_tokens = []
-    
-    for token_hash, data in password_reset_tokens.items():
-        expiry = datetime.fromisoformat(data['expires'])
-        if current_time > expiry:
-            expired_tokens.append(token_hash)
-    
-    for token_hash in expired_tokens:
-        del password_reset_tokens[token_hash]
+    return token_store.peek(PASSWORD_RESET, token, subject=email) is not None
 
 @auth_bp.route('/password-reset', methods=['GET', 'POST'])
 def password_reset_request():
@@ -78,17 +39,9 @@ def password_reset_request():
         return redirect(url_for('auth.password_reset_request'))
     
     try:
-        # Generate reset token
-        reset_token = generate_reset_token()
-        token_hash = hash_token(reset_token)
-        
-        # Store token with expiration
-        expiry = datetime.now() + timedelta(hours=2)
-        password_reset_tokens[token_hash] = {
-            'email': email,
-            'expires': expiry.isoformat(),
-            'created': datetime.now().isoformat()
-        }
+        # Generate reset token (replaces any earlier link for this email)
+        expiry = datetime.now() + timedelta(hours=Config.RESET_TOKEN_EXPIRY_HOURS)
+        reset_token = token_store.issue(PASSWORD_RESET, email, Config.RESET_TOKEN_EXPIRY_HOURS * 3600)
         
         # Generate reset URL
         reset_url = url_for('auth.password_reset_verify', token=reset_token, email=email, _external=True)
@@ -130,9 +83,6 @@ def password_reset_verify():
         flash('Invalid reset link.', 'error')
         return redirect(url_for('auth.password_reset_request'))
     
-    # Clean up expired tokens
-    cleanup_expired_tokens()
-    
     # Verify token
     if not is_token_valid(token, email):
         flash('Reset link has expired or is invalid. Please request a new one.', 'error')
@@ -160,23 +110,15 @@ def password_reset_confirm():
         flash('Password must be at least 6 characters long.', 'error')
         return render_template('auth/password_reset_form.html', token=token, email=email)
     
-    # Clean up expired tokens
-    cleanup_expired_tokens()
-    
-    # Verify token one more time
-    if not is_token_valid(token, email):
+    # Use up the token; a second submission of the same link fails here
+    if token_store.consume(PASSWORD_RESET, token, subject=email) is None:
         flash('Reset link has expired or is invalid.', 'error')
         return redirect(url_for('auth.password_reset_request'))
     
     try:
         # In production, update password in database
         # For demo, we'll simulate the password update
-        password_hash = generate_password_hash(new_password)
-        
-        # Remove used token
-        token_hash = hash_token(token)
-        if token_hash in password_reset_tokens:
-            del password_reset_tokens[token_hash]
+        password_hash = hash_password(new_password)
         
         # Send confirmation email
         mail_service.send_password_reset_confirmation(email)
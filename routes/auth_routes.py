@@ -2,7 +2,6 @@
 Authentication routes for email verification and login
 """
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
-from werkzeug.security import generate_password_hash
 from services.auth_utils import (
     create_user_with_verification, verify_email_token, 
     resend_verification_email, authenticate_user
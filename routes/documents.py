@@ -1,12 +1,14 @@
 import os
-import hashlib
 import logging
 from datetime import datetime
 from flask import Blueprint, request, jsonify, render_template, send_file, session, abort
 from werkzeug.utils import secure_filename
 from io import BytesIO
+from urllib.parse import quote
 
 from consumer_main_final import consumer_app as app, db
+from config import Config
+from services.blob_store import blob_store, BlobTooLarge
 
 logger = logging.getLogger(__name__)
 
@@ -36,9 +38,6 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def calculate_file_hash(file_data):
-    """Calculate SHA-256 hash of file data"""
-    return hashlib.sha256(file_data).hexdigest()
 
 @documents_bp.route('/<quote_ref>/docs', methods=['GET'])
 def list_documents(quote_ref):
@@ -153,15 +152,14 @@ def upload_documents(quote_ref):
                 errors.append(f'File type not allowed: {file.filename}')
                 continue
             
-            # Read file data
-            file_data = file.read()
-            
-            # Validate file size
-            if len(file_data) > MAX_FILE_SIZE:
-                errors.append(f'File too large: {file.filename} ({len(file_data)} bytes)')
+            # Stream into the blob store in chunks, hashing as it goes; identical content is stored once
+            try:
+                file_hash, file_size = blob_store.write(file.stream, max_size=MAX_FILE_SIZE)
+            except BlobTooLarge:
+                errors.append(f'File too large: {file.filename} (over {MAX_FILE_SIZE} bytes)')
                 continue
             
-            if len(file_data) == 0:
+            if file_size == 0:
                 errors.append(f'Empty file: {file.filename}')
                 continue
             
@@ -177,9 +175,6 @@ def upload_documents(quote_ref):
             else:
                 unique_filename = f"{secure_name}_{timestamp}"
             
-            # Calculate file hash
-            file_hash = calculate_file_hash(file_data)
-            
             # Create document record
             try:
                 document = Document(
@@ -187,8 +182,7 @@ def upload_documents(quote_ref):
                     filename=unique_filename,
                     original_filename=original_filename,
                     content_type=file.content_type or 'application/octet-stream',
-                    file_size=len(file_data),
-                    file_data=file_data,
+                    file_size=file_size,
                     uploaded_by=user_id,
                     upload_source='web',
                     file_hash=file_hash
@@ -211,7 +205,7 @@ def upload_documents(quote_ref):
                     new_values={
                         'filename': unique_filename,
                         'original_filename': original_filename,
-                        'file_size': len(file_data),
+                        'file_size': file_size,
                         'content_type': file.content_type
                     }
                 )
@@ -276,12 +270,44 @@ def download_document(quote_ref, doc_id):
         )
         db.session.commit()
         
-        # Return file data
+        # Rows not yet moved out of the database still carry their content
+        if document.file_data is not None:
+            return send_file(
+                BytesIO(document.file_data),
+                mimetype=document.content_type,
+                as_attachment=True,
+                download_name=document.original_filename,
+                conditional=True
+            )
+        
+        if not document.file_hash or not blob_store.exists(document.file_hash):
+            logger.error(f"Blob missing for document {doc_id} ({document.file_hash})")
+            abort(404, description="Document content not found")
+        
+        if Config.DOCUMENT_ACCEL_REDIRECT_PREFIX:
+            # nginx serves the file (and any Range) itself from an internal location
+            response = app.response_class(mimetype=document.content_type)
+            response.headers['X-Accel-Redirect'] = (
+                Config.DOCUMENT_ACCEL_REDIRECT_PREFIX.rstrip('/') + '/' +
+                blob_store.relative_path(document.file_hash).replace(os.sep, '/')
+            )
+            try:
+                document.original_filename.encode('ascii')
+                response.headers.set('Content-Disposition', 'attachment', filename=document.original_filename)
+            except UnicodeEncodeError:
+                response.headers.set('Content-Disposition', 'attachment',
+                                     **{'filename*': f"UTF-8''{quote(document.original_filename)}"})
+            return response
+        
+        # Serve from disk: Range and If-None-Match are handled, USE_X_SENDFILE hands the file to the
+        # front server, and otherwise the WSGI server's file wrapper can use sendfile()
         return send_file(
-            BytesIO(document.file_data),
+            blob_store.path(document.file_hash),
             mimetype=document.content_type,
             as_attachment=True,
-            download_name=document.original_filename
+            download_name=document.original_filename,
+            conditional=True,
+            etag=document.file_hash
         )
         
     except Exception as e:
@@ -5,6 +5,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from datetime import datetime, timezone, timedelta
 from models import QuoteRequest, User
 from services.mailer import mail_service
+from services.notifications import notification_dispatcher
 from services.audit import log_quote_created, log_quote_submitted_by_affiliate, log_quote_confirmed
 from app import db
 
@@ -67,10 +68,19 @@ def submit_quote():
         # Send confirmation email to individual
         mail_service.send_quote_request_confirmation(user, quote_request)
         
-        # Send notification to test affiliates (for now, just admin users with affiliate type)
-        affiliate_users = User.query.filter_by(user_type='affiliate', is_verified=True).all()
-        for affiliate_user in affiliate_users[:3]:  # Limit to first 3 affiliates for testing
-            mail_service.send_new_quote_notification(affiliate_user, quote_request)
+        # Queue the affiliate notifications in the mail outbox (see NOTIFY_NEW_QUOTE_MAX_RECIPIENTS)
+        job_id = notification_dispatcher.notify_new_quote(quote_request.id)
+        
+        if request.accept_mimetypes.best == 'application/json':
+            response = jsonify({
+                'success': True,
+                'booking_id': booking_id,
+                'notification_job': job_id,
+                'status_url': url_for('quote.notification_status', job_id=job_id) if job_id else None
+            })
+            response.status_code = 202
+            response.headers['Location'] = url_for('quote.quote_results', booking_id=booking_id)
+            return response
         
         flash(f'Quote request submitted successfully! Reference: {booking_id}', 'success')
         return redirect(url_for('quote.quote_results', booking_id=booking_id))
@@ -80,6 +90,22 @@ def submit_quote():
         flash(f'Error submitting quote: {str(e)}', 'error')
         return redirect(request.referrer or url_for('consumer.intake'))
 
+@quote_bp.route('/notifications/jobs/<job_id>')
+def notification_status(job_id):
+    """Progress of a notification fan-out job, for the user who started it or an admin"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Login required'}), 401
+    
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'Login required'}), 401
+    # Someone else's job looks the same as a missing one
+    job = notification_dispatcher.job_status(job_id, user_id=None if user.role == 'admin' else user.id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
 @quote_bp.route('/quote_results/<booking_id>')
 def quote_results(booking_id):
     """Show quote results to individual"""
@@ -226,10 +252,25 @@ def admin_email_log():
         flash('Admin access required', 'error')
         return redirect(url_for('consumer.home'))
     
-    from models import EmailLog
-    from services.mailer import mail_service
+    from models import EmailLog, EmailStatsHourly
+    from services.mailer import mail_service, email_log_buffer
+    
+    # Write out this worker's buffered rows so the page is current
+    email_log_buffer.flush()
     email_logs = EmailLog.query.order_by(EmailLog.created_at.desc()).limit(100).all()
     
+    # Throughput from the hourly counters instead of scanning email_logs
+    since = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0, tzinfo=None) - timedelta(hours=23)
+    hourly_stats = EmailStatsHourly.query.filter(EmailStatsHourly.hour >= since).order_by(
+        EmailStatsHourly.hour.desc(), EmailStatsHourly.email_type
+    ).all()
+    totals = {
+        'sent': sum(stat.sent for stat in hourly_stats),
+        'failed': sum(stat.failed for stat in hourly_stats)
+    }
+    
     return render_template('admin_templates/email_log.html', 
                          email_logs=email_logs, 
+                         hourly_stats=hourly_stats,
+                         totals=totals,
                          mail_disabled=not mail_service.enabled)
\ No newline at end of file
@@ -9,8 +9,8 @@ import uuid
 
 from models import db, Quote
 from routes.affiliate import send_affiliate_quote_request
-from services.mailer import email_service
 from services.sms import sms_service
+from services.work_queue import work_queue
 
 logger = logging.getLogger(__name__)
 
@@ -87,6 +87,7 @@ def submit_quote_request():
         
         db.session.add(quote)
         db.session.commit()
+        work_queue.quote_changed(quote)
         
         # Send notification to affiliate
         send_affiliate_quote_request(quote)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+SkyCareLink Data Store Migration
+One-shot import of the data/*.json documents into the SQLite data store
+"""
+
+import argparse
+import os
+import sys
+
+# Run from the repository root so relative data/ paths resolve
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+from services.storage import MIGRATED_FILES, SQLiteBackend, import_json_files  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def main():
+    """Import legacy JSON documents into the data store"""
+    parser = argparse.ArgumentParser(description='Import data/*.json files into the SQLite data store')
+    parser.add_argument('--db', default=Config.DATA_STORE_PATH, help='SQLite database path')
+    parser.add_argument('--force', action='store_true', help='Overwrite documents already in the store')
+    parser.add_argument('--archive', metavar='DIR', help='Move imported JSON files into DIR afterwards')
+    parser.add_argument('files', nargs='*', help='Specific files to import (default: all managed documents)')
+    args = parser.parse_args()
+
+    store = SQLiteBackend(args.db)
+    files = args.files or MIGRATED_FILES
+
+    print("🗄️  SkyCareLink Data Store Migration")
+    print(f"Database: {args.db}")
+    print(f"Files to import: {len(files)}")
+    print("-" * 60)
+
+    results = import_json_files(store, files, force=args.force, archive_dir=args.archive)
+
+    failures = 0
+    for path, status in results.items():
+        if status == 'imported':
+            print(f"✓ IMPORTED: {path} (version {store.version(path)})")
+        elif status.startswith('error'):
+            failures += 1
+            print(f"✗ FAILED:   {path} - {status}")
+        else:
+            print(f"- {status.upper()}: {path}")
+
+    print("-" * 60)
+    imported = len([s for s in results.values() if s == 'imported'])
+    print(f"📊 Summary: {imported} imported, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Cached site-wide announcements for the inject_announcements context processor
+The announcements document is parsed once per version; "active now" is a bisect over precomputed window boundaries
+"""
+import time
+import bisect
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ANNOUNCEMENTS_PATH = 'data/announcements.json'
+
+# Windows used when an announcement leaves start_at/end_at unset
+DEFAULT_START = '2025-01-01T00:00:00'
+DEFAULT_END = '2025-12-31T23:59:59'
+
+
+def _parse_local(value, tz):
+    """Naive ISO string (optional 'Z' and fractional seconds are dropped) as an aware datetime in tz"""
+    return datetime.fromisoformat(str(value).replace('Z', '').split('.')[0]).replace(tzinfo=tz)
+
+
+def _is_active_flag(announcement):
+    # Schema normalization: handle both is_active and active fields, as booleans or strings
+    is_active = announcement.get('is_active', announcement.get('active', False))
+    if isinstance(is_active, str):
+        is_active = is_active.lower() in ('true', '1', 'yes')
+    return bool(is_active)
+
+
+class AnnouncementCache:
+    """Parsed announcements, reloaded only when the document's store version changes"""
+
+    def __init__(self, store, tz, path=ANNOUNCEMENTS_PATH, check_interval=1.0):
+        self.store = store
+        self.tz = tz
+        self.path = path
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._next_check = 0.0
+        # (boundaries, segments): boundaries are sorted epoch seconds where the active set changes,
+        # segments[i] is what is active between boundaries[i-1] and boundaries[i]
+        self._windows = ([], [()])
+
+    def invalidate(self):
+        """Force a version check on the next lookup (call after saving announcements)"""
+        self._next_check = 0.0
+
+    def _compile(self, data):
+        """[(start, end, countdown_target, announcement)] for enabled announcements with valid windows"""
+        entries = []
+        for announcement in (data or {}).get('announcements', []):
+            if not _is_active_flag(announcement):
+                continue
+            try:
+                start_at = _parse_local(announcement.get('start_at', DEFAULT_START), self.tz)
+                end_at = _parse_local(announcement.get('end_at', DEFAULT_END), self.tz)
+            except Exception as e:
+                logger.error(f"Error parsing announcement dates for {announcement.get('id', 'unknown')}: {e}")
+                continue
+
+            countdown = None
+            countdown_target = announcement.get('countdown_target') or ''
+            if countdown_target and str(countdown_target).strip():
+                try:
+                    countdown = _parse_local(countdown_target, self.tz).timestamp()
+                except ValueError:
+                    # Invalid countdown target, skip countdown
+                    pass
+
+            announcement = dict(announcement, style=announcement.get('style', 'info'))
+            entries.append((start_at.timestamp(), end_at.timestamp(), countdown, announcement))
+        return entries
+
+    def _build(self, entries):
+        # Windows are inclusive of end_at, so each one closes just after its end second
+        boundaries = sorted({start for start, _, _, _ in entries} | {end + 1e-6 for _, end, _, _ in entries})
+        segments = []
+        for i in range(len(boundaries) + 1):
+            probe = boundaries[i - 1] if i else float('-inf')
+            segments.append(tuple(
+                (countdown, announcement) for start, end, countdown, announcement in entries
+                if start <= probe <= end
+            ))
+        return boundaries, segments
+
+    def refresh(self, force=False):
+        """Reload if the document changed (version checked at most once per interval)"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        with self._lock:
+            self._next_check = now + self.check_interval
+            version = self.store.version(self.path)
+            if not force and version == self._version:
+                return False
+            self._windows = self._build(self._compile(self.store.load(self.path)))
+            self._version = version
+        return True
+
+    def active(self, now=None):
+        """Announcements active at `now` (default: current time), with countdown fields filled in"""
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"Error loading announcements from /{self.path}: {e}")
+        now = now or datetime.now(self.tz)
+        timestamp = now.timestamp()
+        boundaries, segments = self._windows
+        segment = segments[bisect.bisect_right(boundaries, timestamp)]
+
+        active_announcements = []
+        for countdown, announcement in segment:
+            announcement = dict(announcement)
+            if countdown is not None:
+                remaining = countdown - timestamp
+                if remaining > 0:
+                    days, remainder = divmod(int(remaining), 86400)
+                    hours, remainder = divmod(remainder, 3600)
+                    announcement['countdown_display'] = f"{days:02d}:{hours:02d}:{remainder // 60:02d}"
+                    announcement['countdown_expired'] = False
+                else:
+                    announcement['countdown_display'] = "We're live!"
+                    announcement['countdown_expired'] = True
+            active_announcements.append(announcement)
+        return active_announcements
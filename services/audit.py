@@ -1,46 +1,190 @@
 """
 Audit service for tracking system actions
+Events are queued with their request context and bulk-inserted by a background writer
 """
+import os
+import queue
+import atexit
 import logging
+import threading
+import time
 from datetime import datetime, timezone
-from flask import request, session
+from flask import request, session, has_request_context, has_app_context, current_app
+from sqlalchemy import insert
 from models import AuditLog
 from app import db
+from config import Config
 
 logger = logging.getLogger(__name__)
 
+
+class AuditWriter:
+    """Bounded queue of audit rows flushed in batches by a daemon thread"""
+
+    def __init__(self, max_size=None, batch_size=None, flush_interval=None, enqueue_timeout=None):
+        self.max_size = max_size or Config.AUDIT_QUEUE_MAX_SIZE
+        self.batch_size = batch_size or Config.AUDIT_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.AUDIT_FLUSH_INTERVAL_SECONDS
+        self.enqueue_timeout = enqueue_timeout if enqueue_timeout is not None else Config.AUDIT_ENQUEUE_TIMEOUT_SECONDS
+
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._app = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'batches': 0,
+            'blocked': 0,
+            'max_depth': 0
+        }
+
+        atexit.register(self.shutdown)
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _ensure_started(self):
+        """Start the writer thread, again in each forked worker"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Queue contents belong to the parent process
+                self._queue = queue.Queue(maxsize=self.max_size)
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, row):
+        """Queue one audit row; blocks briefly when full, then drops and counts it"""
+        if self._app is None and has_app_context():
+            self._app = current_app._get_current_object()
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count('blocked')
+            try:
+                self._queue.put(row, timeout=self.enqueue_timeout)
+            except queue.Full:
+                self._count('dropped')
+                logger.warning(f"Audit queue full, dropped event {row.get('action')}")
+                return False
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            if depth > self._stats['max_depth']:
+                self._stats['max_depth'] = depth
+        return True
+
+    def _take_batch(self):
+        """Wait for the first row, then collect up to batch_size within the flush interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        if self._app is None:
+            from app import app as default_app
+            self._app = default_app
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                with self._app.app_context():
+                    self.write_batch(batch)
+                    db.session.remove()
+
+    def write_batch(self, rows):
+        """Bulk insert rows in one transaction (requires an app context)"""
+        try:
+            db.session.execute(insert(AuditLog), rows)
+            db.session.commit()
+        except Exception as e:
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+            self._count('failed', len(rows))
+            logger.error(f"Failed to write {len(rows)} audit events: {e}")
+            return False
+
+        with self._stats_lock:
+            self._stats['written'] += len(rows)
+            self._stats['batches'] += 1
+        return True
+
+    def shutdown(self, timeout=10.0):
+        """Drain queued events before the process exits"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Audit writer did not drain in {timeout}s, {self._queue.qsize()} events pending")
+
+    def stats(self):
+        """Backpressure and throughput counters"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        return stats
+
+
+# Global audit writer instance
+audit_writer = AuditWriter()
+
+
 def log_audit(action, details=None, user_id=None):
     """Log an audit event"""
     try:
-        # Get IP and user agent from request context
+        # Get IP and user agent from request context now; the writer runs outside it
         ip_address = None
         user_agent = None
         
-        if request:
+        if has_request_context():
             ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR'))
             user_agent = request.environ.get('HTTP_USER_AGENT', '')[:500]  # Truncate long user agents
         
-        audit_log = AuditLog(
-            action=action,
-            details=details,
-            user_id=user_id,
-            ip_address=ip_address,
-            user_agent=user_agent,
-            created_at=datetime.now(timezone.utc)
-        )
+        row = {
+            'action': action,
+            'details': details,
+            'user_id': user_id,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'created_at': datetime.now(timezone.utc)
+        }
         
-        db.session.add(audit_log)
-        db.session.commit()
+        if Config.AUDIT_ASYNC:
+            audit_writer.enqueue(row)
+        else:
+            audit_writer.write_batch([row])
         
         logger.info(f"Audit logged: {action} - User: {user_id}")
         
     except Exception as e:
         logger.error(f"Failed to log audit event {action}: {e}")
         # Don't let audit failures break the application
-        try:
-            db.session.rollback()
-        except:
-            pass
 
 def log_user_registered(user_id, username):
     """Log user registration"""
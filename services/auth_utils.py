@@ -1,21 +1,24 @@
 """
 Authentication utilities for email verification and password reset
 """
-import secrets
 import hashlib
 from datetime import datetime, timezone, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app
 from models import User, AuditLog
 from services.audit import (
     log_user_registered, log_email_verification_sent, log_email_verified,
     log_login_failed, log_login_rate_limited, log_login_success
 )
 from services.mailer import mail_service
+from services.passwords import password_hasher, hash_password, verify_password, PasswordHasherBusy
+from services.tokens import token_store, EMAIL_VERIFICATION
+from config import Config
 from app import db
 
-def generate_verification_token():
-    """Generate a secure verification token"""
-    return secrets.token_urlsafe(32)
+def issue_verification_token(user):
+    """Store a new email verification token for the user (earlier ones stop working) and return it"""
+    return token_store.issue(EMAIL_VERIFICATION, user.id,
+                             Config.EMAIL_VERIFICATION_TOKEN_EXPIRY_HOURS * 3600)
 
 def create_user_with_verification(username, email, password, role='individual'):
     """Create a new user and send verification email"""
@@ -26,8 +29,7 @@ def create_user_with_verification(username, email, password, role='individual'):
             return False, "Username or email already exists"
         
         # Create new user
-        password_hash = generate_password_hash(password)
-        verification_token = generate_verification_token()
+        password_hash = hash_password(password)
         
         user = User(
             username=username,
@@ -45,6 +47,7 @@ def create_user_with_verification(username, email, password, role='individual'):
         log_user_registered(user.id, username)
         
         # Send verification email
+        verification_token = issue_verification_token(user)
         if mail_service.send_verification_email(user, verification_token):
             log_email_verification_sent(user.id, email)
             return True, "User created successfully. Please check your email for verification."
@@ -56,18 +59,22 @@ def create_user_with_verification(username, email, password, role='individual'):
         return False, f"Error creating user: {str(e)}"
 
 def verify_email_token(token):
-    """Verify email with token - simplified for existing schema"""
+    """Verify email with a token issued by issue_verification_token (single use)"""
     try:
-        # For existing schema, we'll just activate the account
-        user = User.query.filter_by(username=token[:20]).first()  # Simple token matching
+        record = token_store.consume(EMAIL_VERIFICATION, token)
+        if not record:
+            return False, "Invalid or expired verification token"
+        
+        user = User.query.get(int(record['subject']))
         if not user:
             return False, "Invalid verification token"
         
-        if user.is_active:
+        if user.is_verified:
             return True, "Email already verified"
         
-        # Activate the user
+        user.is_verified = True
         user.is_active = True
+        user.verification_token = None
         db.session.commit()
         
         # Log verification
@@ -80,25 +87,39 @@ def verify_email_token(token):
         return False, f"Error verifying email: {str(e)}"
 
 def resend_verification_email(email):
-    """Resend verification email - simplified for existing schema"""
+    """Send a fresh verification link; earlier links for the user stop working"""
     try:
         user = User.query.filter_by(email=email).first()
         if not user:
             return False, "User not found"
         
-        if user.is_active:
+        if user.is_verified:
             return False, "Email already verified"
         
-        # For existing schema, just activate the account
-        user.is_active = True
-        db.session.commit()
+        verification_token = issue_verification_token(user)
+        if not mail_service.send_verification_email(user, verification_token):
+            return False, "Verification email failed to send. Please try again later."
         
         log_email_verification_sent(user.id, email)
-        return True, "Account activated"
+        return True, "Verification email sent. Please check your inbox."
             
     except Exception as e:
         return False, f"Error resending verification: {str(e)}"
 
+def schedule_password_upgrade(user_id, password, password_hash):
+    """Rehash an outdated password hash in the background after a successful login"""
+    app = current_app._get_current_object()
+
+    def persist(new_hash):
+        with app.app_context():
+            # Conditional update: leave the row alone if the password changed meanwhile
+            User.query.filter_by(id=user_id, password_hash=password_hash).update(
+                {'password_hash': new_hash}, synchronize_session=False
+            )
+            db.session.commit()
+
+    password_hasher.rehash_later(password, password_hash, persist)
+
 def authenticate_user(username_or_email, password):
     """Authenticate user with rate limiting"""
     try:
@@ -117,8 +138,12 @@ def authenticate_user(username_or_email, password):
             time_left = int((user.locked_until - datetime.now(timezone.utc)).total_seconds() / 60)
             return False, f"Account locked for {time_left} more minutes", None
         
-        # Check password
-        if not check_password_hash(user.password_hash, password):
+        # Check password (an overloaded hasher is not counted as a failed attempt)
+        try:
+            password_ok = verify_password(password, user.password_hash)
+        except PasswordHasherBusy:
+            return False, "Too many sign-in attempts right now. Please try again in a moment.", None
+        if not password_ok:
             # Increment failed attempts
             user.failed_login_attempts += 1
             
@@ -144,6 +169,7 @@ def authenticate_user(username_or_email, password):
         user.last_login = datetime.now(timezone.utc)
         db.session.commit()
         
+        schedule_password_upgrade(user.id, password, user.password_hash)
         log_login_success(user.id, user.username)
         return True, "Login successful", user
         
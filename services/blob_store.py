@@ -0,0 +1,147 @@
+"""
+Content-addressed file store for uploaded documents
+Each blob lives at <root>/<aa>/<bb>/<sha256> and is named by the SHA-256 of its content, so identical uploads
+share one file. Writes stream in chunks through the hash into a temp file that is renamed into place.
+"""
+import io
+import os
+import re
+import hashlib
+import logging
+import tempfile
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobTooLarge(Exception):
+    """The stream was longer than max_size; nothing was stored"""
+
+    def __init__(self, max_size):
+        super().__init__(f'Blob exceeds {max_size} bytes')
+        self.max_size = max_size
+
+
+class BlobStore:
+    """Write-once blobs on local disk keyed by SHA-256"""
+
+    def __init__(self, root=None, chunk_size=None):
+        self.root = root or Config.DOCUMENT_STORE_PATH
+        self.chunk_size = chunk_size or Config.DOCUMENT_UPLOAD_CHUNK_SIZE
+
+    def relative_path(self, digest):
+        if not _HASH_RE.match(digest or ''):
+            raise ValueError(f'Not a SHA-256 hex digest: {digest!r}')
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def path(self, digest):
+        return os.path.join(self.root, self.relative_path(digest))
+
+    def exists(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def write(self, stream, max_size=None):
+        """Store everything read from stream and return (sha256 hex, size)
+
+        Empty streams are not stored. Raises BlobTooLarge (after discarding the partial write) when the
+        stream is longer than max_size; a blob that is already stored is kept as is.
+        """
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise BlobTooLarge(max_size)
+                    digest.update(chunk)
+                    f.write(chunk)
+                if size:
+                    f.flush()
+                    os.fsync(f.fileno())
+            digest = digest.hexdigest()
+            if size:
+                self._commit(tmp_path, digest)
+            return digest, size
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def put_bytes(self, data):
+        """Store bytes already in memory (e.g. rows moved out of the database); returns (sha256 hex, size)"""
+        return self.write(io.BytesIO(data))
+
+    def _commit(self, tmp_path, digest):
+        """Rename a finished temp file into place unless the same content is already stored"""
+        path = self.path(digest)
+        if os.path.exists(path):
+            return  # dedup: identical content, keep the existing file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, path)
+
+    def read(self, digest):
+        with open(self.path(digest), 'rb') as f:
+            return f.read()
+
+
+def move_document_blobs(connection, store, batch_size=100):
+    """Copy documents.file_data into store and clear the column, batch by batch
+
+    Rows whose stored file_hash does not match their content are left in the table and reported.
+    Returns (moved, mismatched ids).
+    """
+    from sqlalchemy import text
+
+    moved, mismatched, last_id = 0, [], 0
+    while True:
+        rows = connection.execute(text(
+            'SELECT id, file_hash, file_data FROM documents '
+            'WHERE file_data IS NOT NULL AND id > :last_id ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': batch_size}).fetchall()
+        if not rows:
+            return moved, mismatched
+        for doc_id, file_hash, file_data in rows:
+            last_id = doc_id
+            file_data = bytes(file_data)
+            if file_hash and file_hash != hashlib.sha256(file_data).hexdigest():
+                logger.warning(f"Document {doc_id} content does not match its file_hash; left in the table")
+                mismatched.append(doc_id)
+                continue
+            digest, _ = store.put_bytes(file_data)
+            connection.execute(text(
+                'UPDATE documents SET file_data = NULL, file_hash = :file_hash WHERE id = :id'
+            ), {'file_hash': digest, 'id': doc_id})
+            moved += 1
+
+
+def restore_document_blobs(connection, store, batch_size=100):
+    """Inverse of move_document_blobs: copy blobs back into documents.file_data; returns how many"""
+    from sqlalchemy import text
+
+    restored, last_id = 0, 0
+    while True:
+        rows = connection.execute(text(
+            'SELECT id, file_hash FROM documents '
+            'WHERE file_data IS NULL AND id > :last_id ORDER BY id LIMIT :limit'
+        ), {'last_id': last_id, 'limit': batch_size}).fetchall()
+        if not rows:
+            return restored
+        for doc_id, file_hash in rows:
+            last_id = doc_id
+            connection.execute(text('UPDATE documents SET file_data = :file_data WHERE id = :id'),
+                               {'file_data': store.read(file_hash), 'id': doc_id})
+            restored += 1
+
+
+# Global document blob store
+blob_store = BlobStore()
@@ -0,0 +1,203 @@
+"""
+Write-behind popularity counters with rolling-window totals
+Increments are aggregated in memory and flushed to daily SQLite buckets in one transaction
+"""
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from datetime import date, timedelta
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counter_buckets (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    day TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (name, key, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_counter_buckets_day ON counter_buckets (day);
+CREATE TABLE IF NOT EXISTS counter_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+
+class WriteBehindCounters:
+    """Per-day counters; at most flush_interval seconds of increments are lost on a crash"""
+
+    def __init__(self, db_path=None, flush_interval=None, retention_days=None):
+        self.db_path = db_path or Config.COUNTERS_DB_PATH
+        self.flush_interval = flush_interval or Config.COUNTER_FLUSH_INTERVAL_SECONDS
+        self.retention_days = retention_days or Config.COUNTER_RETENTION_DAYS
+
+        self._local = threading.local()
+        self._pending = {}  # (name, key, day) -> count
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._last_prune = None
+
+        atexit.register(self.flush)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_started(self):
+        """Start the flush thread, again in each forked worker"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Increments inherited from the parent are flushed by the parent
+                self._pending = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='counter-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def incr(self, name, key, amount=1):
+        """Absorb an increment in memory; O(1), no I/O"""
+        self._ensure_started()
+        bucket = (name, str(key), date.today().isoformat())
+        with self._lock:
+            self._pending[bucket] = self._pending.get(bucket, 0) + amount
+
+    def flush(self):
+        """Write all pending increments in one transaction; returns the number of buckets written"""
+        if self._pid != os.getpid():
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            conn = self._connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany(
+                    """INSERT INTO counter_buckets (name, key, day, count) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(name, key, day) DO UPDATE SET count = count + excluded.count""",
+                    [(name, key, day, count) for (name, key, day), count in pending.items()]
+                )
+                conn.executemany(
+                    """INSERT INTO counter_versions (name, version) VALUES (?, 1)
+                       ON CONFLICT(name) DO UPDATE SET version = version + 1""",
+                    [(name,) for name in {bucket[0] for bucket in pending}]
+                )
+                conn.execute('COMMIT')
+            except Exception as e:
+                conn.execute('ROLLBACK')
+                # Put the increments back so the next flush retries them
+                with self._lock:
+                    for bucket, count in pending.items():
+                        self._pending[bucket] = self._pending.get(bucket, 0) + count
+                logger.error(f"Counter flush failed: {e}")
+                return 0
+
+            self._prune()
+            return len(pending)
+
+    def _prune(self):
+        """Drop buckets that have left every rolling window (once a day)"""
+        today = date.today()
+        if self._last_prune == today:
+            return
+        self._last_prune = today
+        cutoff = (today - timedelta(days=self.retention_days)).isoformat()
+        self._connect().execute('DELETE FROM counter_buckets WHERE day < ?', (cutoff,))
+
+    def _window_start(self, days):
+        return (date.today() - timedelta(days=days - 1)).isoformat()
+
+    def _pending_totals(self, name, since):
+        with self._lock:
+            totals = {}
+            for (bucket_name, key, day), count in self._pending.items():
+                if bucket_name == name and day >= since:
+                    totals[key] = totals.get(key, 0) + count
+            return totals
+
+    def rolling(self, name, key, days=90):
+        """Total for one key over the last `days` days, including unflushed increments"""
+        since = self._window_start(days)
+        row = self._connect().execute(
+            'SELECT COALESCE(SUM(count), 0) FROM counter_buckets WHERE name = ? AND key = ? AND day >= ?',
+            (name, str(key), since)
+        ).fetchone()
+        return row[0] + self._pending_totals(name, since).get(str(key), 0)
+
+    def rolling_all(self, name, days=90):
+        """{key: total} over the last `days` days, including unflushed increments"""
+        since = self._window_start(days)
+        totals = dict(self._connect().execute(
+            'SELECT key, SUM(count) FROM counter_buckets WHERE name = ? AND day >= ? GROUP BY key',
+            (name, since)
+        ).fetchall())
+        for key, count in self._pending_totals(name, since).items():
+            totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def version(self, name):
+        """Bumped on every flush that touched this counter (cache key for derived data)"""
+        row = self._connect().execute('SELECT version FROM counter_versions WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def seed(self, name, entries):
+        """One-time import of legacy totals as [(key, count, day)] if the counter has no history"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM counter_versions WHERE name = ?', (name,)).fetchone():
+                conn.execute('COMMIT')
+                return False
+            cutoff = (date.today() - timedelta(days=self.retention_days)).isoformat()
+            entries = [(key, count, day) for key, count, day in entries if count]
+            kept = [(name, str(key), day, count) for key, count, day in entries if day >= cutoff]
+            if len(kept) < len(entries):
+                logger.warning(f"Seeding {name}: dropped {len(entries) - len(kept)} entries dated before {cutoff}")
+            conn.executemany(
+                """INSERT INTO counter_buckets (name, key, day, count) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(name, key, day) DO UPDATE SET count = count + excluded.count""",
+                kept
+            )
+            conn.execute('INSERT INTO counter_versions (name, version) VALUES (?, 1)', (name,))
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+# Global counters instance
+popularity_counters = WriteBehindCounters()
@@ -0,0 +1,277 @@
+"""
+Persistent intake drafts shared across devices
+Autosaves are coalesced in memory and only the latest version of each draft is written after a short delay
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import sqlite3
+import logging
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'draft',
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_drafts_owner ON drafts (owner, updated_at);
+CREATE INDEX IF NOT EXISTS idx_drafts_expires ON drafts (expires_at);
+"""
+
+
+class DraftConflict(Exception):
+    """A patch was based on an older version than the current draft, or on a draft that no longer exists
+    (draft is None then)"""
+
+    def __init__(self, draft, draft_id=None):
+        if draft is None:
+            super().__init__(f"Draft {draft_id} no longer exists")
+        else:
+            super().__init__(f"Draft {draft['id']} is at version {draft['version']}")
+        self.draft = draft
+
+
+class DraftStore:
+    """Drafts table with write coalescing, field-level patches and an expiry sweeper
+
+    Pending writes live in this process for up to coalesce_seconds; reads in the same process see
+    them immediately, other workers see them once flushed.
+    """
+
+    def __init__(self, db_path=None, expiry_days=7, max_per_owner=10,
+                 coalesce_seconds=None, sweep_interval=None):
+        self.db_path = db_path or Config.DRAFTS_DB_PATH
+        self.expiry_days = expiry_days
+        self.max_per_owner = max_per_owner
+        self.coalesce_seconds = coalesce_seconds or Config.DRAFT_COALESCE_SECONDS
+        self.sweep_interval = sweep_interval or Config.DRAFT_SWEEP_INTERVAL_SECONDS
+
+        self._local = threading.local()
+        self._pending = {}  # draft id -> draft dict awaiting write
+        self._due = {}  # draft id -> monotonic time the pending write is due
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._next_sweep = 0.0
+
+        atexit.register(self.flush)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_started(self):
+        """Start the flush/sweep thread, again in each forked worker"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Pending drafts inherited from the parent are written by the parent
+                self._pending, self._due = {}, {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='draft-writer', daemon=True)
+            self._thread.start()
+
+    # -- reading ----------------------------------------------------------------
+
+    @staticmethod
+    def _from_row(row):
+        return {
+            'id': row['id'],
+            'owner': row['owner'],
+            'status': row['status'],
+            'data': json.loads(row['data']),
+            'version': row['version'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'expires_at': row['expires_at'],
+        }
+
+    def _read(self, draft_id):
+        row = self._connect().execute('SELECT * FROM drafts WHERE id = ?', (draft_id,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def get(self, draft_id, owner=None):
+        """Latest version of a draft (pending or stored), None if missing, expired or not the owner's"""
+        with self._lock:
+            draft = self._pending.get(draft_id)
+            draft = dict(draft) if draft else None
+        if draft is None:
+            draft = self._read(draft_id)
+        if draft is None or draft['expires_at'] < time.time():
+            return None
+        if owner is not None and draft['owner'] != owner:
+            return None
+        return draft
+
+    def list(self, owner, limit=None):
+        """Owner's live drafts, most recently updated first"""
+        rows = self._connect().execute(
+            'SELECT * FROM drafts WHERE owner = ? AND expires_at >= ? ORDER BY updated_at DESC LIMIT ?',
+            (owner, time.time(), limit or self.max_per_owner)
+        ).fetchall()
+        drafts = {row['id']: self._from_row(row) for row in rows}
+        with self._lock:
+            for draft_id, draft in self._pending.items():
+                if draft['owner'] == owner:
+                    drafts[draft_id] = dict(draft)
+        return sorted(drafts.values(), key=lambda d: d['updated_at'], reverse=True)[:limit or self.max_per_owner]
+
+    # -- writing ----------------------------------------------------------------
+
+    def save(self, owner, draft_id=None, data=None, patch=None, remove=(), base_version=None, status='draft'):
+        """Replace (data) or patch (patch/remove) a draft and schedule the write; returns the new draft
+
+        Raises DraftConflict when base_version is given and the draft has moved past it or is gone
+        (expired or deleted), since a patch cannot be applied to a draft the client no longer shares.
+        """
+        self._ensure_started()
+        draft_id = draft_id or str(uuid.uuid4())
+        # Serialize read-modify-write so concurrent saves of one draft get distinct versions
+        with self._save_lock:
+            current = self.get(draft_id)
+            if current is not None and current['owner'] != owner:
+                raise PermissionError(f"Draft {draft_id} belongs to another user")
+            if base_version is not None and (current is None or base_version != current['version']):
+                raise DraftConflict(current, draft_id)
+
+            now = time.time()
+            if data is None:
+                data = dict(current['data']) if current else {}
+                data.update(patch or {})
+                for field in remove:
+                    data.pop(field, None)
+
+            draft = {
+                'id': draft_id,
+                'owner': owner,
+                'status': status,
+                'data': data,
+                'version': (current['version'] if current else 0) + 1,
+                'created_at': current['created_at'] if current else now,
+                'updated_at': now,
+                'expires_at': now + self.expiry_days * 86400,
+            }
+            with self._lock:
+                self._pending[draft_id] = draft
+                # Keep the first due time so a steady stream of autosaves still lands every coalesce window
+                self._due.setdefault(draft_id, time.monotonic() + self.coalesce_seconds)
+        self._wakeup.set()
+        return dict(draft)
+
+    def delete(self, draft_id, owner=None):
+        """Delete a draft in 'draft' status; returns False if missing, not the owner's or already submitted"""
+        draft = self.get(draft_id, owner)
+        if draft is None or draft['status'] != 'draft':
+            return False
+        with self._lock:
+            self._pending.pop(draft_id, None)
+            self._due.pop(draft_id, None)
+        self._connect().execute('DELETE FROM drafts WHERE id = ?', (draft_id,))
+        return True
+
+    def reassign(self, from_owner, to_owner):
+        """Move anonymous drafts to a user after login"""
+        self.flush()
+        return self._connect().execute(
+            'UPDATE drafts SET owner = ? WHERE owner = ?', (to_owner, from_owner)
+        ).rowcount
+
+    def flush(self, only_due=False):
+        """Write pending drafts (all, or only those whose coalescing window has passed)"""
+        if self._pid != os.getpid():
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            ready = [draft_id for draft_id, due in self._due.items() if not only_due or due <= now]
+            batch = [self._pending.pop(draft_id) for draft_id in ready]
+            for draft_id in ready:
+                del self._due[draft_id]
+        if not batch:
+            return 0
+
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                """INSERT INTO drafts (id, owner, status, data, version, created_at, updated_at, expires_at)
+                   VALUES (:id, :owner, :status, :data, :version, :created_at, :updated_at, :expires_at)
+                   ON CONFLICT(id) DO UPDATE SET
+                       owner = excluded.owner, status = excluded.status, data = excluded.data,
+                       version = excluded.version, updated_at = excluded.updated_at,
+                       expires_at = excluded.expires_at
+                   WHERE excluded.version > drafts.version""",
+                [dict(draft, data=json.dumps(draft['data'])) for draft in batch]
+            )
+            for owner in {draft['owner'] for draft in batch}:
+                # Keep only the newest max_per_owner drafts
+                conn.execute(
+                    """DELETE FROM drafts WHERE owner = ? AND status = 'draft' AND id NOT IN (
+                           SELECT id FROM drafts WHERE owner = ? ORDER BY updated_at DESC LIMIT ?)""",
+                    (owner, owner, self.max_per_owner)
+                )
+            conn.execute('COMMIT')
+        except Exception as e:
+            conn.execute('ROLLBACK')
+            # Requeue unless a newer save for the same draft arrived meanwhile
+            with self._lock:
+                for draft in batch:
+                    if draft['id'] not in self._pending:
+                        self._pending[draft['id']] = draft
+                        self._due[draft['id']] = time.monotonic() + self.coalesce_seconds
+            logger.error(f"Draft flush failed: {e}")
+            return 0
+        return len(batch)
+
+    def sweep(self):
+        """Delete expired drafts"""
+        deleted = self._connect().execute('DELETE FROM drafts WHERE expires_at < ?', (time.time(),)).rowcount
+        if deleted:
+            logger.info(f"Draft sweeper removed {deleted} expired drafts")
+        return deleted
+
+    def _run(self):
+        while True:
+            with self._lock:
+                next_due = min(self._due.values(), default=None)
+            timeout = self.sweep_interval if next_due is None else max(0.0, next_due - time.monotonic())
+            self._wakeup.wait(min(timeout, self.sweep_interval))
+            self._wakeup.clear()
+            try:
+                self.flush(only_due=True)
+                if time.monotonic() >= self._next_sweep:
+                    self._next_sweep = time.monotonic() + self.sweep_interval
+                    self.sweep()
+            except Exception as e:
+                logger.error(f"Draft writer error: {e}")
@@ -0,0 +1,260 @@
+"""
+Append-only segmented event log for the security and error logs
+Events are written as JSON lines to size/time-rotated segment files and read back newest-first
+"""
+import os
+import glob
+import json
+import time
+import atexit
+import fcntl
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_TIME_FORMAT = '%Y%m%dT%H%M%S%f'
+_READ_BLOCK_SIZE = 64 * 1024
+
+
+def _reverse_lines(path):
+    """Yield the lines of a file from last to first without reading it all into memory"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b''
+        while position > 0:
+            read_size = min(_READ_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            chunk = f.read(read_size) + remainder
+            lines = chunk.split(b'\n')
+            # First piece may be the tail of a line that continues in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+
+class SegmentedLog:
+    """JSON-lines log split into rotated segments shared by all worker processes"""
+
+    def __init__(self, directory, prefix, max_segment_bytes=None, max_segment_age_hours=None,
+                 max_segments=None, fsync_interval=None, fsync_batch=None,
+                 legacy_path=None, legacy_key=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_segment_bytes = max_segment_bytes or Config.LOG_SEGMENT_MAX_BYTES
+        self.max_segment_age = (max_segment_age_hours or Config.LOG_SEGMENT_MAX_AGE_HOURS) * 3600
+        self.max_segments = max_segments or Config.LOG_MAX_SEGMENTS
+        self.fsync_interval = fsync_interval if fsync_interval is not None else Config.LOG_FSYNC_INTERVAL_SECONDS
+        self.fsync_batch = fsync_batch or Config.LOG_FSYNC_BATCH
+        self.legacy_path = legacy_path
+        self.legacy_key = legacy_key
+
+        self._lock = threading.Lock()
+        self._fd = None
+        self._path = None
+        self._pid = None
+        self._segment_started = 0.0
+        self._pending_fsync = 0
+        self._last_fsync = time.monotonic()
+
+        atexit.register(self.close)
+
+    # -- segment management -------------------------------------------------
+
+    def _segment_paths(self):
+        """Segment files oldest first (names sort by creation time)"""
+        return sorted(glob.glob(os.path.join(self.directory, f'{self.prefix}-*.jsonl')))
+
+    def _segment_started_at(self, path):
+        stamp = os.path.basename(path)[len(self.prefix) + 1:].split('-')[0]
+        try:
+            return datetime.strptime(stamp, _SEGMENT_TIME_FORMAT).timestamp()
+        except ValueError:
+            return os.path.getmtime(path)
+
+    def _is_full(self, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return True
+        return size >= self.max_segment_bytes or time.time() - self._segment_started_at(path) >= self.max_segment_age
+
+    @contextmanager
+    def _directory_lock(self):
+        """Cross-process lock held while choosing, creating or pruning segments"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, f'.{self.prefix}.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _new_segment_path(self):
+        stamp = datetime.now().strftime(_SEGMENT_TIME_FORMAT)
+        return os.path.join(self.directory, f'{self.prefix}-{stamp}-{os.getpid()}.jsonl')
+
+    def _import_legacy(self, path):
+        """Seed the first segment from the old whole-file JSON log"""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, 'r') as f:
+                entries = json.load(f).get(self.legacy_key, [])
+            with open(path, 'a') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, separators=(',', ':'), default=str) + '\n')
+            os.replace(self.legacy_path, f'{self.legacy_path}.migrated')
+            logger.info(f"Imported {len(entries)} entries from {self.legacy_path} into {path}")
+        except Exception as e:
+            logger.error(f"Failed to import legacy log {self.legacy_path}: {e}")
+
+    def _close_fd(self):
+        if self._fd is not None and self._pid == os.getpid():
+            try:
+                os.fsync(self._fd)
+            except OSError:
+                pass
+            os.close(self._fd)
+        self._fd = None
+        self._path = None
+
+    def _open_segment(self):
+        """Open the newest segment, creating a new one if it is full (or none exist)"""
+        self._close_fd()
+        with self._directory_lock():
+            segments = self._segment_paths()
+            if segments and not self._is_full(segments[-1]):
+                path = segments[-1]
+            else:
+                path = self._new_segment_path()
+                if not segments:
+                    self._import_legacy(path)
+                segments.append(path)
+
+            # Retention: drop the oldest segments beyond the configured count
+            for old_path in segments[:-self.max_segments]:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._path = path
+        self._pid = os.getpid()
+        self._segment_started = self._segment_started_at(path)
+
+    def _needs_rotation(self):
+        if self._fd is None or self._pid != os.getpid():
+            return True
+        if time.time() - self._segment_started >= self.max_segment_age:
+            return True
+        return os.fstat(self._fd).st_size >= self.max_segment_bytes
+
+    # -- writing --------------------------------------------------------------
+
+    def append(self, event):
+        """Append one event; fsync is batched by count and interval"""
+        line = (json.dumps(event, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+        with self._lock:
+            if self._needs_rotation():
+                self._open_segment()
+            # O_APPEND makes single-line writes from several workers land whole
+            os.write(self._fd, line)
+
+            self._pending_fsync += 1
+            now = time.monotonic()
+            if self._pending_fsync >= self.fsync_batch or now - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._fd)
+                self._pending_fsync = 0
+                self._last_fsync = now
+
+    def flush(self):
+        """Force pending writes to disk"""
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid() and self._pending_fsync:
+                os.fsync(self._fd)
+                self._pending_fsync = 0
+                self._last_fsync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._close_fd()
+
+    # -- reading --------------------------------------------------------------
+
+    def iter_recent(self, since=None, limit=None):
+        """Stream events newest-first from segment tails
+
+        since: ISO timestamp; iteration stops at the first older event
+        limit: maximum number of events to scan
+        """
+        if self.legacy_path and not self._segment_paths() and os.path.exists(self.legacy_path):
+            # Nothing written yet in this deployment; import the old file before reading
+            with self._lock:
+                self._open_segment()
+
+        scanned = 0
+        for path in reversed(self._segment_paths()):
+            try:
+                lines = _reverse_lines(path)
+                for line in lines:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # Partially written line from a concurrent writer
+                        continue
+                    if since and event.get('timestamp', '') < since:
+                        return
+                    yield event
+                    scanned += 1
+                    if limit and scanned >= limit:
+                        return
+            except FileNotFoundError:
+                # Segment pruned by another worker while we were reading
+                continue
+
+    def tail(self, limit=100, predicate=None, since=None, scan_limit=None):
+        """Newest matching events, at most `limit` of them"""
+        results = []
+        for event in self.iter_recent(since=since, limit=scan_limit):
+            if predicate is None or predicate(event):
+                results.append(event)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def backup(self, backup_dir):
+        """Copy all segments into backup_dir/<prefix>/"""
+        self.flush()
+        target_dir = os.path.join(backup_dir, 'logs', self.prefix)
+        os.makedirs(target_dir, exist_ok=True)
+        copied = []
+        for path in self._segment_paths():
+            try:
+                shutil.copy2(path, target_dir)
+                copied.append(os.path.basename(path))
+            except FileNotFoundError:
+                continue
+        return copied
+
+
+# Global log instances
+security_events = SegmentedLog(
+    Config.SECURITY_LOG_DIR, 'security',
+    legacy_path='data/security_log.json', legacy_key='events'
+)
+error_events = SegmentedLog(
+    Config.ERROR_LOG_DIR, 'errors',
+    legacy_path='data/error_log.json', legacy_key='errors'
+)
@@ -0,0 +1,217 @@
+"""
+Facility autocomplete for /api/hospital-search
+Facilities are loaded from a CSV/JSONL file or a table into sorted token arrays and searched by token prefix
+"""
+import os
+import re
+import csv
+import json
+import time
+import heapq
+import bisect
+import hashlib
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+_MAX_LABEL_SCAN = 20000  # label-prefix matches ranked before falling back to alphabetical order
+_RESULT_CACHE_SIZE = 2048
+
+
+def normalize(text):
+    return ' '.join(_TOKEN_RE.findall((text or '').lower()))
+
+
+def facility_label(row):
+    """'Name - City, ST' display label for a facility record"""
+    if row.get('label'):
+        return row['label'].strip()
+    name = (row.get('name') or '').strip()
+    place = ', '.join(part.strip() for part in (row.get('city'), row.get('state')) if part and part.strip())
+    return f'{name} - {place}' if place else name
+
+
+def _weight(row):
+    try:
+        return float(row.get('weight') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def load_facility_file(path):
+    """Facility records from a .csv (header row) or .jsonl file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f))
+
+
+class FacilityAutocomplete:
+    """Token-prefix autocomplete over facility labels
+
+    Facilities are numbered in rank order (weight, then shorter label), so every posting array is
+    already sorted by rank and a query can stop after the first `limit` matches.
+    Source order: the file at `path`, else rows_fn() (e.g. a table) plus `defaults`, else `defaults`.
+    """
+
+    def __init__(self, path=None, rows_fn=None, defaults=(), check_interval=5.0):
+        self.path = path or Config.FACILITY_DATA_PATH
+        self.rows_fn = rows_fn
+        self.defaults = list(defaults)
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._signature = None
+        self._next_check = 0.0
+
+        self.labels = []  # doc id -> display label, in rank order
+        self.version = ''
+        self._doc_tokens = []  # doc id -> tuple of tokens
+        self._tokens = []  # sorted unique tokens
+        self._postings = {}  # token -> array of doc ids (ascending = rank order)
+        self._sorted_labels = []  # normalized labels, sorted
+        self._label_docs = array('I')  # doc id for each entry of _sorted_labels
+        self._cache = OrderedDict()  # (query, limit) -> results
+
+    # -- loading ----------------------------------------------------------------
+
+    def _file_signature(self):
+        if not self.path:
+            return None
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_rows(self, signature):
+        if signature is not None:
+            try:
+                return load_facility_file(self.path)
+            except (OSError, ValueError, csv.Error) as e:
+                logger.error(f"Failed to load facilities from {self.path}: {e}")
+        if self.rows_fn:
+            try:
+                rows = self.rows_fn()
+                if rows:
+                    return list(rows) + [{'label': label} for label in self.defaults]
+            except Exception as e:
+                logger.error(f"Failed to load facilities from the database: {e}")
+        return [{'label': label} for label in self.defaults]
+
+    def build(self, rows):
+        """Index facility records (dicts with label or name/city/state, optional weight)"""
+        ranked = {}
+        for row in rows:
+            label = facility_label(row)
+            if label:
+                ranked[label] = max(ranked.get(label, 0.0), _weight(row))
+        labels = sorted(ranked, key=lambda label: (-ranked[label], len(label), label))
+
+        doc_tokens = []
+        postings = {}
+        for doc, label in enumerate(labels):
+            tokens = tuple(dict.fromkeys(_TOKEN_RE.findall(label.lower())))
+            doc_tokens.append(tokens)
+            for token in tokens:
+                postings.setdefault(token, array('I')).append(doc)
+
+        by_label = sorted(range(len(labels)), key=lambda doc: normalize(labels[doc]))
+        version = hashlib.sha1('\n'.join(labels).encode()).hexdigest()[:16]
+
+        with self._lock:
+            self.labels = labels
+            self.version = version
+            self._doc_tokens = doc_tokens
+            self._tokens = sorted(postings)
+            self._postings = postings
+            self._sorted_labels = [normalize(labels[doc]) for doc in by_label]
+            self._label_docs = array('I', by_label)
+            self._cache = OrderedDict()
+        logger.info(f"Facility autocomplete built: {len(labels)} facilities, {len(postings)} tokens")
+
+    def refresh(self, force=False):
+        """Rebuild when the facility file changed (checked at most once per interval)"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        signature = self._file_signature()
+        if not force and signature == self._signature and self.labels:
+            return False
+        self.build(self._load_rows(signature))
+        self._signature = signature
+        return True
+
+    # -- querying ---------------------------------------------------------------
+
+    def _token_range(self, prefix):
+        start = bisect.bisect_left(self._tokens, prefix)
+        end = bisect.bisect_left(self._tokens, prefix + '\uffff', start)
+        return self._tokens[start:end]
+
+    def _label_prefix_docs(self, query, limit):
+        """Best-ranked facilities whose whole label starts with the query"""
+        start = bisect.bisect_left(self._sorted_labels, query)
+        end = bisect.bisect_left(self._sorted_labels, query + '\uffff', start)
+        if end - start <= limit:
+            return sorted(self._label_docs[start:end])
+        return heapq.nsmallest(limit, self._label_docs[start:min(end, start + _MAX_LABEL_SCAN)])
+
+    def _token_docs(self, tokens):
+        """Docs where every query token prefixes some label token, in rank order"""
+        ranges = [self._token_range(token) for token in tokens]
+        if not all(ranges):
+            return
+        # Walk the postings of the most selective query token and check the others per doc
+        sizes = [sum(len(self._postings[t]) for t in matched) for matched in ranges]
+        pivot = sizes.index(min(sizes))
+        others = [token for i, token in enumerate(tokens) if i != pivot]
+
+        last = None
+        for doc in heapq.merge(*(self._postings[t] for t in ranges[pivot])):
+            if doc == last:
+                continue
+            last = doc
+            doc_tokens = self._doc_tokens[doc]
+            if all(any(t.startswith(q) for t in doc_tokens) for q in others):
+                yield doc
+
+    def search(self, query, limit=10):
+        """Up to `limit` labels: label-prefix matches first, then token-prefix matches, each by rank"""
+        self.refresh()
+        query = normalize(query)
+        if not query:
+            return []
+        key = (query, limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+            results = self._label_prefix_docs(query, limit)
+            seen = set(results)
+            for doc in self._token_docs(query.split()):
+                if len(results) >= limit:
+                    break
+                if doc not in seen:
+                    results.append(doc)
+            labels = [self.labels[doc] for doc in results]
+
+            self._cache[key] = labels
+            if len(self._cache) > _RESULT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return labels
+
+    def etag(self, query, limit=10):
+        """Validator for a query's response; changes whenever the dataset does"""
+        self.refresh()
+        return hashlib.sha1(f'{self.version}|{normalize(query)}|{limit}'.encode()).hexdigest()[:20]
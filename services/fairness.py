@@ -0,0 +1,185 @@
+"""
+Fairness-ordered affiliate ranking for quote distribution
+The ordering is kept in memory and only the affiliates whose response rate, booking count or delist status
+changed are re-slotted; every change bumps a version that quote pages can cache against
+"""
+import time
+import bisect
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+DELISTED_PATH = 'data/delisted_affiliates.json'
+
+# Fields that can move an affiliate in the ordering or change its badge
+_RANKED_FIELDS = ('response_rate_30d', 'total_bookings', 'days_since_join', 'spotlight', 'delisted')
+
+
+def delisted_ids(data):
+    """Affiliate IDs whose latest delist record has not been relisted"""
+    status = {}
+    for entry in (data or {}).get('delisted', []):
+        relisted = entry.get('relisted_at') or entry.get('is_delisted') is False
+        status[entry.get('affiliate_id')] = not relisted
+    return {affiliate_id for affiliate_id, delisted in status.items() if delisted}
+
+
+def days_since(created_at):
+    if not created_at:
+        return 0
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created_at).days
+
+
+class FairnessRanking:
+    """High responders first, then deprioritized low responders, each by response rate (descending)
+
+    Affiliates are dicts with a stable 'id' plus name, base_price, capabilities, priority, ground_included,
+    response_rate_30d (percent), total_bookings, days_since_join and optionally spotlight.
+    Rows come from rows_fn() (e.g. the Affiliate table) or, when that yields nothing, from defaults.
+    """
+
+    def __init__(self, rows_fn=None, defaults=(), store=None, delisted_path=DELISTED_PATH,
+                 fairness_threshold=50, spotlight_bookings=50, spotlight_days=90, check_interval=30.0):
+        self.rows_fn = rows_fn
+        self.defaults = list(defaults)
+        self.store = store
+        self.delisted_path = delisted_path
+        self.fairness_threshold = fairness_threshold
+        self.spotlight_bookings = spotlight_bookings
+        self.spotlight_days = spotlight_days
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._affiliates = {}  # id -> affiliate dict (with 'spotlight' and 'delisted' resolved)
+        self._slots = {}  # id -> sort key currently in _order
+        self._order = []  # sorted sort keys of listed affiliates
+        self._version = 0
+        self._snapshot = (-1, ())
+        self._next_check = 0.0
+        self._delisted_version = None
+        self._delisted = set()
+
+    @property
+    def version(self):
+        self.refresh()
+        return self._version
+
+    def invalidate(self):
+        """Re-read sources on the next lookup (call after delisting, relisting or editing an affiliate)"""
+        self._next_check = 0.0
+
+    def _sort_key(self, affiliate):
+        rate = affiliate['response_rate_30d']
+        return (rate < self.fairness_threshold, -rate, affiliate['_seq'], affiliate['id'])
+
+    def _resolve(self, affiliate):
+        if affiliate.get('spotlight') is None or affiliate.get('_derived_spotlight'):
+            affiliate['spotlight'] = (affiliate['total_bookings'] < self.spotlight_bookings or
+                                      affiliate['days_since_join'] < self.spotlight_days)
+            affiliate['_derived_spotlight'] = True
+        affiliate['delisted'] = affiliate['id'] in self._delisted
+        return affiliate
+
+    def _place(self, affiliate_id):
+        """Move one affiliate to its slot (or out of the ordering when delisted); caller holds _lock"""
+        old = self._slots.pop(affiliate_id, None)
+        if old is not None:
+            del self._order[bisect.bisect_left(self._order, old)]
+        affiliate = self._affiliates.get(affiliate_id)
+        if affiliate is not None and not affiliate['delisted']:
+            key = self._sort_key(affiliate)
+            bisect.insort(self._order, key)
+            self._slots[affiliate_id] = key
+
+    def update(self, affiliate_id, **fields):
+        """Apply changed fields to one affiliate; re-slots it only if a ranked field changed.
+        Returns True if anything changed."""
+        with self._lock:
+            return self._update(affiliate_id, fields)
+
+    def _update(self, affiliate_id, fields):
+        affiliate = self._affiliates.get(affiliate_id)
+        if affiliate is None:
+            return False
+        before = {field: affiliate.get(field) for field in _RANKED_FIELDS}
+        changed = any(affiliate.get(field) != value for field, value in fields.items())
+        if not changed:
+            return False
+        # Copy on write: snapshots already handed out keep their values
+        affiliate = dict(affiliate, **fields)
+        if 'spotlight' in fields:
+            affiliate['_derived_spotlight'] = fields['spotlight'] is None
+        self._affiliates[affiliate_id] = self._resolve(affiliate)
+        if any(affiliate.get(field) != before[field] for field in _RANKED_FIELDS):
+            self._place(affiliate_id)
+        self._version += 1
+        return True
+
+    def _sync(self, rows):
+        """Diff rows against the current affiliates and apply only the differences; caller holds _lock"""
+        seen = set()
+        changed = False
+        for seq, row in enumerate(rows):
+            row = dict(row, _seq=seq)
+            affiliate_id = row['id']
+            seen.add(affiliate_id)
+            current = self._affiliates.get(affiliate_id)
+            if current is None:
+                self._affiliates[affiliate_id] = self._resolve(row)
+                self._place(affiliate_id)
+                changed = True
+                continue
+            fields = {key: value for key, value in row.items() if current.get(key) != value}
+            if current.get('_derived_spotlight') and 'spotlight' in fields and row.get('spotlight') is None:
+                del fields['spotlight']
+            if fields or current['delisted'] != (affiliate_id in self._delisted):
+                changed = self._update(affiliate_id, fields or {'delisted': affiliate_id in self._delisted}) or changed
+        for affiliate_id in set(self._affiliates) - seen:
+            self._affiliates.pop(affiliate_id)
+            self._place(affiliate_id)
+            changed = True
+        if changed:
+            self._version += 1
+        return changed
+
+    def refresh(self, force=False):
+        """Re-read rows and delist status (at most once per check_interval) and apply what changed"""
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        with self._lock:
+            if not force and now < self._next_check:
+                return False
+            self._next_check = now + self.check_interval
+            try:
+                if self.store is not None:
+                    version = self.store.version(self.delisted_path)
+                    if force or version != self._delisted_version:
+                        self._delisted = delisted_ids(self.store.load(self.delisted_path))
+                        self._delisted_version = version
+                rows = self.rows_fn() if self.rows_fn else []
+            except Exception as e:
+                logger.error(f"Failed to refresh affiliate ranking: {e}")
+                if self._affiliates:
+                    return False
+                rows = []
+            return self._sync(rows or self.defaults)
+
+    def ordered(self):
+        """Listed affiliates in fairness order (an immutable snapshot, rebuilt only after a change)"""
+        self.refresh()
+        version, snapshot = self._snapshot
+        if version == self._version:
+            return snapshot
+        with self._lock:
+            snapshot = tuple(self._affiliates[key[-1]] for key in self._order)
+            self._snapshot = (self._version, snapshot)
+        return snapshot
+
+    def get(self, affiliate_id):
+        self.refresh()
+        return self._affiliates.get(affiliate_id)
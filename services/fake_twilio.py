@@ -0,0 +1,107 @@
+"""
+Local stand-in for the Twilio Messages API, for offline and load testing of SMS delivery
+Accepts POST /2010-04-01/Accounts/<sid>/Messages.json and records the messages
+
+Run: python -m services.fake_twilio --port 8026 --latency 0.2 --failure-rate 0.05
+Then: ENABLE_SMS=true TWILIO_API_BASE=http://127.0.0.1:8026 TWILIO_ACCOUNT_SID=AC1 TWILIO_AUTH_TOKEN=x TWILIO_PHONE_NUMBER=+15550000000
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+_MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/([^/]+)/Messages\.json$')
+
+
+class _TwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+        match = _MESSAGES_PATH.match(self.path)
+        if not match:
+            self._respond(404, {'code': 20404, 'message': 'The requested resource was not found'})
+            return
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        to_phone = form.get('To', '')
+        if not to_phone.startswith('+'):
+            self._respond(400, {'code': 21211, 'message': f"The 'To' number {to_phone} is not a valid phone number."})
+            return
+        if random.random() < server.failure_rate:
+            self._respond(503, {'code': 20503, 'message': 'Service unavailable'})
+            return
+
+        sid = f"SM{uuid.uuid4().hex}"
+        server.record({'sid': sid, 'account_sid': match.group(1), 'to': to_phone,
+                       'from': form.get('From'), 'body': form.get('Body')})
+        self._respond(201, {'sid': sid, 'status': 'queued', 'to': to_phone, 'body': form.get('Body')})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    """Threaded fake Twilio API; accepted messages are kept in .messages"""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=8026, latency=0.0, failure_rate=0.0, verbose=False):
+        super().__init__((host, port), _TwilioHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def record(self, message):
+        with self._lock:
+            self.messages.append(message)
+
+    def start(self):
+        """Serve in a background thread (for tests and scripts)"""
+        threading.Thread(target=self.serve_forever, name='fake-twilio', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Twilio Messages API for offline SMS testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8026)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before answering')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server = FakeTwilioServer(args.host, args.port, args.latency, args.failure_rate, verbose=True)
+    print(f"📱 Fake Twilio listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
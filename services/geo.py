@@ -0,0 +1,283 @@
+"""
+Offline geocoding and nearest-neighbour lookups for facilities and affiliate bases
+A gazetteer resolves facility names and city/state pairs to coordinates; a grid index answers nearest-K queries
+"""
+import re
+import csv
+import json
+import math
+import heapq
+import logging
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.05
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_STATE_RE = re.compile(r'^(?P<city>.*?),\s*(?P<state>[A-Za-z]{2})(?:\s+\d{5}(?:-\d{4})?)?\s*$')
+
+
+def _key(text):
+    return ' '.join(_WORD_RE.findall((text or '').lower().replace('saint ', 'st ')))
+
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in miles"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_many(lat, lng, lats, lngs):
+    """Distances in miles from one point to many"""
+    return [haversine_miles(lat, lng, lat2, lng2) for lat2, lng2 in zip(lats, lngs)]
+
+
+def split_city_state(text):
+    """('Houston', 'TX') from 'Houston, TX' or '1 Baylor Plaza, Houston, TX 77030'; (None, None) otherwise"""
+    match = _STATE_RE.match((text or '').strip())
+    if not match:
+        return None, None
+    city = match.group('city').rsplit(',', 1)[-1].strip()
+    return city, match.group('state').upper()
+
+
+class Gazetteer:
+    """In-memory lookup of US cities and named facilities to (lat, lng)"""
+
+    def __init__(self, paths=None):
+        self.paths = paths if paths is not None else [Config.GAZETTEER_PATH]
+        self._places = {}  # 'city|ST' or facility key -> (lat, lng)
+        self._cities = {}  # city key without state -> (lat, lng) of the first one loaded
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for path in self.paths:
+                try:
+                    self.load_file(path)
+                except (OSError, ValueError, csv.Error) as e:
+                    logger.error(f"Failed to load gazetteer {path}: {e}")
+            self._loaded = True
+
+    def load_file(self, path):
+        """Bulk-load a .csv (header row) or .jsonl file with name, state, lat, lng and optional kind"""
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if line.strip()] if path.endswith('.jsonl') else csv.DictReader(f)
+            count = self.add_many(rows)
+        logger.info(f"Gazetteer loaded {count} places from {path}")
+        return count
+
+    def add_many(self, rows):
+        count = 0
+        for row in rows:
+            try:
+                lat, lng = float(row['lat']), float(row['lng'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.add(row.get('name'), lat, lng, state=row.get('state'), kind=row.get('kind') or 'city')
+            count += 1
+        return count
+
+    def add(self, name, lat, lng, state=None, kind='city'):
+        name_key = _key(name)
+        if not name_key:
+            return
+        if kind == 'city':
+            self._places[f'{name_key}|{(state or "").upper()}'] = (lat, lng)
+            self._cities.setdefault(name_key, (lat, lng))
+        else:
+            self._places[name_key] = (lat, lng)
+
+    def geocode(self, name=None, city=None, state=None, address=None):
+        """Best (lat, lng) for a facility name, city/state or free-text address; None if unknown
+
+        Tries the facility name (also the part before ' - ' in 'Name - City, ST' labels),
+        then city and state, then the 'City, ST' tail of the name or address.
+        """
+        self._ensure_loaded()
+        candidates = []
+        if name:
+            facility, _, place = name.partition(' - ')
+            candidates.append(('facility', _key(name)))
+            candidates.append(('facility', _key(facility)))
+            candidates.append(('place',) + split_city_state(place))
+        if city:
+            candidates.append(('place', city, state))
+        if address:
+            candidates.append(('place',) + split_city_state(address))
+
+        for kind, *value in candidates:
+            if kind == 'facility':
+                point = self._places.get(value[0]) if value[0] else None
+            else:
+                point = self._lookup_city(*value)
+            if point:
+                return point
+        return None
+
+    def _lookup_city(self, city, state):
+        city_key = _key(city)
+        if not city_key:
+            return None
+        if state:
+            point = self._places.get(f'{city_key}|{state.strip().upper()}')
+            if point:
+                return point
+        return self._cities.get(city_key)
+
+
+class GeoIndex:
+    """Uniform lat/lng grid over points for nearest-K and radius queries
+
+    Cells are searched in rings outward from the query cell; a ring is only visited while it could
+    still hold a point closer than the K-th best found so far.
+    """
+
+    def __init__(self, cell_degrees=1.0):
+        self.cell_degrees = cell_degrees
+        self._cells = {}  # (row, col) -> ([ids], [lats], [lngs])
+        self._points = {}  # id -> (lat, lng, payload)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def build(self, points):
+        """Replace the index with [(id, lat, lng, payload)]"""
+        cells, by_id = {}, {}
+        for point_id, lat, lng, payload in points:
+            if lat is None or lng is None:
+                continue
+            lat, lng = float(lat), float(lng)
+            ids, lats, lngs = cells.setdefault(self._cell(lat, lng), ([], [], []))
+            ids.append(point_id)
+            lats.append(lat)
+            lngs.append(lng)
+            by_id[point_id] = (lat, lng, payload)
+        with self._lock:
+            self._cells = cells
+            self._points = by_id
+
+    def payload(self, point_id):
+        point = self._points.get(point_id)
+        return point[2] if point else None
+
+    def _ring(self, center, radius):
+        row, col = center
+        if radius == 0:
+            yield center
+            return
+        for dc in range(-radius, radius + 1):
+            yield row - radius, col + dc
+            yield row + radius, col + dc
+        for dr in range(-radius + 1, radius):
+            yield row + dr, col - radius
+            yield row + dr, col + radius
+
+    def _min_ring_miles(self, lat, radius):
+        """Lower bound on the distance to any point outside `radius` rings of the query cell"""
+        if radius <= 0:
+            return 0.0
+        # Longitude cells narrow towards the poles, so bound with the widest latitude in reach
+        edge_lat = min(89.9, abs(lat) + radius * self.cell_degrees)
+        lng_miles = MILES_PER_DEGREE_LAT * math.cos(math.radians(edge_lat))
+        return (radius - 1) * self.cell_degrees * min(MILES_PER_DEGREE_LAT, lng_miles)
+
+    def _cell_min_miles(self, lat, lng, cell):
+        """Approximate lower bound on the distance from the query to anything in a cell"""
+        row, col = cell
+        nearest_lat = min(max(lat, row * self.cell_degrees), (row + 1) * self.cell_degrees)
+        nearest_lng = min(max(lng, col * self.cell_degrees), (col + 1) * self.cell_degrees)
+        # Clamping to the box is not exact on a sphere; leave a margin so no true neighbour is skipped
+        return 0.98 * haversine_miles(lat, lng, nearest_lat, nearest_lng)
+
+    def nearest(self, lat, lng, k=5, max_miles=None, predicate=None):
+        """[(distance_miles, id, payload)] of the k closest points, optionally within max_miles and
+        filtered by predicate(payload)"""
+        cells, points = self._cells, self._points
+        if not points:
+            return []
+        center = self._cell(lat, lng)
+        max_radius = int(180 / self.cell_degrees) + 1
+        best = []  # max-heap of (-distance, id)
+        seen = 0
+
+        for radius in range(max_radius + 1):
+            bound = self._min_ring_miles(lat, radius)
+            if max_miles is not None and bound > max_miles:
+                break
+            if len(best) >= k and bound > -best[0][0]:
+                break
+            ids, lats, lngs = [], [], []
+            cutoff = -best[0][0] if len(best) >= k else max_miles
+            for cell in self._ring(center, radius):
+                entry = cells.get(cell)
+                if not entry:
+                    continue
+                seen += len(entry[0])
+                if cutoff is not None and radius > 1 and self._cell_min_miles(lat, lng, cell) > cutoff:
+                    continue
+                ids.extend(entry[0])
+                lats.extend(entry[1])
+                lngs.extend(entry[2])
+            if not ids:
+                if seen >= len(points):
+                    break
+                continue
+            for point_id, distance in zip(ids, haversine_many(lat, lng, lats, lngs)):
+                if max_miles is not None and distance > max_miles:
+                    continue
+                if predicate and not predicate(points[point_id][2]):
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, point_id))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, point_id))
+            if seen >= len(points):
+                break
+
+        return [(-neg, point_id, points[point_id][2]) for neg, point_id in sorted(best, reverse=True)]
+
+    def within(self, lat, lng, miles, predicate=None):
+        """All points within `miles`, closest first"""
+        return self.nearest(lat, lng, k=len(self._points), max_miles=miles, predicate=predicate)
+
+
+def resolve_point(location, gazetteer_=None):
+    """(lat, lng) for a (lat, lng) pair, a dict with lat/lng or name/city/state/address, or a place string"""
+    gazetteer_ = gazetteer_ or gazetteer
+    if not location:
+        return None
+    if isinstance(location, (tuple, list)) and len(location) == 2:
+        return float(location[0]), float(location[1])
+    if isinstance(location, dict):
+        if location.get('lat') is not None and location.get('lng') is not None:
+            return float(location['lat']), float(location['lng'])
+        return gazetteer_.geocode(name=location.get('name'), city=location.get('city'),
+                                  state=location.get('state'), address=location.get('address'))
+    city, state = split_city_state(str(location))
+    return gazetteer_.geocode(name=str(location), city=city, state=state)
+
+
+def distance_between(origin, destination):
+    """Rounded road-agnostic distance in miles between two (lat, lng) points, None if either is missing"""
+    if not origin or not destination:
+        return None
+    return round(haversine_miles(origin[0], origin[1], destination[0], destination[1]))
+
+
+# Global gazetteer instance (loaded on first lookup)
+gazetteer = Gazetteer()
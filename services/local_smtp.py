@@ -0,0 +1,124 @@
+"""
+Local SMTP stand-in for offline mail delivery testing
+Accepts any login, stores received messages in memory and optionally as .eml files
+
+Run: python -m services.local_smtp --port 8025 --maildir data/local_mail
+Then: MAIL_SERVER=localhost MAIL_PORT=8025 MAIL_USE_TLS=false MAIL_USERNAME=test MAIL_PASSWORD=test
+"""
+import os
+import argparse
+import threading
+import socketserver
+from datetime import datetime
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP dialogue: EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def _reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        sender, recipients = None, []
+        self._reply('220 localhost SkyCareLink local SMTP ready')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                self.wfile.write(b'250-localhost\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif verb == 'HELO':
+                self._reply('250 localhost')
+            elif verb == 'AUTH':
+                self._reply('235 2.7.0 Authentication successful')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip().strip('<>').split('>')[0], []
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = command[8:].strip().strip('<>').split('>')[0]
+                if server.reject_domain and recipient.endswith(server.reject_domain):
+                    self._reply('550 5.1.1 Recipient rejected')
+                else:
+                    recipients.append(recipient)
+                    self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b'.\r\n', b'.\n'):
+                        break
+                    # Undo dot-stuffing
+                    data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                server.store(sender, recipients, b''.join(data))
+                sender, recipients = None, []
+                self._reply('250 OK queued')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self._reply('250 OK')
+            elif verb == 'NOOP':
+                self._reply('250 OK')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+
+class LocalSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded SMTP sink; messages are kept in .messages as (sender, recipients, raw_bytes)"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=8025, maildir=None, reject_domain=None):
+        super().__init__((host, port), _SMTPHandler)
+        self.maildir = maildir
+        self.reject_domain = reject_domain
+        self.messages = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def store(self, sender, recipients, raw):
+        with self._lock:
+            self.messages.append((sender, recipients, raw))
+            count = len(self.messages)
+        if self.maildir:
+            os.makedirs(self.maildir, exist_ok=True)
+            stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+            with open(os.path.join(self.maildir, f'{stamp}-{count}.eml'), 'wb') as f:
+                f.write(raw)
+
+    def start(self):
+        """Serve in a background thread (for tests and scripts)"""
+        self._thread = threading.Thread(target=self.serve_forever, name='local-smtp', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP stand-in for offline testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--maildir', default='data/local_mail', help='Directory for received .eml files')
+    args = parser.parse_args()
+
+    server = LocalSMTPServer(args.host, args.port, maildir=args.maildir)
+    print(f"📬 Local SMTP listening on {args.host}:{args.port}, saving to {args.maildir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""
+Per-user login profiles (known IPs and devices) for anomaly detection
+Profiles are read through a small in-process LRU cache and updated in memory; changes are written to SQLite
+in batches by a background thread, so a login costs no file rewrite
+"""
+import os
+import json
+import time
+import atexit
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+LEGACY_SETTINGS_PATH = 'data/user_settings.json'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS login_profiles (
+    username TEXT PRIMARY KEY,
+    last_login TEXT,
+    mfa_enabled INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS login_profile_items (
+    username TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (username, kind, value)
+) WITHOUT ROWID;
+"""
+
+
+@lru_cache(maxsize=4096)
+def ua_signature(user_agent):
+    """Short stable fingerprint of a User-Agent string (same format as the signatures already on file)"""
+    if not user_agent:
+        return 'unknown'
+    return hashlib.md5(user_agent.encode(), usedforsecurity=False).hexdigest()[:8]
+
+
+def score_login(profile, ip_address, user_agent_signature, hour):
+    """Risk assessment of one login against a profile, without changing it"""
+    risk_factors = []
+    if ip_address not in profile['ips']:
+        risk_factors.append('new_ip')
+    if user_agent_signature not in profile['uas']:
+        risk_factors.append('new_device')
+    # Login outside 6 AM - 11 PM local time
+    if hour < 6 or hour > 23:
+        risk_factors.append('odd_time')
+    return {
+        'is_risky': len(risk_factors) > 0,
+        'risk_factors': risk_factors,
+        'require_step_up': len(risk_factors) >= 2 or 'new_ip' in risk_factors
+    }
+
+
+def _empty_profile():
+    return {'ips': OrderedDict(), 'uas': OrderedDict(), 'last_login': None}
+
+
+def _remember(known, value, seen_at, limit):
+    """Mark value as most recently seen, dropping the least recent beyond limit"""
+    known[value] = seen_at
+    known.move_to_end(value)
+    while len(known) > limit:
+        known.popitem(last=False)
+
+
+class LoginProfileStore:
+    """Known IPs and User-Agent signatures per username, bounded to the most recently seen"""
+
+    def __init__(self, db_path=None, flush_interval=None, cache_size=None, cache_ttl=None,
+                 max_ips=10, max_user_agents=5, legacy_path=LEGACY_SETTINGS_PATH):
+        self.db_path = db_path or Config.LOGIN_PROFILES_DB_PATH
+        self.flush_interval = flush_interval or Config.LOGIN_PROFILE_FLUSH_INTERVAL_SECONDS
+        self.cache_size = cache_size or Config.LOGIN_PROFILE_CACHE_SIZE
+        self.cache_ttl = cache_ttl or Config.LOGIN_PROFILE_CACHE_TTL_SECONDS
+        self.max_ips = max_ips
+        self.max_user_agents = max_user_agents
+        self.legacy_path = legacy_path
+
+        self._local = threading.local()
+        self._cache = OrderedDict()  # username -> (loaded_at monotonic, profile)
+        self._pending = {}  # username -> {'items': {(kind, value): last_seen}, 'last_login': str}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        atexit.register(self.flush)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+        self._import_legacy(conn)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _import_legacy(self, conn):
+        """One-time import of data/user_settings.json into an empty profile table"""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM login_profiles LIMIT 1').fetchone():
+                conn.execute('COMMIT')
+                return
+            with open(self.legacy_path, 'r') as f:
+                users = json.load(f).get('users', {})
+            profiles, items = [], []
+            for username, data in users.items():
+                profiles.append((username, data.get('last_login'), int(bool(data.get('mfa_enabled')))))
+                # Lists are oldest first; keep that order through last_seen
+                for kind, key in (('ip', 'known_ips'), ('ua', 'known_user_agents')):
+                    for position, value in enumerate(data.get(key) or []):
+                        items.append((username, kind, value, float(position)))
+            conn.executemany('INSERT OR IGNORE INTO login_profiles VALUES (?, ?, ?)', profiles)
+            conn.executemany('INSERT OR IGNORE INTO login_profile_items VALUES (?, ?, ?, ?)', items)
+            conn.execute('COMMIT')
+            logger.info(f"Imported {len(profiles)} login profiles from {self.legacy_path}")
+        except (OSError, ValueError, AttributeError) as e:
+            conn.execute('ROLLBACK')
+            logger.error(f"Failed to import {self.legacy_path}: {e}")
+
+    def _ensure_started(self):
+        """Start the flush thread, again in each forked worker"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Updates inherited from the parent are flushed by the parent
+                self._pending, self._cache = {}, OrderedDict()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='login-profile-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    # -- reading ----------------------------------------------------------------
+
+    def _load(self, username):
+        conn = self._connect()
+        profile = _empty_profile()
+        row = conn.execute('SELECT last_login FROM login_profiles WHERE username = ?', (username,)).fetchone()
+        if row:
+            profile['last_login'] = row[0]
+        for kind, value, last_seen in conn.execute(
+            'SELECT kind, value, last_seen FROM login_profile_items WHERE username = ? ORDER BY last_seen',
+            (username,)
+        ):
+            profile['ips' if kind == 'ip' else 'uas'][value] = last_seen
+        return profile
+
+    def _cached(self, username):
+        """Fresh cache entry or None (caller holds _lock)"""
+        entry = self._cache.get(username)
+        if entry is None or time.monotonic() - entry[0] >= self.cache_ttl:
+            return None
+        self._cache.move_to_end(username)
+        return entry[1]
+
+    def _profile(self, username):
+        """Cached profile including this process's unflushed updates"""
+        with self._lock:
+            profile = self._cached(username)
+        if profile is not None:
+            return profile
+
+        loaded = self._load(username)
+        with self._lock:
+            profile = self._cached(username)
+            if profile is not None:
+                # Another thread loaded it meanwhile
+                return profile
+            pending = self._pending.get(username)
+            if pending:
+                for (kind, value), seen_at in sorted(pending['items'].items(), key=lambda item: item[1]):
+                    if kind == 'ip':
+                        _remember(loaded['ips'], value, seen_at, self.max_ips)
+                    else:
+                        _remember(loaded['uas'], value, seen_at, self.max_user_agents)
+                loaded['last_login'] = pending['last_login'] or loaded['last_login']
+            self._cache[username] = (time.monotonic(), loaded)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return loaded
+
+    def get(self, username):
+        """Copy of a user's profile: {'ips': [...], 'user_agents': [...], 'last_login': iso or None}"""
+        profile = self._profile(username)
+        with self._lock:
+            return {'ips': list(profile['ips']), 'user_agents': list(profile['uas']),
+                    'last_login': profile['last_login']}
+
+    # -- writing ----------------------------------------------------------------
+
+    def record_login(self, username, ip_address, user_agent, now=None):
+        """Score a successful login against the user's profile, then remember its IP and device"""
+        self._ensure_started()
+        now = now or datetime.now()
+        signature = ua_signature(user_agent)
+        seen_at = time.time()
+        profile = self._profile(username)
+        with self._lock:
+            result = score_login(profile, ip_address, signature, now.hour)
+            _remember(profile['ips'], ip_address, seen_at, self.max_ips)
+            _remember(profile['uas'], signature, seen_at, self.max_user_agents)
+            profile['last_login'] = now.isoformat()
+
+            pending = self._pending.setdefault(username, {'items': {}, 'last_login': None})
+            pending['items'][('ip', ip_address)] = seen_at
+            pending['items'][('ua', signature)] = seen_at
+            pending['last_login'] = profile['last_login']
+        return result
+
+    def flush(self):
+        """Write pending profile updates in one transaction; returns the number of users written"""
+        if self._pid != os.getpid():
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            conn = self._connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany(
+                    """INSERT INTO login_profiles (username, last_login) VALUES (?, ?)
+                       ON CONFLICT(username) DO UPDATE SET last_login = excluded.last_login""",
+                    [(username, update['last_login']) for username, update in pending.items()]
+                )
+                conn.executemany(
+                    """INSERT INTO login_profile_items (username, kind, value, last_seen) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(username, kind, value) DO UPDATE
+                       SET last_seen = MAX(last_seen, excluded.last_seen)""",
+                    [(username, kind, value, seen_at)
+                     for username, update in pending.items()
+                     for (kind, value), seen_at in update['items'].items()]
+                )
+                # Keep only the most recently seen entries of each kind
+                for username in pending:
+                    for kind, limit in (('ip', self.max_ips), ('ua', self.max_user_agents)):
+                        conn.execute(
+                            """DELETE FROM login_profile_items WHERE username = ? AND kind = ? AND value NOT IN (
+                                   SELECT value FROM login_profile_items WHERE username = ? AND kind = ?
+                                   ORDER BY last_seen DESC LIMIT ?)""",
+                            (username, kind, username, kind, limit)
+                        )
+                conn.execute('COMMIT')
+            except Exception as e:
+                conn.execute('ROLLBACK')
+                with self._lock:
+                    # Merge back under anything recorded meanwhile
+                    for username, update in pending.items():
+                        current = self._pending.setdefault(username, {'items': {}, 'last_login': None})
+                        for item, seen_at in update['items'].items():
+                            current['items'].setdefault(item, seen_at)
+                        current['last_login'] = current['last_login'] or update['last_login']
+                logger.error(f"Login profile flush failed: {e}")
+                return 0
+        return len(pending)
+
+    def backup(self, backup_dir):
+        """Copy a consistent snapshot of the profile database into backup_dir"""
+        self.flush()
+        target_path = os.path.join(backup_dir, os.path.basename(self.db_path))
+        target = sqlite3.connect(target_path)
+        try:
+            self._connect().backup(target)
+        finally:
+            target.close()
+        return [os.path.basename(target_path)]
+
+    # -- offline analysis -------------------------------------------------------
+
+    def score_events(self, events, seed_from_store=False):
+        """Replay historical login events in timestamp order and score each one
+
+        events: dicts with 'user', 'ip', 'user_agent' and an ISO 'timestamp' (security log format).
+        Profiles start empty (or from the stored ones with seed_from_store) and evolve in memory only;
+        the store itself is not modified. Returns [(event, result)] in replay order.
+        """
+        profiles = {}
+        results = []
+        for event in sorted(events, key=lambda e: e.get('timestamp', '')):
+            username = event.get('user') or 'unknown'
+            profile = profiles.get(username)
+            if profile is None:
+                profile = self._load(username) if seed_from_store else _empty_profile()
+                profiles[username] = profile
+            try:
+                when = datetime.fromisoformat(event.get('timestamp', ''))
+            except ValueError:
+                continue
+            ip_address = event.get('ip') or 'unknown'
+            signature = ua_signature(event.get('user_agent'))
+            results.append((event, score_login(profile, ip_address, signature, when.hour)))
+            seen_at = when.timestamp()
+            _remember(profile['ips'], ip_address, seen_at, self.max_ips)
+            _remember(profile['uas'], signature, seen_at, self.max_user_agents)
+        return results
+
+
+# Global profile store instance
+login_profiles = LoginProfileStore()
@@ -0,0 +1,458 @@
+"""
+SMTP delivery engine for MailService
+Messages go to a durable SQLite outbox and are sent by worker threads over pooled, keep-alive SMTP connections,
+paced by a send rate limit
+"""
+import os
+import time
+import queue
+import atexit
+import random
+import smtplib
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Send rate limit shared by the delivery worker threads"""
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate = rate_per_second
+        self.capacity = burst or max(1.0, rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SMTPConnectionPool:
+    """Small pool of authenticated SMTP connections reused across messages"""
+
+    def __init__(self, host, port, username=None, password=None, use_tls=True,
+                 size=None, idle_seconds=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.size = size or Config.MAIL_POOL_SIZE
+        self.idle_seconds = idle_seconds or Config.MAIL_CONNECTION_IDLE_SECONDS
+        self.timeout = timeout
+
+        self._idle = queue.LifoQueue()  # (server, last_used) - most recently used first
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._pid = os.getpid()
+
+    def _open(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        server.ehlo()
+        if self.use_tls:
+            server.starttls()
+            server.ehlo()
+        if self.username and self.password:
+            server.login(self.username, self.password)
+        return server
+
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _reset_after_fork(self):
+        # Sockets inherited from the parent process must not be shared
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue()
+            self._slots = threading.BoundedSemaphore(self.size)
+            self._pid = os.getpid()
+
+    def acquire(self):
+        """Borrow a live connection, reconnecting if the idle one was dropped by the server"""
+        self._reset_after_fork()
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    server, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._open()
+                if time.monotonic() - last_used < self.idle_seconds:
+                    return server
+                # Idle for a while: check it is still alive before reuse
+                try:
+                    if server.noop()[0] == 250:
+                        return server
+                except smtplib.SMTPException:
+                    pass
+                except OSError:
+                    pass
+                self._close(server)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, server, broken=False):
+        """Return a connection; broken ones are closed instead of reused"""
+        if broken:
+            self._close(server)
+        else:
+            self._idle.put((server, time.monotonic()))
+        self._slots.release()
+
+    def send(self, msg):
+        server = self.acquire()
+        try:
+            server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError):
+            self.release(server, broken=True)
+            raise
+        except Exception:
+            self.release(server)
+            raise
+        self.release(server)
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(server)
+
+
+class Outbox:
+    """Durable message queue shared by all worker processes"""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body_html TEXT NOT NULL,
+        email_type TEXT,
+        batch_id TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        lease_until REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        sent_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+    CREATE TABLE IF NOT EXISTS outbox_batches (
+        batch_id TEXT PRIMARY KEY,
+        owner TEXT,
+        created_at TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, db_path=None, lease_seconds=120):
+        self.db_path = db_path or Config.MAIL_OUTBOX_PATH
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(self._SCHEMA)
+        if 'batch_id' not in {row['name'] for row in conn.execute('PRAGMA table_info(outbox)')}:
+            conn.execute('ALTER TABLE outbox ADD COLUMN batch_id TEXT')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_batch ON outbox (batch_id) WHERE batch_id IS NOT NULL')
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def put(self, recipient, sender, subject, body_html, email_type):
+        cursor = self._connect().execute(
+            """INSERT INTO outbox (recipient, sender, subject, body_html, email_type, next_attempt_at, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (recipient, sender, subject, body_html, email_type, time.time(), datetime.now().isoformat())
+        )
+        return cursor.lastrowid
+
+    def put_many(self, messages, batch_id=None, owner=None):
+        """Insert [(recipient, sender, subject, body_html, email_type)] in one transaction; returns the count
+
+        owner (e.g. the user whose action queued the batch) is recorded with batch_id for batch_owner().
+        """
+        now, created_at = time.time(), datetime.now().isoformat()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if batch_id is not None:
+                conn.execute('INSERT OR IGNORE INTO outbox_batches (batch_id, owner, created_at) VALUES (?, ?, ?)',
+                             (batch_id, None if owner is None else str(owner), created_at))
+            conn.executemany(
+                """INSERT INTO outbox (recipient, sender, subject, body_html, email_type, batch_id,
+                                       next_attempt_at, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(*message, batch_id, now, created_at) for message in messages]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(messages)
+
+    def batch_counts(self, batch_id):
+        """{status: count} for the messages of one put_many batch"""
+        return dict(self._connect().execute(
+            'SELECT status, COUNT(*) FROM outbox WHERE batch_id = ? GROUP BY status', (batch_id,)
+        ).fetchall())
+
+    def batch_owner(self, batch_id):
+        """Owner recorded by put_many for batch_id; None if there is none"""
+        row = self._connect().execute(
+            'SELECT owner FROM outbox_batches WHERE batch_id = ?', (batch_id,)
+        ).fetchone()
+        return row['owner'] if row else None
+
+    def claim(self, limit=10):
+        """Lease due messages so no other worker picks them up until the lease expires"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                """SELECT * FROM outbox
+                   WHERE status = 'pending' AND next_attempt_at <= ? AND lease_until <= ?
+                   ORDER BY next_attempt_at LIMIT ?""",
+                (now, now, limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    'UPDATE outbox SET lease_until = ? WHERE id = ?',
+                    [(now + self.lease_seconds, row['id']) for row in rows]
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return [dict(row) for row in rows]
+
+    def mark_sent(self, message_id):
+        self._connect().execute(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, lease_until = 0, sent_at = ? WHERE id = ?",
+            (datetime.now().isoformat(), message_id)
+        )
+
+    def mark_failed(self, message_id, error, retry_at=None):
+        """Schedule a retry at retry_at, or give up (status 'dead') when it is None"""
+        if retry_at is None:
+            self._connect().execute(
+                """UPDATE outbox SET status = 'dead', attempts = attempts + 1, lease_until = 0, last_error = ?
+                   WHERE id = ?""",
+                (error, message_id)
+            )
+        else:
+            self._connect().execute(
+                """UPDATE outbox SET attempts = attempts + 1, lease_until = 0, last_error = ?, next_attempt_at = ?
+                   WHERE id = ?""",
+                (error, retry_at, message_id)
+            )
+
+    def next_due(self):
+        """Epoch seconds of the next pending message, or None"""
+        row = self._connect().execute(
+            "SELECT MIN(MAX(next_attempt_at, lease_until)) FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        return dict(self._connect().execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+    def purge_sent(self, older_than_days=7):
+        cutoff = datetime.fromtimestamp(time.time() - older_than_days * 86400).isoformat()
+        return self._connect().execute(
+            "DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (cutoff,)
+        ).rowcount
+
+
+def build_message(sender, recipient, subject, body_html):
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg.attach(MIMEText(body_html, 'html'))
+    return msg
+
+
+class DeliveryEngine:
+    """Outbox plus SMTP pool plus worker threads that send outside the request
+
+    Concurrency is the number of workers (and pooled connections); rate_per_second paces all of them together.
+    """
+
+    def __init__(self, pool, outbox=None, workers=None, max_attempts=None,
+                 retry_base_seconds=None, retry_max_seconds=None, on_result=None, rate_per_second=None):
+        self.pool = pool
+        self.outbox = outbox or Outbox()
+        self.workers = workers or Config.MAIL_WORKERS
+        rate_per_second = Config.MAIL_RATE_PER_SECOND if rate_per_second is None else rate_per_second
+        self.rate_limit = TokenBucket(rate_per_second) if rate_per_second > 0 else None
+        self.max_attempts = max_attempts or Config.MAIL_MAX_ATTEMPTS
+        self.retry_base_seconds = retry_base_seconds or Config.MAIL_RETRY_BASE_SECONDS
+        self.retry_max_seconds = retry_max_seconds or Config.MAIL_RETRY_MAX_SECONDS
+        self.on_result = on_result  # callable(message, status, response)
+
+        self._threads = []
+        self._pid = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        """Start the worker threads, again in each forked worker process"""
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'mail-delivery-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def start(self):
+        """Start the workers now and let them drain whatever the outbox already holds"""
+        self._ensure_started()
+        self._wakeup.set()
+
+    def submit(self, recipient, sender, subject, body_html, email_type):
+        """Persist a message to the outbox and wake a worker; returns the outbox id"""
+        message_id = self.outbox.put(recipient, sender, subject, body_html, email_type)
+        self._ensure_started()
+        self._wakeup.set()
+        return message_id
+
+    def submit_many(self, messages, batch_id=None, owner=None):
+        """Persist [(recipient, sender, subject, body_html, email_type)] in one transaction and wake the workers"""
+        count = self.outbox.put_many(messages, batch_id, owner)
+        self._ensure_started()
+        self._wakeup.set()
+        return count
+
+    def _backoff(self, attempts):
+        """Exponential backoff with jitter, capped at retry_max_seconds"""
+        delay = min(self.retry_base_seconds * (2 ** (attempts - 1)), self.retry_max_seconds)
+        return delay * random.uniform(0.8, 1.2)
+
+    def deliver(self, message):
+        """Send one outbox message and record the outcome"""
+        if self.rate_limit:
+            self.rate_limit.acquire()
+        try:
+            self.pool.send(build_message(message['sender'], message['recipient'],
+                                         message['subject'], message['body_html']))
+        except Exception as e:
+            error = str(e)
+            attempts = message['attempts'] + 1
+            permanent = isinstance(e, smtplib.SMTPRecipientsRefused) or (
+                isinstance(e, smtplib.SMTPResponseException) and 500 <= e.smtp_code < 600
+            )
+            if permanent or attempts >= self.max_attempts:
+                self.outbox.mark_failed(message['id'], error)
+                logger.error(f"Failed to send email to {message['recipient']} after {attempts} attempts: {error}")
+                self._report(message, 'FAILED', error)
+            else:
+                retry_at = time.time() + self._backoff(attempts)
+                self.outbox.mark_failed(message['id'], error, retry_at)
+                logger.warning(f"Email to {message['recipient']} failed (attempt {attempts}), retrying: {error}")
+            return False
+
+        self.outbox.mark_sent(message['id'])
+        logger.info(f"Email sent to {message['recipient']}: {message['subject']}")
+        self._report(message, 'SENT', 'Successfully sent')
+        return True
+
+    def _report(self, message, status, response):
+        if self.on_result:
+            try:
+                self.on_result(message, status, response)
+            except Exception as e:
+                logger.error(f"Mail result callback failed: {e}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                batch = self.outbox.claim()
+            except Exception as e:
+                logger.error(f"Outbox claim failed: {e}")
+                batch = []
+
+            for message in batch:
+                self.deliver(message)
+
+            if not batch:
+                # Sleep until woken by submit() or the next retry is due
+                try:
+                    next_due = self.outbox.next_due()
+                except Exception:
+                    next_due = None
+                timeout = 5.0 if next_due is None else min(max(next_due - time.time(), 0.05), 5.0)
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+
+    def flush(self, timeout=30.0):
+        """Send everything that is due now in the calling thread (used at shutdown and by scripts)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            batch = self.outbox.claim()
+            if not batch:
+                return True
+            for message in batch:
+                self.deliver(message)
+        return False
+
+    def shutdown(self, timeout=10.0):
+        """Stop the workers; undelivered messages stay in the outbox for the next start"""
+        if self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self.pool.close()
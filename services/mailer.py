@@ -2,22 +2,186 @@
 Email service for SkyCareLink using Outlook SMTP
 """
 import os
+import atexit
 import logging
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
+from html import escape
 from datetime import datetime, timezone
-from models import EmailLog, QuoteRequest
+from flask import has_app_context, current_app
+from sqlalchemy import insert
+from models import EmailLog, EmailStatsHourly, QuoteRequest
 from app import db
+from config import Config
+from services.mail_delivery import SMTPConnectionPool, DeliveryEngine, build_message
 
 logger = logging.getLogger(__name__)
 
+# Per-recipient substitution marker in templates rendered once for a fan-out
+RECIPIENT_PLACEHOLDER = "%%RECIPIENT%%"
+
+# Shared by every MailService instance so connections and workers are not duplicated
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_delivery_engine():
+    """Process-wide delivery engine, created on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                pool = SMTPConnectionPool(
+                    Config.MAIL_SERVER,
+                    Config.MAIL_PORT,
+                    Config.MAIL_USERNAME,
+                    Config.MAIL_PASSWORD,
+                    use_tls=Config.MAIL_USE_TLS
+                )
+                _engine = DeliveryEngine(pool, on_result=_log_delivery_result)
+    return _engine
+
+
+class EmailLogBuffer:
+    """Buffers EmailLog rows and bulk-inserts them with the hourly counters on size or timer
+
+    A batch that fails to insert goes back to the buffer for the next flush; beyond max_buffered rows
+    the oldest are dropped.
+    """
+    
+    def __init__(self, batch_size=None, flush_interval=None, max_buffered=None):
+        self.batch_size = batch_size or Config.EMAIL_LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.EMAIL_LOG_FLUSH_INTERVAL_SECONDS
+        self.max_buffered = max_buffered or Config.EMAIL_LOG_MAX_BUFFERED
+        self.app = None
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        
+        atexit.register(self.flush)
+    
+    def _ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._rows = []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='email-log-writer', daemon=True)
+            self._thread.start()
+    
+    def add(self, row):
+        if self.app is None and has_app_context():
+            self.app = current_app._get_current_object()
+        self._ensure_started()
+        with self._lock:
+            self._rows.append(row)
+            full = len(self._rows) >= self.batch_size
+        if full:
+            self._wakeup.set()
+    
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+    
+    @staticmethod
+    def _hourly_counts(rows):
+        counts = {}
+        for row in rows:
+            key = (row['created_at'].replace(minute=0, second=0, microsecond=0, tzinfo=None), row['email_type'])
+            sent, failed = counts.get(key, (0, 0))
+            if row['status'] == 'SENT':
+                sent += 1
+            else:
+                failed += 1
+            counts[key] = (sent, failed)
+        return counts
+    
+    @staticmethod
+    def _bump_counters(counts):
+        """Add batch counts to email_stats_hourly with one upsert per (hour, type)"""
+        dialect = db.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            table = EmailStatsHourly.__table__
+            stmt = upsert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['hour', 'email_type'],
+                set_={'sent': table.c.sent + stmt.excluded.sent, 'failed': table.c.failed + stmt.excluded.failed}
+            )
+            db.session.execute(stmt, [
+                {'hour': hour, 'email_type': email_type, 'sent': sent, 'failed': failed}
+                for (hour, email_type), (sent, failed) in counts.items()
+            ])
+            return
+        
+        for (hour, email_type), (sent, failed) in counts.items():
+            stats = EmailStatsHourly.query.filter_by(hour=hour, email_type=email_type).with_for_update().first()
+            if stats is None:
+                db.session.add(EmailStatsHourly(hour=hour, email_type=email_type, sent=sent, failed=failed))
+            else:
+                stats.sent += sent
+                stats.failed += failed
+    
+    def flush(self):
+        """Write buffered rows; returns the number written"""
+        if self._pid != os.getpid():
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            
+            app = self.app
+            if app is None:
+                from app import app
+            try:
+                with app.app_context():
+                    try:
+                        db.session.execute(insert(EmailLog), rows)
+                        self._bump_counters(self._hourly_counts(rows))
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        raise
+            except Exception as e:
+                with self._lock:
+                    self._rows = rows + self._rows
+                    dropped = len(self._rows) - self.max_buffered
+                    if dropped > 0:
+                        del self._rows[:dropped]
+                if dropped > 0:
+                    logger.error(f"Failed to log {len(rows)} emails, dropped the oldest {dropped}: {e}")
+                else:
+                    logger.error(f"Failed to log {len(rows)} emails, will retry: {e}")
+                return 0
+            return len(rows)
+
+
+email_log_buffer = EmailLogBuffer()
+
+
+def _log_delivery_result(message, status, response):
+    """Worker callback: record the final outcome of an outbox message"""
+    mail_service._log_email(message['recipient'], message['subject'], message['email_type'], status, response)
+
+
 class MailService:
     def __init__(self):
-        self.smtp_server = "smtp.office365.com"
-        self.smtp_port = 587
-        self.username = os.environ.get("MAIL_USERNAME")
-        self.password = os.environ.get("MAIL_PASSWORD")
+        self.smtp_server = Config.MAIL_SERVER
+        self.smtp_port = Config.MAIL_PORT
+        self.username = Config.MAIL_USERNAME
+        self.password = Config.MAIL_PASSWORD
         self.default_sender = os.environ.get("MAIL_DEFAULT_SENDER", f"SkyCareLink <{self.username}>")
         self.portal_base = os.environ.get("PORTAL_BASE", "https://your-app.replit.app")
         
@@ -26,26 +190,27 @@ class MailService:
             logger.warning("[MAIL disabled] - MAIL_USERNAME or MAIL_PASSWORD not configured")
     
     def send_email(self, recipient, subject, body_html, email_type):
-        """Send email and log the result"""
+        """Queue email for background delivery (or send inline when MAIL_ASYNC is off)
+        
+        Returns True once the message is accepted; the final SENT/FAILED result is logged by the worker.
+        """
         if not self.enabled:
             logger.warning(f"Email disabled, cannot send to {recipient}: {subject}")
             self._log_email(recipient, subject, email_type, "FAILED", "Mail service disabled")
             return False
         
+        if email_log_buffer.app is None and has_app_context():
+            # Delivery results are logged from worker threads with this app
+            email_log_buffer.app = current_app._get_current_object()
+        
+        engine = get_delivery_engine()
         try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.default_sender
-            msg['To'] = recipient
-            
-            html_part = MIMEText(body_html, 'html')
-            msg.attach(html_part)
-            
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.username, self.password)
-                server.send_message(msg)
+            if Config.MAIL_ASYNC:
+                engine.submit(recipient, self.default_sender, subject, body_html, email_type)
+                logger.info(f"Email queued for {recipient}: {subject}")
+                return True
             
+            engine.pool.send(build_message(self.default_sender, recipient, subject, body_html))
             logger.info(f"Email sent to {recipient}: {subject}")
             self._log_email(recipient, subject, email_type, "SENT", "Successfully sent")
             return True
@@ -56,21 +221,41 @@ class MailService:
             self._log_email(recipient, subject, email_type, "FAILED", error_msg)
             return False
     
+    def queue_bulk(self, messages, email_type, batch_id=None, owner=None):
+        """Put [(recipient, subject, body_html)] into the delivery outbox in one transaction
+        
+        Always goes through the outbox (whatever MAIL_ASYNC says), so the delivery workers apply the send
+        rate and concurrency limits. owner is recorded with batch_id. Returns the number of messages queued.
+        """
+        if not self.enabled:
+            for recipient, subject, _ in messages:
+                self._log_email(recipient, subject, email_type, "FAILED", "Mail service disabled")
+            logger.warning(f"Email disabled, cannot send {len(messages)} {email_type} messages")
+            return 0
+        
+        if email_log_buffer.app is None and has_app_context():
+            email_log_buffer.app = current_app._get_current_object()
+        
+        queued = get_delivery_engine().submit_many(
+            [(recipient, self.default_sender, subject, body_html, email_type)
+             for recipient, subject, body_html in messages],
+            batch_id, owner
+        )
+        logger.info(f"Queued {queued} {email_type} emails")
+        return queued
+    
     def _log_email(self, recipient, subject, email_type, status, response):
         """Log email attempt to database"""
         try:
-            from flask import current_app
-            with current_app.app_context():
-                email_log = EmailLog(
-                    recipient=recipient,
-                    subject=subject,
-                    email_type=email_type,
-                    status=status,
-                    smtp_response=response,
-                    created_at=datetime.now(timezone.utc)
-                )
-                db.session.add(email_log)
-                db.session.commit()
+            # Buffered and bulk-inserted off the request path; the worker uses the app captured here
+            email_log_buffer.add({
+                'recipient': recipient,
+                'subject': subject[:200],
+                'email_type': email_type or 'other',  # NOT NULL in email_logs and email_stats_hourly
+                'status': status,
+                'smtp_response': response,
+                'created_at': datetime.now(timezone.utc)
+            })
         except Exception as e:
             logger.error(f"Failed to log email: {e}")
     
@@ -228,8 +413,8 @@ class MailService:
             "quote_request_confirmation"
         )
     
-    def send_new_quote_notification(self, affiliate_user, quote):
-        """Send notification to affiliate about new quote request"""
+    def render_new_quote_notification(self, quote):
+        """Render the new quote notification once; (subject, html_body) with RECIPIENT_PLACEHOLDER for the name"""
         quote_url = f"{self.portal_base}/affiliate/quote/{quote.booking_id}"
         
         html_body = f"""
@@ -237,7 +422,7 @@ class MailService:
         <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
             <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
                 <h2 style="color: #1976D2;">New Quote Request</h2>
-                <p>Hello,</p>
+                <p>Hello {RECIPIENT_PLACEHOLDER},</p>
                 <p>A new quote request has been submitted that matches your service area.</p>
                 
                 <div style="background: #f8f9fa; padding: 15px; border-radius: 5px; margin: 20px 0;">
@@ -272,10 +457,15 @@ class MailService:
         </html>
         """
         
+        return f"New quote request – Provide Quote – Ref #{quote.booking_id}", html_body
+    
+    def send_new_quote_notification(self, affiliate_user, quote):
+        """Send notification to affiliate about new quote request"""
+        subject, html_body = self.render_new_quote_notification(quote)
         return self.send_email(
             affiliate_user.email,
-            f"New quote request – Provide Quote – Ref #{quote.booking_id}",
-            html_body,
+            subject,
+            html_body.replace(RECIPIENT_PLACEHOLDER, escape(affiliate_user.username)),
             "new_quote_notification"
         )
     
@@ -418,4 +608,15 @@ class MailService:
         )
 
 # Global mail service instance
-mail_service = MailService()
\ No newline at end of file
+mail_service = MailService()
+
+
+def start_mail_delivery(app=None):
+    """Start the delivery workers at app startup, so outbox messages left from before a restart are sent
+    without waiting for the next submit; returns False when mail is disabled or sent inline"""
+    if app is not None and email_log_buffer.app is None:
+        email_log_buffer.app = app
+    if not (mail_service.enabled and Config.MAIL_ASYNC):
+        return False
+    get_delivery_engine().start()
+    return True
@@ -0,0 +1,71 @@
+"""
+Notification dispatcher for fan-out messages (new quote request to affiliates)
+One job per event: recipients resolved in a single query, template rendered once, and every message written to
+the durable mail outbox in one transaction inside the request. The delivery workers pace and parallelize sending
+"""
+import uuid
+import logging
+from html import escape
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationDispatcher:
+    """Fan-out jobs whose messages (and so whose progress) live in the mail outbox"""
+
+    def job_status(self, job_id, user_id=None):
+        """Progress of a fan-out job from its outbox rows; survives restarts and is visible to every worker
+
+        With user_id, None unless that user started the job (admins pass no user_id).
+        """
+        from services.mailer import get_delivery_engine
+
+        outbox = get_delivery_engine().outbox
+        if user_id is not None and outbox.batch_owner(job_id) != str(user_id):
+            return None
+        counts = outbox.batch_counts(job_id)
+        if not counts:
+            return None
+        pending = counts.get('pending', 0)
+        sent = counts.get('sent', 0)
+        return {
+            'job_id': job_id,
+            'status': 'queued' if pending and not sent else 'running' if pending else 'done',
+            'recipients': sum(counts.values()),
+            'pending': pending,
+            'sent': sent,
+            'failed': counts.get('dead', 0),
+        }
+
+    def notify_new_quote(self, quote_request_id):
+        """Queue the new quote request notification for verified affiliates; returns the job id,
+        or None when nothing was queued"""
+        from app import db
+        from models import QuoteRequest, User
+        from services.mailer import mail_service, RECIPIENT_PLACEHOLDER
+
+        quote = db.session.get(QuoteRequest, quote_request_id)
+        if quote is None:
+            raise ValueError(f"Quote request {quote_request_id} not found")
+
+        # Only the columns needed for sending, in one query
+        query = db.session.query(User.username, User.email).filter_by(user_type='affiliate', is_verified=True)
+        if Config.NOTIFY_NEW_QUOTE_MAX_RECIPIENTS:
+            query = query.order_by(User.id).limit(Config.NOTIFY_NEW_QUOTE_MAX_RECIPIENTS)
+        recipients = query.all()
+
+        subject, html_body = mail_service.render_new_quote_notification(quote)
+
+        job_id = uuid.uuid4().hex[:12]
+        queued = mail_service.queue_bulk([
+            (email, subject, html_body.replace(RECIPIENT_PLACEHOLDER, escape(username)))
+            for username, email in recipients
+        ], "new_quote_notification", batch_id=job_id, owner=quote.individual_id)
+        logger.info(f"New quote {quote.booking_id} notification: {queued} of {len(recipients)} queued")
+        return job_id if queued else None
+
+
+# Global dispatcher instance
+notification_dispatcher = NotificationDispatcher()
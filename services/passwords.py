@@ -0,0 +1,216 @@
+"""
+Password hashing shared by the consumer app and the auth blueprints
+Work factors come from config, hashes made with older parameters are upgraded after a successful login,
+and all hashing runs on a small bounded pool so a burst of logins cannot occupy every request thread
+"""
+import os
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Hashes created before work factors were configurable: pbkdf2_sha256$<salt>$<hex>
+_LEGACY_PBKDF2_ITERATIONS = 100000
+_BCRYPT_PREFIXES = ('$2a$', '$2b$', '$2y$')
+
+
+class PasswordHasherBusy(Exception):
+    """Too many hash computations are already queued; the caller should ask the user to retry"""
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """Configurable PBKDF2-SHA256 or scrypt hashing on a bounded worker pool
+
+    Formats written:  pbkdf2_sha256$<iterations>$<salt>$<b64 hash>
+                      scrypt$<n>$<r>$<p>$<salt>$<b64 hash>
+    Also verified:    legacy pbkdf2_sha256$<salt>$<hex>, werkzeug 'pbkdf2:'/'scrypt:' hashes
+                      and bcrypt '$2b$' hashes. All of these report needs_rehash().
+    Anything else is rejected.
+    """
+
+    def __init__(self, scheme=None, pbkdf2_iterations=None, scrypt_n=None, scrypt_r=None, scrypt_p=None,
+                 workers=None, max_pending=None, queue_timeout=None, cache_size=None, cache_ttl=None):
+        self.scheme = scheme or Config.PASSWORD_HASH_SCHEME
+        self.pbkdf2_iterations = pbkdf2_iterations or Config.PASSWORD_PBKDF2_ITERATIONS
+        self.scrypt_n = scrypt_n or Config.PASSWORD_SCRYPT_N
+        self.scrypt_r = scrypt_r or Config.PASSWORD_SCRYPT_R
+        self.scrypt_p = scrypt_p or Config.PASSWORD_SCRYPT_P
+        self.workers = workers or Config.PASSWORD_HASH_WORKERS
+        self.max_pending = max_pending or Config.PASSWORD_HASH_MAX_PENDING
+        self.queue_timeout = queue_timeout if queue_timeout is not None else Config.PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS
+        self.cache_size = cache_size if cache_size is not None else Config.PASSWORD_VERIFY_CACHE_SIZE
+        self.cache_ttl = cache_ttl if cache_ttl is not None else Config.PASSWORD_VERIFY_CACHE_TTL_SECONDS
+
+        self._executor = None
+        self._slots = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+        # Recent successful verifications, keyed by an HMAC under a per-process random key
+        self._cache_key = secrets.token_bytes(32)
+        self._cache = OrderedDict()  # digest -> expires_at (monotonic)
+        self._cache_lock = threading.Lock()
+
+    # -- pool -------------------------------------------------------------------
+
+    def _ensure_started(self):
+        """Create the pool, again in each forked worker"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+            self._cache = OrderedDict()
+            self._pid = os.getpid()
+
+    def _run(self, fn, *args):
+        """Run fn on the pool and wait; raises PasswordHasherBusy when max_pending jobs are already queued"""
+        self._ensure_started()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusy('Password hashing queue is full')
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    # -- hashing ----------------------------------------------------------------
+
+    def _compute(self, password):
+        salt = secrets.token_bytes(16)
+        if self.scheme == 'scrypt':
+            digest = hashlib.scrypt(password.encode(), salt=salt, n=self.scrypt_n, r=self.scrypt_r,
+                                    p=self.scrypt_p, maxmem=256 * 1024 * 1024, dklen=32)
+            return f"scrypt${self.scrypt_n}${self.scrypt_r}${self.scrypt_p}${_b64(salt)}${_b64(digest)}"
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.pbkdf2_iterations)
+        return f"pbkdf2_sha256${self.pbkdf2_iterations}${_b64(salt)}${_b64(digest)}"
+
+    def hash(self, password):
+        """Hash with the configured scheme and work factor"""
+        return self._run(self._compute, password)
+
+    @staticmethod
+    def _check(password, password_hash):
+        """Constant-time check of any supported format (runs on the pool)"""
+        if password_hash.startswith(_BCRYPT_PREFIXES):
+            import bcrypt
+            return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+        parts = password_hash.split('$')
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 3:
+            _, salt, stored = parts
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), _LEGACY_PBKDF2_ITERATIONS)
+            return hmac.compare_digest(digest.hex(), stored)
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            _, iterations, salt, stored = parts
+            digest = hashlib.pbkdf2_hmac('sha256', password.encode(), _unb64(salt), int(iterations))
+            return hmac.compare_digest(digest, _unb64(stored))
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            _, n, r, p, salt, stored = parts
+            expected = _unb64(stored)
+            digest = hashlib.scrypt(password.encode(), salt=_unb64(salt), n=int(n), r=int(r), p=int(p),
+                                    maxmem=256 * 1024 * 1024, dklen=len(expected))
+            return hmac.compare_digest(digest, expected)
+        if parts[0].startswith(('pbkdf2:', 'scrypt:')):
+            from werkzeug.security import check_password_hash
+            return check_password_hash(password_hash, password)
+        return False
+
+    def needs_rehash(self, password_hash):
+        """True when the hash was not made with the current scheme and work factor"""
+        parts = (password_hash or '').split('$')
+        if self.scheme == 'scrypt':
+            return parts[:4] != ['scrypt', str(self.scrypt_n), str(self.scrypt_r), str(self.scrypt_p)] or len(parts) != 6
+        return parts[:2] != ['pbkdf2_sha256', str(self.pbkdf2_iterations)] or len(parts) != 4
+
+    # -- verification -----------------------------------------------------------
+
+    def _cache_digest(self, password, password_hash):
+        return hmac.new(self._cache_key, f'{password_hash}\0{password}'.encode(), hashlib.sha256).digest()
+
+    def _cache_hit(self, digest):
+        with self._cache_lock:
+            expires_at = self._cache.get(digest)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self._cache[digest]
+                return False
+            self._cache.move_to_end(digest)
+            return True
+
+    def _cache_store(self, digest):
+        with self._cache_lock:
+            self._cache[digest] = time.monotonic() + self.cache_ttl
+            self._cache.move_to_end(digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def verify(self, password, password_hash):
+        """Check a password; repeated successful checks within cache_ttl skip the slow hash"""
+        if not password or not password_hash:
+            return False
+        self._ensure_started()
+        digest = self._cache_digest(password, password_hash) if self.cache_size else None
+        if digest and self._cache_hit(digest):
+            return True
+        try:
+            ok = self._run(self._check, password, password_hash)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Unreadable password hash: {e}")
+            return False
+        if ok and digest:
+            # Only successes are cached, so guessing gains nothing from the cache
+            self._cache_store(digest)
+        return ok
+
+    def rehash_later(self, password, password_hash, persist):
+        """After a successful verify: if the hash is outdated, compute a new one in the background and
+        hand it to persist(new_hash). Returns True if a rehash was scheduled."""
+        if not self.needs_rehash(password_hash):
+            return False
+        self._ensure_started()
+        # Upgrades only use spare capacity; under load they wait for a later login
+        if not self._slots.acquire(blocking=False):
+            return False
+
+        def job():
+            try:
+                persist(self._compute(password))
+            except Exception as e:
+                logger.error(f"Background password rehash failed: {e}")
+            finally:
+                self._slots.release()
+
+        self._executor.submit(job)
+        return True
+
+
+# Global hasher instance
+password_hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def verify_password(password, password_hash):
+    return password_hasher.verify(password, password_hash)
@@ -0,0 +1,165 @@
+"""
+Quote pricing engine shared by every quotes page
+One rule table (equipment, surcharges, family seating, price band); a request is priced against all
+candidate fares in one batched pass
+"""
+import random
+
+from config import Config
+
+PRICING_RULES = {
+    # Flat add-on per requested equipment item
+    'equipment': {
+        'ventilator': 15000,
+        'ecmo': 25000,
+        'balloon_pump': 12000,
+        'transport_incubator': 8000,
+        'cardiac_monitor': 5000,
+        'incubator': 3000,
+        'iv_pumps': 3000,
+        'medical_stretcher': 3000,
+        'oxygen_supply': 2500,
+        'basic_monitor': 2000,
+        'escort': 2000,
+        'oxygen': 1000,
+        'other': 0
+    },
+    'same_day_surcharge_percent': 20,  # on base fare + equipment
+    'subscription_discount_percent': 10,
+    'family_seat_price': 1200,
+    # Family seats each aircraft type can carry (helicopters carry none)
+    'aircraft_family_seats': {
+        'Learjet 60': 3, 'Citation X': 2, 'King Air 350': 3,
+        'Hawker 400XP': 2, 'Beechcraft 1900': 1, 'Cessna Citation': 1,
+        'MD 902 Helicopter': 0, 'Bell 429 Helicopter': 0
+    },
+    'default_family_seats': 1,  # aircraft types not listed above
+    'price_band': (20000, 72000),  # dummy/training quotes are clipped into this band
+    'concierge_addon': 15000,
+    'default_base_price': 45000,
+    'default_affiliate_base_price': 135000,  # affiliates without a fare of their own on file
+}
+
+# Simulated-market options for demo and training quotes
+AFFILIATE_AIRCRAFT = ['Learjet 60', 'Citation X', 'King Air 350', 'Hawker 400XP', 'Beechcraft 1900',
+                      'Cessna Citation', 'MD 902 Helicopter', 'Bell 429 Helicopter']
+QUOTE_CAPABILITIES = ['Critical Care Certified', 'Pediatric Specialist', 'ECMO Capable',
+                      '24/7 Availability', 'Weather Certified', 'International Flights']
+
+EQUIPMENT_COSTS = PRICING_RULES['equipment']
+
+
+class PricingEngine:
+    """Prices one request against many fares at once
+
+    seed makes every call reproducible (tests, demos); leave it None for fresh randomness.
+    """
+
+    def __init__(self, rules=None, seed=None):
+        self.rules = rules or PRICING_RULES
+        self.seed = seed
+
+    def draws(self, seed=None):
+        """Seedable random.Random for one batch of draws"""
+        return random.Random(seed if seed is not None else self.seed)
+
+    def equipment_cost(self, equipment):
+        table = self.rules['equipment']
+        return sum(table.get(item, 0) for item in equipment or ())
+
+    def same_day_surcharge(self, subtotal, same_day=True):
+        """Same-day surcharge on one subtotal (0 when not same_day)"""
+        return int(subtotal) * self.rules['same_day_surcharge_percent'] // 100 if same_day else 0
+
+    def surcharged(self, cost, same_day=False):
+        """One cost with the same-day surcharge added, as price() applies it"""
+        return int(cost) + self.same_day_surcharge(cost, same_day)
+
+    def seat_capacity(self, aircraft_types):
+        seats, default = self.rules['aircraft_family_seats'], self.rules['default_family_seats']
+        return [seats.get(aircraft, default) for aircraft in aircraft_types]
+
+    def price(self, base_fares, equipment_cost=0, same_day=False, subscription_discount=False,
+              family_seats=0, seat_capacity=None, band=None):
+        """Price every base fare in one pass
+
+        Order of rules: base + equipment, same-day surcharge on that subtotal, subscription discount,
+        family seats (capped per aircraft by seat_capacity), then clipping into band.
+        Returns {'base_fare', 'equipment_cost', 'same_day_surcharge', 'family_seats', 'family_cost',
+        'total'} as equal-length lists of ints.
+        """
+        keep_pct = 100 - (self.rules['subscription_discount_percent'] if subscription_discount else 0)
+        seat_price = self.rules['family_seat_price']
+        n = len(base_fares)
+        capacity = seat_capacity if seat_capacity is not None else [family_seats] * n
+
+        result = {key: [] for key in ('base_fare', 'equipment_cost', 'same_day_surcharge',
+                                      'family_seats', 'family_cost', 'total')}
+        for base, cap in zip(base_fares, capacity):
+            subtotal = int(base) + int(equipment_cost)
+            surcharge = self.same_day_surcharge(subtotal, same_day)
+            seats = min(int(family_seats), cap)
+            total = (subtotal + surcharge) * keep_pct // 100 + seats * seat_price
+            if band:
+                total = max(band[0], min(band[1], total))
+            result['base_fare'].append(int(base))
+            result['equipment_cost'].append(int(equipment_cost))
+            result['same_day_surcharge'].append(surcharge)
+            result['family_seats'].append(seats)
+            result['family_cost'].append(seats * seat_price)
+            result['total'].append(total)
+        return result
+
+    def affiliate_quotes(self, base_prices, response_rates, equipment=(), same_day=False,
+                         subscription_discount=False, family_seats=0, eta_range=(45, 120),
+                         response_window=(15, 60), aircraft_options=AFFILIATE_AIRCRAFT, seed=None):
+        """Simulated responses from candidate affiliates, priced in one batch
+
+        An affiliate responds with probability response_rate%. Returns one dict per responding affiliate,
+        in input order, with its input 'index', aircraft, timings and the price() fields.
+        """
+        n = len(base_prices)
+        rng = self.draws(seed)
+        rolls = [rng.randint(1, 100) for _ in range(n)]
+        aircraft = [rng.choice(aircraft_options) for _ in range(n)]
+        etas = [rng.randint(*eta_range) for _ in range(n)]
+        response_times = [rng.randint(*response_window) for _ in range(n)]
+        capacity = self.seat_capacity(aircraft)
+        priced = self.price(base_prices, self.equipment_cost(equipment), same_day, subscription_discount,
+                            family_seats, capacity)
+
+        quotes = []
+        for i in range(n):
+            if rolls[i] > response_rates[i]:
+                continue  # This affiliate didn't respond
+            quote = {key: values[i] for key, values in priced.items()}
+            quote.update({
+                'index': i,
+                'aircraft_type': aircraft[i],
+                'seat_capacity': capacity[i],
+                'eta_minutes': etas[i],
+                'response_time_minutes': response_times[i],
+            })
+            quotes.append(quote)
+        return quotes
+
+    def sample_quotes(self, base_fare_options, aircraft_options, equipment_cost=0, same_day=False,
+                      count_range=(3, 5), eta_hours=(2, 8), band=None, seed=None):
+        """A random 3-5 (count_range) quotes drawn from fixed fare and aircraft lists, priced in one batch"""
+        rng = self.draws(seed)
+        n = rng.randint(*count_range)
+        base_fares = [rng.choice(base_fare_options) for _ in range(n)]
+        aircraft = [rng.choice(aircraft_options) for _ in range(n)]
+        etas = [rng.randint(*eta_hours) for _ in range(n)]
+        capabilities = [rng.sample(QUOTE_CAPABILITIES, 3) for _ in range(n)]
+        priced = self.price(base_fares, equipment_cost, same_day, band=band)
+
+        return [
+            dict({key: values[i] for key, values in priced.items()},
+                 aircraft_type=aircraft[i], eta=f'{etas[i]} hours', capabilities=capabilities[i])
+            for i in range(n)
+        ]
+
+
+# Global pricing engine (QUOTE_PRICING_SEED makes demo quotes reproducible)
+pricing_engine = PricingEngine(seed=Config.QUOTE_PRICING_SEED)
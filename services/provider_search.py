@@ -0,0 +1,343 @@
+"""
+In-memory provider search index for /api/providers/search
+Inverted index over name and address tokens with prefix and typo-tolerant matching, ranked with popularity
+"""
+import os
+import re
+import json
+import math
+import time
+import heapq
+import bisect
+import logging
+import threading
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Match quality per query token
+_EXACT_SCORE = 1.0
+_PREFIX_SCORE = 0.75
+_FUZZY_SCORE = 0.5
+_NAME_BONUS = 0.5  # extra weight when the token is in the name rather than the address
+_POPULARITY_WEIGHT = 0.15  # per log1p(search_count_90d)
+
+# Bounds that keep short and very common queries fast
+_MAX_PREFIX_EXPANSION = 200
+_MAX_SCORED_CANDIDATES = 5000
+_MIN_FUZZY_LENGTH = 4
+_SHORT_PREFIX_LENGTH = 2  # one-token queries this short are answered from a precomputed table
+_SHORT_PREFIX_RESULTS = 20
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def _trigrams(token):
+    padded = f'^{token}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _within_edit_distance(a, b, max_distance):
+    """Levenshtein distance <= max_distance, with early exit on the banded row minimum"""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+def _doc_prefixes(provider):
+    """The short prefixes ('h', 'ho') of every name and address token"""
+    return {
+        token[:length]
+        for token in tokenize(provider.get('name')) + tokenize(provider.get('address'))
+        for length in range(1, _SHORT_PREFIX_LENGTH + 1)
+    }
+
+
+class ProviderSearchIndex:
+    """Inverted index rebuilt when the providers file changes; popularity changes are applied in place
+
+    popularity_fn returns {provider_id: count} and replaces search_count_90d from the file;
+    popularity_version_fn returns a number that changes when those counts do.
+    """
+
+    def __init__(self, path, check_interval=1.0, popularity_fn=None, popularity_version_fn=None,
+                 popularity_interval=60.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.popularity_fn = popularity_fn
+        self.popularity_version_fn = popularity_version_fn
+        self.popularity_interval = popularity_interval
+
+        self._lock = threading.Lock()
+        self._signature = None
+        self._next_check = 0.0
+        self._popularity_version = None
+        self._next_popularity_check = 0.0
+        self._built_day = None
+        self._worker = None
+
+        self.providers = []  # approved providers, position = doc id
+        self._doc_by_id = {}
+        self._postings = {}  # token -> {doc: in_name}
+        self._sorted_tokens = []
+        self._trigrams = {}  # trigram -> set(tokens)
+        self._popularity = []  # per doc search_count_90d
+        self._by_popularity = []  # sorted (-popularity, doc), most popular first
+        self._short_prefixes = {}  # 'h', 'ho' -> most popular doc ids with a token starting so
+
+    # -- building -------------------------------------------------------------
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f).get('providers', [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def build(self, providers):
+        """Index approved providers (also used directly when providers come from a table)"""
+        docs = [p for p in providers if p.get('approved', False)]
+        postings = {}
+        for doc, provider in enumerate(docs):
+            for token in tokenize(provider.get('address')):
+                postings.setdefault(token, {})[doc] = False
+            for token in tokenize(provider.get('name')):
+                postings.setdefault(token, {})[doc] = True
+
+        trigrams = {}
+        for token in postings:
+            if len(token) >= _MIN_FUZZY_LENGTH - 1:
+                for gram in _trigrams(token):
+                    trigrams.setdefault(gram, set()).add(token)
+
+        if self.popularity_fn:
+            counts = self.popularity_fn()
+            for provider in docs:
+                provider['search_count_90d'] = counts.get(provider.get('id'), 0)
+        popularity = [p.get('search_count_90d', 0) or 0 for p in docs]
+        by_popularity = sorted((-count, doc) for doc, count in enumerate(popularity))
+
+        short_prefixes = {}
+        for _, doc in by_popularity:
+            for prefix in _doc_prefixes(docs[doc]):
+                top = short_prefixes.setdefault(prefix, [])
+                if len(top) < _SHORT_PREFIX_RESULTS:
+                    top.append(doc)
+
+        with self._lock:
+            self.providers = docs
+            self._doc_by_id = {p.get('id'): doc for doc, p in enumerate(docs)}
+            self._postings = postings
+            self._sorted_tokens = sorted(postings)
+            self._trigrams = trigrams
+            self._popularity = popularity
+            self._by_popularity = by_popularity
+            self._short_prefixes = short_prefixes
+        self._built_day = date.today()
+        logger.info(f"Provider search index built: {len(docs)} providers, {len(postings)} tokens")
+
+    def _popularity_changed(self, now):
+        if not self.popularity_version_fn or now < self._next_popularity_check:
+            return False
+        self._next_popularity_check = now + self.popularity_interval
+        return self.popularity_version_fn() != self._popularity_version
+
+    def refresh(self, force=False):
+        """Pick up a changed file (rebuild) or changed popularity counts (applied in place), checked at most
+        once per interval
+
+        The first build and forced refreshes run on the calling thread; later ones run on a background
+        thread while searches keep using the current index, which is swapped in when the new one is ready.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        if force or self._file_signature() != self._signature:
+            work = self._rebuild
+        elif self._popularity_changed(now):
+            work = self._sync_popularity
+        else:
+            return False
+        if force or self._built_day is None:
+            work()
+            return True
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return False  # the running one picks up this change or the next check does
+            self._worker = threading.Thread(target=work, name='provider-index', daemon=True)
+            self._worker.start()
+        return True
+
+    def _rebuild(self):
+        signature = self._file_signature()
+        popularity_version = self.popularity_version_fn() if self.popularity_version_fn else None
+        self.build(self._load())
+        self._signature = signature
+        self._popularity_version = popularity_version
+
+    def _sync_popularity(self):
+        """Apply flushed counts (including other workers' selections) without rebuilding
+
+        Within a day rolling counts only grow, so only increases are applied; counts that may have shrunk
+        (a day left the window, or a bump landed after counts were read) are left as they are. After a
+        day change the index is rebuilt instead, since days leaving the window can reorder everything.
+        """
+        if self._built_day != date.today():
+            self._rebuild()
+            return
+        popularity_version = self.popularity_version_fn()
+        counts = self.popularity_fn()
+        with self._lock:
+            for doc, provider in enumerate(self.providers):
+                count = counts.get(provider.get('id'), 0)
+                if count > self._popularity[doc]:
+                    self._set_popularity(doc, count)
+        self._popularity_version = popularity_version
+
+    def bump(self, provider_id, amount=1):
+        """Apply a popularity increment in place, moving the provider up in the ranking tables"""
+        with self._lock:
+            doc = self._doc_by_id.get(provider_id)
+            if doc is None or amount <= 0:
+                return
+            self._set_popularity(doc, self._popularity[doc] + amount)
+
+    def _set_popularity(self, doc, count):
+        """Raise doc's popularity to count in the popularity order and its short-prefix tables; caller holds
+        _lock. A doc only moves up, so a prefix table changes only around doc itself."""
+        popularity, order = self._popularity, self._by_popularity
+        del order[bisect.bisect_left(order, (-popularity[doc], doc))]
+        key = (-count, doc)
+        bisect.insort(order, key)
+        popularity[doc] = count
+        self.providers[doc]['search_count_90d'] = count
+
+        for prefix in _doc_prefixes(self.providers[doc]):
+            top = self._short_prefixes.setdefault(prefix, [])
+            if doc in top:
+                top.remove(doc)
+            position = bisect.bisect_left([(-popularity[other], other) for other in top], key)
+            if position < _SHORT_PREFIX_RESULTS:
+                top.insert(position, doc)
+                del top[_SHORT_PREFIX_RESULTS:]
+
+    # -- querying ---------------------------------------------------------------
+
+    def _prefix_tokens(self, token):
+        start = bisect.bisect_left(self._sorted_tokens, token)
+        end = bisect.bisect_left(self._sorted_tokens, token + '\uffff', start)
+        return self._sorted_tokens[start:min(end, start + _MAX_PREFIX_EXPANSION)]
+
+    def _fuzzy_tokens(self, token):
+        max_distance = 1 if len(token) <= 6 else 2
+        grams = _trigrams(token)
+        overlap = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+        # Each edit can break up to 3 trigrams
+        needed = max(1, len(grams) - 3 * max_distance)
+        return [
+            candidate for candidate, shared in overlap.items()
+            if shared >= needed and candidate != token and _within_edit_distance(token, candidate, max_distance)
+        ]
+
+    def _match_token(self, token):
+        """[(index_token, base_score)] for one query token, most frequent first"""
+        matches = {token: _EXACT_SCORE} if token in self._postings else {}
+        for candidate in self._prefix_tokens(token):
+            matches.setdefault(candidate, _PREFIX_SCORE)
+        if len(token) >= _MIN_FUZZY_LENGTH and not matches:
+            for candidate in self._fuzzy_tokens(token):
+                matches.setdefault(candidate, _FUZZY_SCORE)
+        return sorted(matches.items(), key=lambda item: len(self._postings[item[0]]), reverse=True)
+
+    def _doc_score(self, doc, matches):
+        """Best score of doc for one query token's matches, 0 if it matches none"""
+        best = 0.0
+        for candidate, base in matches:
+            in_name = self._postings[candidate].get(doc)
+            if in_name is not None:
+                score = base + (_NAME_BONUS if in_name else 0.0)
+                if score > best:
+                    best = score
+        return best
+
+    def search(self, query, limit=5):
+        """Providers matching every query token, best first"""
+        self.refresh()
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+        # Under the GIL this costs little and keeps a query from seeing a half-swapped rebuild
+        with self._lock:
+            return self._search(tokens, limit)
+
+    def _search(self, tokens, limit):
+
+        providers, popularity = self.providers, self._popularity
+        if len(tokens) == 1 and len(tokens[0]) <= _SHORT_PREFIX_LENGTH:
+            return [providers[doc] for doc in self._short_prefixes.get(tokens[0], [])[:limit]]
+
+        postings = self._postings
+        per_token = []
+        for token in tokens:
+            matches = self._match_token(token)
+            if not matches:
+                return []
+            per_token.append((sum(len(postings[candidate]) for candidate, _ in matches), matches))
+        per_token.sort(key=lambda item: item[0])
+
+        smallest, first_matches = per_token[0]
+
+        if smallest > _MAX_SCORED_CANDIDATES:
+            # Very broad query (short prefix, common word): walk docs by popularity
+            top = []
+            for _, doc in self._by_popularity:
+                if all(self._doc_score(doc, matches) for _, matches in per_token):
+                    top.append(doc)
+                    if len(top) >= limit:
+                        break
+            return [providers[doc] for doc in top]
+
+        # Score the rarest token's docs, then check the other tokens only for those candidates
+        scores = {}
+        for candidate, base in first_matches:
+            for doc, in_name in postings[candidate].items():
+                score = base + (_NAME_BONUS if in_name else 0.0)
+                if score > scores.get(doc, 0.0):
+                    scores[doc] = score
+        for _, matches in per_token[1:]:
+            for doc in list(scores):
+                score = self._doc_score(doc, matches)
+                if score:
+                    scores[doc] += score
+                else:
+                    del scores[doc]
+            if not scores:
+                return []
+
+        top = heapq.nlargest(
+            limit, scores, key=lambda doc: scores[doc] + _POPULARITY_WEIGHT * math.log1p(popularity[doc])
+        )
+        return [providers[doc] for doc in top]
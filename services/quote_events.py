@@ -0,0 +1,252 @@
+"""
+Quote event bus for pushing new quotes to waiting families over Server-Sent Events
+Publishers append to a small SQLite journal (ids are global and monotonic across workers); one watcher thread
+per worker fans new rows out to that worker's open streams, each of which sleeps on its own condition in between
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+QUOTE_RECEIVED = 'quote'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS quote_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quote_events_channel ON quote_events (channel, id);
+CREATE INDEX IF NOT EXISTS idx_quote_events_created ON quote_events (created_at);
+"""
+
+
+class QuoteStreamFull(Exception):
+    """This worker already holds max_subscribers open streams"""
+
+
+def format_event(event_id, event, data):
+    """One SSE message; data is already JSON"""
+    return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+
+
+class QuoteEventBus:
+    """Publish quote events per request ID and stream them with heartbeat and Last-Event-ID replay"""
+
+    def __init__(self, db_path=None, replay_size=None, retention=None, poll_interval=None, heartbeat=None,
+                 max_stream_seconds=None, max_subscribers=None, retry_ms=None):
+        self.db_path = db_path or Config.QUOTE_EVENTS_DB_PATH
+        self.replay_size = replay_size or Config.QUOTE_EVENTS_REPLAY_SIZE
+        self.retention = retention or Config.QUOTE_EVENTS_RETENTION_SECONDS
+        self.poll_interval = poll_interval or Config.QUOTE_EVENTS_POLL_INTERVAL_SECONDS
+        self.heartbeat = heartbeat or Config.QUOTE_STREAM_HEARTBEAT_SECONDS
+        self.max_stream_seconds = max_stream_seconds or Config.QUOTE_STREAM_MAX_SECONDS
+        self.max_subscribers = max_subscribers or Config.QUOTE_STREAM_MAX_SUBSCRIBERS
+        self.retry_ms = retry_ms or Config.QUOTE_STREAM_RETRY_MS
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._channels = {}  # channel -> (set of subscriber Conditions, deque of (id, event, data))
+        self._subscribers = 0
+        self._last_seen = 0  # highest journal id fanned out in this worker
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._next_purge = 0.0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    # -- publishing ---------------------------------------------------------------
+
+    def publish(self, channel, event, data):
+        """Append an event for channel (a request ID) and return its id"""
+        self.maybe_purge()
+        event_id = self._connect().execute(
+            'INSERT INTO quote_events (channel, event, data, created_at) VALUES (?, ?, ?, ?)',
+            (str(channel), event, json.dumps(data), time.time())
+        ).lastrowid
+        # Streams in this worker see it right away, other workers on their next poll
+        self._wake.set()
+        return event_id
+
+    def history(self, channels, after_id=0):
+        """The newest replay_size events of one channel (or a list of channels) after after_id, oldest first"""
+        channels = [str(channels)] if isinstance(channels, str) else [str(channel) for channel in channels]
+        rows = self._connect().execute(
+            f"""SELECT id, event, data FROM quote_events
+                WHERE channel IN ({','.join('?' * len(channels))}) AND id > ? ORDER BY id DESC LIMIT ?""",
+            (*channels, after_id, self.replay_size)
+        ).fetchall()
+        return rows[::-1]
+
+    def latest_id(self, channel=None):
+        if channel is None:
+            row = self._connect().execute('SELECT MAX(id) FROM quote_events').fetchone()
+        else:
+            row = self._connect().execute(
+                'SELECT MAX(id) FROM quote_events WHERE channel = ?', (str(channel),)
+            ).fetchone()
+        return row[0] or 0
+
+    def purge(self):
+        return self._connect().execute(
+            'DELETE FROM quote_events WHERE created_at < ?', (time.time() - self.retention,)
+        ).rowcount
+
+    def maybe_purge(self):
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + 600
+        try:
+            purged = self.purge()
+            if purged:
+                logger.info(f"Quote event purge removed {purged} old events")
+        except sqlite3.Error as e:
+            logger.error(f"Quote event purge failed: {e}")
+
+    # -- fan-out ------------------------------------------------------------------
+
+    def _ensure_started(self):
+        """Start the watcher thread, again in each forked worker"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Streams belong to the process that accepted them
+                self._channels, self._subscribers = {}, 0
+            self._last_seen = self.latest_id()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='quote-events', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self._fan_out()
+            except sqlite3.Error as e:
+                logger.error(f"Quote event fan-out failed: {e}")
+                time.sleep(self.poll_interval)
+
+    def _fan_out(self):
+        """Move journal rows past _last_seen into the buffers of subscribed channels"""
+        rows = self._connect().execute(
+            'SELECT id, channel, event, data FROM quote_events WHERE id > ? ORDER BY id LIMIT 1000',
+            (self._last_seen,)
+        ).fetchall()
+        if not rows:
+            return
+        with self._lock:
+            woken = set()
+            for event_id, channel, event, data in rows:
+                entry = self._channels.get(channel)
+                if entry is not None:
+                    entry[1].append((event_id, event, data))
+                    woken.update(entry[0])
+            self._last_seen = rows[-1][0]
+            for condition in woken:
+                condition.notify()
+        if len(rows) == 1000:
+            self._wake.set()
+
+    # -- streaming ----------------------------------------------------------------
+
+    def stream(self, channels, last_event_id=None):
+        """SSE text chunks for one channel (or a list of channels): a retry hint, any replay after
+        last_event_id, then live events with a comment heartbeat while idle. Ends after max_stream_seconds;
+        the browser reconnects with Last-Event-ID. Raises QuoteStreamFull when this worker is at max_subscribers."""
+        if self._subscribers >= self.max_subscribers:
+            raise QuoteStreamFull(f'{self._subscribers} quote streams open')
+        channels = [str(channels)] if isinstance(channels, str) else list(dict.fromkeys(map(str, channels)))
+        return self._stream(channels, last_event_id)
+
+    def _pending(self, buffers, last_id):
+        """Buffered events after last_id across buffers, in id order; caller holds _lock"""
+        pending = [item for buffer in buffers for item in buffer if item[0] > last_id]
+        if len(buffers) > 1:
+            pending.sort()
+        return pending
+
+    def _stream(self, channels, last_event_id):
+        self._ensure_started()
+        condition = threading.Condition(self._lock)
+        with self._lock:
+            buffers = []
+            for channel in channels:
+                entry = self._channels.get(channel)
+                if entry is None:
+                    entry = self._channels[channel] = (set(), deque(maxlen=self.replay_size))
+                entry[0].add(condition)
+                buffers.append(entry[1])
+            self._subscribers += 1
+            last_id = self._last_seen
+        try:
+            yield f'retry: {self.retry_ms}\n\n'
+            if last_event_id is not None:
+                # Registered first, so nothing falls between this replay and the live buffers
+                last_id = last_event_id
+                for event_id, event, data in self.history(channels, last_event_id):
+                    yield format_event(event_id, event, data)
+                    last_id = event_id
+
+            now = time.monotonic()
+            deadline = now + self.max_stream_seconds
+            next_heartbeat = now + self.heartbeat
+            while now < deadline:
+                with self._lock:
+                    pending = self._pending(buffers, last_id)
+                    if not pending:
+                        condition.wait(min(next_heartbeat, deadline) - now)
+                        pending = self._pending(buffers, last_id)
+                now = time.monotonic()
+                if pending:
+                    for event_id, event, data in pending:
+                        yield format_event(event_id, event, data)
+                    last_id = pending[-1][0]
+                    next_heartbeat = now + self.heartbeat
+                elif now >= next_heartbeat:
+                    # Keeps proxies from closing the idle connection and surfaces dead clients
+                    yield ': keepalive\n\n'
+                    next_heartbeat = now + self.heartbeat
+        finally:
+            with self._lock:
+                self._subscribers -= 1
+                for channel in channels:
+                    entry = self._channels.get(channel)
+                    if entry is not None:
+                        entry[0].discard(condition)
+                        if not entry[0]:
+                            del self._channels[channel]
+
+
+# Global quote event bus
+quote_events = QuoteEventBus()
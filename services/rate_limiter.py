@@ -0,0 +1,357 @@
+"""
+Rate limiter service for login, quote submission and fair-use limits
+Sliding-window counters keyed by IP/username with an in-process or SQLite backend
+"""
+import os
+import math
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlparse
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _roll_window(state, window, now):
+    """Advance a (window_start, current, previous) counter to the window containing now
+
+    Windows are aligned to multiples of the window length, so every worker agrees
+    on the boundaries. Returns the updated (window_start, current, previous).
+    """
+    window_start, current, previous = state
+    aligned_start = math.floor(now / window) * window
+    if abs(aligned_start - window_start) < 1e-6:
+        return window_start, current, previous
+    if abs(aligned_start - window_start - window) < 1e-6:
+        return aligned_start, 0, current
+    return aligned_start, 0, 0
+
+
+def _empty_state(window, now):
+    return math.floor(now / window) * window, 0, 0
+
+
+def _estimate(state, window, now):
+    """Sliding-window estimate: previous window weighted by its remaining overlap"""
+    window_start, current, previous = state
+    overlap = 1.0 - (now - window_start) / window
+    return previous * max(overlap, 0.0) + current
+
+
+class MemoryBackend:
+    """In-process counters; limits are enforced per worker"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries or Config.RATELIMIT_MAX_ENTRIES
+        self._counters = OrderedDict()  # key -> [window_start, current, previous, window], LRU order
+        self._locks = {}  # key -> lock expiry (epoch seconds)
+        self._mutex = threading.Lock()
+
+    def _state(self, key, window, now):
+        entry = self._counters.get(key)
+        if entry is None or entry[3] != window:
+            return _empty_state(window, now)
+        state = _roll_window(tuple(entry[:3]), window, now)
+        if state[1] == 0 and state[2] == 0:
+            # Lazy expiry: both windows have passed
+            del self._counters[key]
+        return state
+
+
+    def hit(self, key, window, now, cost=1, limit=None):
+        with self._mutex:
+            state = self._state(key, window, now)
+            estimate = _estimate(state, window, now)
+            if limit is not None and estimate + cost > limit:
+                return estimate, False
+            window_start, current, previous = state
+            self._counters[key] = [window_start, current + cost, previous, window]
+            self._counters.move_to_end(key)
+            # Bounded: drop least recently used keys beyond max_entries
+            while len(self._counters) > self.max_entries:
+                self._counters.popitem(last=False)
+            return estimate + cost, True
+
+    def count(self, key, window, now):
+        with self._mutex:
+            return _estimate(self._state(key, window, now), window, now)
+
+    def reset(self, key):
+        with self._mutex:
+            return self._counters.pop(key, None) is not None
+
+    def lock(self, key, until):
+        with self._mutex:
+            self._locks[key] = until
+
+    def unlock(self, key):
+        with self._mutex:
+            return self._locks.pop(key, None) is not None
+
+    def lock_until(self, key, now):
+        with self._mutex:
+            until = self._locks.get(key)
+            if until is not None and until <= now:
+                del self._locks[key]
+                return None
+            return until
+
+    def active_locks(self, prefix, now):
+        with self._mutex:
+            return [(key, until) for key, until in self._locks.items() if key.startswith(prefix) and until > now]
+
+    def snapshot(self, prefix, now, limit):
+        """[(key, window, estimate, expires_at)] for live counters under prefix"""
+        with self._mutex:
+            rows = []
+            for key, entry in list(self._counters.items()):
+                if not key.startswith(prefix):
+                    continue
+                window = entry[3]
+                state = _roll_window(tuple(entry[:3]), window, now)
+                if state[1] == 0 and state[2] == 0:
+                    continue
+                rows.append((key, window, _estimate(state, window, now), state[0] + 2 * window))
+                if len(rows) >= limit:
+                    break
+            return rows
+
+    def purge(self, now):
+        with self._mutex:
+            before = len(self._counters)
+            for key in [key for key, entry in self._counters.items() if entry[0] + 2 * entry[3] <= now]:
+                del self._counters[key]
+            for key in [key for key, until in self._locks.items() if until <= now]:
+                del self._locks[key]
+            return before - len(self._counters)
+
+
+class SQLiteBackend:
+    """Counters in a shared SQLite file so every gunicorn worker sees the same limits"""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rate_counters (
+        key TEXT PRIMARY KEY,
+        window REAL NOT NULL,
+        window_start REAL NOT NULL,
+        current INTEGER NOT NULL,
+        previous INTEGER NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_rate_counters_expires ON rate_counters (expires_at);
+    CREATE TABLE IF NOT EXISTS rate_locks (
+        key TEXT PRIMARY KEY,
+        until REAL NOT NULL
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path, max_entries=None):
+        self.db_path = db_path
+        self.max_entries = max_entries or Config.RATELIMIT_MAX_ENTRIES
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(self._SCHEMA)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _state(self, conn, key, window, now):
+        row = conn.execute(
+            'SELECT window, window_start, current, previous FROM rate_counters WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[0] != window:
+            return _empty_state(window, now)
+        return _roll_window(row[1:], window, now)
+
+    def hit(self, key, window, now, cost=1, limit=None):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            state = self._state(conn, key, window, now)
+            estimate = _estimate(state, window, now)
+            if limit is not None and estimate + cost > limit:
+                conn.execute('COMMIT')
+                return estimate, False
+            window_start, current, previous = state
+            conn.execute(
+                """INSERT INTO rate_counters (key, window, window_start, current, previous, expires_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET
+                       window = excluded.window,
+                       window_start = excluded.window_start,
+                       current = excluded.current,
+                       previous = excluded.previous,
+                       expires_at = excluded.expires_at""",
+                (key, window, window_start, current + cost, previous, window_start + 2 * window)
+            )
+            conn.execute('COMMIT')
+            return estimate + cost, True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def count(self, key, window, now):
+        conn = self._connect()
+        return _estimate(self._state(conn, key, window, now), window, now)
+
+    def reset(self, key):
+        cursor = self._connect().execute('DELETE FROM rate_counters WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def lock(self, key, until):
+        self._connect().execute(
+            'INSERT INTO rate_locks (key, until) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET until = excluded.until',
+            (key, until)
+        )
+
+    def unlock(self, key):
+        cursor = self._connect().execute('DELETE FROM rate_locks WHERE key = ?', (key,))
+        return cursor.rowcount > 0
+
+    def lock_until(self, key, now):
+        row = self._connect().execute('SELECT until FROM rate_locks WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        return row[0]
+
+    def active_locks(self, prefix, now):
+        return self._connect().execute(
+            'SELECT key, until FROM rate_locks WHERE key >= ? AND key < ? AND until > ? ORDER BY key',
+            (prefix, prefix + '\uffff', now)
+        ).fetchall()
+
+    def snapshot(self, prefix, now, limit):
+        """[(key, window, estimate, expires_at)] for live counters under prefix"""
+        rows = self._connect().execute(
+            """SELECT key, window, window_start, current, previous FROM rate_counters
+               WHERE key >= ? AND key < ? AND expires_at > ? ORDER BY key LIMIT ?""",
+            (prefix, prefix + '\uffff', now, limit)
+        ).fetchall()
+        snapshot = []
+        for key, window, window_start, current, previous in rows:
+            state = _roll_window((window_start, current, previous), window, now)
+            snapshot.append((key, window, _estimate(state, window, now), state[0] + 2 * window))
+        return snapshot
+
+    def purge(self, now):
+        """Delete expired counters and locks, then trim to max_entries (soonest-expiring first)"""
+        conn = self._connect()
+        deleted = conn.execute('DELETE FROM rate_counters WHERE expires_at <= ?', (now,)).rowcount
+        conn.execute('DELETE FROM rate_locks WHERE until <= ?', (now,))
+        excess = conn.execute('SELECT COUNT(*) FROM rate_counters').fetchone()[0] - self.max_entries
+        if excess > 0:
+            deleted += conn.execute(
+                """DELETE FROM rate_counters WHERE key IN (
+                       SELECT key FROM rate_counters ORDER BY expires_at LIMIT ?)""",
+                (excess,)
+            ).rowcount
+        return deleted
+
+
+class RateLimiter:
+    """Sliding-window rate limiter with O(1) work per check"""
+
+    def __init__(self, storage_url=None, purge_interval=None):
+        self.storage_url = storage_url or Config.RATELIMIT_STORAGE_URL
+        self.backend = self._create_backend(self.storage_url)
+        self.purge_interval = purge_interval or Config.RATELIMIT_PURGE_INTERVAL_SECONDS
+        self._next_purge = 0.0
+
+    @staticmethod
+    def _create_backend(storage_url):
+        parsed = urlparse(storage_url)
+        if parsed.scheme == 'memory':
+            return MemoryBackend()
+        if parsed.scheme == 'sqlite':
+            # sqlite:///relative/path.db or sqlite:////absolute/path.db
+            return SQLiteBackend(parsed.path[1:] if parsed.path.startswith('/') else parsed.path)
+        logger.warning(f"Unsupported RATELIMIT_STORAGE_URL scheme '{parsed.scheme}', using in-process limits")
+        return MemoryBackend()
+
+    def _maybe_purge(self, now):
+        """TTL eviction piggybacked on writes, at most once per purge interval per worker"""
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        try:
+            self.backend.purge(now)
+        except Exception as e:
+            logger.warning(f"Rate limiter purge failed: {e}")
+
+    def hit(self, key, window_seconds, cost=1):
+        """Record an event and return the sliding-window count including it"""
+        now = time.time()
+        count, _ = self.backend.hit(key, float(window_seconds), now, cost)
+        self._maybe_purge(now)
+        return count
+
+    def allow(self, key, limit, window_seconds, cost=1):
+        """Record the event only if it stays within limit; returns whether it was allowed"""
+        now = time.time()
+        _, allowed = self.backend.hit(key, float(window_seconds), now, cost, limit)
+        self._maybe_purge(now)
+        return allowed
+
+    def count(self, key, window_seconds):
+        """Current sliding-window count without recording anything"""
+        return self.backend.count(key, float(window_seconds), time.time())
+
+    def reset(self, key):
+        return self.backend.reset(key)
+
+    def lock(self, key, until):
+        """Lock a key until the given datetime"""
+        self.backend.lock(key, until.timestamp())
+
+    def unlock(self, key):
+        return self.backend.unlock(key)
+
+    def lock_until(self, key):
+        """Datetime the key is locked until, or None if not locked"""
+        until = self.backend.lock_until(key, time.time())
+        return datetime.fromtimestamp(until) if until is not None else None
+
+    def active_locks(self, prefix=''):
+        """[(key, locked_until datetime)] for unexpired locks under prefix"""
+        return [
+            (key, datetime.fromtimestamp(until))
+            for key, until in self.backend.active_locks(prefix, time.time())
+        ]
+
+    def snapshot(self, prefix='', limit=500):
+        """Live counters for the admin view"""
+        return [
+            {
+                'key': key,
+                'window_seconds': int(window),
+                'count': round(count, 2),
+                'expires_at': datetime.fromtimestamp(expires_at).isoformat()
+            }
+            for key, window, count, expires_at in self.backend.snapshot(prefix, time.time(), limit)
+        ]
+
+    def purge(self):
+        """Evict expired entries now instead of waiting for the next periodic purge"""
+        return self.backend.purge(time.time())
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,316 @@
+"""
+Server-side sessions for consumer_app
+The cookie only carries a random session ID; values live in SQLite, one row per key, so a request
+loads the session once and writes back only the keys whose value changed
+"""
+import os
+import re
+import time
+import sqlite3
+import secrets
+import logging
+import threading
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_SID_RE = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    sid TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_accessed ON sessions (accessed_at);
+CREATE TABLE IF NOT EXISTS session_items (
+    sid TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (sid, key)
+) WITHOUT ROWID;
+"""
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class SQLiteSessionStore:
+    """Session rows with TTL expiry on last access and LRU eviction beyond max_entries"""
+
+    def __init__(self, db_path=None, max_entries=None, purge_interval=None):
+        self.db_path = db_path or Config.SESSION_STORE_PATH
+        self.max_entries = max_entries or Config.SESSION_MAX_ENTRIES
+        self.purge_interval = purge_interval or Config.SESSION_PURGE_INTERVAL_SECONDS
+        self._local = threading.local()
+        self._next_purge = 0.0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sid, ttl):
+        """(accessed_at, {key: serialized value}) for a live session, or None if unknown or expired"""
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT accessed_at FROM sessions WHERE sid = ? AND accessed_at >= ?', (sid, time.time() - ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        items = conn.execute('SELECT key, value FROM session_items WHERE sid = ?', (sid,)).fetchall()
+        return row[0], dict(items)
+
+    def save(self, sid, upserts, deletes, touch=True, drop_sid=None):
+        """Apply changed keys in one transaction; drop_sid removes a session being replaced (rotation)"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if drop_sid:
+                conn.execute('DELETE FROM session_items WHERE sid = ?', (drop_sid,))
+                conn.execute('DELETE FROM sessions WHERE sid = ?', (drop_sid,))
+            if touch or upserts or deletes:
+                conn.execute(
+                    """INSERT INTO sessions (sid, created_at, accessed_at) VALUES (?, ?, ?)
+                       ON CONFLICT(sid) DO UPDATE SET accessed_at = excluded.accessed_at""",
+                    (sid, now, now)
+                )
+            if upserts:
+                conn.executemany(
+                    """INSERT INTO session_items (sid, key, value) VALUES (?, ?, ?)
+                       ON CONFLICT(sid, key) DO UPDATE SET value = excluded.value""",
+                    [(sid, key, value) for key, value in upserts.items()]
+                )
+            if deletes:
+                conn.executemany('DELETE FROM session_items WHERE sid = ? AND key = ?',
+                                 [(sid, key) for key in deletes])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, sid):
+        self.save(sid, {}, (), touch=False, drop_sid=sid)
+
+    def purge(self, ttl):
+        """Drop expired sessions, then the least recently used ones beyond max_entries"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cutoff = time.time() - ttl
+            expired = conn.execute('DELETE FROM sessions WHERE accessed_at < ?', (cutoff,)).rowcount
+            count = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+            evicted = 0
+            if count > self.max_entries:
+                evicted = conn.execute(
+                    """DELETE FROM sessions WHERE sid IN (
+                           SELECT sid FROM sessions ORDER BY accessed_at LIMIT ?)""",
+                    (count - self.max_entries,)
+                ).rowcount
+            if expired or evicted:
+                conn.execute('DELETE FROM session_items WHERE sid NOT IN (SELECT sid FROM sessions)')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return expired, evicted
+
+    def maybe_purge(self, ttl):
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        try:
+            expired, evicted = self.purge(ttl)
+            if expired or evicted:
+                logger.info(f"Session purge: {expired} expired, {evicted} evicted")
+        except sqlite3.Error as e:
+            logger.error(f"Session purge failed: {e}")
+
+
+class ServerSideSession(SessionMixin):
+    """Session mapping loaded on first use; values are deserialized per key when read"""
+
+    def __init__(self, sid, store, serializer, ttl, new=False):
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.rotated_from = None  # previous sid when the session was cleared or the cookie was unknown
+
+        self._store = store
+        self._serializer = serializer
+        self._ttl = ttl
+        self._raw = {} if new else None  # key -> serialized value as stored
+        self._accessed_at = time.time() if new else None
+        self._values = {}  # key -> live value, for keys read or written this request
+        self._removed = set()
+
+    @property
+    def loaded(self):
+        return self._raw is not None
+
+    def _load(self):
+        if self._raw is not None:
+            return
+        result = self._store.load(self.sid, self._ttl)
+        if result is None:
+            # Never adopt a session ID the server did not issue
+            self._raw, self._accessed_at = {}, time.time()
+            self.rotated_from, self.sid, self.new = self.sid, new_sid(), True
+        else:
+            self._accessed_at, self._raw = result
+
+    def _keys(self):
+        self._load()
+        keys = dict.fromkeys(self._raw)
+        keys.update(dict.fromkeys(self._values))
+        return [key for key in keys if key not in self._removed]
+
+    def __getitem__(self, key):
+        self.accessed = True
+        self._load()
+        if key in self._removed:
+            raise KeyError(key)
+        if key not in self._values:
+            if key not in self._raw:
+                raise KeyError(key)
+            self._values[key] = self._serializer.loads(self._raw[key])
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self.accessed = self.modified = True
+        self._load()
+        self._values[key] = value
+        self._removed.discard(key)
+
+    def __delitem__(self, key):
+        self.accessed = self.modified = True
+        self._load()
+        if key in self._removed or (key not in self._values and key not in self._raw):
+            raise KeyError(key)
+        self._values.pop(key, None)
+        self._removed.add(key)
+
+    def __iter__(self):
+        self.accessed = True
+        return iter(self._keys())
+
+    def __len__(self):
+        self.accessed = True
+        return len(self._keys())
+
+    def __contains__(self, key):
+        self.accessed = True
+        self._load()
+        return key not in self._removed and (key in self._values or key in self._raw)
+
+    def clear(self):
+        """Empty the session and issue a new ID on save (prevents fixation across logout/login)"""
+        self.accessed = self.modified = True
+        self._load()
+        self._removed.update(self._keys())
+        self._values = {}
+        if not self.new and self.rotated_from is None:
+            self.rotated_from, self.sid = self.sid, new_sid()
+
+    def changes(self):
+        """({key: serialized} to write, [keys] to delete) compared with what was loaded"""
+        if self._raw is None:
+            return {}, []
+        if self.rotated_from:
+            # Nothing exists under the new ID yet: write every live key
+            upserts = {key: self._raw[key] for key in self._raw if key not in self._removed}
+        else:
+            upserts = {}
+        for key, value in self._values.items():
+            serialized = self._serializer.dumps(value)
+            if key in upserts or self._raw.get(key) != serialized:
+                upserts[key] = serialized
+        deletes = [] if self.rotated_from else [key for key in self._removed if key in self._raw]
+        return upserts, deletes
+
+    def needs_touch(self, touch_interval):
+        return self._accessed_at is not None and time.time() - self._accessed_at >= touch_interval
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Flask session interface storing sessions server-side; the cookie holds only the session ID"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store=None, touch_interval=None):
+        self.store = store or SQLiteSessionStore()
+        self.touch_interval = touch_interval or Config.SESSION_TOUCH_INTERVAL_SECONDS
+
+    def _ttl(self, app):
+        return app.permanent_session_lifetime.total_seconds()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or not _SID_RE.match(sid):
+            return ServerSideSession(new_sid(), self.store, self.serializer, self._ttl(app), new=True)
+        return ServerSideSession(sid, self.store, self.serializer, self._ttl(app))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.loaded:
+            # The request never touched the session: no storage I/O at all
+            return
+
+        ttl = self._ttl(app)
+        try:
+            if not session:
+                if session.modified or session.rotated_from:
+                    self.store.delete(session.rotated_from or session.sid)
+                    if not session.new or session.rotated_from:
+                        response.delete_cookie(name, domain=domain, path=path,
+                                               secure=self.get_cookie_secure(app),
+                                               samesite=self.get_cookie_samesite(app),
+                                               httponly=self.get_cookie_httponly(app))
+                return
+
+            upserts, deletes = session.changes()
+            touch = session.new or session.needs_touch(self.touch_interval)
+            if upserts or deletes or touch or session.rotated_from:
+                self.store.save(session.sid, upserts, deletes, drop_sid=session.rotated_from)
+            self.store.maybe_purge(ttl)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to save session: {e}")
+            return
+
+        if session.new or session.rotated_from or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
@@ -1,20 +1,264 @@
 """
 SMS service for SkyCareLink notifications using Twilio
 Supports conditional enabling via ENABLE_SMS flag
+Messages are queued and sent by a worker pool; repeats to the same number are coalesced
 """
 
 import os
+import time
+import json
+import heapq
+import base64
+import atexit
+import random
 import logging
+import threading
+import http.client
 from typing import Optional
+from urllib.parse import urlparse, urlencode
+
+from config import Config
 
 logger = logging.getLogger(__name__)
 
+
+class PermanentSMSError(Exception):
+    """Delivery failure that retrying will not fix (invalid number, unsubscribed, bad credentials)"""
+
+
+class TwilioTransport:
+    """Twilio REST client, one per worker thread and reused for every message"""
+
+    def __init__(self, account_sid, auth_token, from_number):
+        from twilio.rest import Client  # ImportError here disables SMS at startup
+        self.client_class = Client
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.client_class(self.account_sid, self.auth_token)
+        return client
+
+    def send(self, to_phone, body):
+        from twilio.base.exceptions import TwilioRestException
+        try:
+            return self._client().messages.create(body=body, from_=self.from_number, to=to_phone).sid
+        except TwilioRestException as e:
+            if e.status and 400 <= e.status < 500 and e.status != 429:
+                raise PermanentSMSError(str(e))
+            raise
+
+
+class HTTPTransport:
+    """Twilio-compatible Messages API over a persistent HTTP connection per worker thread
+
+    Used with TWILIO_API_BASE to point delivery at a local fake server (services/fake_twilio.py).
+    """
+
+    def __init__(self, base_url, account_sid, auth_token, from_number, timeout=10):
+        parsed = urlparse(base_url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = f"{parsed.path.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.from_number = from_number
+        self.timeout = timeout
+        credentials = base64.b64encode(f"{account_sid}:{auth_token}".encode()).decode()
+        self.headers = {
+            'Authorization': f'Basic {credentials}',
+            'Content-Type': 'application/x-www-form-urlencoded'
+        }
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            conn = self._local.conn = conn_class(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def send(self, to_phone, body):
+        payload = urlencode({'To': to_phone, 'From': self.from_number, 'Body': body})
+        conn = self._connection()
+        try:
+            conn.request('POST', self.path, body=payload, headers=self.headers)
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Drop the connection so the retry reconnects
+            conn.close()
+            self._local.conn = None
+            raise
+        if response.status >= 400:
+            message = f"HTTP {response.status}: {data[:200]!r}"
+            if response.status < 500 and response.status != 429:
+                raise PermanentSMSError(message)
+            raise RuntimeError(message)
+        return json.loads(data).get('sid')
+
+
+class SMSQueue:
+    """Scheduled SMS jobs with per-destination coalescing, worker threads and jittered retries
+
+    A message is sent right away unless the same (number, kind) was sent within the
+    coalesce window. In that case it replaces any pending message for that key and goes
+    out once at the end of the window. A repeat of the last text sent is dropped.
+    """
+
+    def __init__(self, transport, workers=None, coalesce_seconds=None, max_attempts=None,
+                 retry_base_seconds=None):
+        self.transport = transport
+        self.workers = workers or Config.SMS_WORKERS
+        self.coalesce_seconds = coalesce_seconds if coalesce_seconds is not None else Config.SMS_COALESCE_SECONDS
+        self.max_attempts = max_attempts or Config.SMS_MAX_ATTEMPTS
+        self.retry_base_seconds = retry_base_seconds or Config.SMS_RETRY_BASE_SECONDS
+
+        self._heap = []  # (due_at, seq, key)
+        self._jobs = {}  # key -> {'to', 'body', 'attempts', 'due_at'}
+        self._last_sent = {}  # key -> (sent_at, body)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+        self.stats = {'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'coalesced': 0, 'deduplicated': 0}
+
+        atexit.register(self.shutdown)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        if self._pid != os.getpid():
+            self._heap, self._jobs, self._last_sent = [], {}, {}
+        self._pid = os.getpid()
+        self._stopping = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f'sms-worker-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _schedule(self, key, due_at):
+        self._seq += 1
+        heapq.heappush(self._heap, (due_at, self._seq, key))
+        self._cond.notify()
+
+    def _prune_last_sent(self, now):
+        if len(self._last_sent) > 10000:
+            cutoff = now - self.coalesce_seconds
+            self._last_sent = {k: v for k, v in self._last_sent.items() if v[0] >= cutoff}
+
+    def submit(self, to_phone, body, kind=None):
+        """Queue a message; returns False if it was dropped as a duplicate"""
+        key = (to_phone, kind or body)
+        now = time.time()
+        with self._cond:
+            self._ensure_started()
+            last = self._last_sent.get(key)
+            job = self._jobs.get(key)
+
+            if job is not None:
+                # Coalesce: newest text wins, keeps its scheduled slot
+                job['body'] = body
+                self.stats['coalesced'] += 1
+                return True
+
+            if last and now - last[0] < self.coalesce_seconds:
+                if last[1] == body:
+                    self.stats['deduplicated'] += 1
+                    return False
+                due_at = last[0] + self.coalesce_seconds
+            else:
+                due_at = now
+
+            self._jobs[key] = {'to': to_phone, 'body': body, 'attempts': 0, 'due_at': due_at}
+            self.stats['queued'] += 1
+            self._schedule(key, due_at)
+            return True
+
+    def _next_job(self):
+        """Block until a job is due; returns (key, job) or None when stopping"""
+        with self._cond:
+            while True:
+                if self._stopping and not self._heap:
+                    return None
+                if self._heap:
+                    due_at, _, key = self._heap[0]
+                    wait = due_at - time.time()
+                    if wait <= 0 or self._stopping:
+                        heapq.heappop(self._heap)
+                        job = self._jobs.get(key)
+                        if job is None or job['due_at'] != due_at:
+                            continue
+                        # Claim it: later submits for this key start a new job
+                        del self._jobs[key]
+                        return key, job
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            item = self._next_job()
+            if item is None:
+                return
+            self.deliver(*item)
+
+    def deliver(self, key, job):
+        to_phone, body = job['to'], job['body']
+        try:
+            sid = self.transport.send(to_phone, body)
+        except Exception as e:
+            attempts = job['attempts'] + 1
+            with self._cond:
+                if isinstance(e, PermanentSMSError) or attempts >= self.max_attempts or self._stopping:
+                    self.stats['failed'] += 1
+                    logger.error(f"Failed to send SMS to {to_phone} after {attempts} attempts: {str(e)}")
+                    return False
+                if key in self._jobs:
+                    # A newer message for this key is already queued; it supersedes this one
+                    return False
+                # Exponential backoff with full jitter
+                delay = random.uniform(0, self.retry_base_seconds * (2 ** (attempts - 1)))
+                job.update(attempts=attempts, due_at=time.time() + delay)
+                self._jobs[key] = job
+                self.stats['retried'] += 1
+                self._schedule(key, job['due_at'])
+            logger.warning(f"SMS to {to_phone} failed (attempt {attempts}), retrying: {str(e)}")
+            return False
+
+        with self._cond:
+            now = time.time()
+            self._last_sent[key] = (now, body)
+            self._prune_last_sent(now)
+            self.stats['sent'] += 1
+        logger.info(f"SMS sent successfully to {to_phone}, SID: {sid}")
+        return True
+
+    def shutdown(self, timeout=5.0):
+        """Send whatever is due, then stop the workers"""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
 class SMSService:
     def __init__(self):
         self.enabled = os.environ.get('ENABLE_SMS', 'false').lower() == 'true'
         self.account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
         self.auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
         self.phone_number = os.environ.get('TWILIO_PHONE_NUMBER')
+        self.api_base = os.environ.get('TWILIO_API_BASE')  # e.g. http://127.0.0.1:8026 for the fake server
+        self.queue = None
         
         if self.enabled:
             if not all([self.account_sid, self.auth_token, self.phone_number]):
@@ -22,9 +266,13 @@ class SMSService:
                 self.enabled = False
             else:
                 try:
-                    from twilio.rest import Client
-                    self.client = Client(self.account_sid, self.auth_token)
-                    logger.info("SMS service enabled with Twilio")
+                    if self.api_base:
+                        transport = HTTPTransport(self.api_base, self.account_sid, self.auth_token, self.phone_number)
+                        logger.info(f"SMS service enabled with Twilio-compatible API at {self.api_base}")
+                    else:
+                        transport = TwilioTransport(self.account_sid, self.auth_token, self.phone_number)
+                        logger.info("SMS service enabled with Twilio")
+                    self.queue = SMSQueue(transport)
                 except ImportError:
                     logger.error("SMS disabled: Twilio library not installed")
                     self.enabled = False
@@ -34,10 +282,12 @@ class SMSService:
         else:
             logger.info("SMS disabled via ENABLE_SMS=false")
 
-    def send_sms(self, to_phone: str, message: str) -> bool:
+    def send_sms(self, to_phone: str, message: str, kind: Optional[str] = None) -> bool:
         """
-        Send SMS message
-        Returns True if successful, False otherwise
+        Queue SMS message for background delivery
+        kind groups messages for coalescing (e.g. 'quote_ready'); repeats within
+        SMS_COALESCE_SECONDS collapse into one text to that number
+        Returns True if accepted, False otherwise
         """
         if not self.enabled:
             logger.info(f"[SMS disabled] Would send to {to_phone}: {message}")
@@ -55,14 +305,12 @@ class SMSService:
                     logger.error(f"Invalid phone number format: {to_phone}")
                     return False
 
-            message_obj = self.client.messages.create(
-                body=message,
-                from_=self.phone_number,
-                to=to_phone
-            )
+            if not Config.SMS_ASYNC:
+                sid = self.queue.transport.send(to_phone, message)
+                logger.info(f"SMS sent successfully to {to_phone}, SID: {sid}")
+                return True
 
-            logger.info(f"SMS sent successfully to {to_phone}, SID: {message_obj.sid}")
-            return True
+            return self.queue.submit(to_phone, message, kind)
 
         except Exception as e:
             logger.error(f"Failed to send SMS to {to_phone}: {str(e)}")
@@ -78,7 +326,7 @@ class SMSService:
             f"Valid 7 days. {results_url}"
         )
         
-        return self.send_sms(to_phone, message)
+        return self.send_sms(to_phone, message, kind='quote_ready')
 
     def send_booking_confirmed_sms(self, to_phone: str, booking_ref: str, 
                                   provider_name: str, flight_date: str, booking_url: str) -> bool:
@@ -88,7 +336,8 @@ class SMSService:
             f"on {flight_date}. Details: {booking_url}"
         )
         
-        return self.send_sms(to_phone, message)
+        # One key per booking: confirmations of two bookings to the same number must both go out
+        return self.send_sms(to_phone, message, kind=f'booking_confirmed:{booking_ref}')
 
 # Global instance
 sms_service = SMSService()
\ No newline at end of file
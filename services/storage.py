@@ -0,0 +1,500 @@
+"""
+Document store for the JSON data files under data/
+Uses a SQLite (WAL) backend by default and keeps the whole-file JSON backend as a compatibility mode.
+List-valued keys (ledger entries, audit events) are stored one row per element, so appends stay O(1)
+"""
+import os
+import copy
+import json
+import shutil
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Documents imported by the one-shot migration (see scripts/migrate_json_store.py)
+MIGRATED_FILES = [
+    'data/ledger.json',
+    'data/audit_trail.json',
+    'data/affiliates_recoup.json',
+    'data/delisted_affiliates.json',
+    'data/training_limits.json',
+    'data/announcements.json',
+    'data/invoices/index.json',
+]
+
+# Row key used for documents whose top level is not a JSON object
+_VALUE_KEY = ''
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    is_object INTEGER NOT NULL DEFAULT 1,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS document_items (
+    path TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (path, item_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS document_list_items (
+    path TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (path, item_key, seq)
+) WITHOUT ROWID;
+"""
+
+# document_items.value of a key whose list lives in document_list_items (is_list = 1)
+_LIST_VALUE = '[]'
+
+
+def _normalize(path):
+    """Normalize a document path so 'data/x.json' and './data/x.json' share a key"""
+    return os.path.normpath(path).replace(os.sep, '/')
+
+
+def _encode(value):
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+
+class JSONFileBackend:
+    """Legacy backend: each save rewrites the whole file with indent=2"""
+
+    name = 'json'
+
+    def __init__(self):
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, path):
+        with self._locks_guard:
+            return self._locks.setdefault(_normalize(path), threading.RLock())
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def load(self, path):
+        """Return the document, or None if it does not exist"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save(self, path, data):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Write to a temp file first so readers never see a half-written document
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def version(self, path):
+        """File modification time, which changes on every save"""
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def get_item(self, path, key, default=None):
+        data = self.load(path)
+        if not isinstance(data, dict):
+            return default
+        return data.get(key, default)
+
+    def set_item(self, path, key, value):
+        with self.transaction(path, {}) as data:
+            data[key] = value
+
+    def delete_item(self, path, key):
+        with self.transaction(path, {}) as data:
+            data.pop(key, None)
+
+    def append_item(self, path, key, value, default=None):
+        """Append to the list under key (rewrites the file); returns the new element's index"""
+        with self.transaction(path, default) as data:
+            items = data.setdefault(key, [])
+            items.append(value(len(items)) if callable(value) else value)
+            return len(items) - 1
+
+    @contextmanager
+    def transaction(self, path, default=None):
+        """Read-modify-write a document; only serialized within this process"""
+        with self._lock_for(path):
+            data = self.load(path)
+            if data is None:
+                data = copy.deepcopy(default) if default is not None else {}
+            yield data
+            self.save(path, data)
+
+    def backup(self, backup_dir):
+        """JSON documents are plain files; nothing beyond the regular file backup is needed"""
+        return []
+
+
+class SQLiteBackend:
+    """SQLite backend storing one row per top-level key of each document, and one row per element of list values"""
+
+    name = 'sqlite'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connect(self):
+        """Per-thread connection, reopened after a fork (gunicorn workers)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.executescript(_SCHEMA)
+        if 'is_list' not in {row[1] for row in conn.execute('PRAGMA table_info(document_items)')}:
+            # Stores created before per-element lists; their list values convert on the next write
+            conn.execute('ALTER TABLE document_items ADD COLUMN is_list INTEGER NOT NULL DEFAULT 0')
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write_txn(self):
+        """BEGIN IMMEDIATE so concurrent writers queue up instead of losing updates"""
+        conn = self._connect()
+        if conn.in_transaction:
+            # Nested call inside an open transaction: reuse it
+            yield conn
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _has_document(self, conn, path):
+        return conn.execute('SELECT 1 FROM documents WHERE path = ?', (path,)).fetchone() is not None
+
+    def _stored_list(self, conn, path, key):
+        """Encoded elements of a per-element list, in order"""
+        return [value for (value,) in conn.execute(
+            'SELECT value FROM document_list_items WHERE path = ? AND item_key = ? ORDER BY seq', (path, key)
+        )]
+
+    def _read_list(self, conn, path, key):
+        return [json.loads(value) for value in self._stored_list(conn, path, key)]
+
+    def _read(self, conn, path):
+        row = conn.execute('SELECT is_object FROM documents WHERE path = ?', (path,)).fetchone()
+        if row is None:
+            return None
+
+        items = {
+            key: self._read_list(conn, path, key) if is_list else json.loads(value)
+            for key, value, is_list in conn.execute(
+                'SELECT item_key, value, is_list FROM document_items WHERE path = ? ORDER BY position', (path,)
+            )
+        }
+
+        if not row[0]:
+            return items.get(_VALUE_KEY)
+        return items
+
+    def _touch(self, conn, path, is_object=None):
+        """Create the document row or bump its version"""
+        conn.execute(
+            """INSERT INTO documents (path, is_object, version, updated_at) VALUES (?, ?, 1, ?)
+               ON CONFLICT(path) DO UPDATE SET
+                   is_object = COALESCE(?, documents.is_object),
+                   version = documents.version + 1,
+                   updated_at = excluded.updated_at""",
+            (path, 1 if is_object is None else is_object, datetime.now().isoformat(), is_object)
+        )
+
+    def _write_list(self, conn, path, key, elements, stored=()):
+        """Make the list rows of key match elements (already encoded), touching only changed positions"""
+        stored = list(stored)
+        upserts = [
+            (path, key, seq, value) for seq, value in enumerate(elements)
+            if seq >= len(stored) or stored[seq] != value
+        ]
+        if upserts:
+            conn.executemany(
+                """INSERT INTO document_list_items (path, item_key, seq, value) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(path, item_key, seq) DO UPDATE SET value = excluded.value""",
+                upserts
+            )
+        if len(stored) > len(elements):
+            conn.execute(
+                'DELETE FROM document_list_items WHERE path = ? AND item_key = ? AND seq >= ?',
+                (path, key, len(elements))
+            )
+
+    def _write(self, conn, path, data):
+        """Upsert only the top-level keys (and list elements) whose value or position changed"""
+        if isinstance(data, dict):
+            is_object = 1
+            values = {str(key): value for key, value in data.items()}
+        else:
+            is_object = 0
+            values = {_VALUE_KEY: data}
+
+        # key -> (document_items value, encoded list elements or None)
+        items = {
+            key: (_LIST_VALUE, [_encode(element) for element in value]) if isinstance(value, list)
+            else (_encode(value), None)
+            for key, value in values.items()
+        }
+
+        existing = {
+            key: (position, value, is_list) for key, position, value, is_list in conn.execute(
+                'SELECT item_key, position, value, is_list FROM document_items WHERE path = ?', (path,)
+            )
+        }
+
+        upserts = [
+            (path, key, position, value, int(elements is not None))
+            for position, (key, (value, elements)) in enumerate(items.items())
+            if existing.get(key) != (position, value, int(elements is not None))
+        ]
+        deletes = [(path, key) for key in existing if key not in items]
+
+        self._touch(conn, path, is_object)
+        if upserts:
+            conn.executemany(
+                """INSERT INTO document_items (path, item_key, position, value, is_list) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(path, item_key) DO UPDATE SET
+                       position = excluded.position,
+                       value = excluded.value,
+                       is_list = excluded.is_list""",
+                upserts
+            )
+        if deletes:
+            conn.executemany('DELETE FROM document_items WHERE path = ? AND item_key = ?', deletes)
+
+        for key, (_, elements) in items.items():
+            was_list = key in existing and existing[key][2]
+            if elements is not None:
+                self._write_list(conn, path, key, elements, self._stored_list(conn, path, key) if was_list else ())
+            elif was_list:
+                conn.execute('DELETE FROM document_list_items WHERE path = ? AND item_key = ?', (path, key))
+        for _, key in deletes:
+            if existing[key][2]:
+                conn.execute('DELETE FROM document_list_items WHERE path = ? AND item_key = ?', (path, key))
+
+    def _put_item(self, conn, path, key, value):
+        """Write one top-level key in place (caller has touched the document)"""
+        row = conn.execute(
+            'SELECT is_list FROM document_items WHERE path = ? AND item_key = ?', (path, key)
+        ).fetchone()
+        is_list = isinstance(value, list)
+        conn.execute(
+            """INSERT INTO document_items (path, item_key, position, value, is_list)
+               VALUES (?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM document_items WHERE path = ?), ?, ?)
+               ON CONFLICT(path, item_key) DO UPDATE SET value = excluded.value, is_list = excluded.is_list""",
+            (path, key, path, _LIST_VALUE if is_list else _encode(value), int(is_list))
+        )
+        was_list = row is not None and row[0]
+        if is_list:
+            self._write_list(conn, path, key, [_encode(element) for element in value],
+                             self._stored_list(conn, path, key) if was_list else ())
+        elif was_list:
+            conn.execute('DELETE FROM document_list_items WHERE path = ? AND item_key = ?', (path, key))
+
+    def _ensure_document(self, conn, path, default=None):
+        """Import the legacy file or create the document from default, without reading it"""
+        if self._has_document(conn, path):
+            return
+        if os.path.exists(path):
+            self._read_or_import(conn, path)
+        else:
+            self._write(conn, path, copy.deepcopy(default) if default is not None else {})
+
+    def _read_or_import(self, conn, path):
+        """Read a document, importing the legacy JSON file on first access"""
+        data = self._read(conn, path)
+        if data is None and os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+            self._write(conn, path, data)
+            logger.info(f"Imported {path} into data store")
+        return data
+
+    def exists(self, path):
+        path = _normalize(path)
+        return self._has_document(self._connect(), path) or os.path.exists(path)
+
+    def load(self, path):
+        """Return the document, or None if it does not exist"""
+        path = _normalize(path)
+        conn = self._connect()
+        data = self._read(conn, path)
+        if data is None and os.path.exists(path):
+            with self._write_txn() as conn:
+                data = self._read_or_import(conn, path)
+        return data
+
+    def save(self, path, data):
+        path = _normalize(path)
+        with self._write_txn() as conn:
+            self._write(conn, path, data)
+
+    def version(self, path):
+        """Monotonic per-document version, bumped on every write"""
+        row = self._connect().execute(
+            'SELECT version FROM documents WHERE path = ?', (_normalize(path),)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_item(self, path, key, default=None):
+        """Read a single top-level key without loading the rest of the document"""
+        path = _normalize(path)
+        conn = self._connect()
+        if not self._has_document(conn, path) and os.path.exists(path):
+            self.load(path)
+        row = conn.execute(
+            'SELECT value, is_list FROM document_items WHERE path = ? AND item_key = ?', (path, str(key))
+        ).fetchone()
+        if row is None:
+            return default
+        return self._read_list(conn, path, str(key)) if row[1] else json.loads(row[0])
+
+    def set_item(self, path, key, value):
+        """Write a single top-level key without touching the rest of the document"""
+        path = _normalize(path)
+        with self._write_txn() as conn:
+            self._ensure_document(conn, path)
+            self._touch(conn, path)
+            self._put_item(conn, path, str(key), value)
+
+    def delete_item(self, path, key):
+        path = _normalize(path)
+        with self._write_txn() as conn:
+            self._ensure_document(conn, path)
+            self._touch(conn, path)
+            conn.execute('DELETE FROM document_items WHERE path = ? AND item_key = ?', (path, str(key)))
+            conn.execute('DELETE FROM document_list_items WHERE path = ? AND item_key = ?', (path, str(key)))
+
+    def append_item(self, path, key, value, default=None):
+        """Append to the list under key with a single row insert; returns the new element's index
+
+        value may be a callable that takes the index (e.g. to number the element). A missing document is
+        created from default and a missing key starts as an empty list.
+        """
+        path, key = _normalize(path), str(key)
+        with self._write_txn() as conn:
+            self._ensure_document(conn, path, default)
+            row = conn.execute(
+                'SELECT value, is_list FROM document_items WHERE path = ? AND item_key = ?', (path, key)
+            ).fetchone()
+            if row is None or not row[1]:
+                # New key, or a list still stored as one JSON value: move it to per-element rows once
+                current = json.loads(row[0]) if row else []
+                if not isinstance(current, list):
+                    raise TypeError(f"{key} in {path} is not a list")
+                self._put_item(conn, path, key, current)
+            index = conn.execute(
+                'SELECT COALESCE(MAX(seq), -1) + 1 FROM document_list_items WHERE path = ? AND item_key = ?',
+                (path, key)
+            ).fetchone()[0]
+            if callable(value):
+                value = value(index)
+            conn.execute(
+                'INSERT INTO document_list_items (path, item_key, seq, value) VALUES (?, ?, ?, ?)',
+                (path, key, index, _encode(value))
+            )
+            self._touch(conn, path)
+            return index
+
+    @contextmanager
+    def transaction(self, path, default=None):
+        """Atomic read-modify-write of a document across threads and worker processes"""
+        path = _normalize(path)
+        with self._write_txn() as conn:
+            data = self._read_or_import(conn, path)
+            if data is None:
+                data = copy.deepcopy(default) if default is not None else {}
+            yield data
+            self._write(conn, path, data)
+
+    def backup(self, backup_dir):
+        """Copy a consistent snapshot of the database into backup_dir"""
+        target_path = os.path.join(backup_dir, os.path.basename(self.db_path))
+        target = sqlite3.connect(target_path)
+        try:
+            self._connect().backup(target)
+        finally:
+            target.close()
+        return [os.path.basename(target_path)]
+
+
+def create_store(backend_name=None, db_path=None):
+    """Build the configured backend ('sqlite' or 'json')"""
+    backend_name = (backend_name or Config.DATA_STORE_BACKEND).lower()
+    if backend_name == 'json':
+        return JSONFileBackend()
+    if backend_name != 'sqlite':
+        logger.warning(f"Unknown DATA_STORE_BACKEND '{backend_name}', using sqlite")
+    return SQLiteBackend(db_path or Config.DATA_STORE_PATH)
+
+
+def import_json_files(store, paths=None, force=False, archive_dir=None):
+    """One-shot migration of data/*.json files into the given store
+
+    Documents already present in the store are skipped unless force is set.
+    When archive_dir is given, imported files are moved there afterwards.
+    """
+    if not isinstance(store, SQLiteBackend):
+        raise ValueError("JSON files can only be imported into the sqlite backend")
+
+    results = {}
+    conn = store._connect()
+    for path in paths or MIGRATED_FILES:
+        if not os.path.exists(path):
+            results[path] = 'missing'
+            continue
+
+        if not force and store._read(conn, _normalize(path)) is not None:
+            results[path] = 'skipped'
+            continue
+
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            store.save(path, data)
+        except Exception as e:
+            logger.error(f"Failed to import {path}: {e}")
+            results[path] = f'error: {e}'
+            continue
+
+        if archive_dir:
+            target = os.path.join(archive_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(path, target)
+        results[path] = 'imported'
+
+    return results
+
+
+# Global data store instance
+data_store = create_store()
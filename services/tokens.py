@@ -0,0 +1,172 @@
+"""
+Single-use tokens for password resets and email verification
+Only a SHA-256 of each token is stored, in SQLite with a unique index on the hash and an index on expiry,
+so lookups are index seeks and expired rows are purged in small batches instead of scanning everything
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import secrets
+import logging
+import threading
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_RESET = 'password_reset'
+EMAIL_VERIFICATION = 'email_verification'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    id INTEGER PRIMARY KEY,
+    token_hash TEXT NOT NULL,
+    purpose TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    data TEXT,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tokens_hash ON tokens (token_hash);
+CREATE INDEX IF NOT EXISTS idx_tokens_expires ON tokens (expires_at);
+CREATE INDEX IF NOT EXISTS idx_tokens_subject ON tokens (purpose, subject);
+"""
+
+
+def hash_token(token):
+    """Hash token for secure storage"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenStore:
+    """Issue, check and consume expiring tokens shared by every worker through one SQLite file"""
+
+    def __init__(self, db_path=None, purge_interval=None, purge_batch_size=None):
+        self.db_path = db_path or Config.TOKEN_STORE_PATH
+        self.purge_interval = purge_interval or Config.TOKEN_PURGE_INTERVAL_SECONDS
+        self.purge_batch_size = purge_batch_size or Config.TOKEN_PURGE_BATCH_SIZE
+        self._local = threading.local()
+        self._next_purge = 0.0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _from_row(row):
+        return {
+            'purpose': row['purpose'],
+            'subject': row['subject'],
+            'data': json.loads(row['data']) if row['data'] else {},
+            'created_at': row['created_at'],
+            'expires_at': row['expires_at'],
+        }
+
+    def issue(self, purpose, subject, ttl_seconds, data=None, replace=True):
+        """Create a token for subject (e.g. an email or user ID) and return it; only its hash is kept.
+        With replace, earlier tokens of the same purpose and subject stop working."""
+        self.maybe_purge()
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if replace:
+                conn.execute('DELETE FROM tokens WHERE purpose = ? AND subject = ?', (purpose, str(subject)))
+            conn.execute(
+                """INSERT INTO tokens (token_hash, purpose, subject, data, created_at, expires_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (hash_token(token), purpose, str(subject), json.dumps(data) if data else None,
+                 now, now + ttl_seconds)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return token
+
+    def peek(self, purpose, token, subject=None):
+        """Token record if the token is live (and belongs to subject, when given), else None"""
+        if not token:
+            return None
+        row = self._connect().execute(
+            'SELECT * FROM tokens WHERE token_hash = ? AND purpose = ? AND expires_at >= ?',
+            (hash_token(token), purpose, time.time())
+        ).fetchone()
+        if row is None or (subject is not None and row['subject'] != str(subject)):
+            return None
+        return self._from_row(row)
+
+    def consume(self, purpose, token, subject=None):
+        """Like peek, but deletes the token in the same transaction so it can be used only once"""
+        if not token:
+            return None
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM tokens WHERE token_hash = ? AND purpose = ? AND expires_at >= ?',
+                (hash_token(token), purpose, time.time())
+            ).fetchone()
+            if row is None or (subject is not None and row['subject'] != str(subject)):
+                conn.execute('COMMIT')
+                return None
+            conn.execute('DELETE FROM tokens WHERE id = ?', (row['id'],))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self._from_row(row)
+
+    def revoke(self, purpose, subject):
+        """Invalidate every token of a purpose for subject; returns how many were removed"""
+        return self._connect().execute(
+            'DELETE FROM tokens WHERE purpose = ? AND subject = ?', (purpose, str(subject))
+        ).rowcount
+
+    def purge(self):
+        """Delete expired tokens in batches of purge_batch_size, each in its own short transaction"""
+        conn = self._connect()
+        total = 0
+        while True:
+            deleted = conn.execute(
+                """DELETE FROM tokens WHERE id IN (
+                       SELECT id FROM tokens WHERE expires_at < ? ORDER BY expires_at LIMIT ?)""",
+                (time.time(), self.purge_batch_size)
+            ).rowcount
+            total += deleted
+            if deleted < self.purge_batch_size:
+                return total
+
+    def maybe_purge(self):
+        now = time.monotonic()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        try:
+            purged = self.purge()
+            if purged:
+                logger.info(f"Token purge removed {purged} expired tokens")
+        except sqlite3.Error as e:
+            logger.error(f"Token purge failed: {e}")
+
+
+# Global token store instance
+token_store = TokenStore()
@@ -0,0 +1,265 @@
+"""
+Affiliate work queue: open quote requests ordered by severity, then by age
+The queue lives in memory and is kept current by quote lifecycle events (requested, quoted, confirmed);
+a periodic resync picks up changes made by other workers. Every change bumps a version and goes into a
+bounded change log, so dashboards can fetch only what changed since the version they last saw. Versions only
+mean something within one process, so each process has its own epoch and a client holding another epoch resets
+"""
+import os
+import time
+import uuid
+import bisect
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone, timedelta
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+QUOTED = 'quoted'
+CONFIRMED = 'confirmed'
+
+
+def _timestamp(value):
+    """Epoch seconds for a datetime column; naive values are UTC"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def queue_status(quote):
+    """pending, quoted or confirmed for open requests, None once closed
+
+    Quotes carry two status columns (status and quote_status) that different flows set; either one counts.
+    """
+    status, quote_status = quote.status, quote.quote_status
+    if status == 'expired' or quote_status == 'expired':
+        return None
+    if status == 'confirmed' or quote_status == 'booked':
+        return CONFIRMED
+    if status == 'quoted' or quote_status == 'quoted':
+        return QUOTED
+    if status in ('pending', 'submitted') or quote_status == 'pending':
+        return PENDING
+    return None
+
+
+def quote_item(quote):
+    """Queue entry for a Quote row (JSON-serializable)"""
+    return {
+        'ref_id': quote.ref_id,
+        'status': queue_status(quote),
+        'severity_level': int(quote.severity_level or 1),
+        'created_at': _timestamp(quote.created_at) or time.time(),
+        'from_city': quote.from_city,
+        'from_state': quote.from_state,
+        'to_city': quote.to_city,
+        'to_state': quote.to_state,
+        'flight_date': quote.flight_date.isoformat() if quote.flight_date else None,
+        'contact_name': quote.contact_name,
+        'contact_phone': quote.contact_phone,
+        'contact_email': quote.contact_email,
+        'ground_transport_needed': bool(getattr(quote, 'ground_transport_needed', False)),
+        'quoted_price': quote.quoted_price,
+        'quote_submitted_at': _timestamp(quote.quote_submitted_at),
+        'booking_confirmed_at': _timestamp(quote.booking_confirmed_at),
+    }
+
+
+def load_open_quotes(max_items=None, confirmed_hours=None):
+    """Open quote requests from the database, newest first: pending and quoted ones,
+    plus bookings confirmed within confirmed_hours"""
+    from sqlalchemy import or_
+    from models import Quote
+
+    max_items = max_items or Config.WORK_QUEUE_MAX_ITEMS
+    confirmed_hours = confirmed_hours or Config.WORK_QUEUE_CONFIRMED_HOURS
+    since = datetime.utcnow() - timedelta(hours=confirmed_hours)
+    quotes = Quote.query.filter(or_(
+        Quote.status.in_(['pending', 'submitted', 'quoted']),
+        Quote.quote_status.in_(['pending', 'quoted']),
+        Quote.booking_confirmed_at >= since
+    )).order_by(Quote.created_at.desc()).limit(max_items).all()
+    return [quote_item(quote) for quote in quotes]
+
+
+class AffiliateWorkQueue:
+    """Open quote requests, most severe first and oldest first within a severity
+
+    Each affiliate sees the shared queue minus the requests they passed on (exclude).
+    """
+
+    def __init__(self, rows_fn=load_open_quotes, resync_interval=None, change_log_size=None, page_size=None):
+        self.rows_fn = rows_fn
+        self.resync_interval = resync_interval or Config.WORK_QUEUE_RESYNC_SECONDS
+        self.page_size = page_size or Config.WORK_QUEUE_PAGE_SIZE
+
+        self._lock = threading.Lock()
+        self._items = {}  # ref_id -> item
+        self._keys = {}  # ref_id -> sort key currently in _order
+        self._order = []  # sorted sort keys
+        self._version = 0
+        self._changes = deque(maxlen=change_log_size or Config.WORK_QUEUE_CHANGE_LOG_SIZE)  # (version, ref_id)
+        self._stats = (None, None, None)  # (version, day, stats)
+        self._next_sync = 0.0
+        self._epoch = (None, None)  # (pid, epoch)
+
+    @property
+    def epoch(self):
+        """Identifies this process's version sequence; a new one after fork since the copies diverge"""
+        pid, epoch = self._epoch
+        if pid != os.getpid():
+            pid, epoch = os.getpid(), f'{os.getpid():x}-{uuid.uuid4().hex[:8]}'
+            self._epoch = (pid, epoch)
+        return epoch
+
+    @property
+    def version(self):
+        self.refresh()
+        return self._version
+
+    @staticmethod
+    def _sort_key(item):
+        return (-item['severity_level'], item['created_at'], item['ref_id'])
+
+    def _apply(self, ref_id, item):
+        """Insert, replace or (item None) remove one entry; caller holds _lock. Returns True if it changed."""
+        if item is not None and item['status'] is None:
+            item = None
+        if self._items.get(ref_id) == item:
+            return False
+        old = self._keys.pop(ref_id, None)
+        if old is not None:
+            del self._order[bisect.bisect_left(self._order, old)]
+        if item is None:
+            self._items.pop(ref_id, None)
+        else:
+            self._items[ref_id] = item
+            key = self._sort_key(item)
+            bisect.insort(self._order, key)
+            self._keys[ref_id] = key
+        self._version += 1
+        self._changes.append((self._version, ref_id))
+        return True
+
+    # -- lifecycle events -----------------------------------------------------------
+
+    def quote_changed(self, quote):
+        """Call after committing a new or updated Quote"""
+        try:
+            item = quote_item(quote)
+        except Exception as e:
+            logger.error(f"Failed to queue quote {getattr(quote, 'ref_id', None)}: {e}")
+            return
+        with self._lock:
+            self._apply(item['ref_id'], item)
+
+    def quote_removed(self, ref_id):
+        with self._lock:
+            self._apply(ref_id, None)
+
+    def refresh(self, force=False):
+        """Reconcile with the database (at most once per resync_interval); only differences become changes"""
+        now = time.monotonic()
+        if not force and now < self._next_sync:
+            return False
+        with self._lock:
+            if not force and now < self._next_sync:
+                return False
+            self._next_sync = now + self.resync_interval
+            started = self._version
+        try:
+            rows = self.rows_fn() if self.rows_fn else []
+        except Exception as e:
+            logger.error(f"Failed to refresh affiliate work queue: {e}")
+            return False
+        with self._lock:
+            before = self._version
+            # Events applied while the rows were loading are newer than the rows
+            newer = {ref_id for version, ref_id in self._changes if version > started}
+            seen = set()
+            for item in rows:
+                seen.add(item['ref_id'])
+                if item['ref_id'] not in newer:
+                    self._apply(item['ref_id'], item)
+            for ref_id in set(self._items) - seen - newer:
+                self._apply(ref_id, None)
+            return self._version != before
+
+    # -- reading ----------------------------------------------------------------------
+
+    def ordered(self, exclude=(), limit=None):
+        """The first limit (page_size) entries, skipping refs in exclude"""
+        self.refresh()
+        limit = limit or self.page_size
+        with self._lock:
+            items = []
+            for key in self._order:
+                if key[-1] in exclude:
+                    continue
+                items.append(self._items[key[-1]])
+                if len(items) >= limit:
+                    break
+            return items
+
+    def stats(self):
+        """Counts for the dashboard header, recomputed only after a change or at midnight UTC"""
+        self.refresh()
+        today = datetime.now(timezone.utc).date()
+        version, day, stats = self._stats
+        if version == self._version and day == today:
+            return stats
+        with self._lock:
+            version = self._version
+            items = list(self._items.values())
+        start_of_day = datetime.combine(today, datetime.min.time(), timezone.utc).timestamp()
+        stats = {'pending_quotes': 0, 'completed_today': 0, 'urgent_requests': 0, 'revenue_today': 0}
+        for item in items:
+            if item['status'] == PENDING:
+                stats['pending_quotes'] += 1
+                if item['severity_level'] == 3:
+                    stats['urgent_requests'] += 1
+            if item['quote_submitted_at'] and item['quote_submitted_at'] >= start_of_day:
+                stats['completed_today'] += 1
+                if item['quoted_price']:
+                    stats['revenue_today'] += float(item['quoted_price'])
+        self._stats = (version, today, stats)
+        return stats
+
+    def changes_since(self, version=None, exclude=(), limit=None, epoch=None, shown=()):
+        """What changed in this affiliate's view since (epoch, version), relative to the refs the client shows
+
+        Returns {'epoch', 'version', 'reset', 'order', 'upserts', 'removed', 'stats'}: order is the refs in
+        view; upserts are view entries that changed or are not in shown (all of them when reset, i.e. the epoch
+        is another process's or the version is unknown or older than the change log); removed are refs in
+        shown that are no longer in view.
+        """
+        view = self.ordered(exclude, limit)
+        stats = self.stats()
+        current_epoch = self.epoch
+        with self._lock:
+            current = self._version
+            oldest = self._changes[0][0] if self._changes else current + 1
+            reset = (epoch != current_epoch or version is None or version > current
+                     or (version < current and version + 1 < oldest))
+            changed = set() if reset else {ref_id for v, ref_id in self._changes if v > version}
+        shown = set(shown)
+        order = [item['ref_id'] for item in view]
+        in_view = set(order)
+        return {
+            'epoch': current_epoch,
+            'version': current,
+            'reset': reset,
+            'order': order,
+            'upserts': [item for item in view if reset or item['ref_id'] in changed or item['ref_id'] not in shown],
+            'removed': [] if reset else sorted(shown - in_view),
+            'stats': stats,
+        }
+
+# Global affiliate work queue
+work_queue = AffiliateWorkQueue()
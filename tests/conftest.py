@@ -0,0 +1,30 @@
+"""
+Shared test setup: the repo root is importable and every on-disk store (database, SQLite side stores,
+logs, blobs) lives in a throwaway directory instead of data/. Runs before any test module imports config.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = tempfile.mkdtemp(prefix='medifly-tests-')
+
+for name, relative in {
+    'SESSION_STORE_PATH': 'sessions.db',
+    'MAIL_OUTBOX_PATH': 'mail_outbox.db',
+    'AUDIT_STORE_PATH': 'audit.db',
+    'DATA_STORE_PATH': 'datastore.db',
+    'SECURITY_LOG_DIR': 'logs/security',
+    'ERROR_LOG_DIR': 'logs/errors',
+    'COUNTERS_DB_PATH': 'counters.db',
+    'DRAFTS_DB_PATH': 'drafts.db',
+    'TOKEN_STORE_PATH': 'tokens.db',
+    'LOGIN_PROFILES_DB_PATH': 'login_profiles.db',
+    'QUOTE_EVENTS_DB_PATH': 'quote_events.db',
+    'DOCUMENT_STORE_PATH': 'documents',
+}.items():
+    os.environ.setdefault(name, os.path.join(DATA_DIR, relative))
+os.environ.setdefault('RATELIMIT_STORAGE_URL', 'sqlite:///' + os.path.join(DATA_DIR, 'ratelimits.db'))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(DATA_DIR, 'medifly.db'))
@@ -0,0 +1,88 @@
+"""
+Audit writer tests: queued events land in audit_logs in batches, a full queue drops instead of blocking
+the caller, and shutdown drains whatever is still queued
+"""
+import threading
+
+import pytest
+from sqlalchemy import delete
+
+from app import app, db
+from models import AuditLog
+from services.audit import AuditWriter
+
+
+@pytest.fixture
+def app_context():
+    with app.app_context():
+        db.metadata.create_all(db.engine, tables=[AuditLog.__table__])
+        db.session.execute(delete(AuditLog))
+        db.session.commit()
+        yield
+        db.session.remove()
+
+
+def row(action, user_id=None):
+    return {'action': action, 'details': None, 'user_id': user_id, 'ip_address': '10.0.0.1', 'user_agent': 'pytest'}
+
+
+def test_queued_events_are_bulk_inserted_on_shutdown(app_context):
+    writer = AuditWriter(max_size=1000, batch_size=50, flush_interval=0.05)
+    for i in range(120):
+        assert writer.enqueue(row('login', i))
+    writer.shutdown()
+
+    stats = writer.stats()
+    assert stats['enqueued'] == stats['written'] == 120
+    assert stats['queue_depth'] == 0
+    # 120 rows at 50 per batch need at least three INSERTs, and never one per row
+    assert 3 <= stats['batches'] < 120
+    assert sorted(user_id for (user_id,) in db.session.query(AuditLog.user_id)) == list(range(120))
+
+
+def test_concurrent_producers_lose_nothing(app_context):
+    writer = AuditWriter(max_size=1000, batch_size=100, flush_interval=0.05)
+
+    def produce(thread_id):
+        for i in range(100):
+            writer.enqueue(row(f'action_{thread_id}', i))
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.shutdown()
+
+    assert writer.stats()['written'] == 400
+    assert db.session.query(AuditLog).count() == 400
+
+
+def test_full_queue_drops_after_a_short_wait(app_context):
+    writer = AuditWriter(max_size=2, batch_size=10, flush_interval=0.05, enqueue_timeout=0.01)
+    # Stall the writer so the queue cannot drain until the gate opens
+    gate = threading.Event()
+    take_batch = writer._take_batch
+    writer._take_batch = lambda: gate.wait() and take_batch()
+
+    assert writer.enqueue(row('a'))
+    assert writer.enqueue(row('b'))
+    assert not writer.enqueue(row('c'))
+
+    stats = writer.stats()
+    assert stats['blocked'] == 1
+    assert stats['dropped'] == 1
+    assert stats['max_depth'] == 2
+
+    gate.set()
+    writer.shutdown()
+    assert writer.stats()['written'] == 2
+    assert sorted(action for (action,) in db.session.query(AuditLog.action)) == ['a', 'b']
+
+
+def test_failed_batch_is_counted_not_raised(app_context):
+    writer = AuditWriter(max_size=10, batch_size=10, flush_interval=0.05)
+    assert not writer.write_batch([{'action': None}])
+    assert writer.stats()['failed'] == 1
+    assert writer.write_batch([row('after_failure')])
+    assert db.session.query(AuditLog).filter_by(action='after_failure').count() == 1
@@ -0,0 +1,141 @@
+"""
+Blob store tests: content addressing and dedup, streamed writes with a size limit that leaves nothing behind,
+concurrent writers of one blob, and moving documents.file_data out of (and back into) the table on SQLite
+"""
+import hashlib
+import importlib.util
+import io
+import os
+import threading
+
+import pytest
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from services.blob_store import BlobStore, BlobTooLarge, move_document_blobs, restore_document_blobs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATION = os.path.join(ROOT, 'migrations', 'versions', '9c3b7e1f4a62_document_blob_store.py')
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / 'documents'), chunk_size=4)
+
+
+def stored_files(store):
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), store.root)
+        for directory, _, names in os.walk(store.root) for name in names
+    )
+
+
+def test_content_is_stored_under_its_hash(store):
+    data = b'patient discharge summary'
+    digest, size = store.write(io.BytesIO(data))
+    assert (digest, size) == (hashlib.sha256(data).hexdigest(), len(data))
+    assert store.path(digest).endswith(os.path.join(digest[:2], digest[2:4], digest))
+    assert store.read(digest) == data
+    assert os.stat(store.path(digest)).st_mode & 0o222 == 0  # write-once
+
+
+def test_identical_uploads_share_one_file(store):
+    first = store.write(io.BytesIO(b'same'))
+    assert store.put_bytes(b'same') == first
+    assert stored_files(store) == [store.relative_path(first[0])]
+
+
+def test_empty_streams_are_not_stored(store):
+    digest, size = store.write(io.BytesIO(b''))
+    assert size == 0 and not store.exists(digest)
+    assert stored_files(store) == []
+
+
+def test_too_large_streams_leave_nothing_behind(store):
+    kept, _ = store.put_bytes(b'x' * 10)
+    with pytest.raises(BlobTooLarge) as error:
+        store.write(io.BytesIO(b'x' * 11), max_size=10)
+    assert error.value.max_size == 10
+    assert stored_files(store) == [store.relative_path(kept)]
+    assert store.write(io.BytesIO(b'x' * 10), max_size=10) == (kept, 10)
+
+
+def test_digests_are_validated(store):
+    with pytest.raises(ValueError):
+        store.path('../../etc/passwd')
+
+
+def test_concurrent_writers_of_one_blob(store):
+    data = os.urandom(64 * 1024)
+    results = []
+
+    def write():
+        results.append(store.write(io.BytesIO(data)))
+
+    threads = [threading.Thread(target=write) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(results)) == 1
+    assert store.read(results[0][0]) == data
+    assert stored_files(store) == [store.relative_path(results[0][0])]
+
+
+def make_documents(tmp_path, file_data_type):
+    engine = sa.create_engine(f'sqlite:///{tmp_path}/medifly.db')
+    with engine.begin() as connection:
+        connection.execute(sa.text(
+            'CREATE TABLE documents (id INTEGER PRIMARY KEY, filename VARCHAR(255), '
+            f'file_hash VARCHAR(64), file_data {file_data_type})'))
+        for doc_id, data in enumerate([b'report', b'report', b'x-ray', b'tampered'], 1):
+            file_hash = hashlib.sha256(b'original' if data == b'tampered' else data).hexdigest()
+            connection.execute(sa.text('INSERT INTO documents VALUES (:id, :name, :hash, :data)'),
+                               {'id': doc_id, 'name': f'doc{doc_id}.pdf', 'hash': file_hash, 'data': data})
+    return engine
+
+
+def documents(connection):
+    return connection.execute(sa.text('SELECT id, file_hash, file_data FROM documents ORDER BY id')).fetchall()
+
+
+def test_move_and_restore_document_blobs(tmp_path, store):
+    engine = make_documents(tmp_path, 'BLOB')
+    with engine.begin() as connection:
+        assert move_document_blobs(connection, store, batch_size=2) == (3, [4])
+        rows = documents(connection)
+        assert [row.file_data for row in rows] == [None, None, None, b'tampered']
+        assert len(stored_files(store)) == 2  # the two 'report' rows share a blob
+
+        assert restore_document_blobs(connection, store, batch_size=2) == 3
+        assert [bytes(row.file_data) for row in documents(connection)] == [b'report', b'report', b'x-ray', b'tampered']
+
+
+def load_migration(store, monkeypatch):
+    spec = importlib.util.spec_from_file_location('document_blob_store_migration', MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    monkeypatch.setattr(migration, 'blob_store', store)
+    return migration
+
+
+def run(engine, step):
+    with engine.begin() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            step()
+
+
+def test_migration_round_trips_on_sqlite(tmp_path, store, monkeypatch):
+    # Pre-migration schema: file_data NOT NULL, which SQLite can only relax by rebuilding the table
+    engine = make_documents(tmp_path, 'BLOB NOT NULL')
+    migration = load_migration(store, monkeypatch)
+    run(engine, migration.upgrade)
+    with engine.connect() as connection:
+        assert [row.file_data for row in documents(connection)] == [None, None, None, b'tampered']
+    assert sa.inspect(engine).get_columns('documents')[3]['nullable']
+
+    run(engine, migration.downgrade)
+    with engine.connect() as connection:
+        assert [bytes(row.file_data) for row in documents(connection)] == [b'report', b'report', b'x-ray', b'tampered']
+    assert not sa.inspect(engine).get_columns('documents')[3]['nullable']
@@ -0,0 +1,110 @@
+"""
+Write-behind counter tests: increments are visible before they are flushed, flushes lose nothing under
+concurrent increments or forked workers, and legacy totals are seeded once into the rolling window
+"""
+import multiprocessing
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+from services.counters import WriteBehindCounters
+
+
+@pytest.fixture
+def counters(tmp_path):
+    # Long interval: tests flush explicitly
+    return WriteBehindCounters(str(tmp_path / 'counters.db'), flush_interval=3600, retention_days=120)
+
+
+def days_ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def test_unflushed_increments_are_counted(counters):
+    counters.incr('provider_selected', 7)
+    counters.incr('provider_selected', 7, 2)
+    assert counters.rolling('provider_selected', 7) == 3
+    assert counters.rolling_all('provider_selected') == {'7': 3}
+    assert counters.version('provider_selected') == 0
+
+
+def test_flush_writes_buckets_and_bumps_the_version(counters):
+    counters.incr('provider_selected', 7)
+    counters.incr('provider_selected', 8)
+    counters.incr('search_hits', 'miami')
+    assert counters.flush() == 3
+    assert counters.flush() == 0
+    assert counters.version('provider_selected') == 1
+    counters.incr('provider_selected', 7)
+    counters.flush()
+    assert counters.version('provider_selected') == 2
+    assert counters.version('search_hits') == 1
+    assert counters.rolling_all('provider_selected') == {'7': 2, '8': 1}
+
+
+def test_rolling_window_excludes_older_days(counters):
+    assert counters.seed('provider_selected', [(7, 4, days_ago(0)), (7, 5, days_ago(30)), (7, 6, days_ago(100))])
+    assert counters.rolling('provider_selected', 7, days=1) == 4
+    assert counters.rolling('provider_selected', 7, days=90) == 9
+    assert counters.rolling('provider_selected', 7, days=120) == 15
+
+
+def test_seed_runs_once_and_skips_entries_past_retention(counters):
+    assert counters.seed('search_hits', [('miami', 3, days_ago(1)), ('tampa', 9, days_ago(400))])
+    assert not counters.seed('search_hits', [('miami', 100, days_ago(1))])
+    assert counters.rolling_all('search_hits', days=1000) == {'miami': 3}
+
+
+def test_concurrent_increments_and_flushes_lose_nothing(counters):
+    def bump():
+        for i in range(500):
+            counters.incr('provider_selected', i % 5)
+            if i % 100 == 0:
+                counters.flush()
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counters.flush()
+    assert counters.rolling_all('provider_selected') == {str(key): 400 for key in range(5)}
+
+
+def _bump_in_process(db_path):
+    counters = WriteBehindCounters(db_path, flush_interval=3600)
+    for _ in range(100):
+        counters.incr('provider_selected', 1)
+    counters.flush()
+
+
+def test_forked_workers_flush_into_one_total(counters):
+    counters.incr('provider_selected', 1, 5)
+    counters.flush()
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_bump_in_process, args=(counters.db_path,)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+    assert counters.rolling('provider_selected', 1) == 305
+    assert counters.version('provider_selected') == 4
+
+
+def _bump_inherited(counters):
+    for _ in range(100):
+        counters.incr('provider_selected', 1)
+    counters.flush()
+
+
+def test_forked_worker_does_not_reflush_parent_increments(counters):
+    counters.incr('provider_selected', 1, 5)
+    ctx = multiprocessing.get_context('fork')
+    worker = ctx.Process(target=_bump_inherited, args=(counters,))
+    worker.start()
+    worker.join(30)
+    assert worker.exitcode == 0
+    counters.flush()
+    assert counters.rolling('provider_selected', 1) == 105
@@ -0,0 +1,154 @@
+"""
+Draft store tests: autosaves coalesce into one write of the latest version, stale or orphaned patches
+conflict, failed flushes are retried, expired drafts are swept, and older versions never overwrite newer ones
+"""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from services.drafts import DraftStore, DraftConflict
+
+
+@pytest.fixture
+def drafts(tmp_path):
+    return DraftStore(str(tmp_path / 'drafts.db'), max_per_owner=3, coalesce_seconds=0.2, sweep_interval=3600)
+
+
+def stored(drafts, draft_id):
+    return drafts._read(draft_id)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_autosaves_coalesce_into_one_write(drafts, monkeypatch):
+    writes = []
+    flush = drafts.flush
+    monkeypatch.setattr(drafts, 'flush', lambda only_due=False: writes.append(flush(only_due)) or writes[-1])
+
+    draft = drafts.save('user:1', data={'patient_name': 'J'})
+    for name in ('Jo', 'Joh', 'John'):
+        draft = drafts.save('user:1', draft['id'], patch={'patient_name': name})
+    # Visible to this process right away, not yet written
+    assert drafts.get(draft['id'])['data'] == {'patient_name': 'John'}
+    assert stored(drafts, draft['id']) is None
+
+    wait_for(lambda: sum(writes) == 1)
+    row = stored(drafts, draft['id'])
+    assert row['version'] == 4
+    assert row['data'] == {'patient_name': 'John'}
+    assert sum(writes) == 1
+
+
+def test_patch_and_remove_fields(drafts):
+    draft = drafts.save('user:1', data={'a': 1, 'b': 2})
+    draft = drafts.save('user:1', draft['id'], patch={'c': 3}, remove=['a'])
+    assert draft['data'] == {'b': 2, 'c': 3}
+
+
+def test_stale_base_version_conflicts_with_the_current_draft(drafts):
+    draft = drafts.save('user:1', data={'a': 1})
+    drafts.save('user:1', draft['id'], patch={'a': 2}, base_version=1)
+    with pytest.raises(DraftConflict) as conflict:
+        drafts.save('user:1', draft['id'], patch={'a': 3}, base_version=1)
+    assert conflict.value.draft['version'] == 2
+    assert conflict.value.draft['data'] == {'a': 2}
+
+
+def test_patch_against_a_deleted_draft_conflicts_without_a_draft(drafts):
+    draft = drafts.save('user:1', data={'a': 1})
+    drafts.flush()
+    assert drafts.delete(draft['id'], 'user:1')
+    with pytest.raises(DraftConflict) as conflict:
+        drafts.save('user:1', draft['id'], patch={'a': 2}, base_version=1)
+    assert conflict.value.draft is None
+    assert drafts.get(draft['id']) is None
+
+
+def test_other_owners_cannot_read_or_write(drafts):
+    draft = drafts.save('user:1', data={'a': 1})
+    assert drafts.get(draft['id'], 'user:2') is None
+    with pytest.raises(PermissionError):
+        drafts.save('user:2', draft['id'], patch={'a': 2})
+
+
+def test_failed_flush_requeues_the_drafts(drafts, monkeypatch):
+    draft = drafts.save('user:1', data={'a': 1})
+    conn = drafts._connect()
+
+    class FailingConnection:
+        def execute(self, *args):
+            return conn.execute(*args)
+
+        def executemany(self, *args):
+            raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(drafts, '_connect', lambda: FailingConnection())
+    assert drafts.flush() == 0
+    assert drafts.get(draft['id'])['data'] == {'a': 1}
+    monkeypatch.undo()
+    assert drafts.flush() == 1
+    assert stored(drafts, draft['id'])['data'] == {'a': 1}
+
+
+def test_expired_drafts_are_hidden_and_swept(drafts):
+    draft = drafts.save('user:1', data={'a': 1})
+    drafts.flush()
+    drafts._connect().execute('UPDATE drafts SET expires_at = ? WHERE id = ?', (time.time() - 1, draft['id']))
+    assert drafts.get(draft['id']) is None
+    assert drafts.list('user:1') == []
+    assert drafts.sweep() == 1
+
+
+def test_only_the_newest_drafts_per_owner_are_kept(drafts):
+    ids = []
+    for i in range(5):
+        ids.append(drafts.save('user:1', data={'n': i})['id'])
+        time.sleep(0.001)
+    drafts.flush()
+    assert [draft['id'] for draft in drafts.list('user:1')] == ids[:1:-1]
+
+
+def test_reassign_moves_anonymous_drafts(drafts):
+    draft = drafts.save('anon:abc', data={'a': 1})
+    assert drafts.reassign('anon:abc', 'user:1') == 1
+    assert drafts.get(draft['id'], 'user:1')['data'] == {'a': 1}
+
+
+def test_concurrent_patches_get_distinct_versions(drafts):
+    draft = drafts.save('user:1', data={})
+
+    def patch(field):
+        for i in range(25):
+            drafts.save('user:1', draft['id'], patch={field: i})
+
+    threads = [threading.Thread(target=patch, args=(f'field_{n}',)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    drafts.flush()
+    row = stored(drafts, draft['id'])
+    assert row['version'] == 101
+    assert row['data'] == {f'field_{n}': 24 for n in range(4)}
+
+
+def test_older_version_from_another_worker_does_not_overwrite(drafts, tmp_path):
+    other = DraftStore(drafts.db_path, coalesce_seconds=60, sweep_interval=3600)
+    draft = drafts.save('user:1', data={'step': 1})
+    drafts.flush()
+    # Both workers start from version 1; this one saves twice, the other once
+    stale = other.save('user:1', draft['id'], patch={'step': 'stale'})
+    drafts.save('user:1', draft['id'], patch={'step': 2})
+    drafts.save('user:1', draft['id'], patch={'step': 3})
+    drafts.flush()
+    assert stale['version'] == 2
+    other.flush()
+    row = stored(drafts, draft['id'])
+    assert (row['version'], row['data']) == (3, {'step': 3})
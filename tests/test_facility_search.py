@@ -0,0 +1,85 @@
+"""
+Facility autocomplete tests: label-prefix then token-prefix matches in rank order, file-change rebuilds,
+and conditional GETs on /api/hospital-search
+"""
+import json
+import os
+
+import pytest
+
+import consumer_main_final
+from services.facility_search import FacilityAutocomplete
+
+FACILITIES = [
+    {'name': 'Jackson Memorial Hospital', 'city': 'Miami', 'state': 'FL', 'weight': 10},
+    {'name': 'Mount Sinai Medical Center', 'city': 'Miami Beach', 'state': 'FL', 'weight': 5},
+    {'name': 'Mayo Clinic', 'city': 'Rochester', 'state': 'MN', 'weight': 20},
+    {'name': 'Memorial Regional Hospital', 'city': 'Hollywood', 'state': 'FL', 'weight': 1},
+    {'label': 'Miami Children\'s Hospital - Miami, FL'},
+]
+
+
+def write_jsonl(path, rows):
+    with open(path, 'w') as f:
+        f.write('\n'.join(json.dumps(row) for row in rows))
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / 'facilities.jsonl')
+    write_jsonl(path, FACILITIES)
+    index = FacilityAutocomplete(path=path, check_interval=0)
+    index.refresh(force=True)
+    return index
+
+
+def test_label_prefix_matches_come_first(index):
+    assert index.search('mem') == [
+        'Memorial Regional Hospital - Hollywood, FL',
+        'Jackson Memorial Hospital - Miami, FL',
+    ]
+
+
+def test_every_token_must_prefix_a_label_token(index):
+    assert index.search('miami hosp') == [
+        'Jackson Memorial Hospital - Miami, FL',
+        "Miami Children's Hospital - Miami, FL",
+    ]
+    assert index.search('mayo miami') == []
+
+
+def test_results_follow_weight_and_respect_the_limit(index):
+    assert index.search('m', limit=2) == ['Mayo Clinic - Rochester, MN', 'Mount Sinai Medical Center - Miami Beach, FL']
+    assert len(index.search('fl', limit=10)) == 4
+
+
+def test_csv_and_defaults(tmp_path):
+    path = str(tmp_path / 'facilities.csv')
+    with open(path, 'w') as f:
+        f.write('name,city,state,weight\nTampa General Hospital,Tampa,FL,3\n')
+    assert FacilityAutocomplete(path=path, check_interval=0).search('tampa') == ['Tampa General Hospital - Tampa, FL']
+    fallback = FacilityAutocomplete(path=str(tmp_path / 'missing.csv'), defaults=['Other Hospital'], check_interval=0)
+    assert fallback.search('other') == ['Other Hospital']
+
+
+def test_file_change_rebuilds_and_changes_the_etag(index):
+    etag = index.etag('tampa')
+    assert index.search('tampa') == []
+    write_jsonl(index.path, FACILITIES + [{'name': 'Tampa General Hospital', 'city': 'Tampa', 'state': 'FL'}])
+    stat = os.stat(index.path)
+    os.utime(index.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert index.search('tampa') == ['Tampa General Hospital - Tampa, FL']
+    assert index.etag('tampa') != etag
+
+
+def test_route_answers_conditional_requests(index, monkeypatch):
+    monkeypatch.setattr(consumer_main_final, 'facility_search', index)
+    client = consumer_main_final.consumer_app.test_client()
+    response = client.get('/api/hospital-search?q=mayo')
+    assert response.status_code == 200
+    assert response.get_json() == ['Mayo Clinic - Rochester, MN']
+    assert response.cache_control.public and response.cache_control.max_age
+
+    etag = response.headers['ETag']
+    assert client.get('/api/hospital-search?q=mayo', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/hospital-search?q=jackson', headers={'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,155 @@
+"""
+Fairness ranking tests: high responders first, incremental re-slotting that matches a full sort,
+copy-on-write snapshots, delist status from the data store, and consistent orderings under concurrent updates
+"""
+import random
+import threading
+
+import pytest
+
+from services.fairness import FairnessRanking
+from services.storage import SQLiteBackend
+
+DELISTED_PATH = 'store/delisted_affiliates.json'
+
+
+def affiliate(affiliate_id, rate, bookings=100, days=365, **extra):
+    return dict(id=affiliate_id, name=f'Affiliate {affiliate_id}', base_price=20000, capabilities=[],
+                priority=False, ground_included=False, response_rate_30d=rate, total_bookings=bookings,
+                days_since_join=days, **extra)
+
+
+ROWS = [affiliate(1, 40), affiliate(2, 90), affiliate(3, 70, bookings=10), affiliate(4, 90), affiliate(5, 20, days=30)]
+
+
+def ids(affiliates):
+    return [a['id'] for a in affiliates]
+
+
+def full_sort(ranking):
+    listed = [a for a in ranking._affiliates.values() if not a['delisted']]
+    return ids(sorted(listed, key=ranking._sort_key))
+
+
+@pytest.fixture
+def rows():
+    return [dict(row) for row in ROWS]
+
+
+@pytest.fixture
+def ranking(rows):
+    return FairnessRanking(rows_fn=lambda: rows, check_interval=3600)
+
+
+def test_high_responders_come_first(ranking):
+    # 2 and 4 tie on rate and keep their row order; 1 and 5 are below the threshold
+    assert ids(ranking.ordered()) == [2, 4, 3, 1, 5]
+
+
+def test_spotlight_is_derived_unless_set(ranking):
+    assert [a['spotlight'] for a in ranking.ordered()] == [False, False, True, False, True]
+    ranking.update(2, spotlight=True)
+    assert ranking.get(2)['spotlight']
+    ranking.update(2, spotlight=None)
+    assert not ranking.get(2)['spotlight']
+
+
+def test_update_reslots_only_on_ranked_changes(ranking):
+    ranking.ordered()
+    version = ranking.version
+    assert not ranking.update(1, response_rate_30d=40)
+    assert ranking.version == version
+
+    assert ranking.update(1, name='Renamed')
+    assert ranking.version == version + 1
+    assert ids(ranking.ordered()) == [2, 4, 3, 1, 5]
+
+    assert ranking.update(1, response_rate_30d=95)
+    assert ids(ranking.ordered()) == [1, 2, 4, 3, 5]
+    assert not ranking.update(99, response_rate_30d=10)
+
+
+def test_snapshots_are_reused_and_never_mutated(ranking):
+    snapshot = ranking.ordered()
+    assert ranking.ordered() is snapshot
+    ranking.update(5, response_rate_30d=99)
+    assert snapshot[-1]['response_rate_30d'] == 20
+    assert ids(ranking.ordered())[0] == 5
+
+
+def test_row_changes_are_synced_on_refresh(ranking, rows):
+    ranking.ordered()
+    rows[0] = dict(rows[0], response_rate_30d=100)
+    del rows[-1]
+    rows.append(affiliate(6, 60))
+    ranking.invalidate()
+    assert ids(ranking.ordered()) == [1, 2, 4, 3, 6]
+
+
+def test_failed_refresh_keeps_the_current_ordering(rows):
+    calls = []
+
+    def rows_fn():
+        calls.append(1)
+        if len(calls) > 1:
+            raise RuntimeError('database unavailable')
+        return rows
+
+    ranking = FairnessRanking(rows_fn=rows_fn, check_interval=3600)
+    assert ids(ranking.ordered()) == [2, 4, 3, 1, 5]
+    ranking.invalidate()
+    assert ids(ranking.ordered()) == [2, 4, 3, 1, 5]
+
+
+def test_defaults_are_used_when_there_are_no_rows():
+    ranking = FairnessRanking(rows_fn=lambda: [], defaults=ROWS[:2], check_interval=3600)
+    assert ids(ranking.ordered()) == [2, 1]
+
+
+def test_delisted_affiliates_are_dropped_and_relisted(rows, tmp_path):
+    store = SQLiteBackend(str(tmp_path / 'datastore.db'))
+    ranking = FairnessRanking(rows_fn=lambda: rows, store=store, delisted_path=DELISTED_PATH, check_interval=3600)
+    assert 2 in ids(ranking.ordered())
+
+    store.save(DELISTED_PATH, {'delisted': [{'affiliate_id': 2, 'is_delisted': True}]})
+    ranking.invalidate()
+    assert ids(ranking.ordered()) == [4, 3, 1, 5]
+    assert ranking.get(2)['delisted']
+
+    store.save(DELISTED_PATH, {'delisted': [{'affiliate_id': 2, 'is_delisted': True},
+                                            {'affiliate_id': 2, 'relisted_at': '2026-10-17'}]})
+    ranking.invalidate()
+    assert ids(ranking.ordered()) == [2, 4, 3, 1, 5]
+
+
+def test_concurrent_updates_keep_a_sorted_ordering(rows):
+    rows = [affiliate(i, random.randint(0, 100)) for i in range(200)]
+    ranking = FairnessRanking(rows_fn=lambda: rows, check_interval=3600)
+    ranking.ordered()
+    errors = []
+    stop = threading.Event()
+
+    def read():
+        while not stop.is_set():
+            snapshot = ranking.ordered()
+            keys = [ranking._sort_key(a) for a in snapshot]
+            if keys != sorted(keys) or len(snapshot) != 200:
+                errors.append(ids(snapshot))
+                return
+
+    def write(seed):
+        rng = random.Random(seed)
+        for _ in range(500):
+            ranking.update(rng.randrange(200), response_rate_30d=rng.randint(0, 100))
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    writers = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in readers:
+        thread.join()
+    assert errors == []
+    assert ids(ranking.ordered()) == full_sort(ranking)
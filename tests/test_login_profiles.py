@@ -0,0 +1,138 @@
+"""
+Login profile tests: scoring against known IPs and devices, write-behind persistence that survives a new
+store instance, bounded history, legacy import, and no lost updates across threads or forked workers
+"""
+import json
+import multiprocessing
+import sqlite3
+import threading
+from datetime import datetime
+
+import pytest
+
+from services.login_profiles import LoginProfileStore, ua_signature
+
+NOON = datetime(2026, 10, 17, 12, 0)
+CHROME = 'Mozilla/5.0 Chrome/130'
+
+
+def make_store(db_path, **kwargs):
+    kwargs.setdefault('flush_interval', 3600)  # tests flush explicitly
+    kwargs.setdefault('legacy_path', None)
+    return LoginProfileStore(str(db_path), **kwargs)
+
+
+@pytest.fixture
+def profiles(tmp_path):
+    return make_store(tmp_path / 'login_profiles.db')
+
+
+def test_first_login_is_risky_and_repeat_is_not(profiles):
+    first = profiles.record_login('alice', '10.0.0.1', CHROME, now=NOON)
+    assert first['risk_factors'] == ['new_ip', 'new_device'] and first['require_step_up']
+    repeat = profiles.record_login('alice', '10.0.0.1', CHROME, now=NOON)
+    assert not repeat['is_risky']
+    late = profiles.record_login('alice', '10.0.0.1', CHROME, now=NOON.replace(hour=3))
+    assert late['risk_factors'] == ['odd_time'] and not late['require_step_up']
+
+
+def test_updates_are_written_behind_and_survive_restart(profiles, tmp_path):
+    profiles.record_login('alice', '10.0.0.1', CHROME, now=NOON)
+    assert profiles.get('alice')['ips'] == ['10.0.0.1']
+    assert make_store(profiles.db_path).get('alice')['ips'] == []
+
+    assert profiles.flush() == 1
+    restarted = make_store(profiles.db_path)
+    assert restarted.get('alice') == {
+        'ips': ['10.0.0.1'], 'user_agents': [ua_signature(CHROME)], 'last_login': NOON.isoformat()}
+    assert not restarted.record_login('alice', '10.0.0.1', CHROME, now=NOON)['is_risky']
+
+
+def test_history_keeps_the_most_recent_entries(tmp_path):
+    profiles = make_store(tmp_path / 'login_profiles.db', max_ips=3)
+    for i in range(5):
+        profiles.record_login('alice', f'10.0.0.{i}', CHROME, now=NOON)
+    profiles.record_login('alice', '10.0.0.2', CHROME, now=NOON)
+    expected = ['10.0.0.3', '10.0.0.4', '10.0.0.2']
+    assert profiles.get('alice')['ips'] == expected
+    profiles.flush()
+    assert make_store(profiles.db_path, max_ips=3).get('alice')['ips'] == expected
+
+
+def test_legacy_settings_are_imported_once(tmp_path):
+    legacy = tmp_path / 'user_settings.json'
+    legacy.write_text(json.dumps({'users': {'bob': {
+        'known_ips': ['1.1.1.1', '2.2.2.2'], 'known_user_agents': ['abcd1234'], 'last_login': '2026-01-01T10:00:00'}}}))
+    profiles = make_store(tmp_path / 'login_profiles.db', legacy_path=str(legacy))
+    assert profiles.get('bob')['ips'] == ['1.1.1.1', '2.2.2.2']
+    legacy.write_text(json.dumps({'users': {'carol': {'known_ips': ['3.3.3.3']}}}))
+    reopened = make_store(profiles.db_path, legacy_path=str(legacy))
+    assert reopened.get('carol')['ips'] == []
+
+
+def test_failed_flush_keeps_the_updates(profiles, monkeypatch):
+    profiles.record_login('alice', '10.0.0.1', CHROME, now=NOON)
+    conn = profiles._connect()
+
+    class FailingConnection:
+        def execute(self, *args):
+            return conn.execute(*args)
+
+        def executemany(self, *args):
+            raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(profiles, '_connect', lambda: FailingConnection())
+    assert profiles.flush() == 0
+    monkeypatch.undo()
+    assert profiles.flush() == 1
+    assert make_store(profiles.db_path).get('alice')['ips'] == ['10.0.0.1']
+
+
+def test_concurrent_logins_lose_no_entries(tmp_path):
+    profiles = make_store(tmp_path / 'login_profiles.db', max_ips=100)
+
+    def login(n):
+        for i in range(20):
+            profiles.record_login('alice', f'10.{n}.0.{i}', CHROME, now=NOON)
+            if i % 5 == 0:
+                profiles.flush()
+
+    threads = [threading.Thread(target=login, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiles.flush()
+    assert len(make_store(profiles.db_path, max_ips=100).get('alice')['ips']) == 80
+
+
+def _login_in_process(db_path, n):
+    profiles = make_store(db_path, max_ips=100)
+    for i in range(10):
+        profiles.record_login('alice', f'10.{n}.0.{i}', CHROME, now=NOON)
+    profiles.flush()
+
+
+def test_forked_workers_merge_into_one_profile(profiles):
+    profiles.record_login('alice', '10.9.9.9', CHROME, now=NOON)
+    profiles.flush()
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_login_in_process, args=(profiles.db_path, n)) for n in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+    assert len(make_store(profiles.db_path, max_ips=100).get('alice')['ips']) == 31
+
+
+def test_replay_scores_history_without_touching_the_store(profiles):
+    events = [
+        {'user': 'alice', 'ip': '10.0.0.2', 'user_agent': CHROME, 'timestamp': '2026-10-02T12:00:00'},
+        {'user': 'alice', 'ip': '10.0.0.1', 'user_agent': CHROME, 'timestamp': '2026-10-01T12:00:00'},
+        {'user': 'alice', 'ip': '10.0.0.1', 'user_agent': CHROME, 'timestamp': '2026-10-03T12:00:00'},
+    ]
+    results = profiles.score_events(events)
+    assert [event['timestamp'][:10] for event, _ in results] == ['2026-10-01', '2026-10-02', '2026-10-03']
+    assert [result['risk_factors'] for _, result in results] == [['new_ip', 'new_device'], ['new_ip'], []]
+    assert profiles.get('alice')['ips'] == []
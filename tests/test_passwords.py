@@ -0,0 +1,131 @@
+"""
+Password hasher tests: every stored format verifies, outdated hashes are upgraded in the background,
+a saturated pool fails fast with PasswordHasherBusy, and only successful checks are cached
+"""
+import hashlib
+import multiprocessing
+import threading
+
+import bcrypt
+import pytest
+from werkzeug.security import generate_password_hash
+
+from services.passwords import PasswordHasher, PasswordHasherBusy
+
+
+def make_hasher(**kwargs):
+    kwargs.setdefault('pbkdf2_iterations', 1000)
+    kwargs.setdefault('scrypt_n', 1024)
+    kwargs.setdefault('workers', 2)
+    kwargs.setdefault('max_pending', 4)
+    kwargs.setdefault('queue_timeout', 0.05)
+    kwargs.setdefault('cache_size', 16)
+    kwargs.setdefault('cache_ttl', 60)
+    return PasswordHasher(**kwargs)
+
+
+@pytest.mark.parametrize('scheme', ['pbkdf2_sha256', 'scrypt'])
+def test_round_trip(scheme):
+    hasher = make_hasher(scheme=scheme)
+    password_hash = hasher.hash('correct horse')
+    assert password_hash.startswith(scheme)
+    assert hasher.verify('correct horse', password_hash)
+    assert not hasher.verify('wrong horse', password_hash)
+    assert not hasher.needs_rehash(password_hash)
+
+
+def legacy_pbkdf2(password, salt='legacysalt'):
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
+    return f'pbkdf2_sha256${salt}${digest.hex()}'
+
+
+@pytest.mark.parametrize('password_hash', [
+    legacy_pbkdf2('s3cret'),
+    generate_password_hash('s3cret', method='pbkdf2:sha256:1000'),
+    bcrypt.hashpw(b's3cret', bcrypt.gensalt(rounds=4)).decode(),
+], ids=['legacy', 'werkzeug', 'bcrypt'])
+def test_older_formats_verify_and_need_rehash(password_hash):
+    hasher = make_hasher()
+    assert hasher.verify('s3cret', password_hash)
+    assert not hasher.verify('nope', password_hash)
+    assert hasher.needs_rehash(password_hash)
+
+
+def test_unknown_formats_are_rejected():
+    hasher = make_hasher()
+    assert not hasher.verify('s3cret', 's3cret')
+    assert not hasher.verify('s3cret', 'pbkdf2_sha256$x$!!$!!')
+    assert not hasher.verify('', hasher.hash('s3cret'))
+
+
+def test_changed_work_factor_needs_rehash():
+    password_hash = make_hasher(pbkdf2_iterations=1000).hash('s3cret')
+    assert make_hasher(pbkdf2_iterations=2000).needs_rehash(password_hash)
+    assert make_hasher(scheme='scrypt').needs_rehash(password_hash)
+
+
+def test_rehash_later_persists_an_upgraded_hash():
+    hasher = make_hasher()
+    old_hash = legacy_pbkdf2('s3cret')
+    persisted = threading.Event()
+    new_hashes = []
+
+    def persist(new_hash):
+        new_hashes.append(new_hash)
+        persisted.set()
+
+    assert hasher.rehash_later('s3cret', old_hash, persist)
+    assert persisted.wait(5)
+    assert hasher.verify('s3cret', new_hashes[0])
+    assert not hasher.needs_rehash(new_hashes[0])
+    assert not hasher.rehash_later('s3cret', new_hashes[0], persist)
+
+
+def test_saturated_pool_raises_busy_and_skips_rehashes():
+    hasher = make_hasher(workers=1, max_pending=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    blocker = threading.Thread(target=hasher._run, args=(slow,))
+    blocker.start()
+    assert started.wait(5)
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash('s3cret')
+        assert not hasher.rehash_later('s3cret', legacy_pbkdf2('s3cret'), lambda new_hash: None)
+    finally:
+        release.set()
+        blocker.join()
+    assert hasher.verify('s3cret', hasher.hash('s3cret'))
+
+
+def test_only_successful_checks_are_cached(monkeypatch):
+    hasher = make_hasher()
+    password_hash = hasher.hash('s3cret')
+    checks = []
+    check = hasher._check
+    monkeypatch.setattr(hasher, '_check', lambda *args: checks.append(args[0]) or check(*args))
+
+    assert not hasher.verify('wrong', password_hash)
+    assert not hasher.verify('wrong', password_hash)
+    assert hasher.verify('s3cret', password_hash)
+    assert hasher.verify('s3cret', password_hash)
+    assert checks == ['wrong', 'wrong', 's3cret']
+
+
+def _verify_in_process(hasher, password_hash, results):
+    results.put(hasher.verify('s3cret', password_hash))
+
+
+def test_forked_worker_gets_its_own_pool():
+    hasher = make_hasher()
+    password_hash = hasher.hash('s3cret')
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    worker = ctx.Process(target=_verify_in_process, args=(hasher, password_hash, results))
+    worker.start()
+    assert results.get(timeout=30) is True
+    worker.join(30)
@@ -0,0 +1,120 @@
+"""
+Provider search index tests: prefix and typo matching, ranking, in-place popularity updates, and searches
+that keep working while the providers file is rebuilt underneath them
+"""
+import json
+import os
+import threading
+
+import pytest
+
+from services.provider_search import ProviderSearchIndex
+
+PROVIDERS = [
+    {'id': 1, 'name': 'Angel MedFlight', 'address': 'Scottsdale, Arizona', 'approved': True, 'search_count_90d': 5},
+    {'id': 2, 'name': 'Air Methods', 'address': 'Greenwood Village, Colorado', 'approved': True, 'search_count_90d': 20},
+    {'id': 3, 'name': 'REVA Air Ambulance', 'address': 'Fort Lauderdale, Florida', 'approved': True, 'search_count_90d': 1},
+    {'id': 4, 'name': 'Colorado Critical Air', 'address': 'Denver, Colorado', 'approved': True, 'search_count_90d': 0},
+    {'id': 5, 'name': 'Pending Air Care', 'address': 'Austin, Texas', 'approved': False},
+]
+
+
+def write_providers(path, providers):
+    with open(path, 'w') as f:
+        json.dump({'providers': providers}, f)
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / 'providers.json')
+    write_providers(path, PROVIDERS)
+    index = ProviderSearchIndex(path, check_interval=0)
+    index.refresh(force=True)
+    return index
+
+
+def ids(results):
+    return [provider['id'] for provider in results]
+
+
+def test_exact_prefix_and_typo_matches(index):
+    assert ids(index.search('medflight')) == [1]
+    assert ids(index.search('medfl')) == [1]
+    assert ids(index.search('medfligt')) == [1]
+    assert ids(index.search('ambulence')) == [3]
+    assert index.search('zzzz') == []
+
+
+def test_every_query_token_must_match(index):
+    assert ids(index.search('air colorado')) == [4, 2]
+    assert ids(index.search('air texas')) == []
+
+
+def test_unapproved_providers_are_not_indexed(index):
+    assert ids(index.search('pending')) == []
+
+
+def test_name_matches_outrank_address_matches(index):
+    # Provider 4 has Colorado in its name; provider 2 only in its address, despite more searches
+    assert ids(index.search('colorado')) == [4, 2]
+
+
+def test_short_prefixes_rank_by_popularity(index):
+    assert ids(index.search('a', limit=3)) == [2, 1, 3]
+
+
+def test_bump_reorders_in_place(index):
+    index.bump(4, 100)
+    assert ids(index.search('a', limit=2)) == [4, 2]
+    assert index.providers[index._doc_by_id[4]]['search_count_90d'] == 100
+    index.bump(99, 5)  # unknown ids are ignored
+
+
+def test_popularity_counts_sync_without_rebuild(tmp_path):
+    path = str(tmp_path / 'providers.json')
+    write_providers(path, PROVIDERS)
+    counts = {1: 5, 2: 20, 3: 1, 4: 0}
+    version = [0]
+    index = ProviderSearchIndex(path, check_interval=0, popularity_fn=lambda: dict(counts),
+                                popularity_version_fn=lambda: version[0], popularity_interval=0)
+    index.refresh(force=True)
+    signature = index._signature
+    counts[3] = 500
+    version[0] += 1
+    index._sync_popularity()
+    assert index._signature == signature
+    assert ids(index.search('a', limit=1)) == [3]
+
+
+def test_file_change_triggers_a_rebuild(index):
+    providers = PROVIDERS + [{'id': 6, 'name': 'Lifeguard Air', 'address': 'Albuquerque', 'approved': True}]
+    write_providers(index.path, providers)
+    stat = os.stat(index.path)
+    os.utime(index.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert index.refresh()
+    index._worker.join(5)
+    assert ids(index.search('lifeguard')) == [6]
+
+
+def test_searches_during_rebuilds_see_a_whole_index(index):
+    errors = []
+    stop = threading.Event()
+
+    def search():
+        while not stop.is_set():
+            try:
+                results = ids(index.search('air colorado'))
+                assert results == [4, 2], results
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=search) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for _ in range(20):
+        index.build(PROVIDERS)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Quote stream tests: a quote submitted by an affiliate reaches /quotes/stream/<request_id>
+Runs against the Flask test client with a throwaway event journal. The first two fake the Quote lookup;
+the last goes from intake through a real Quote row in the test database.
+"""
+
+import types
+from datetime import datetime
+
+import pytest
+
+import consumer_main_final
+import routes.affiliate
+from services.quote_events import QuoteEventBus
+
+REQUEST_ID = 'QR261017ABC123'
+
+
+class FakeQuote:
+    ref_id = REQUEST_ID
+    severity_level = 2
+    created_at = datetime.utcnow()
+    from_city, from_state, to_city, to_state = 'Miami', 'FL', 'Atlanta', 'GA'
+    flight_date = datetime.utcnow()
+    contact_name, contact_phone, contact_email = 'John Smith', None, None
+    status, quote_status = 'pending', 'pending'
+    quoted_price = None
+    quote_submitted_at = booking_confirmed_at = None
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    bus = QuoteEventBus(db_path=str(tmp_path / 'quote_events.db'), max_stream_seconds=5, heartbeat=5)
+    monkeypatch.setattr(consumer_main_final, 'quote_events', bus)
+    monkeypatch.setattr(routes.affiliate, 'quote_events', bus)
+
+    quote = FakeQuote()
+    query = types.SimpleNamespace(filter_by=lambda **kwargs: types.SimpleNamespace(first=lambda: quote))
+    monkeypatch.setattr(routes.affiliate, 'Quote', types.SimpleNamespace(query=query))
+    monkeypatch.setattr(routes.affiliate, 'db', types.SimpleNamespace(session=types.SimpleNamespace(commit=lambda: None)))
+    monkeypatch.setattr(routes.affiliate, 'send_quote_ready_notifications', lambda quote: None)
+
+    consumer_main_final.consumer_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with consumer_main_final.consumer_app.test_client() as client:
+        yield client, bus
+
+
+def submit_quote(client):
+    response = client.post(f'/affiliate/submit-quote/{REQUEST_ID}', data={'quoted_price': '25000'})
+    assert response.status_code == 302
+
+
+def read_until_quote(chunks):
+    for chunk in chunks:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if 'event: quote' in chunk:
+            return chunk
+    return None
+
+
+def test_quote_submitted_while_streaming_is_pushed(client):
+    client, bus = client
+    response = client.get(f'/quotes/stream/{REQUEST_ID}?last_event_id={bus.latest_id()}', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    chunks = iter(response.response)
+    assert 'retry:' in next(chunks).decode()
+
+    submit_quote(client)
+
+    event = read_until_quote(chunks)
+    response.close()
+    assert event is not None
+    assert f'"request_id": "{REQUEST_ID}"' in event
+
+
+def test_quote_submitted_before_stream_opens_is_replayed(client):
+    # The page renders its starting id; a quote landing before EventSource connects must not be lost
+    client, bus = client
+    starting_id = bus.latest_id()
+    submit_quote(client)
+
+    response = client.get(f'/quotes/stream/{REQUEST_ID}?last_event_id={starting_id}', buffered=False)
+    event = read_until_quote(iter(response.response))
+    response.close()
+    assert event is not None
+    assert f'"request_id": "{REQUEST_ID}"' in event
+
+
+@pytest.fixture
+def intake_client(tmp_path, monkeypatch):
+    bus = QuoteEventBus(db_path=str(tmp_path / 'quote_events.db'), max_stream_seconds=5, heartbeat=5)
+    monkeypatch.setattr(consumer_main_final, 'quote_events', bus)
+    monkeypatch.setattr(routes.affiliate, 'quote_events', bus)
+    monkeypatch.setattr(routes.affiliate, 'send_quote_ready_notifications', lambda quote: None)
+
+    app = consumer_main_final.consumer_app
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        # Only the quotes table; create_all trips over unrelated models with dangling foreign keys
+        db = consumer_main_final.db
+        db.metadata.create_all(db.engine, tables=[consumer_main_final.Quote.__table__])
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['logged_in'] = True
+            session['user_id'] = 'family-1'
+            session['user_email'] = 'family@example.com'
+        yield client, bus
+
+
+def test_intake_request_becomes_a_quote_that_streams(intake_client):
+    client, bus = intake_client
+    response = client.post('/intake/submit', json={
+        'patient_first_name': 'Jane', 'patient_last_name': 'Doe',
+        'from_city': 'Miami', 'from_state': 'FL', 'to_city': 'Atlanta', 'to_state': 'GA',
+        'serviceType': 'non-critical', 'severity': '2', 'equipment': ['oxygen'],
+    })
+    body = response.get_json()
+    assert body['success'], body
+    request_id = body['request_id']
+
+    with consumer_main_final.consumer_app.app_context():
+        quote = consumer_main_final.Quote.query.filter_by(ref_id=request_id).first()
+        assert quote is not None
+        assert quote.quote_expiry is not None
+        assert (quote.from_city, quote.to_city) == ('Miami', 'Atlanta')
+
+    stream = client.get(f'/quotes/stream/{request_id}?last_event_id={bus.latest_id()}', buffered=False)
+    chunks = iter(stream.response)
+    next(chunks)
+
+    response = client.post(f'/affiliate/submit-quote/{request_id}', data={'quoted_price': '25000'})
+    assert response.status_code == 302
+
+    event = read_until_quote(chunks)
+    stream.close()
+    assert event is not None
+    assert f'"request_id": "{request_id}"' in event
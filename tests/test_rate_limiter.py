@@ -0,0 +1,113 @@
+"""
+Rate limiter tests: sliding-window counting on both backends, locks, eviction, and one shared limit
+across threads and forked workers on the SQLite backend
+"""
+import multiprocessing
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.rate_limiter import MemoryBackend, SQLiteBackend, RateLimiter
+
+WINDOW = 60.0
+START = 1_000_020.0  # a window boundary (multiple of 60)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBackend(max_entries=1000)
+    return SQLiteBackend(str(tmp_path / 'ratelimits.db'), max_entries=1000)
+
+
+def test_limit_is_enforced_within_a_window(backend):
+    results = [backend.hit('ip:1', WINDOW, START + i, limit=3)[1] for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert backend.count('ip:1', WINDOW, START + 5) == 3
+    # Other keys are independent
+    assert backend.hit('ip:2', WINDOW, START, limit=3)[1]
+
+
+def test_previous_window_is_weighted_by_its_overlap(backend):
+    for _ in range(10):
+        backend.hit('user:a', WINDOW, START + 1)
+    # A quarter into the next window, three quarters of the previous count still applies
+    assert backend.count('user:a', WINDOW, START + WINDOW + 15) == pytest.approx(7.5)
+    # Two windows later it is gone
+    assert backend.count('user:a', WINDOW, START + 2 * WINDOW + 1) == 0
+
+
+def test_locks_expire(backend):
+    backend.lock('lock:bob', START + 100)
+    assert backend.lock_until('lock:bob', START) == START + 100
+    assert [key for key, _ in backend.active_locks('lock:', START)] == ['lock:bob']
+    assert backend.lock_until('lock:bob', START + 101) is None
+    backend.lock('lock:bob', START + 100)
+    assert backend.unlock('lock:bob')
+    assert backend.lock_until('lock:bob', START) is None
+
+
+def test_purge_drops_expired_counters(backend):
+    backend.hit('ip:old', WINDOW, START)
+    backend.hit('ip:new', WINDOW, START + 3 * WINDOW)
+    backend.purge(START + 3 * WINDOW)
+    assert [row[0] for row in backend.snapshot('ip:', START + 3 * WINDOW, 10)] == ['ip:new']
+
+
+def test_memory_backend_is_bounded():
+    backend = MemoryBackend(max_entries=3)
+    for i in range(5):
+        backend.hit(f'ip:{i}', WINDOW, START)
+    assert [row[0] for row in backend.snapshot('ip:', START, 10)] == ['ip:2', 'ip:3', 'ip:4']
+
+
+def test_sqlite_backend_is_trimmed_to_max_entries(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'ratelimits.db'), max_entries=2)
+    for i in range(4):
+        backend.hit(f'ip:{i}', WINDOW, START + i * WINDOW / 4)
+    backend.purge(START)
+    assert len(backend.snapshot('ip:', START, 10)) == 2
+
+
+def test_threads_share_one_limit(tmp_path):
+    limiter = RateLimiter(f'sqlite:///{tmp_path}/ratelimits.db')
+    allowed = []
+
+    def attempt():
+        for _ in range(20):
+            allowed.append(limiter.allow('quote:ip', 30, 3600))
+
+    threads = [threading.Thread(target=attempt) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert allowed.count(True) == 30
+
+
+def _attempt_in_process(storage_url, results):
+    limiter = RateLimiter(storage_url)
+    results.put(sum(limiter.allow('login:ip', 25, 3600) for _ in range(20)))
+
+
+def test_forked_workers_share_one_limit(tmp_path):
+    storage_url = f'sqlite:///{tmp_path}/ratelimits.db'
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_attempt_in_process, args=(storage_url, results)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    allowed = sum(results.get(timeout=30) for _ in workers)
+    for worker in workers:
+        worker.join(30)
+    assert allowed == 25
+
+
+def test_limiter_lock_round_trips_datetimes(tmp_path):
+    limiter = RateLimiter('memory://')
+    until = datetime.now() + timedelta(minutes=5)
+    limiter.lock('lock:alice', until)
+    assert abs((limiter.lock_until('lock:alice') - until).total_seconds()) < 1e-3
+    assert limiter.unlock('lock:alice')
+    assert limiter.lock_until('lock:alice') is None
@@ -0,0 +1,145 @@
+"""
+Server-side session tests: the cookie carries only an ID, requests write back only changed keys,
+unknown or cleared sessions get a fresh ID, and concurrent requests on one session keep each other's keys
+"""
+import multiprocessing
+import time
+from datetime import timedelta
+
+import pytest
+from flask import Flask, session
+
+from services.sessions import SQLiteSessionInterface, SQLiteSessionStore, ServerSideSession
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteSessionStore(str(tmp_path / 'sessions.db'), max_entries=100, purge_interval=3600)
+
+
+@pytest.fixture
+def app(store):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.permanent_session_lifetime = timedelta(hours=1)
+    app.session_interface = SQLiteSessionInterface(store, touch_interval=60)
+
+    @app.route('/set/<key>/<value>')
+    def set_value(key, value):
+        session[key] = value
+        return 'ok'
+
+    @app.route('/get/<key>')
+    def get_value(key):
+        return session.get(key, '')
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return 'ok'
+
+    @app.route('/static-page')
+    def static_page():
+        return 'ok'
+
+    return app
+
+
+def session_cookie(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie else None
+
+
+def test_cookie_holds_only_the_id_and_values_persist(app, store):
+    client = app.test_client()
+    client.get('/set/user_email/a@example.com')
+    sid = session_cookie(client)
+    assert 'example' not in sid
+    assert client.get('/get/user_email').text == 'a@example.com'
+    assert store.load(sid, 3600)[1] == {'user_email': '"a@example.com"'}
+
+
+def test_untouched_session_does_no_storage_io(app, store, monkeypatch):
+    client = app.test_client()
+    client.get('/set/a/1')
+    calls = []
+    monkeypatch.setattr(store, 'load', lambda *args: calls.append('load'))
+    monkeypatch.setattr(store, 'save', lambda *args, **kwargs: calls.append('save'))
+    response = client.get('/static-page')
+    assert calls == []
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_only_changed_keys_are_written(app, store, monkeypatch):
+    client = app.test_client()
+    client.get('/set/a/1')
+    client.get('/set/b/2')
+    saves = []
+    save = store.save
+    monkeypatch.setattr(store, 'save', lambda sid, upserts, deletes, **kwargs: (
+        saves.append((upserts, list(deletes))), save(sid, upserts, deletes, **kwargs)))
+    client.get('/set/b/3')
+    client.get('/set/b/3')  # unchanged value and a recent touch: nothing to write
+    client.get('/get/a')
+    assert saves == [({'b': '"3"'}, [])]
+
+
+def test_unknown_session_id_is_not_adopted(app, store):
+    client = app.test_client()
+    forged = 'x' * 43
+    client.set_cookie('session', forged)
+    client.get('/set/a/1')
+    assert session_cookie(client) != forged
+    assert store.load(forged, 3600) is None
+
+
+def test_clear_rotates_the_id_and_drops_the_old_rows(app, store):
+    client = app.test_client()
+    client.get('/set/a/1')
+    old_sid = session_cookie(client)
+    client.get('/logout')
+    assert session_cookie(client) is None
+    assert store.load(old_sid, 3600) is None
+
+
+def test_expired_and_least_recent_sessions_are_purged(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'), max_entries=2, purge_interval=3600)
+    for sid in ('s1', 's2', 's3', 's4'):
+        store.save(sid, {'k': '1'}, ())
+        time.sleep(0.01)
+    conn = store._connect()
+    conn.execute("UPDATE sessions SET accessed_at = accessed_at - 7200 WHERE sid = 's1'")
+    assert store.purge(3600) == (1, 1)
+    assert [sid for (sid,) in conn.execute('SELECT sid FROM sessions ORDER BY sid')] == ['s3', 's4']
+    assert conn.execute("SELECT COUNT(*) FROM session_items WHERE sid IN ('s1', 's2')").fetchone()[0] == 0
+
+
+def test_overlapping_requests_keep_each_others_keys(store):
+    serializer = SQLiteSessionInterface.serializer
+    store.save('shared', {'cart': serializer.dumps([1])}, ())
+    first = ServerSideSession('shared', store, serializer, 3600)
+    second = ServerSideSession('shared', store, serializer, 3600)
+    first['quote_id'] = 'Q1'
+    second['draft_id'] = 'D1'
+    for request_session in (first, second):
+        store.save('shared', *request_session.changes())
+    assert store.load('shared', 3600)[1] == {
+        'cart': '[1]', 'quote_id': '"Q1"', 'draft_id': '"D1"'}
+
+
+def _write_key_in_process(db_path, key):
+    store = SQLiteSessionStore(db_path)
+    for i in range(20):
+        store.save('shared', {key: str(i)}, ())
+
+
+def test_forked_workers_write_one_session(store):
+    store.save('shared', {}, ())
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_write_key_in_process, args=(store.db_path, f'k{n}')) for n in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+    assert store.load('shared', 3600)[1] == {'k0': '19', 'k1': '19', 'k2': '19'}
@@ -0,0 +1,133 @@
+"""
+SMS queue tests against a recording transport: repeats to one number coalesce or drop, separate
+bookings both go out, transient failures retry and permanent ones do not
+"""
+import threading
+import time
+
+import pytest
+
+from services.sms import SMSQueue, SMSService, PermanentSMSError
+
+
+class RecordingTransport:
+    def __init__(self, failures=()):
+        self.sent = []
+        self.failures = list(failures)
+        self.lock = threading.Lock()
+
+    def send(self, to_phone, body):
+        with self.lock:
+            if self.failures:
+                raise self.failures.pop(0)
+            self.sent.append((to_phone, body))
+            return f'SM{len(self.sent)}'
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def transport():
+    return RecordingTransport()
+
+
+def make_queue(transport, **kwargs):
+    kwargs.setdefault('workers', 2)
+    kwargs.setdefault('coalesce_seconds', 0.3)
+    kwargs.setdefault('max_attempts', 3)
+    kwargs.setdefault('retry_base_seconds', 0.01)
+    return SMSQueue(transport, **kwargs)
+
+
+def test_repeat_within_window_is_dropped(transport):
+    sms = make_queue(transport)
+    assert sms.submit('+15550001', 'Quote ready', kind='quote_ready')
+    wait_for(lambda: sms.stats['sent'] == 1)
+    assert not sms.submit('+15550001', 'Quote ready', kind='quote_ready')
+    sms.shutdown()
+    assert transport.sent == [('+15550001', 'Quote ready')]
+    assert sms.stats['deduplicated'] == 1
+
+
+def test_updates_within_window_coalesce_into_the_newest_text(transport):
+    sms = make_queue(transport)
+    sms.submit('+15550001', 'Quote 1 ready', kind='quote_ready')
+    wait_for(lambda: sms.stats['sent'] == 1)
+    sms.submit('+15550001', 'Quote 2 ready', kind='quote_ready')
+    sms.submit('+15550001', 'Quote 3 ready', kind='quote_ready')
+    sent_at = time.monotonic()
+    # Held until the window closes, then sent once
+    time.sleep(0.1)
+    assert len(transport.sent) == 1
+    wait_for(lambda: sms.stats['sent'] == 2)
+    assert time.monotonic() - sent_at >= 0.15
+    sms.shutdown()
+    assert transport.sent == [('+15550001', 'Quote 1 ready'), ('+15550001', 'Quote 3 ready')]
+    assert sms.stats['coalesced'] == 1
+
+
+def test_kinds_and_numbers_do_not_coalesce(transport):
+    sms = make_queue(transport)
+    sms.submit('+15550001', 'Quote ready', kind='quote_ready')
+    sms.submit('+15550002', 'Quote ready', kind='quote_ready')
+    sms.submit('+15550001', 'Booked', kind='booking_confirmed:B1')
+    wait_for(lambda: sms.stats['sent'] == 3)
+    sms.shutdown()
+
+
+def test_two_bookings_to_one_number_both_send(transport):
+    service = SMSService()
+    service.enabled = True
+    service.queue = make_queue(transport, coalesce_seconds=60)
+    assert service.send_booking_confirmed_sms('5550001234', 'BK1', 'AirMed', '2026-11-01', 'https://x/b/BK1')
+    assert service.send_booking_confirmed_sms('5550001234', 'BK2', 'AirMed', '2026-11-02', 'https://x/b/BK2')
+    wait_for(lambda: service.queue.stats['sent'] == 2)
+    service.queue.shutdown()
+    assert {to for to, _ in transport.sent} == {'+15550001234'}
+    assert any('#BK1' in body for _, body in transport.sent)
+    assert any('#BK2' in body for _, body in transport.sent)
+
+
+def test_transient_failures_are_retried():
+    transport = RecordingTransport(failures=[RuntimeError('503'), RuntimeError('503')])
+    sms = make_queue(transport)
+    sms.submit('+15550001', 'Quote ready')
+    wait_for(lambda: sms.stats['sent'] == 1)
+    sms.shutdown()
+    assert sms.stats['retried'] == 2
+    assert sms.stats['failed'] == 0
+
+
+def test_permanent_failure_and_exhausted_retries_give_up():
+    transport = RecordingTransport(failures=[PermanentSMSError('invalid number')] + [RuntimeError('503')] * 3)
+    sms = make_queue(transport, workers=1)
+    sms.submit('+15550001', 'first')
+    wait_for(lambda: sms.stats['failed'] == 1)
+    assert sms.stats['retried'] == 0
+    sms.submit('+15550002', 'second')
+    wait_for(lambda: sms.stats['failed'] == 2)
+    sms.shutdown()
+    assert sms.stats['retried'] == 2
+    assert transport.sent == []
+
+
+def test_concurrent_submits_send_each_message_once(transport):
+    sms = make_queue(transport, workers=4)
+
+    def produce(offset):
+        for i in range(50):
+            sms.submit(f'+1555{offset:03d}{i:04d}', f'Quote {i}', kind='quote_ready')
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sms.shutdown()
+    assert len(transport.sent) == 200
+    assert len(set(transport.sent)) == 200
@@ -0,0 +1,134 @@
+"""
+Data store tests: SQLite backend round trips, per-key and per-element writes, legacy JSON import,
+and no lost updates when threads and forked worker processes write the same document
+"""
+import json
+import multiprocessing
+import threading
+
+import pytest
+
+from services.storage import SQLiteBackend, JSONFileBackend
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteBackend(str(tmp_path / 'datastore.db'))
+
+
+def test_round_trip_keeps_order_lists_and_scalars(store, tmp_path):
+    doc = {'b': 1, 'a': {'nested': [1, 2]}, 'entries': [{'id': 1}, {'id': 2}], 'none': None}
+    store.save('store/doc.json', doc)
+    assert store.load('./store/doc.json') == doc
+    assert list(store.load('store/doc.json')) == ['b', 'a', 'entries', 'none']
+
+    store.save('store/list.json', [1, 'two', 3])
+    assert store.load('store/list.json') == [1, 'two', 3]
+    assert store.load('store/missing.json') is None
+
+
+def test_save_rewrites_only_what_changed(store):
+    store.save('store/doc.json', {'a': 1, 'entries': [1, 2, 3], 'gone': True})
+    version = store.version('store/doc.json')
+    store.save('store/doc.json', {'a': 2, 'entries': [1, 2]})
+    assert store.load('store/doc.json') == {'a': 2, 'entries': [1, 2]}
+    assert store.version('store/doc.json') == version + 1
+
+    conn = store._connect()
+    rows = conn.execute("SELECT seq FROM document_list_items WHERE item_key = 'entries' ORDER BY seq").fetchall()
+    assert [seq for (seq,) in rows] == [0, 1]
+
+
+def test_item_access_without_loading_the_document(store):
+    store.save('store/doc.json', {'a': 1})
+    store.set_item('store/doc.json', 'b', [1, 2])
+    assert store.get_item('store/doc.json', 'b') == [1, 2]
+    assert store.get_item('store/doc.json', 'c', 'default') == 'default'
+    store.delete_item('store/doc.json', 'a')
+    assert store.load('store/doc.json') == {'b': [1, 2]}
+
+
+def test_legacy_json_file_is_imported_on_first_read(store, tmp_path):
+    legacy = tmp_path / 'ledger.json'
+    legacy.write_text(json.dumps({'entries': [{'amount': 5}], 'total': 5}))
+    assert store.load(str(legacy)) == {'entries': [{'amount': 5}], 'total': 5}
+    legacy.write_text('{}')
+    # Now served from the store, not the file
+    assert store.get_item(str(legacy), 'total') == 5
+
+
+def test_append_item_numbers_elements_and_converts_json_lists(store):
+    store.save('store/audit.json', {'events': [{'n': 0}]})
+    # A list stored as one JSON value (stores written before per-element lists)
+    conn = store._connect()
+    conn.execute("DELETE FROM document_list_items")
+    conn.execute("UPDATE document_items SET value = ?, is_list = 0 WHERE item_key = 'events'", ('[{"n":0}]',))
+
+    index = store.append_item('store/audit.json', 'events', lambda i: {'n': i})
+    assert index == 1
+    assert store.load('store/audit.json') == {'events': [{'n': 0}, {'n': 1}]}
+    assert store.append_item('store/new.json', 'events', 'x', default={'meta': {}}) == 0
+    assert store.load('store/new.json') == {'meta': {}, 'events': ['x']}
+
+
+def test_concurrent_transactions_do_not_lose_updates(store):
+    store.save('store/counter.json', {'count': 0})
+
+    def bump():
+        for _ in range(50):
+            with store.transaction('store/counter.json') as data:
+                data['count'] += 1
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.load('store/counter.json') == {'count': 200}
+
+
+def test_concurrent_appends_get_distinct_indexes(store):
+    indexes = []
+
+    def append():
+        for _ in range(25):
+            indexes.append(store.append_item('store/ledger.json', 'entries', lambda i: {'seq': i}))
+
+    threads = [threading.Thread(target=append) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(indexes) == list(range(100))
+    assert [entry['seq'] for entry in store.load('store/ledger.json')['entries']] == list(range(100))
+
+
+def _bump_in_process(db_path, times):
+    store = SQLiteBackend(db_path)
+    for _ in range(times):
+        with store.transaction('store/counter.json') as data:
+            data['count'] = data.get('count', 0) + 1
+        store.append_item('store/counter.json', 'log', 1)
+
+
+def test_forked_workers_serialize_writes(store):
+    store.save('store/counter.json', {'count': 0})
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_bump_in_process, args=(store.db_path, 25)) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+    data = store.load('store/counter.json')
+    assert data['count'] == 75
+    assert len(data['log']) == 75
+
+
+def test_json_backend_matches_sqlite_for_items(tmp_path):
+    store = JSONFileBackend()
+    path = str(tmp_path / 'doc.json')
+    store.save(path, {'a': 1})
+    store.set_item(path, 'b', 2)
+    assert store.append_item(path, 'events', 'x') == 0
+    assert store.load(path) == {'a': 1, 'b': 2, 'events': ['x']}
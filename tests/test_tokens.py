@@ -0,0 +1,91 @@
+"""
+Token store tests: only hashes are stored, tokens expire and are purged in batches, reissuing replaces,
+and a token consumed concurrently by threads or forked workers is honoured exactly once
+"""
+import multiprocessing
+import threading
+
+import pytest
+
+from services.tokens import TokenStore, PASSWORD_RESET, EMAIL_VERIFICATION, hash_token
+
+
+@pytest.fixture
+def tokens(tmp_path):
+    return TokenStore(str(tmp_path / 'tokens.db'), purge_interval=3600, purge_batch_size=2)
+
+
+def test_only_the_hash_is_stored(tokens):
+    token = tokens.issue(PASSWORD_RESET, 'a@example.com', 60, data={'user_id': 7})
+    rows = tokens._connect().execute('SELECT token_hash FROM tokens').fetchall()
+    assert [row['token_hash'] for row in rows] == [hash_token(token)]
+    record = tokens.peek(PASSWORD_RESET, token)
+    assert (record['subject'], record['data']) == ('a@example.com', {'user_id': 7})
+
+
+def test_purpose_and_subject_must_match(tokens):
+    token = tokens.issue(PASSWORD_RESET, 'a@example.com', 60)
+    assert tokens.peek(EMAIL_VERIFICATION, token) is None
+    assert tokens.peek(PASSWORD_RESET, token, subject='b@example.com') is None
+    assert tokens.consume(PASSWORD_RESET, token, subject='b@example.com') is None
+    assert tokens.peek(PASSWORD_RESET, token, subject='a@example.com') is not None
+    assert tokens.peek(PASSWORD_RESET, '') is None
+
+
+def test_consume_is_single_use(tokens):
+    token = tokens.issue(EMAIL_VERIFICATION, 7, 60)
+    assert tokens.consume(EMAIL_VERIFICATION, token)['subject'] == '7'
+    assert tokens.consume(EMAIL_VERIFICATION, token) is None
+
+
+def test_reissue_replaces_unless_asked_not_to(tokens):
+    first = tokens.issue(PASSWORD_RESET, 'a@example.com', 60)
+    second = tokens.issue(PASSWORD_RESET, 'a@example.com', 60)
+    assert tokens.peek(PASSWORD_RESET, first) is None
+    third = tokens.issue(PASSWORD_RESET, 'a@example.com', 60, replace=False)
+    assert tokens.peek(PASSWORD_RESET, second) and tokens.peek(PASSWORD_RESET, third)
+    assert tokens.revoke(PASSWORD_RESET, 'a@example.com') == 2
+
+
+def test_expired_tokens_are_rejected_and_purged_in_batches(tokens):
+    expired = [tokens.issue(PASSWORD_RESET, f'user{i}', -1) for i in range(5)]
+    live = tokens.issue(PASSWORD_RESET, 'live', 60)
+    assert tokens.peek(PASSWORD_RESET, expired[0]) is None
+    assert tokens.consume(PASSWORD_RESET, expired[0]) is None
+    assert tokens.purge() == 5
+    assert tokens._connect().execute('SELECT COUNT(*) FROM tokens').fetchone()[0] == 1
+    assert tokens.peek(PASSWORD_RESET, live) is not None
+
+
+def test_concurrent_consumers_succeed_once(tokens):
+    token = tokens.issue(PASSWORD_RESET, 'a@example.com', 60)
+    results = []
+    barrier = threading.Barrier(8)
+
+    def consume():
+        barrier.wait()
+        results.append(tokens.consume(PASSWORD_RESET, token))
+
+    threads = [threading.Thread(target=consume) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(result is not None for result in results) == 1
+
+
+def _consume_in_process(db_path, token, results):
+    results.put(TokenStore(db_path).consume(PASSWORD_RESET, token) is not None)
+
+
+def test_forked_workers_consume_once(tokens):
+    token = tokens.issue(PASSWORD_RESET, 'a@example.com', 60)
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_consume_in_process, args=(tokens.db_path, token, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join(30)
+    assert outcomes.count(True) == 1
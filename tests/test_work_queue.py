@@ -0,0 +1,172 @@
+"""
+Affiliate work queue tests: severity-then-age ordering, lifecycle events, resyncs that do not undo newer
+events, and the change feed (deltas against the client's view, resets on unknown versions or epochs)
+"""
+import multiprocessing
+import threading
+import time
+import types
+from datetime import datetime, timezone
+
+import pytest
+
+from services.work_queue import AffiliateWorkQueue, quote_item, queue_status, PENDING, QUOTED, CONFIRMED
+
+
+def make_quote(ref_id, severity=1, age_minutes=0, status='pending', quote_status='pending', **extra):
+    fields = dict(
+        ref_id=ref_id, status=status, quote_status=quote_status, severity_level=severity,
+        created_at=datetime.fromtimestamp(1_800_000_000 - age_minutes * 60, timezone.utc),
+        from_city='Miami', from_state='FL', to_city='Atlanta', to_state='GA', flight_date=None,
+        contact_name='John Smith', contact_phone=None, contact_email=None,
+        quoted_price=None, quote_submitted_at=None, booking_confirmed_at=None)
+    fields.update(extra)
+    return types.SimpleNamespace(**fields)
+
+
+@pytest.fixture
+def rows():
+    return [quote_item(make_quote('Q1', 1, 30)), quote_item(make_quote('Q2', 3, 5)), quote_item(make_quote('Q3', 1, 60))]
+
+
+@pytest.fixture
+def queue(rows):
+    return AffiliateWorkQueue(rows_fn=lambda: list(rows), resync_interval=3600, change_log_size=5, page_size=50)
+
+
+def refs(items):
+    return [item['ref_id'] for item in items]
+
+
+def test_status_columns_map_to_queue_status():
+    assert queue_status(make_quote('Q', status='submitted', quote_status=None)) == PENDING
+    assert queue_status(make_quote('Q', status='pending', quote_status='quoted')) == QUOTED
+    assert queue_status(make_quote('Q', status='quoted', quote_status='booked')) == CONFIRMED
+    assert queue_status(make_quote('Q', status='confirmed', quote_status='expired')) is None
+
+
+def test_most_severe_then_oldest_first(queue):
+    assert refs(queue.ordered()) == ['Q2', 'Q3', 'Q1']
+    assert refs(queue.ordered(exclude={'Q2'}, limit=1)) == ['Q3']
+
+
+def test_lifecycle_events_move_and_close_requests(queue):
+    queue.ordered()
+    queue.quote_changed(make_quote('Q4', 3, 90))
+    assert refs(queue.ordered()) == ['Q4', 'Q2', 'Q3', 'Q1']
+    queue.quote_changed(make_quote('Q4', 3, 90, status='expired'))
+    queue.quote_removed('Q3')
+    assert refs(queue.ordered()) == ['Q2', 'Q1']
+
+
+def test_unchanged_events_do_not_bump_the_version(queue):
+    version = queue.version
+    queue.quote_changed(make_quote('Q1', 1, 30))
+    assert queue.version == version
+
+
+def test_resync_applies_only_differences(queue, rows):
+    version = queue.version
+    assert not queue.refresh(force=True)
+    rows[0] = quote_item(make_quote('Q1', 2, 30))
+    del rows[2]
+    assert queue.refresh(force=True)
+    assert queue.version == version + 2
+    assert refs(queue.ordered()) == ['Q2', 'Q1']
+
+
+def test_resync_does_not_undo_events_applied_while_loading(rows):
+    queue = AffiliateWorkQueue(rows_fn=lambda: list(rows), resync_interval=3600, change_log_size=50)
+    queue.refresh(force=True)
+    stale = list(rows)
+
+    def rows_fn():
+        # Another request quotes Q2 while this resync is reading the (now stale) rows
+        queue.quote_changed(make_quote('Q2', 3, 5, status='quoted', quote_status='quoted', quoted_price=25000))
+        return stale
+
+    queue.rows_fn = rows_fn
+    queue.refresh(force=True)
+    assert queue._items['Q2']['status'] == QUOTED
+
+
+def test_first_poll_is_a_reset_with_everything(queue):
+    feed = queue.changes_since()
+    assert feed['reset'] and feed['order'] == ['Q2', 'Q3', 'Q1']
+    assert refs(feed['upserts']) == ['Q2', 'Q3', 'Q1']
+    assert feed['stats']['pending_quotes'] == 3 and feed['stats']['urgent_requests'] == 1
+
+
+def test_later_polls_send_only_deltas_against_the_view(queue):
+    feed = queue.changes_since()
+    epoch, version, shown = feed['epoch'], feed['version'], feed['order']
+    assert refs(queue.changes_since(version, epoch=epoch, shown=shown)['upserts']) == []
+
+    queue.quote_changed(make_quote('Q1', 1, 30, status='quoted', quote_status='quoted'))
+    queue.quote_changed(make_quote('Q5', 2, 1))
+    queue.quote_removed('Q3')
+    feed = queue.changes_since(version, epoch=epoch, shown=shown)
+    assert not feed['reset']
+    assert feed['order'] == ['Q2', 'Q5', 'Q1']
+    assert refs(feed['upserts']) == ['Q5', 'Q1']
+    assert feed['removed'] == ['Q3']
+
+
+def test_excluded_requests_are_removed_from_the_view(queue):
+    feed = queue.changes_since()
+    feed = queue.changes_since(feed['version'], exclude={'Q3'}, epoch=feed['epoch'], shown=feed['order'])
+    assert feed['removed'] == ['Q3'] and feed['upserts'] == []
+
+
+def test_unknown_versions_and_epochs_reset(queue):
+    feed = queue.changes_since()
+    epoch, version = feed['epoch'], feed['version']
+    assert queue.changes_since(version, epoch='other-epoch', shown=feed['order'])['reset']
+    assert queue.changes_since(version + 1, epoch=epoch)['reset']
+    for n in range(6):
+        queue.quote_changed(make_quote(f'N{n}', 1, n))
+    # Older than the change log (5 entries)
+    assert queue.changes_since(version, epoch=epoch)['reset']
+
+
+def _epoch_in_process(queue, results):
+    results.put(queue.epoch)
+
+
+def test_forked_workers_get_their_own_epoch(queue):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    worker = ctx.Process(target=_epoch_in_process, args=(queue, results))
+    worker.start()
+    assert results.get(timeout=30) != queue.epoch
+    worker.join(30)
+
+
+def test_stats_are_cached_until_a_change(queue):
+    stats = queue.stats()
+    assert queue.stats() is stats
+    queue.quote_changed(make_quote('Q2', 3, 5, status='quoted', quote_status='quoted',
+                                   quoted_price=25000, quote_submitted_at=datetime.now(timezone.utc)))
+    stats = queue.stats()
+    assert stats['pending_quotes'] == 2 and stats['completed_today'] == 1 and stats['revenue_today'] == 25000
+
+
+def test_concurrent_events_keep_the_ordering_consistent(queue):
+    queue.ordered()
+
+    def produce(n):
+        for i in range(50):
+            queue.quote_changed(make_quote(f'T{n}-{i}', severity=1 + i % 3, age_minutes=i))
+            if i % 10 == 0:
+                queue.quote_removed(f'T{n}-{i}')
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    items = queue.ordered(limit=1000)
+    assert len(items) == 3 + 4 * 45
+    keys = [queue._sort_key(item) for item in items]
+    assert keys == sorted(keys)
+    assert queue.version == 3 + 4 * 55